@@ -0,0 +1,28 @@
+"""Keyset pagination index for campaign recipients
+
+Revision ID: 005
+Revises: 004
+Create Date: 2025-02-10
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves "campaign_id = :id AND status = 'pending' AND id > :last ORDER BY id"
+    # pages when streaming recipients of large campaigns
+    op.create_index(
+        'idx_campaign_recipients_campaign_status_id',
+        'campaign_recipients',
+        ['campaign_id', 'status', 'id']
+    )
+
+
+def downgrade():
+    op.drop_index('idx_campaign_recipients_campaign_status_id', table_name='campaign_recipients')
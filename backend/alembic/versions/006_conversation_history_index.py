@@ -0,0 +1,31 @@
+"""Conversation history lookup index for WhatsApp messages
+
+Revision ID: 006
+Revises: 005
+Create Date: 2025-02-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves "customer_id = :id ORDER BY created_at DESC LIMIT :n" across both
+    # directions when loading recent turns for an inbound message; the existing
+    # customer indexes are limited to one direction or lead with direction
+    op.create_index(
+        'idx_whatsapp_messages_customer_created',
+        'whatsapp_messages',
+        ['customer_id', sa.desc('created_at')],
+        postgresql_where=sa.text('is_deleted = false')
+    )
+
+
+def downgrade():
+    op.drop_index('idx_whatsapp_messages_customer_created', table_name='whatsapp_messages')
@@ -0,0 +1,85 @@
+"""Precomputed per-customer engagement stats
+
+Revision ID: 007
+Revises: 006
+Create Date: 2025-02-24
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # One row per customer, maintained on flush by the application; the
+    # existing history is backfilled below so readers never see empty totals
+    op.create_table('customer_engagement_stats',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('is_deleted', sa.Boolean(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.Column('created_by', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('updated_by', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('customer_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('total_messages', sa.Integer(), nullable=False),
+        sa.Column('total_responses', sa.Integer(), nullable=False),
+        sa.Column('response_hours_total', sa.Float(), nullable=False),
+        sa.Column('timed_responses', sa.Integer(), nullable=False),
+        sa.Column('last_message_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['customer_id'], ['customers.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        op.f('ix_customer_engagement_stats_customer_id'),
+        'customer_engagement_stats',
+        ['customer_id'],
+        unique=True
+    )
+
+    # Same totals as app.services.engagement_stats.rebuild_engagement_stats
+    op.execute("""
+        INSERT INTO customer_engagement_stats (
+            id, created_at, updated_at, is_deleted,
+            customer_id, total_messages, total_responses,
+            response_hours_total, timed_responses, last_message_at
+        )
+        SELECT
+            gen_random_uuid(), now(), now(), false,
+            c.id,
+            COALESCE(m.total_messages, 0),
+            COALESCE(r.total_responses, 0),
+            COALESCE(r.response_hours_total, 0.0),
+            COALESCE(r.timed_responses, 0),
+            m.last_message_at
+        FROM customers c
+        LEFT JOIN (
+            SELECT customer_id,
+                   count(id) AS total_messages,
+                   max(created_at) AS last_message_at
+            FROM whatsapp_messages
+            GROUP BY customer_id
+        ) m ON m.customer_id = c.id
+        LEFT JOIN (
+            SELECT customer_id,
+                   count(id) AS total_responses,
+                   COALESCE(sum(extract(epoch FROM responded_at - sent_at) / 3600), 0.0) AS response_hours_total,
+                   count(responded_at - sent_at) AS timed_responses
+            FROM campaign_recipients
+            WHERE status = 'responded'
+            GROUP BY customer_id
+        ) r ON r.customer_id = c.id
+        WHERE c.is_deleted = false
+          AND (m.customer_id IS NOT NULL OR r.customer_id IS NOT NULL)
+    """)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_customer_engagement_stats_customer_id'), table_name='customer_engagement_stats')
+    op.drop_table('customer_engagement_stats')
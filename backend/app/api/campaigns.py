@@ -19,7 +19,6 @@ from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks,
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, and_, or_, text
-from sqlalchemy.orm import selectinload
 
 from ..core.logging import get_logger
 from ..database import get_db_session
@@ -370,6 +369,34 @@ async def get_campaign_stats(
         )
 
 
+@router.get("/{campaign_id}/audience", response_model=Dict[str, Any])
+async def get_campaign_audience_size(
+    campaign_id: UUID,
+    session: AsyncSession = Depends(get_db_session),
+    current_user: User = Depends(current_active_user)
+):
+    """Count the restaurant's customers matching the campaign targeting."""
+    try:
+        campaign = await get_campaign_or_404(campaign_id, session, current_user)
+
+        audience_size = await segmentation_service.count_segment(
+            targeting_config=campaign.targeting_config or {},
+            restaurant_id=campaign.restaurant_id,
+            session=session
+        )
+
+        return {"campaign_id": str(campaign_id), "audience_size": audience_size}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Campaign audience count failed: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to count campaign audience"
+        )
+
+
 @router.delete("/{campaign_id}", status_code=status.HTTP_200_OK)
 async def delete_campaign(
     campaign_id: UUID,
@@ -473,9 +500,14 @@ async def add_campaign_recipients(
         # Handle A/B testing variant assignments
         variant_assignments = {}
         if campaign.is_ab_test and campaign.ab_test_config:
+            strata = None
+            if campaign.ab_test_config.get("assignment_method") == "stratified":
+                strata = ab_testing_service.customer_strata(segmented_customers, campaign.ab_test_config)
             variant_assignments = ab_testing_service.assign_variants(
                 customer_ids=[c.id for c in segmented_customers],
-                ab_config=campaign.ab_test_config
+                ab_config=campaign.ab_test_config,
+                campaign_id=campaign_id,
+                strata=strata
             )
         
         # Create recipient records
@@ -622,17 +654,10 @@ async def get_ab_test_results(
                 detail="Campaign is not an A/B test"
             )
         
-        # Get recipients with variant data
-        stmt = select(CampaignRecipient).where(
-            CampaignRecipient.campaign_id == campaign_id
-        ).options(selectinload(CampaignRecipient.customer))
-        result = await session.execute(stmt)
-        recipients = result.scalars().all()
-        
-        # Perform statistical analysis
+        # Statistical analysis on per-variant counts aggregated in SQL
         ab_results = await ab_testing_service.analyze_ab_test(
             campaign=campaign,
-            recipients=recipients
+            session=session
         )
         
         return ABTestResults(**ab_results)
@@ -15,6 +15,11 @@ import os
 # Import models for type hints
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..core.metrics import StageLatencyTracker
+from ..services.inbound_pipeline import InboundMessage, InboundMessagePipeline, InboundQueueFull
+from ..services.conversation_history import conversation_history as recent_conversations
+from ..services.status_ingestion import StatusEvent, status_ingestion
+
 # Import logger first
 logger = logging.getLogger(__name__)
 
@@ -112,242 +117,139 @@ async def debug_environment():
 @router.post("/webhook")
 async def whatsapp_webhook(request: Request):
     """
-    ULTRA-ROBUST WhatsApp webhook with comprehensive error handling.
-    Tests every component step by step to identify failure points.
+    Accept an inbound WhatsApp message from Twilio.
+    The message is validated and queued; replies are generated by the inbound pipeline workers
+    so Twilio gets its 200 within milliseconds.
     """
-    step = "INIT"
-    debug_info = {
-        "timestamp": datetime.utcnow().isoformat(),
-        "step": step,
-        "form_data": {},
-        "extracted_data": {},
-        "database_status": "unknown",
-        "twilio_status": "unknown",
-        "ai_response_status": "unknown"
-    }
-    
     try:
-        logger.info("=== ULTRA-DEBUG WEBHOOK STARTED ===")
-        step = "FORM_DATA_EXTRACTION"
-        debug_info["step"] = step
+        form_data = await request.form()
+        from_number = form_data.get('From', '').replace('whatsapp:', '')
+        message_body = form_data.get('Body', '')
+        message_sid = form_data.get('MessageSid', '')
         
-        # STEP 1: Extract form data with detailed logging
-        try:
-            form_data = await request.form()
-            debug_info["form_data"] = dict(form_data)
-            logger.info(f"✅ STEP 1 SUCCESS: Form data extracted: {debug_info['form_data']}")
-        except Exception as e:
-            logger.error(f"❌ STEP 1 FAILED: Form data extraction error: {str(e)}")
-            debug_info["form_data_error"] = str(e)
-            return PlainTextResponse(f"Error-Step1: {str(e)}", status_code=200)
+        if not from_number or not message_body:
+            logger.error(f"❌ Missing required data - from: '{from_number}', body: '{message_body}'")
+            return PlainTextResponse("Error: Missing data", status_code=200)
         
-        # STEP 2: Parse message details
-        step = "MESSAGE_PARSING" 
-        debug_info["step"] = step
-        try:
-            from_number = form_data.get('From', '').replace('whatsapp:', '')
-            message_body = form_data.get('Body', '')
-            message_sid = form_data.get('MessageSid', '')
-            
-            debug_info["extracted_data"] = {
-                "from_number": from_number,
-                "message_body": message_body,
-                "message_sid": message_sid,
-                "all_form_keys": list(form_data.keys())
-            }
-            
-            if not from_number or not message_body:
-                logger.error(f"❌ STEP 2 FAILED: Missing required data - from: '{from_number}', body: '{message_body}'")
-                return PlainTextResponse("Error-Step2: Missing data", status_code=200)
-            
-            logger.info(f"✅ STEP 2 SUCCESS: Parsed message from {from_number}: {message_body}")
-        except Exception as e:
-            logger.error(f"❌ STEP 2 FAILED: Message parsing error: {str(e)}")
-            return PlainTextResponse(f"Error-Step2: {str(e)}", status_code=200)
+        await inbound_pipeline.submit(InboundMessage(
+            message_sid=message_sid,
+            from_number=from_number,
+            body=message_body
+        ))
+        logger.info(f"✅ Queued message {message_sid} from {from_number}")
+        return PlainTextResponse("OK", status_code=200)
+    
+    except InboundQueueFull as e:
+        # Shed rather than hold the request open until Twilio times out and retries
+        logger.error(f"🚫 {str(e)}")
+        return PlainTextResponse("Busy", status_code=200)
         
-        # STEP 3: Test database connectivity
-        step = "DATABASE_TEST"
-        debug_info["step"] = step
+    except Exception as e:
+        logger.error(f"💥 WEBHOOK FAILURE: {str(e)}")
+        logger.error(f"Full traceback: {traceback.format_exc()}")
+        
+        # Still return 200 to prevent Twilio retries, but include error info
+        return PlainTextResponse(f"Error: {str(e)}", status_code=200)
+
+async def process_inbound_message(message: InboundMessage, metrics: StageLatencyTracker) -> None:
+    """
+    Generate and send the reply to one inbound message.
+    Runs on an inbound pipeline worker; each stage is timed for the pipeline stats.
+    """
+    from_number = message.from_number
+    message_body = message.body
+    
+    # STAGE 1: Make sure the database is usable
+    database_ready = False
+    async with metrics.time("database"):
         try:
-            # Try to import database manager
             from ..database import db_manager
-            logger.info("✅ STEP 3.1 SUCCESS: Database manager imported")
-            
-            # Test if db_manager is initialized
             if not db_manager.is_initialized:
-                logger.warning("⚠️ STEP 3.2 WARNING: Database not initialized, attempting initialization...")
-                try:
-                    await db_manager.initialize()
-                    logger.info("✅ STEP 3.2 SUCCESS: Database initialized successfully")
-                except Exception as init_error:
-                    logger.error(f"❌ STEP 3.2 FAILED: Database initialization error: {str(init_error)}")
-                    debug_info["database_status"] = f"init_failed: {str(init_error)}"
-                    # Continue without database for now
-            
-            # Test database connection
-            try:
-                health = await db_manager.health_check()
-                debug_info["database_status"] = health["status"]
-                logger.info(f"✅ STEP 3.3 SUCCESS: Database health check: {health}")
-            except Exception as health_error:
-                logger.error(f"❌ STEP 3.3 FAILED: Database health check error: {str(health_error)}")
-                debug_info["database_status"] = f"health_failed: {str(health_error)}"
-                
+                logger.warning("⚠️ Database not initialized, attempting initialization...")
+                await db_manager.initialize()
+            database_ready = db_manager.is_initialized
         except Exception as e:
-            logger.error(f"❌ STEP 3 FAILED: Database test error: {str(e)}")
-            debug_info["database_status"] = f"import_failed: {str(e)}"
-        
-        # STEP 4: Generate AI response with context
-        step = "AI_RESPONSE"
-        debug_info["step"] = step
+            logger.error(f"❌ Database initialization error: {str(e)}")
+    
+    # STAGE 2: Load conversation history (ring buffer first, indexed lookup on a miss)
+    conversation_history = []
+    async with metrics.time("history"):
         try:
-            # Try to get conversation history from database
-            previous_messages = []
-            if debug_info["database_status"] == "healthy":
-                try:
-                    from ..database import db_manager
-                    from ..models.whatsapp import WhatsAppMessage
-                    from sqlalchemy import select
-                    
-                    async with db_manager.get_session() as session:
-                        # Get last 5 messages from this phone number
-                        stmt = select(WhatsAppMessage.content).where(
-                            WhatsAppMessage.context.contains(from_number)
-                        ).order_by(WhatsAppMessage.sent_at.desc()).limit(5)
-                        
-                        result = await session.execute(stmt)
-                        messages = result.scalars().all()
-                        previous_messages = list(reversed(messages))  # Oldest first
-                        logger.info(f"✅ Loaded {len(previous_messages)} previous messages for context")
-                except Exception as e:
-                    logger.warning(f"⚠️ Could not load message history: {str(e)}")
-                    previous_messages = []
-            
-            # Try intelligent AI first, fallback to simple if needed
-            ai_response = None
-            try:
-                from ..services.restaurant_ai_agent import restaurant_ai_agent
-                
-                # Convert messages to proper format
-                conversation_history = []
-                for msg in previous_messages:
-                    conversation_history.append({
-                        "from": "customer",  # Assume previous messages are from customer
-                        "body": msg
-                    })
-                
-                # Generate intelligent response
-                ai_response = await restaurant_ai_agent.generate_intelligent_response(
-                    message=message_body,
-                    conversation_history=conversation_history,
-                    customer_id=from_number.replace('+', ''),  # Use phone as customer ID
-                    language="ar"
-                )
-                debug_info["ai_response_status"] = "intelligent_ai_success"
-                logger.info(f"✅ STEP 4 SUCCESS: Intelligent AI response generated")
-                
-            except Exception as ai_error:
-                logger.warning(f"⚠️ Intelligent AI failed, using fallback: {str(ai_error)}")
-                # Fallback to simple AI
-                ai_response = get_simple_ai_response(message_body, previous_messages)
-                debug_info["ai_response_status"] = f"fallback_used: {str(ai_error)}"
-            
-            debug_info["ai_response_length"] = len(ai_response) if ai_response else 0
-            debug_info["context_messages_count"] = len(previous_messages)
-            logger.info(f"✅ STEP 4 SUCCESS: AI response generated ({len(ai_response) if ai_response else 0} chars) with {len(previous_messages)} context messages")
+            conversation_history = await recent_conversations.get_recent_turns(from_number, limit=5)
+            logger.info(f"✅ Loaded {len(conversation_history)} previous messages for context")
         except Exception as e:
-            logger.error(f"❌ STEP 4 FAILED: AI response error: {str(e)}")
-            debug_info["ai_response_status"] = f"failed: {str(e)}"
-            ai_response = "شكراً لرسالتكم! سنتواصل معكم قريباً."  # Fallback response
-        
-        # STEP 5: Test Twilio service
-        step = "TWILIO_TEST"
-        debug_info["step"] = step
-        try:
-            # Try to import Twilio service
-            from ..services.twilio_whatsapp import twilio_service
-            logger.info("✅ STEP 5.1 SUCCESS: Twilio service imported")
-            
-            # Check if Twilio is enabled
-            if not twilio_service.enabled:
-                logger.error("❌ STEP 5.2 FAILED: Twilio service not enabled (missing credentials)")
-                debug_info["twilio_status"] = "disabled: missing credentials"
-                return PlainTextResponse("Error-Step5: Twilio disabled", status_code=200)
-            
-            logger.info("✅ STEP 5.2 SUCCESS: Twilio service is enabled")
-            debug_info["twilio_status"] = "enabled"
-            
-        except Exception as e:
-            logger.error(f"❌ STEP 5 FAILED: Twilio import/test error: {str(e)}")
-            debug_info["twilio_status"] = f"import_failed: {str(e)}"
-            return PlainTextResponse(f"Error-Step5: {str(e)}", status_code=200)
-        
-        # STEP 6: Create customer object and send message
-        step = "MESSAGE_SENDING"
-        debug_info["step"] = step
+            logger.warning(f"⚠️ Could not load message history: {str(e)}")
+    previous_messages = [turn["body"] for turn in conversation_history]
+    
+    # STAGE 3: Generate AI response, falling back to the keyword responder
+    async with metrics.time("ai_generation"):
         try:
-            # Create simple customer object
-            class SimpleCustomer:
-                phone_number = from_number
-                preferred_language = 'ar'
-                first_name = None  # Add required attributes
+            from ..services.restaurant_ai_agent import restaurant_ai_agent
             
-            customer = SimpleCustomer()
-            logger.info("✅ STEP 6.1 SUCCESS: Simple customer object created")
-            
-            # Send message
-            send_result = await twilio_service.send_message(
-                customer=customer,
-                custom_message=ai_response
+            ai_response = await restaurant_ai_agent.generate_intelligent_response(
+                message=message_body,
+                conversation_history=conversation_history,
+                customer_id=from_number.replace('+', ''),  # Use phone as customer ID
+                language="ar"
             )
-            
-            if send_result['success']:
-                logger.info(f"✅ STEP 6.2 SUCCESS: Message sent successfully: {send_result}")
-                debug_info["message_sent"] = True
-                debug_info["message_sid"] = send_result.get('message_sid', 'unknown')
-            else:
-                logger.error(f"❌ STEP 6.2 FAILED: Message sending failed: {send_result}")
-                debug_info["message_sent"] = False
-                debug_info["send_error"] = send_result.get('error', 'unknown')
-            
-        except Exception as e:
-            logger.error(f"❌ STEP 6 FAILED: Message sending error: {str(e)}")
-            logger.error(f"Full traceback: {traceback.format_exc()}")
-            debug_info["message_sending_error"] = str(e)
-        
-        # STEP 7: Database logging (if available)
-        step = "DATABASE_LOGGING"
-        debug_info["step"] = step
-        if debug_info["database_status"] == "healthy":
-            try:
-                # Try to log the interaction to database
-                await log_whatsapp_interaction(from_number, message_body, ai_response)
-                logger.info("✅ STEP 7 SUCCESS: Interaction logged to database")
-                debug_info["db_logged"] = True
-            except Exception as e:
-                logger.error(f"❌ STEP 7 FAILED: Database logging error: {str(e)}")
-                debug_info["db_logging_error"] = str(e)
-                # Continue anyway
-        else:
-            logger.info("⚠️ STEP 7 SKIPPED: Database not available for logging")
-            debug_info["db_logged"] = False
-        
-        # SUCCESS - Log complete debug info
-        logger.info(f"🎉 WEBHOOK SUCCESS: {debug_info}")
-        return PlainTextResponse("OK", status_code=200)
-        
-    except Exception as e:
-        # CRITICAL FAILURE - Log everything for debugging
-        logger.error(f"💥 CRITICAL WEBHOOK FAILURE at step {step}: {str(e)}")
-        logger.error(f"Full traceback: {traceback.format_exc()}")
-        logger.error(f"Debug info: {debug_info}")
-        
-        # Still return 200 to prevent Twilio retries, but include error info
-        return PlainTextResponse(f"Error-{step}: {str(e)}", status_code=200)
+        except Exception as ai_error:
+            logger.warning(f"⚠️ Intelligent AI failed, using fallback: {str(ai_error)}")
+            ai_response = get_simple_ai_response(message_body, previous_messages)
+    
+    if not ai_response:
+        ai_response = "شكراً لرسالتكم! سنتواصل معكم قريباً."  # Fallback response
+    
+    # STAGE 4: Send the reply
+    from ..services.twilio_whatsapp import twilio_service
+    
+    if not twilio_service.enabled:
+        logger.error("❌ Twilio service not enabled (missing credentials)")
+        return
+    
+    class SimpleCustomer:
+        phone_number = from_number
+        preferred_language = 'ar'
+        first_name = None
+    
+    async with metrics.time("send"):
+        send_result = await twilio_service.send_message(
+            customer=SimpleCustomer(),
+            custom_message=ai_response
+        )
+    
+    if send_result['success']:
+        logger.info(f"✅ Reply to {message.message_sid} sent: {send_result.get('message_sid', 'unknown')}")
+    else:
+        logger.error(f"❌ Reply to {message.message_sid} failed: {send_result.get('error', 'unknown')}")
+    
+    # STAGE 5: Log the interaction
+    await recent_conversations.record_exchange(from_number, message_body, ai_response)
+    if database_ready:
+        async with metrics.time("logging"):
+            await log_whatsapp_interaction(from_number, message_body, ai_response)
+
+inbound_pipeline = InboundMessagePipeline(handler=process_inbound_message)
+
+@router.get("/pipeline/stats")
+async def get_inbound_pipeline_stats():
+    """Inbound pipeline queue depth, counters and p50/p99 latency per stage."""
+    from ..services.restaurant_ai_agent import restaurant_ai_agent
+    from ..services.http_pool import http_pool
+    
+    return {
+        **inbound_pipeline.get_stats(),
+        "conversation_history": recent_conversations.get_stats(),
+        "conversation_memory": restaurant_ai_agent.conversation_memory.get_stats(),
+        "http_pool": http_pool.get_stats(),
+        "status_ingestion": status_ingestion.get_stats()
+    }
 
 @router.post("/status")
 async def whatsapp_status_webhook(request: Request):
-    """Handle message status updates from Twilio."""
+    """
+    Handle message status updates from Twilio.
+    Receipts are buffered and written in batches by the status ingestion stage.
+    """
     try:
         form_data = await request.form()
         message_sid = form_data.get('MessageSid', '')
@@ -355,24 +257,13 @@ async def whatsapp_status_webhook(request: Request):
         
         logger.info(f"Message {message_sid} status: {status}")
         
-        # Update message status in database
-        async with db_manager.get_session() as session:
-            result = await session.execute(
-                select(WhatsAppMessage).where(
-                    WhatsAppMessage.whatsapp_message_id == message_sid
-                )
-            )
-            message = result.scalar_one_or_none()
-            
-            if message:
-                if status == 'delivered':
-                    message.mark_delivered()
-                elif status == 'read':
-                    message.mark_read()
-                elif status == 'failed':
-                    message.mark_failed()
-                
-                await session.commit()
+        if message_sid and status:
+            await status_ingestion.submit(StatusEvent(
+                message_sid=message_sid,
+                status=status,
+                error_code=form_data.get('ErrorCode'),
+                error_message=form_data.get('ErrorMessage')
+            ))
         
         return PlainTextResponse("OK", status_code=200)
         
@@ -50,8 +50,10 @@ class WhatsAppSettings(BaseSettings):
     WHATSAPP_WEBHOOK_URL: Optional[str] = None
     
     # Rate limiting
-    WHATSAPP_MAX_MESSAGES_PER_HOUR: int = 1000
-    WHATSAPP_MAX_MESSAGES_PER_DAY: int = 10000
+    WHATSAPP_MAX_MESSAGES_PER_HOUR: int = 1000  # per sender number
+    WHATSAPP_MAX_MESSAGES_PER_DAY: int = 10000  # per sender number (messaging tier)
+    WHATSAPP_MAX_MESSAGES_PER_SECOND: int = 80  # per sender number (provider throughput)
+    WHATSAPP_RESTAURANT_MAX_MESSAGES_PER_HOUR: int = 0  # per restaurant, across its campaigns (0 = no limit)
     
     class Config:
         extra = "ignore"
@@ -86,6 +88,24 @@ class OpenRouterSettings(BaseSettings):
     MAX_REQUESTS_PER_MINUTE: int = 60
     MONTHLY_BUDGET_LIMIT_USD: float = 200.0
     
+    # Response cache lookup strategy: exact, fuzzy or semantic
+    CACHE_STRATEGY: str = "exact"
+    # sentence-transformers model for semantic cache lookups; unset uses the offline hashing embedder
+    CACHE_EMBEDDING_MODEL: Optional[str] = None
+    
+    # Shared HTTP connection pool used by every OpenRouter client
+    OPENROUTER_MAX_CONNECTIONS: int = 100
+    OPENROUTER_MAX_KEEPALIVE_CONNECTIONS: int = 30
+    OPENROUTER_KEEPALIVE_EXPIRY: float = 60.0  # seconds an idle connection is kept
+    OPENROUTER_TIMEOUT: float = 60.0
+    OPENROUTER_CONNECT_TIMEOUT: float = 10.0
+    OPENROUTER_HTTP2: bool = True  # used when the h2 package is installed
+    
+    # Adaptive concurrency for batched requests
+    OPENROUTER_TOKENS_PER_MINUTE: int = 100000
+    OPENROUTER_MAX_CONCURRENCY: int = 50
+    OPENROUTER_LATENCY_TARGET: float = 15.0  # seconds; slower requests shrink concurrency
+    
     class Config:
         extra = "ignore"
     
@@ -0,0 +1,56 @@
+"""
+Latency metrics shared by the services.
+Tracks recent per-stage samples and reports their percentiles.
+"""
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+
+class StageLatencyTracker:
+    """Keeps a bounded window of latency samples per pipeline stage."""
+
+    def __init__(self, window_size: int = 2048):
+        self.window_size = window_size
+        self.samples: Dict[str, Deque[float]] = {}
+        self.counts: Dict[str, int] = {}
+
+    def record(self, stage: str, seconds: float):
+        """Record one sample for a stage."""
+        window = self.samples.get(stage)
+        if window is None:
+            window = self.samples[stage] = deque(maxlen=self.window_size)
+        window.append(seconds)
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    @asynccontextmanager
+    async def time(self, stage: str):
+        """Time the enclosed block as one sample of a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def percentile(self, stage: str, pct: float) -> Optional[float]:
+        """Nearest-rank percentile of a stage in seconds."""
+        window = self.samples.get(stage)
+        if not window:
+            return None
+        ordered = sorted(window)
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """p50/p99 in milliseconds for every stage."""
+        stats = {}
+        for stage in self.samples:
+            p50 = self.percentile(stage, 50)
+            p99 = self.percentile(stage, 99)
+            stats[stage] = {
+                "count": self.counts[stage],
+                "p50_ms": round(p50 * 1000, 2),
+                "p99_ms": round(p99 * 1000, 2),
+            }
+        return stats
@@ -4,14 +4,13 @@ Provides utilities for optimizing database queries, preventing N+1 problems,
 and monitoring query performance.
 """
 import time
-import asyncio
 from typing import Any, Dict, List, Optional, Type, Union
 from uuid import UUID
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, text, event, inspect
+from sqlalchemy import select, func, text, event, inspect, and_, case
 from sqlalchemy.orm import selectinload, joinedload, contains_eager, Load
 from sqlalchemy.engine import Engine
 from sqlalchemy.pool import QueuePool
@@ -21,6 +20,7 @@ from ...core.config import settings
 from ...models.customer import Customer
 from ...models.whatsapp import WhatsAppMessage
 from ...models.ai_agent import AIInteraction
+from ...models.engagement import CustomerEngagementStats
 
 logger = get_logger(__name__)
 
@@ -298,14 +298,23 @@ class QueryOptimizer:
                 .where(and_(*message_filters))
             )
 
-            # Execute queries concurrently
-            customer_result, message_result = await asyncio.gather(
-                session.execute(customer_metrics_query),
-                session.execute(message_metrics_query)
+            # Lifetime engagement from the precomputed per-customer stats
+            engagement_query = (
+                select(
+                    func.count(CustomerEngagementStats.id).label('customers_messaged'),
+                    func.coalesce(func.sum(CustomerEngagementStats.total_messages), 0).label('total_messages'),
+                    func.coalesce(func.sum(CustomerEngagementStats.total_responses), 0).label('total_responses'),
+                    func.coalesce(func.sum(CustomerEngagementStats.response_hours_total), 0.0).label('response_hours_total'),
+                    func.coalesce(func.sum(CustomerEngagementStats.timed_responses), 0).label('timed_responses')
+                )
+                .join(Customer, Customer.id == CustomerEngagementStats.customer_id)
+                .where(and_(*customer_filters))
             )
 
-            customer_metrics = customer_result.one()
-            message_metrics = message_result.one()
+            # An AsyncSession runs one statement at a time
+            customer_metrics = (await session.execute(customer_metrics_query)).one()
+            message_metrics = (await session.execute(message_metrics_query)).one()
+            engagement = (await session.execute(engagement_query)).one()
 
             # Calculate derived metrics
             total_customers = customer_metrics.total_customers or 0
@@ -331,6 +340,17 @@ class QueryOptimizer:
                     'positive': positive_feedback,
                     'negative': negative_feedback,
                     'total': customers_with_feedback
+                },
+                'engagement': {
+                    'customers_messaged': engagement.customers_messaged,
+                    'total_messages': engagement.total_messages,
+                    'total_responses': engagement.total_responses,
+                    'message_response_rate': round(
+                        engagement.total_responses / engagement.total_messages * 100, 2
+                    ) if engagement.total_messages else 0,
+                    'avg_response_hours': round(
+                        engagement.response_hours_total / engagement.timed_responses, 2
+                    ) if engagement.timed_responses else None
                 }
             }
 
@@ -23,6 +23,12 @@ from .api import (
     campaigns_router,
     whatsapp_router
 )
+from .api.whatsapp import inbound_pipeline
+from .services.conversation_history import conversation_history
+from .services.http_pool import http_pool
+from .services.status_ingestion import status_ingestion
+from .services.campaigns.throttle import send_throttle
+from .services.restaurant_ai_agent import restaurant_ai_agent
 # Force deployment - 2025-08-25 v2
 
 logger = get_logger(__name__)
@@ -43,6 +49,12 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         await init_database()
         logger.info("Database initialized successfully")
         
+        # Start inbound message workers
+        await conversation_history.initialize()
+        await restaurant_ai_agent.conversation_memory.initialize()
+        await inbound_pipeline.start()
+        await send_throttle.initialize()
+        
         # Log configuration
         logger.info("Application configuration loaded:")
         logger.info(f"- API Prefix: {settings.app.API_V1_PREFIX}")
@@ -62,6 +74,15 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     logger.info("Shutting down application...")
     
     try:
+        await inbound_pipeline.stop()
+        await conversation_history.close()
+        await restaurant_ai_agent.conversation_memory.close()
+        logger.info("Inbound message pipeline stopped")
+        
+        await status_ingestion.close()
+        await send_throttle.close()
+        await http_pool.close()
+        
         await close_database()
         logger.info("Database connections closed")
         
@@ -10,6 +10,7 @@ from .customer import Customer
 from .whatsapp import WhatsAppMessage, ConversationThread
 from .campaign import Campaign, CampaignRecipient
 from .ai_agent import AgentPersona, MessageFlow, AIInteraction
+from .engagement import CustomerEngagementStats
 
 # Export all models
 __all__ = [
@@ -34,6 +35,9 @@ __all__ = [
     "Campaign",
     "CampaignRecipient",
     
+    # Precomputed aggregates
+    "CustomerEngagementStats",
+    
     # AI Agent system
     "AgentPersona",
     "MessageFlow", 
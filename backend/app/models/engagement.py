@@ -0,0 +1,161 @@
+"""
+Per-customer engagement aggregates.
+Kept up to date on every flush that adds messages or records campaign responses.
+"""
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, case, event, inspect
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Session
+
+from .base import Base
+from .campaign import CampaignRecipient
+from .whatsapp import WhatsAppMessage
+from ..core.logging import get_logger
+
+logger = get_logger(__name__)
+
+RESPONDED = "responded"
+
+
+class CustomerEngagementStats(Base):
+    """
+    Message and response totals for one customer.
+
+    Replaces per-request aggregation over ``whatsapp_messages`` JOIN
+    ``campaign_recipients``: a message counts once it is stored, a response
+    once its campaign recipient reaches ``responded``. Rows are maintained
+    incrementally by the flush hook below, backfilled by migration 007;
+    ``rebuild_engagement_stats`` recomputes them after bulk writes.
+    """
+
+    __tablename__ = "customer_engagement_stats"
+
+    customer_id = Column(UUID(as_uuid=True), ForeignKey("customers.id"), nullable=False, unique=True, index=True)
+
+    total_messages = Column(Integer, default=0, nullable=False)
+    total_responses = Column(Integer, default=0, nullable=False)
+
+    # Sum and count of (responded_at - sent_at) for responses with both timestamps
+    response_hours_total = Column(Float, default=0.0, nullable=False)
+    timed_responses = Column(Integer, default=0, nullable=False)
+
+    last_message_at = Column(DateTime, nullable=True)
+
+    @property
+    def response_rate(self) -> float:
+        """Responses per message, in percent."""
+        return self.total_responses / self.total_messages * 100 if self.total_messages else 0.0
+
+    @property
+    def avg_response_hours(self) -> Optional[float]:
+        """Average hours from send to response, if any response was timed."""
+        return self.response_hours_total / self.timed_responses if self.timed_responses else None
+
+    def to_history(self) -> Dict[str, Any]:
+        """Summary in the shape used for personalization context."""
+        return {
+            "total_messages": self.total_messages,
+            "total_responses": self.total_responses,
+            "avg_response_time_hours": self.avg_response_hours,
+            "response_rate": self.response_rate
+        }
+
+    def __repr__(self) -> str:
+        return f"<CustomerEngagementStats(customer_id={self.customer_id}, messages={self.total_messages}, responses={self.total_responses})>"
+
+
+def _became_responded(recipient: CampaignRecipient, is_new: bool) -> bool:
+    if recipient.status != RESPONDED:
+        return False
+    if is_new:
+        return True
+    added, _, deleted = inspect(recipient).attrs.status.history
+    return bool(added) and RESPONDED not in deleted
+
+
+def collect_engagement_deltas(session: Session) -> Dict[Any, Dict[str, Any]]:
+    """Per-customer changes made by the flush in progress."""
+    deltas: Dict[Any, Dict[str, Any]] = defaultdict(lambda: {
+        "total_messages": 0, "total_responses": 0, "response_hours_total": 0.0,
+        "timed_responses": 0, "last_message_at": None
+    })
+
+    for obj in session.new:
+        if isinstance(obj, WhatsAppMessage) and obj.customer_id is not None:
+            delta = deltas[obj.customer_id]
+            delta["total_messages"] += 1
+            created_at = obj.created_at or datetime.utcnow()
+            if delta["last_message_at"] is None or created_at > delta["last_message_at"]:
+                delta["last_message_at"] = created_at
+
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, CampaignRecipient) or obj.customer_id is None:
+            continue
+        if not _became_responded(obj, obj in session.new):
+            continue
+        delta = deltas[obj.customer_id]
+        delta["total_responses"] += 1
+        if obj.responded_at and obj.sent_at:
+            delta["response_hours_total"] += (obj.responded_at - obj.sent_at).total_seconds() / 3600
+            delta["timed_responses"] += 1
+
+    return deltas
+
+
+def upsert_engagement_deltas(connection, deltas: Dict[Any, Dict[str, Any]]):
+    """Add ``deltas`` to the customers' rows, creating missing rows."""
+    if not deltas:
+        return
+
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        logger.warning(f"Engagement stats not maintained on {dialect}; run the rebuild instead")
+        return
+
+    table = CustomerEngagementStats.__table__
+    now = datetime.utcnow()
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.customer_id],
+        set_={
+            "total_messages": table.c.total_messages + stmt.excluded.total_messages,
+            "total_responses": table.c.total_responses + stmt.excluded.total_responses,
+            "response_hours_total": table.c.response_hours_total + stmt.excluded.response_hours_total,
+            "timed_responses": table.c.timed_responses + stmt.excluded.timed_responses,
+            "last_message_at": _later_of(table.c.last_message_at, stmt.excluded.last_message_at),
+            "updated_at": stmt.excluded.updated_at,
+        }
+    )
+    connection.execute(stmt, [
+        {
+            "id": uuid.uuid4(), "customer_id": customer_id, "created_at": now, "updated_at": now,
+            "is_deleted": False, **delta
+        }
+        for customer_id, delta in deltas.items()
+    ])
+
+
+def _later_of(stored, incoming):
+    """Later of two nullable timestamps; a flush without messages keeps the stored one."""
+    return case(
+        (incoming.is_(None), stored),
+        (stored.is_(None), incoming),
+        (incoming > stored, incoming),
+        else_=stored
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _track_engagement(session: Session, flush_context):
+    # Runs inside the flush transaction, so the aggregates commit or roll back with the rows
+    deltas = collect_engagement_deltas(session)
+    if deltas:
+        upsert_engagement_deltas(session.connection(), deltas)
@@ -0,0 +1,266 @@
+"""
+Adaptive concurrency and rate budgets for batched AI requests.
+AIMD concurrency limit, queued request/token budgets and per-model throughput.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+from ..core.metrics import StageLatencyTracker
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit that adapts to how the API is coping.
+
+    Additive increase: after a full window of healthy requests (as many as
+    the current limit) the limit grows by one. Multiplicative decrease: a
+    429, a failure or a request slower than ``latency_target`` cuts the
+    limit by ``backoff_factor``. Decreases are spaced by ``cooldown``
+    seconds so one burst of 429s from requests already in flight only
+    counts once.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 5,
+        min_limit: int = 1,
+        max_limit: int = 50,
+        latency_target: float = 15.0,
+        backoff_factor: float = 0.5,
+        cooldown: float = 2.0
+    ):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff_factor = backoff_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._healthy_in_window = 0
+        self._last_decrease = float("-inf")
+        self._condition = asyncio.Condition()
+        self.stats = {"increases": 0, "decreases": 0, "rate_limited": 0, "slow": 0, "failed": 0}
+
+    async def acquire(self):
+        """Wait until a request fits under the current limit."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def release(self, latency: float, success: bool = True):
+        """Finish a request and adjust the limit from its outcome."""
+        async with self._condition:
+            self.in_flight -= 1
+            if not success:
+                self.stats["failed"] += 1
+                self._decrease()
+            elif latency > self.latency_target:
+                self.stats["slow"] += 1
+                self._decrease()
+            else:
+                self._healthy_in_window += 1
+                if self._healthy_in_window >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._healthy_in_window = 0
+                    self.stats["increases"] += 1
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Hold a concurrency slot for one request.
+
+        Set ``outcome["success"] = False`` inside the block to report a
+        failure that did not raise, and ``outcome["latency"]`` to report the
+        request's own latency when the block also spent time queuing.
+        """
+        await self.acquire()
+        outcome: Dict[str, Any] = {"success": True, "latency": None}
+        started = time.perf_counter()
+        try:
+            yield outcome
+        except Exception:
+            outcome["success"] = False
+            raise
+        finally:
+            latency = outcome["latency"]
+            if latency is None:
+                latency = time.perf_counter() - started
+            await self.release(latency, outcome["success"])
+
+    def on_rate_limited(self):
+        """Back off after the API answered 429."""
+        self.stats["rate_limited"] += 1
+        self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._healthy_in_window = 0
+        new_limit = max(self.min_limit, int(self.limit * self.backoff_factor))
+        if new_limit < self.limit:
+            self.limit = new_limit
+            self.stats["decreases"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Current limit, occupancy and how often it moved."""
+        return {
+            **self.stats,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+        }
+
+
+class RateBudget:
+    """
+    Requests-per-minute, requests-per-hour and tokens-per-minute budgets.
+
+    Each budget is a bucket that refills continuously. ``acquire`` waits
+    until every bucket can cover the request instead of failing, and
+    callers are served in arrival order so a large request cannot be
+    starved by a stream of small ones. Token reservations are estimates;
+    ``settle`` corrects the bucket once the real usage is known.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 60,
+        tokens_per_minute: int = 100000,
+        requests_per_hour: Optional[int] = None
+    ):
+        # name -> (capacity, refill per second)
+        self.limits: Dict[str, Tuple[float, float]] = {
+            "requests_per_minute": (requests_per_minute, requests_per_minute / 60.0),
+            "tokens_per_minute": (tokens_per_minute, tokens_per_minute / 60.0),
+        }
+        if requests_per_hour:
+            self.limits["requests_per_hour"] = (requests_per_hour, requests_per_hour / 3600.0)
+        self.available = {name: float(capacity) for name, (capacity, _) in self.limits.items()}
+        self._updated = time.monotonic()
+        self._turn = asyncio.Lock()
+        self.waiting = 0
+        self.stats = {"acquired": 0, "queued": 0, "wait_seconds": 0.0}
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        for name, (capacity, rate) in self.limits.items():
+            self.available[name] = min(capacity, self.available[name] + elapsed * rate)
+
+    def _needs(self, tokens: int) -> Dict[str, float]:
+        needs = {name: 1.0 for name in self.limits if name.startswith("requests")}
+        # A reservation larger than the bucket could never be granted; cap it at capacity
+        needs["tokens_per_minute"] = min(float(tokens), self.limits["tokens_per_minute"][0])
+        return needs
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Reserve one request and ``tokens`` tokens, waiting as long as needed. Returns the wait."""
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._turn:
+                needs = self._needs(tokens)
+                while True:
+                    self._refill()
+                    wait = max(
+                        (needs[name] - self.available[name]) / self.limits[name][1]
+                        for name in needs
+                    )
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                for name, amount in needs.items():
+                    self.available[name] -= amount
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.stats["acquired"] += 1
+        if waited > 0.001:
+            self.stats["queued"] += 1
+            self.stats["wait_seconds"] += waited
+        return waited
+
+    def settle(self, reserved_tokens: int, used_tokens: int):
+        """Correct a token reservation with the usage the API reported."""
+        self._refill()
+        # Going negative is allowed: overspend is paid back before the next request
+        self.available["tokens_per_minute"] += reserved_tokens - used_tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Remaining budget and how much requests had to queue."""
+        self._refill()
+        return {
+            **self.stats,
+            "waiting": self.waiting,
+            "available": {name: round(value, 1) for name, value in self.available.items()},
+            "limits": {name: capacity for name, (capacity, _) in self.limits.items()},
+        }
+
+
+class ModelThroughput:
+    """Completed requests, tokens and latency per model over a sliding window."""
+
+    def __init__(self, window_seconds: float = 60.0):
+        self.window_seconds = window_seconds
+        self.recent: Dict[str, Deque[Tuple[float, int]]] = {}
+        self.totals: Dict[str, Dict[str, int]] = {}
+        self.latency = StageLatencyTracker()
+
+    def _totals(self, model: str) -> Dict[str, int]:
+        totals = self.totals.get(model)
+        if totals is None:
+            totals = self.totals[model] = {"requests": 0, "failed": 0, "rate_limited": 0, "tokens": 0}
+        return totals
+
+    def record(self, model: str, latency: float, tokens: int, success: bool = True):
+        """Record one finished request."""
+        totals = self._totals(model)
+        totals["requests"] += 1
+        if not success:
+            totals["failed"] += 1
+            return
+        totals["tokens"] += tokens
+        now = time.monotonic()
+        window = self.recent.setdefault(model, deque())
+        window.append((now, tokens))
+        # Prune here too, so the window stays bounded when stats are never read
+        self._prune(window, now)
+        self.latency.record(model, latency)
+
+    def record_rate_limited(self, model: str):
+        """Record a 429 answer for a model."""
+        self._totals(model)["rate_limited"] += 1
+
+    def _prune(self, window: Deque[Tuple[float, int]], now: float):
+        cutoff = now - self.window_seconds
+        while window and window[0][0] < cutoff:
+            window.popleft()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Requests and tokens per minute, totals and p50/p99 latency per model."""
+        now = time.monotonic()
+        latency = self.latency.snapshot()
+        per_minute = 60.0 / self.window_seconds
+        stats = {}
+        for model, totals in self.totals.items():
+            window = self.recent.get(model, deque())
+            self._prune(window, now)
+            stats[model] = {
+                **totals,
+                "requests_per_minute": round(len(window) * per_minute, 1),
+                "tokens_per_minute": round(sum(tokens for _, tokens in window) * per_minute, 1),
+                **latency.get(model, {}),
+            }
+        return stats
@@ -14,8 +14,8 @@ from sqlalchemy import select
 
 from ..models.customer import Customer
 from ..models import WhatsAppMessage
-from ..services.openrouter_service import OpenRouterService
-from ..services.restaurant_ai_agent import RestaurantAIAgent
+from ..services.openrouter_service import OpenRouterService, openrouter_service
+from ..services.restaurant_ai_agent import RestaurantAIAgent, restaurant_ai_agent
 from ..core.logging import get_logger
 
 logger = get_logger(__name__)
@@ -24,11 +24,16 @@ logger = get_logger(__name__)
 class AIService:
     """Service class for AI-related business logic."""
 
-    def __init__(self, session: AsyncSession):
-        """Initialize the service with a database session."""
+    def __init__(
+        self,
+        session: AsyncSession,
+        openrouter: Optional[OpenRouterService] = None,
+        restaurant_agent: Optional[RestaurantAIAgent] = None
+    ):
+        """Initialize the service with a database session and the shared AI clients."""
         self.session = session
-        self.openrouter_service = OpenRouterService()
-        self.restaurant_agent = RestaurantAIAgent()
+        self.openrouter_service = openrouter or openrouter_service
+        self.restaurant_agent = restaurant_agent or restaurant_ai_agent
 
     async def analyze_sentiment(
         self,
@@ -11,8 +11,13 @@ import numpy as np
 from scipy import stats
 from scipy.stats import chi2_contingency, ttest_ind
 
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from ...core.logging import get_logger
 from ...models import Campaign, CampaignRecipient, Customer
+from ..engagement_stats import hours_between
+from .bucketing import assign_buckets, assign_stratified, uuid_keys
 
 logger = get_logger(__name__)
 
@@ -26,9 +31,22 @@ class ABTestingService:
     def assign_variants(
         self,
         customer_ids: List[UUID],
-        ab_config: Dict[str, Any]
+        ab_config: Dict[str, Any],
+        campaign_id: Optional[UUID] = None,
+        strata: Optional[Dict[UUID, Any]] = None
     ) -> Dict[UUID, str]:
-        """Assign variants to customers for A/B testing."""
+        """
+        Assign variants to customers for A/B testing.
+        
+        "random" (the default) gives each customer a hash bucket keyed by the
+        campaign id and ``random_seed``, so a customer keeps their variant
+        across workers, retries and re-runs. "stratified" hashes the same way
+        but splits each stratum by rank, so it is repeatable only for the same
+        customers and strata: adding or removing customers, or a customer
+        changing stratum, can move others to a different variant. ``strata``
+        maps customer ids to their stratum for "stratified"; see
+        ``customer_strata``.
+        """
         try:
             variants = ab_config.get("variants", [])
             if not variants:
@@ -39,23 +57,18 @@ class ABTestingService:
             variant_probabilities = [variant.get("weight", 1) / total_weight for variant in variants]
             variant_ids = [variant.get("id") for variant in variants]
             
-            assignments = {}
-            
-            # Ensure random seed for reproducibility if specified
-            if ab_config.get("random_seed"):
-                random.seed(ab_config["random_seed"])
-            
+            salt = f"{campaign_id or ''}:{ab_config.get('random_seed') or ''}"
             assignment_method = ab_config.get("assignment_method", "random")
             
-            if assignment_method == "random":
-                assignments = self._random_assignment(customer_ids, variant_ids, variant_probabilities)
-            elif assignment_method == "sequential":
-                assignments = self._sequential_assignment(customer_ids, variant_ids, variant_probabilities)
+            if assignment_method == "sequential":
+                rng = random.Random(ab_config.get("random_seed"))
+                assignments = self._sequential_assignment(customer_ids, variant_ids, variant_probabilities, rng)
             elif assignment_method == "stratified":
-                # Would require customer segmentation data
-                assignments = self._random_assignment(customer_ids, variant_ids, variant_probabilities)
+                assignments = self._stratified_assignment(
+                    customer_ids, variant_ids, variant_probabilities, salt, strata
+                )
             else:
-                assignments = self._random_assignment(customer_ids, variant_ids, variant_probabilities)
+                assignments = self._random_assignment(customer_ids, variant_ids, variant_probabilities, salt)
             
             logger.info(f"Assigned variants to {len(assignments)} customers")
             return assignments
@@ -64,28 +77,44 @@ class ABTestingService:
             logger.error(f"Variant assignment failed: {str(e)}")
             return {}
     
+    def customer_strata(self, customers: List[Customer], ab_config: Dict[str, Any]) -> Dict[UUID, Tuple]:
+        """Stratum of each customer from the ``stratify_by`` customer attributes."""
+        attributes = ab_config.get("stratify_by") or ["preferred_language"]
+        return {
+            customer.id: tuple(getattr(customer, attribute, None) for attribute in attributes)
+            for customer in customers
+        }
+    
     def _random_assignment(
         self,
         customer_ids: List[UUID],
         variant_ids: List[str],
-        probabilities: List[float]
+        probabilities: List[float],
+        salt: str = ""
     ) -> Dict[UUID, str]:
-        """Randomly assign variants based on probabilities."""
-        assignments = {}
-        
-        for customer_id in customer_ids:
-            # Use customer_id as seed for consistent assignment
-            random.seed(hash(str(customer_id)) % (2**32))
-            variant = random.choices(variant_ids, weights=probabilities, k=1)[0]
-            assignments[customer_id] = variant
-        
-        return assignments
+        """Assign variants by hash bucket, with the given probabilities."""
+        buckets = assign_buckets(uuid_keys(customer_ids), probabilities, salt)
+        return {customer_id: variant_ids[bucket] for customer_id, bucket in zip(customer_ids, buckets)}
+    
+    def _stratified_assignment(
+        self,
+        customer_ids: List[UUID],
+        variant_ids: List[str],
+        probabilities: List[float],
+        salt: str = "",
+        strata: Optional[Dict[UUID, Any]] = None
+    ) -> Dict[UUID, str]:
+        """Assign variants in exact proportions within each stratum."""
+        customer_strata = [strata.get(customer_id) for customer_id in customer_ids] if strata else None
+        buckets = assign_stratified(uuid_keys(customer_ids), customer_strata, probabilities, salt)
+        return {customer_id: variant_ids[bucket] for customer_id, bucket in zip(customer_ids, buckets)}
     
     def _sequential_assignment(
         self,
         customer_ids: List[UUID],
         variant_ids: List[str],
-        probabilities: List[float]
+        probabilities: List[float],
+        rng: Optional[random.Random] = None
     ) -> Dict[UUID, str]:
         """Sequential assignment to maintain exact proportions."""
         assignments = {}
@@ -105,7 +134,7 @@ class ABTestingService:
             assignment_list.extend([variant_id] * count)
         
         # Shuffle and assign
-        random.shuffle(assignment_list)
+        (rng or random.Random()).shuffle(assignment_list)
         
         for i, customer_id in enumerate(customer_ids):
             assignments[customer_id] = assignment_list[i]
@@ -115,17 +144,31 @@ class ABTestingService:
     async def analyze_ab_test(
         self,
         campaign: Campaign,
-        recipients: List[CampaignRecipient]
+        recipients: Optional[List[CampaignRecipient]] = None,
+        session: Optional[AsyncSession] = None
     ) -> Dict[str, Any]:
-        """Perform comprehensive A/B test statistical analysis."""
+        """
+        Perform comprehensive A/B test statistical analysis.
+        
+        With a ``session`` the per-variant counts come from one aggregate query
+        (see ``summarize_variants``), so the cost does not grow with the
+        campaign and results can be refreshed while it is sending. Otherwise
+        the given ``recipients`` are counted in memory. Variants are listed by
+        id either way, the first being the baseline for uplift.
+        """
         try:
             if not campaign.is_ab_test or not campaign.ab_test_config:
                 raise ValueError("Campaign is not configured for A/B testing")
             
-            # Group recipients by variant
-            variant_data = self._group_by_variant(recipients)
+            if session is not None:
+                variant_analyses = await self.summarize_variants(campaign.id, session)
+            else:
+                variant_analyses = [
+                    self._analyze_variant(variant_id, variant_recipients)
+                    for variant_id, variant_recipients in sorted(self._group_by_variant(recipients or []).items())
+                ]
             
-            if len(variant_data) < 2:
+            if len(variant_analyses) < 2:
                 return {
                     "campaign_id": str(campaign.id),
                     "test_duration_hours": 0,
@@ -141,12 +184,6 @@ class ABTestingService:
             # Calculate test duration
             test_duration = self._calculate_test_duration(campaign)
             
-            # Analyze each variant
-            variant_analyses = []
-            for variant_id, variant_recipients in variant_data.items():
-                analysis = self._analyze_variant(variant_id, variant_recipients)
-                variant_analyses.append(analysis)
-            
             # Perform statistical significance testing
             significance_results = self._test_statistical_significance(variant_analyses)
             
@@ -185,6 +222,45 @@ class ABTestingService:
             logger.error(f"A/B test analysis failed: {str(e)}")
             return {"error": str(e)}
     
+    async def summarize_variants(self, campaign_id: UUID, session: AsyncSession) -> List[Dict[str, Any]]:
+        """
+        Per-variant analysis from one ``GROUP BY variant_id`` query.
+        
+        Counts and the average response time are aggregated in the database,
+        served by the campaign_id index; recipients without a variant are
+        reported as "control", as in ``_group_by_variant``.
+        """
+        variant_id = func.coalesce(CampaignRecipient.variant_id, "control")
+        response_hours = hours_between(
+            CampaignRecipient.responded_at, CampaignRecipient.sent_at, session.get_bind().dialect.name
+        )
+        
+        def count_status(*statuses):
+            return func.count(case((CampaignRecipient.status.in_(statuses), 1)))
+        
+        result = await session.execute(
+            select(
+                variant_id.label("variant_id"),
+                func.count(CampaignRecipient.id).label("sample_size"),
+                count_status("sent", "delivered", "read", "responded").label("sent_count"),
+                count_status("delivered", "read", "responded").label("delivered_count"),
+                count_status("read", "responded").label("read_count"),
+                count_status("responded").label("response_count"),
+                func.avg(response_hours).label("avg_response_time_hours")
+            )
+            .where(CampaignRecipient.campaign_id == campaign_id)
+            .group_by(variant_id)
+            .order_by(variant_id)
+        )
+        
+        return [
+            self._variant_analysis(
+                row.variant_id, row.sample_size, row.sent_count, row.delivered_count,
+                row.read_count, row.response_count, float(row.avg_response_time_hours or 0)
+            )
+            for row in result
+        ]
+    
     def _group_by_variant(self, recipients: List[CampaignRecipient]) -> Dict[str, List[CampaignRecipient]]:
         """Group recipients by variant ID."""
         variant_data = {}
@@ -224,29 +300,45 @@ class ABTestingService:
                 "avg_response_time_hours": 0
             }
         
-        # Count metrics
-        sent_count = sum(1 for r in recipients if r.is_sent)
-        delivered_count = sum(1 for r in recipients if r.status in ["delivered", "read", "responded"])
-        read_count = sum(1 for r in recipients if r.status in ["read", "responded"])
-        response_count = sum(1 for r in recipients if r.has_responded)
-        
-        # Calculate rates
-        delivery_rate = (delivered_count / sent_count * 100) if sent_count > 0 else 0
-        read_rate = (read_count / delivered_count * 100) if delivered_count > 0 else 0
-        response_rate = (response_count / delivered_count * 100) if delivered_count > 0 else 0
-        
-        # Calculate average response time
+        # Count metrics in a single pass
+        sent_count = delivered_count = read_count = response_count = 0
         response_times = []
         for recipient in recipients:
+            status = recipient.status
+            sent_count += status in ("sent", "delivered", "read", "responded")
+            delivered_count += status in ("delivered", "read", "responded")
+            read_count += status in ("read", "responded")
+            response_count += status == "responded"
             if recipient.sent_at and recipient.responded_at:
                 time_diff = recipient.responded_at - recipient.sent_at
                 response_times.append(time_diff.total_seconds() / 3600)
         
         avg_response_time = sum(response_times) / len(response_times) if response_times else 0
         
+        return self._variant_analysis(
+            variant_id, total_recipients, sent_count, delivered_count,
+            read_count, response_count, avg_response_time
+        )
+    
+    def _variant_analysis(
+        self,
+        variant_id: str,
+        sample_size: int,
+        sent_count: int,
+        delivered_count: int,
+        read_count: int,
+        response_count: int,
+        avg_response_time: float
+    ) -> Dict[str, Any]:
+        """Variant metrics from its summary counts."""
+        # Calculate rates
+        delivery_rate = (delivered_count / sent_count * 100) if sent_count > 0 else 0
+        read_rate = (read_count / delivered_count * 100) if delivered_count > 0 else 0
+        response_rate = (response_count / delivered_count * 100) if delivered_count > 0 else 0
+        
         return {
             "variant_id": variant_id,
-            "sample_size": total_recipients,
+            "sample_size": sample_size,
             "sent_count": sent_count,
             "delivered_count": delivered_count,
             "read_count": read_count,
@@ -0,0 +1,117 @@
+"""
+Deterministic hash-bucket assignment for A/B test variants.
+Maps customer ids onto weighted variants with a keyed hash, vectorized over numpy arrays.
+"""
+import hashlib
+from typing import Hashable, List, Optional, Sequence
+from uuid import UUID
+
+import numpy as np
+
+# splitmix64 finalizer constants
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def uuid_keys(ids: Sequence[UUID]) -> np.ndarray:
+    """Ids as an ``(n, 2)`` array of their high and low 64-bit halves."""
+    if not len(ids):
+        return np.empty((0, 2), dtype=np.uint64)
+    return np.frombuffer(b"".join(i.bytes for i in ids), dtype=">u8").astype(np.uint64).reshape(-1, 2)
+
+
+def _salt_keys(salt: str):
+    digest = hashlib.blake2b(salt.encode(), digest_size=16, person=b"ab-variants").digest()
+    return np.uint64(int.from_bytes(digest[:8], "big")), np.uint64(int.from_bytes(digest[8:], "big"))
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    x = x ^ (x >> np.uint64(30))
+    x = x * _MIX_1
+    x = x ^ (x >> np.uint64(27))
+    x = x * _MIX_2
+    return x ^ (x >> np.uint64(31))
+
+
+def hash_unit_interval(keys: np.ndarray, salt: str) -> np.ndarray:
+    """
+    Keyed hash of each id onto ``[0, 1)``.
+
+    The salt (typically the campaign id) is expanded with BLAKE2 into two
+    64-bit keys, which are mixed into the id halves with the splitmix64
+    finalizer. Unlike ``hash()`` the result does not depend on
+    ``PYTHONHASHSEED``, so every worker computes the same value, and
+    different salts give independent assignments.
+    """
+    k0, k1 = _salt_keys(salt)
+    with np.errstate(over="ignore"):
+        h = _mix64(_mix64(keys[:, 0] ^ k0) ^ keys[:, 1] ^ k1)
+    # Top 53 bits as a double
+    return (h >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+def _cumulative(weights: Sequence[float]) -> np.ndarray:
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.size == 0 or (weights < 0).any() or weights.sum() <= 0:
+        raise ValueError("Variant weights must be non-negative with a positive total")
+    return np.cumsum(weights) / weights.sum()
+
+
+def _bucket_of(points: np.ndarray, cumulative: np.ndarray) -> np.ndarray:
+    return np.minimum(np.searchsorted(cumulative, points, side="right"), len(cumulative) - 1)
+
+
+def assign_buckets(keys: np.ndarray, weights: Sequence[float], salt: str) -> np.ndarray:
+    """
+    Variant index for each id, drawn with probability proportional to ``weights``.
+
+    An id's variant depends only on the id, the salt and the weights, never on
+    which other ids are assigned with it.
+    """
+    return _bucket_of(hash_unit_interval(keys, salt), _cumulative(weights))
+
+
+def assign_stratified(
+    keys: np.ndarray,
+    strata: Optional[List[Hashable]],
+    weights: Sequence[float],
+    salt: str
+) -> np.ndarray:
+    """
+    Variant index for each id, with exact proportions inside every stratum.
+
+    Ids of a stratum are ordered by their hash and split systematically: the
+    id at rank ``r`` of ``n`` lands in the bucket covering ``(r + offset) / n``,
+    where ``offset`` is hash-derived per stratum. Each variant therefore gets
+    its share of each stratum to within one id, and the result does not depend
+    on input order. Without ``strata`` all ids form one stratum.
+    """
+    cumulative = _cumulative(weights)
+    points = hash_unit_interval(keys, salt)
+    if not len(points):
+        return np.empty(0, dtype=np.intp)
+
+    if strata is None:
+        codes = np.zeros(len(points), dtype=np.intp)
+        labels = [""]
+    else:
+        index = {}
+        codes = np.fromiter((index.setdefault(s, len(index)) for s in strata), dtype=np.intp, count=len(strata))
+        labels = list(index)
+
+    order = np.lexsort((points, codes))
+    counts = np.bincount(codes, minlength=len(labels))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sorted_codes = codes[order]
+    ranks = np.arange(len(order)) - starts[sorted_codes]
+
+    # One offset per stratum, so small strata do not always round the same way
+    offsets = hash_unit_interval(uuid_keys([_stratum_id(label) for label in labels]), salt)
+
+    buckets = np.empty(len(points), dtype=np.intp)
+    buckets[order] = _bucket_of((ranks + offsets[sorted_codes]) / counts[sorted_codes], cumulative)
+    return buckets
+
+
+def _stratum_id(label: Hashable) -> UUID:
+    return UUID(bytes=hashlib.blake2b(str(label).encode(), digest_size=16).digest())
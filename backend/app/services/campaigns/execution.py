@@ -4,18 +4,23 @@ Handles bulk messaging, rate limiting, and real-time monitoring.
 """
 import asyncio
 import json
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, AsyncGenerator
-from uuid import UUID
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Dict, Any, Optional, AsyncGenerator, AsyncIterator
+from uuid import UUID, uuid4
 import logging
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, func, text
+from sqlalchemy import select, and_, or_, func, text, inspect
 from sqlalchemy.orm import selectinload
 
+from ...core.config import settings
 from ...core.logging import get_logger
 from ...models import Campaign, CampaignRecipient, Customer, WhatsAppMessage, Restaurant
 from ..openrouter.client import OpenRouterClient
+from .personalization import PersonalizationEngine
+from .throttle import BucketLimit, TokenBucketThrottle, send_throttle
 
 logger = get_logger(__name__)
 
@@ -25,64 +30,88 @@ class CampaignWebSocketManager:
     pass
 
 
-class RateLimiter:
-    """Rate limiter for campaign message sending."""
-    
-    def __init__(self, max_rate_per_hour: int = 100):
-        self.max_rate_per_hour = max_rate_per_hour
-        self.sent_times: List[datetime] = []
-        
-    def can_send(self) -> bool:
-        """Check if we can send a message based on rate limit."""
-        now = datetime.utcnow()
-        cutoff_time = now - timedelta(hours=1)
-        
-        # Remove old entries
-        self.sent_times = [t for t in self.sent_times if t > cutoff_time]
-        
-        return len(self.sent_times) < self.max_rate_per_hour
-    
-    def record_send(self):
-        """Record that a message was sent."""
-        self.sent_times.append(datetime.utcnow())
+@dataclass
+class SendOutcome:
+    """Result of sending one campaign message, applied to the DB in batches."""
+    recipient: CampaignRecipient
+    message: Optional[WhatsAppMessage]
+    success: bool
+    error: Optional[str] = None
+
+
+@dataclass
+class ExecutionProgress:
+    """Running counters for a campaign execution."""
+    total: int
+    sent: int = 0
+    failed: int = 0
+    last_broadcast: float = 0.0
     
-    def time_until_next_send(self) -> Optional[float]:
-        """Get seconds to wait until next message can be sent."""
-        if self.can_send():
-            return 0
-        
-        if not self.sent_times:
-            return 0
-            
-        # Find the oldest message in the current hour
-        cutoff_time = datetime.utcnow() - timedelta(hours=1)
-        oldest_in_hour = min([t for t in self.sent_times if t > cutoff_time])
-        
-        # Time until oldest message expires from the hour window
-        next_available = oldest_in_hour + timedelta(hours=1)
-        return (next_available - datetime.utcnow()).total_seconds()
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed
 
 
 class CampaignExecutionService:
-    """Service for executing campaigns with advanced features."""
+    """
+    Service for executing campaigns with advanced features.
     
-    def __init__(self):
+    Features:
+    - Bounded worker pool sending recipients concurrently
+    - Personalization rendered a page of recipients at a time
+    - Keyset-paginated recipient streaming for large, resumable campaigns
+    - Token-bucket send throttle per campaign, restaurant and sender number,
+      shared across workers and processes
+    - Batched commits of message records and recipient status changes
+    - Periodic (not per-message) pause/stop checks on a separate session
+    - Throttled WebSocket progress broadcasts
+    """
+    
+    def __init__(
+        self,
+        max_concurrency: int = 10,
+        commit_batch_size: int = 50,
+        status_check_interval: float = 2.0,
+        progress_interval: float = 1.0,
+        recipient_page_size: int = 500,
+        streaming_threshold: int = 5000,
+        throttle: Optional[TokenBucketThrottle] = None
+    ):
         self.openrouter_client = OpenRouterClient()
-        self.rate_limiters: Dict[str, RateLimiter] = {}
+        self.personalization = PersonalizationEngine()
+        self.throttle = throttle or send_throttle
+        
+        self.max_concurrency = max_concurrency
+        self.commit_batch_size = commit_batch_size
+        self.status_check_interval = status_check_interval
+        self.progress_interval = progress_interval
+        self.recipient_page_size = recipient_page_size
+        self.streaming_threshold = streaming_threshold
         
     async def execute_campaign(
         self,
         campaign_id: UUID,
-        websocket_manager: Optional[CampaignWebSocketManager] = None
+        websocket_manager: Optional[CampaignWebSocketManager] = None,
+        stream_recipients: Optional[bool] = None
     ):
-        """Execute campaign with real-time monitoring."""
+        """
+        Execute campaign with real-time monitoring.
+        
+        Args:
+            campaign_id: Campaign to execute
+            websocket_manager: Optional manager for progress broadcasts
+            stream_recipients: Page pending recipients from the database instead of
+                loading them all up front. Defaults to streaming once the campaign
+                has ``streaming_threshold`` recipients or more.
+        """
         from ...database import db_manager
         
+        campaign = None
         async with db_manager.get_session() as session:
             try:
-                # Get campaign with recipients
+                # Recipients are loaded separately, filtered in SQL
                 stmt = select(Campaign).where(Campaign.id == campaign_id).options(
-                    selectinload(Campaign.campaign_recipients).selectinload(CampaignRecipient.customer)
+                    selectinload(Campaign.restaurant)
                 )
                 result = await session.execute(stmt)
                 campaign = result.scalar_one_or_none()
@@ -95,104 +124,63 @@ class CampaignExecutionService:
                     logger.error(f"Campaign not in running state: {campaign.status}")
                     return
                 
-                # Initialize rate limiter
-                rate_limiter = RateLimiter(campaign.send_rate_per_hour)
-                self.rate_limiters[str(campaign_id)] = rate_limiter
+                # Buckets this campaign's sends are charged against
+                send_limits = self._send_limits(campaign)
+                
+                if stream_recipients is None:
+                    stream_recipients = campaign.recipients_count >= self.streaming_threshold
                 
                 # Get pending recipients
-                pending_recipients = [
-                    r for r in campaign.campaign_recipients 
-                    if r.status == "pending"
-                ]
+                pending_count = await self._count_pending_recipients(session, campaign_id)
                 
-                if not pending_recipients:
+                if not pending_count:
                     logger.info(f"No pending recipients for campaign: {campaign_id}")
                     campaign.complete_campaign()
                     await session.commit()
                     return
                 
-                logger.info(f"Starting execution of campaign {campaign_id} with {len(pending_recipients)} recipients")
+                logger.info(
+                    f"Starting execution of campaign {campaign_id} with {pending_count} recipients"
+                    f" ({'streaming' if stream_recipients else 'preloaded'})"
+                )
                 
-                # Send messages with rate limiting
-                sent_count = 0
-                failed_count = 0
+                session_lock = asyncio.Lock()
+                if stream_recipients:
+                    pages = self._iter_pending_recipient_pages(session, campaign_id, session_lock)
+                else:
+                    pages = self._preloaded_recipient_pages(
+                        await self._load_pending_recipients(session, campaign_id)
+                    )
                 
-                for recipient in pending_recipients:
-                    try:
-                        # Check if campaign is still running
-                        await session.refresh(campaign)
-                        if campaign.status != "running":
-                            logger.info(f"Campaign {campaign_id} stopped during execution")
-                            break
-                        
-                        # Rate limiting
-                        if not rate_limiter.can_send():
-                            wait_time = rate_limiter.time_until_next_send()
-                            if wait_time > 0:
-                                logger.info(f"Rate limit reached, waiting {wait_time:.1f}s")
-                                await asyncio.sleep(wait_time)
-                        
-                        # Send message
-                        success = await self._send_campaign_message(
-                            campaign=campaign,
-                            recipient=recipient,
-                            session=session
-                        )
-                        
-                        if success:
-                            sent_count += 1
-                            rate_limiter.record_send()
-                            
-                            # Update recipient status
-                            recipient.mark_sent()
-                            
-                            # Update campaign metrics
-                            campaign.messages_sent += 1
-                        else:
-                            failed_count += 1
-                            recipient.status = "failed"
-                            campaign.messages_failed += 1
-                        
-                        await session.commit()
-                        
-                        # Send real-time update via WebSocket
-                        if websocket_manager:
-                            progress = {
-                                "campaign_id": str(campaign_id),
-                                "sent": sent_count,
-                                "failed": failed_count,
-                                "remaining": len(pending_recipients) - sent_count - failed_count,
-                                "progress_percent": round((sent_count + failed_count) / len(pending_recipients) * 100, 2),
-                                "timestamp": datetime.utcnow().isoformat()
-                            }
-                            await websocket_manager.broadcast_to_campaign(
-                                str(campaign_id),
-                                progress
-                            )
-                        
-                        # Small delay to prevent overwhelming the system
-                        await asyncio.sleep(0.1)
-                        
-                    except Exception as e:
-                        logger.error(f"Error sending message to recipient {recipient.id}: {str(e)}")
-                        failed_count += 1
-                        recipient.status = "failed"
-                        campaign.messages_failed += 1
-                        await session.commit()
+                progress = ExecutionProgress(total=pending_count)
+                stopped = await self._run_worker_pool(
+                    campaign=campaign,
+                    recipient_pages=pages,
+                    send_limits=send_limits,
+                    progress=progress,
+                    session=session,
+                    websocket_manager=websocket_manager,
+                    session_lock=session_lock
+                )
                 
-                # Complete campaign
-                campaign.complete_campaign()
+                if stopped:
+                    logger.info(f"Campaign {campaign_id} stopped during execution")
+                    # Keep the externally set status (paused/cancelled)
+                    await session.refresh(campaign, ["status"])
+                else:
+                    # Complete campaign
+                    campaign.complete_campaign()
                 await session.commit()
                 
-                logger.info(f"Campaign {campaign_id} completed - Sent: {sent_count}, Failed: {failed_count}")
+                logger.info(f"Campaign {campaign_id} finished - Sent: {progress.sent}, Failed: {progress.failed}")
                 
                 # Final WebSocket update
                 if websocket_manager:
                     final_update = {
                         "campaign_id": str(campaign_id),
-                        "status": "completed",
-                        "total_sent": sent_count,
-                        "total_failed": failed_count,
+                        "status": campaign.status,
+                        "total_sent": progress.sent,
+                        "total_failed": progress.failed,
                         "completion_time": datetime.utcnow().isoformat()
                     }
                     await websocket_manager.broadcast_to_campaign(
@@ -204,64 +192,362 @@ class CampaignExecutionService:
                 logger.error(f"Campaign execution failed: {str(e)}")
                 # Update campaign status to failed
                 if campaign:
+                    await session.rollback()
                     campaign.status = "failed"
                     await session.commit()
     
-    async def _send_campaign_message(
+    def _send_limits(self, campaign: Campaign) -> List[BucketLimit]:
+        """
+        Limits charged for each send of a campaign.
+        
+        The campaign's own rate, the sender number's provider throughput and
+        messaging tier and, when WHATSAPP_RESTAURANT_MAX_MESSAGES_PER_HOUR is
+        set, the restaurant's share across all of its campaigns. Restaurants
+        without their own WhatsApp number share the Twilio sender, and
+        therefore its limits. Hourly and daily limits are sliding windows,
+        so none of them admits more than its count in any hour or day.
+        """
+        whatsapp = settings.whatsapp
+        restaurant = getattr(campaign, "restaurant", None)
+        sender = (restaurant and restaurant.whatsapp_business_phone) or settings.twilio.TWILIO_WHATSAPP_NUMBER
+        sender = sender.replace("whatsapp:", "")
+        
+        # The campaign is paced by a bucket and capped by its hourly quota
+        limits = [
+            BucketLimit.for_rate(f"campaign:{campaign.id}", campaign.send_rate_per_hour, 3600),
+            BucketLimit.for_window(f"campaign:{campaign.id}:hour", campaign.send_rate_per_hour, 3600),
+        ]
+        
+        restaurant_limit = whatsapp.WHATSAPP_RESTAURANT_MAX_MESSAGES_PER_HOUR
+        if restaurant_limit:
+            if campaign.send_rate_per_hour > restaurant_limit:
+                logger.info(
+                    f"Campaign {campaign.id} send rate {campaign.send_rate_per_hour}/h is capped by "
+                    f"the restaurant limit of {restaurant_limit}/h"
+                )
+            limits.append(BucketLimit.for_window(f"restaurant:{campaign.restaurant_id}", restaurant_limit, 3600))
+        
+        return limits + [
+            BucketLimit.for_rate(f"sender:{sender}:second", whatsapp.WHATSAPP_MAX_MESSAGES_PER_SECOND, 1),
+            BucketLimit.for_window(f"sender:{sender}:hour", whatsapp.WHATSAPP_MAX_MESSAGES_PER_HOUR, 3600),
+            BucketLimit.for_window(f"sender:{sender}:day", whatsapp.WHATSAPP_MAX_MESSAGES_PER_DAY, 86400),
+        ]
+    
+    async def _count_pending_recipients(self, session: AsyncSession, campaign_id: UUID) -> int:
+        """Count pending recipients (served by the campaign/status/id index)."""
+        return await session.scalar(
+            select(func.count(CampaignRecipient.id)).where(
+                and_(
+                    CampaignRecipient.campaign_id == campaign_id,
+                    CampaignRecipient.status == "pending"
+                )
+            )
+        ) or 0
+    
+    def _pending_recipients_query(self, campaign_id: UUID):
+        return select(CampaignRecipient).where(
+            and_(
+                CampaignRecipient.campaign_id == campaign_id,
+                CampaignRecipient.status == "pending"
+            )
+        ).options(
+            selectinload(CampaignRecipient.customer)
+        ).order_by(CampaignRecipient.id)
+    
+    async def _load_pending_recipients(
+        self,
+        session: AsyncSession,
+        campaign_id: UUID
+    ) -> List[CampaignRecipient]:
+        """Load every pending recipient in one query (small campaigns)."""
+        result = await session.execute(self._pending_recipients_query(campaign_id))
+        return list(result.scalars().all())
+    
+    async def _preloaded_recipient_pages(
+        self,
+        recipients: List[CampaignRecipient]
+    ) -> AsyncIterator[List[CampaignRecipient]]:
+        """Yield already-loaded recipients in pages."""
+        for start in range(0, len(recipients), self.recipient_page_size):
+            yield recipients[start:start + self.recipient_page_size]
+    
+    async def _iter_pending_recipient_pages(
+        self,
+        session: AsyncSession,
+        campaign_id: UUID,
+        session_lock: asyncio.Lock,
+        after_id: Optional[UUID] = None
+    ) -> AsyncIterator[List[CampaignRecipient]]:
+        """
+        Stream pending recipients in fixed-size pages using keyset pagination.
+        
+        Each page is ``WHERE campaign_id = :id AND status = 'pending' AND id > :last
+        ORDER BY id LIMIT :n`` on the (campaign_id, status, id) index, so the cost
+        per page is constant regardless of campaign size and only one page is held
+        in memory. Recipients leave the pending state as batches commit, so a
+        restarted execution simply resumes from the first unsent recipient.
+        """
+        last_id = after_id
+        while True:
+            stmt = self._pending_recipients_query(campaign_id).limit(self.recipient_page_size)
+            if last_id is not None:
+                stmt = stmt.where(CampaignRecipient.id > last_id)
+            
+            async with session_lock:
+                result = await session.execute(stmt)
+                page = list(result.scalars().all())
+            
+            if not page:
+                return
+            
+            last_id = page[-1].id
+            yield page
+            
+            if len(page) < self.recipient_page_size:
+                return
+    
+    async def _run_worker_pool(
         self,
         campaign: Campaign,
-        recipient: CampaignRecipient,
-        session: AsyncSession
+        recipient_pages: AsyncIterator[List[CampaignRecipient]],
+        send_limits: List[BucketLimit],
+        progress: ExecutionProgress,
+        session: AsyncSession,
+        websocket_manager: Optional[CampaignWebSocketManager] = None,
+        session_lock: Optional[asyncio.Lock] = None
     ) -> bool:
-        """Send a message to a campaign recipient."""
+        """
+        Send to recipients with a bounded pool of workers.
+        
+        Recipient pages are personalized as a whole and fed into a bounded queue
+        (at most one page ahead of the workers). Workers pull recipients and send
+        concurrently,
+        and hand outcomes to a buffer that is committed every
+        ``commit_batch_size`` messages. The session is only touched under a
+        lock since AsyncSession is not safe for concurrent use.
+        
+        Returns:
+            True if the campaign was paused or stopped before finishing
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency * 2)
+        stop_event = asyncio.Event()
+        session_lock = session_lock or asyncio.Lock()
+        outcomes: List[SendOutcome] = []
+        failures: List[Exception] = []
+        
+        async def producer():
+            async for page in recipient_pages:
+                contents = await self._personalize_page(campaign, page, session, session_lock)
+                for recipient in page:
+                    if stop_event.is_set():
+                        return
+                    await queue.put((recipient, contents.get(recipient.id)))
+        
+        async def worker():
+            while True:
+                recipient, content = await queue.get()
+                try:
+                    if stop_event.is_set():
+                        continue
+                    if not await self.throttle.acquire(send_limits, stop_event.is_set):
+                        continue
+                    
+                    outcome = await self._send_to_recipient(
+                        campaign, recipient, session, session_lock, content
+                    )
+                    outcomes.append(outcome)
+                    
+                    if len(outcomes) >= self.commit_batch_size:
+                        await self._flush_outcomes(campaign, outcomes, progress, session, session_lock)
+                        await self._broadcast_progress(campaign.id, progress, websocket_manager)
+                except Exception as e:
+                    # A failed batch commit aborts the run; remaining items are drained
+                    failures.append(e)
+                    stop_event.set()
+                finally:
+                    queue.task_done()
+        
+        watcher = asyncio.create_task(self._watch_campaign_status(campaign.id, stop_event))
+        workers = [asyncio.create_task(worker()) for _ in range(max(1, self.max_concurrency))]
+        try:
+            await producer()
+            await queue.join()
+        finally:
+            for task in workers + [watcher]:
+                task.cancel()
+            await asyncio.gather(*workers, watcher, return_exceptions=True)
+        
+        if failures:
+            raise failures[0]
+        
+        # Persist whatever is left in the buffer
+        await self._flush_outcomes(campaign, outcomes, progress, session, session_lock)
+        await self._broadcast_progress(campaign.id, progress, websocket_manager, force=True)
+        
+        return stop_event.is_set()
+    
+    async def _watch_campaign_status(self, campaign_id: UUID, stop_event: asyncio.Event):
+        """Poll campaign status on its own session and signal workers to stop."""
+        from ...database import db_manager
+        
+        while not stop_event.is_set():
+            await asyncio.sleep(self.status_check_interval)
+            try:
+                async with db_manager.get_session() as status_session:
+                    status = await status_session.scalar(
+                        select(Campaign.status).where(Campaign.id == campaign_id)
+                    )
+                if status != "running":
+                    logger.info(f"Campaign {campaign_id} status changed to {status}, stopping workers")
+                    stop_event.set()
+            except Exception as e:
+                logger.warning(f"Campaign status check failed: {str(e)}")
+    
+    async def _send_to_recipient(
+        self,
+        campaign: Campaign,
+        recipient: CampaignRecipient,
+        session: AsyncSession,
+        session_lock: asyncio.Lock,
+        content: Optional[str] = None
+    ) -> SendOutcome:
+        """
+        Send one message without committing.
+        
+        ``content`` is the recipient's pre-rendered message from its page;
+        without it the message is personalized on its own.
+        """
         try:
-            # Get message variant for this recipient
             message_variant = self._get_message_variant(campaign, recipient)
             
-            # Personalize message content
-            personalized_content = await self._personalize_message(
-                message_variant,
-                recipient,
-                campaign,
-                session
-            )
+            if content is None:
+                async with session_lock:
+                    personalized_content = await self._personalize_message(
+                        message_variant,
+                        recipient,
+                        campaign,
+                        session
+                    )
+            elif message_variant.get("use_ai_personalization", False):
+                personalized_content = await self._ai_personalize_message(
+                    content=content,
+                    customer=recipient.customer,
+                    campaign=campaign
+                )
+            else:
+                personalized_content = content
             
-            # Create WhatsApp message record
-            whatsapp_message = WhatsAppMessage(
-                content=personalized_content,
-                direction="outbound",
-                status="queued",
-                language=campaign.default_language,
-                template_name=message_variant.get("template_name"),
-                template_parameters=message_variant.get("template_parameters"),
-                customer_id=recipient.customer_id,
-                restaurant_id=campaign.restaurant_id,
-                campaign_id=campaign.id
-            )
+            whatsapp_message = self._build_message(campaign, recipient, message_variant, personalized_content)
             
-            session.add(whatsapp_message)
-            await session.commit()
-            await session.refresh(whatsapp_message)
+            await self._dispatch_message(whatsapp_message)
             
-            # TODO: Integrate with actual WhatsApp Business API
-            # For now, simulate message sending
-            await asyncio.sleep(0.1)  # Simulate API call
+            logger.debug(f"Message sent to customer {recipient.customer_id}")
+            return SendOutcome(recipient=recipient, message=whatsapp_message, success=True)
             
-            # Update message status (simulated success)
-            whatsapp_message.status = "sent"
-            whatsapp_message.sent_at = datetime.utcnow()
+        except Exception as e:
+            logger.error(f"Error sending message to recipient {recipient.id}: {str(e)}")
+            return SendOutcome(recipient=recipient, message=None, success=False, error=str(e))
+    
+    async def _flush_outcomes(
+        self,
+        campaign: Campaign,
+        outcomes: List[SendOutcome],
+        progress: ExecutionProgress,
+        session: AsyncSession,
+        session_lock: asyncio.Lock
+    ):
+        """Apply buffered outcomes and commit them in one transaction."""
+        if not outcomes:
+            return
+        
+        async with session_lock:
+            batch = outcomes[:]
+            outcomes.clear()
             
-            # Link message to recipient
-            recipient.message_id = whatsapp_message.id
+            sent = 0
+            failed = 0
+            for outcome in batch:
+                if outcome.success:
+                    session.add(outcome.message)
+                    outcome.recipient.mark_sent(outcome.message.id)
+                    sent += 1
+                else:
+                    outcome.recipient.status = "failed"
+                    failed += 1
             
-            await session.commit()
+            campaign.messages_sent += sent
+            campaign.messages_failed += failed
             
-            logger.debug(f"Message sent to customer {recipient.customer_id}")
-            return True
+            try:
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Failed to commit campaign batch of {len(batch)}: {str(e)}")
+                await session.rollback()
+                raise
             
+            progress.sent += sent
+            progress.failed += failed
+    
+    async def _broadcast_progress(
+        self,
+        campaign_id: UUID,
+        progress: ExecutionProgress,
+        websocket_manager: Optional[CampaignWebSocketManager],
+        force: bool = False
+    ):
+        """Send a progress update at most once per ``progress_interval``."""
+        if not websocket_manager:
+            return
+        
+        now = time.monotonic()
+        if not force and now - progress.last_broadcast < self.progress_interval:
+            return
+        progress.last_broadcast = now
+        
+        update = {
+            "campaign_id": str(campaign_id),
+            "sent": progress.sent,
+            "failed": progress.failed,
+            "remaining": progress.total - progress.processed,
+            "progress_percent": round(progress.processed / progress.total * 100, 2) if progress.total else 100.0,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        try:
+            await websocket_manager.broadcast_to_campaign(str(campaign_id), update)
         except Exception as e:
-            logger.error(f"Failed to send message: {str(e)}")
-            return False
+            logger.warning(f"Progress broadcast failed: {str(e)}")
+    
+    def _build_message(
+        self,
+        campaign: Campaign,
+        recipient: CampaignRecipient,
+        message_variant: Dict[str, Any],
+        content: str
+    ) -> WhatsAppMessage:
+        """Create the WhatsApp message record (added to the session on flush)."""
+        return WhatsAppMessage(
+            # Assigned up front so recipients can be linked without a flush
+            id=uuid4(),
+            content=content,
+            direction="outbound",
+            status="queued",
+            language=campaign.default_language,
+            template_name=message_variant.get("template_name"),
+            template_parameters=message_variant.get("template_parameters"),
+            customer_id=recipient.customer_id,
+            restaurant_id=campaign.restaurant_id,
+            campaign_id=campaign.id
+        )
+    
+    async def _dispatch_message(self, whatsapp_message: WhatsAppMessage):
+        """Send a message through the WhatsApp provider."""
+        # TODO: Integrate with actual WhatsApp Business API
+        # For now, simulate message sending
+        await asyncio.sleep(0.1)  # Simulate API call
+        
+        # Update message status (simulated success)
+        whatsapp_message.status = "sent"
+        whatsapp_message.sent_at = datetime.utcnow()
     
     def _get_message_variant(
         self,
@@ -281,43 +567,94 @@ class CampaignExecutionService:
         # Default to first variant
         return campaign.message_variants[0]
     
-    async def _personalize_message(
+    async def _personalize_page(
         self,
-        message_variant: Dict[str, Any],
-        recipient: CampaignRecipient,
         campaign: Campaign,
-        session: AsyncSession
-    ) -> str:
-        """Personalize message content for recipient."""
-        base_content = message_variant.get("content", "")
+        page: List[CampaignRecipient],
+        session: AsyncSession,
+        session_lock: asyncio.Lock
+    ) -> Dict[UUID, str]:
+        """
+        Render the variant template of every recipient on a page at once.
         
-        # Get customer data
-        await session.refresh(recipient.customer)
-        customer = recipient.customer
+        Customer context for the whole page costs a constant number of queries
+        and each variant is compiled once. Recipients missing from the result
+        (no variant, or the page failed to render) are personalized one by one
+        by their worker. AI personalization is applied per recipient afterwards.
+        """
+        templates = {}
+        for recipient in page:
+            try:
+                templates[recipient.id] = self._get_message_variant(campaign, recipient).get("content", "")
+            except ValueError:
+                continue
         
-        # Basic personalization variables
-        variables = {
+        if not templates:
+            return {}
+        
+        try:
+            async with session_lock:
+                recipients = [recipient for recipient in page if recipient.id in templates]
+                for recipient in recipients:
+                    if "customer" in inspect(recipient).unloaded:
+                        await session.refresh(recipient, ["customer"])
+                
+                return await self.personalization.render_recipients(
+                    recipients,
+                    templates,
+                    campaign,
+                    session,
+                    base_variables={
+                        recipient.id: self._basic_variables(recipient, campaign) for recipient in recipients
+                    }
+                )
+        except Exception as e:
+            logger.warning(f"Page personalization failed, personalizing recipients individually: {str(e)}")
+            return {}
+    
+    def _basic_variables(self, recipient: CampaignRecipient, campaign: Campaign) -> Dict[str, Any]:
+        """Variables every message can use, from the customer and restaurant."""
+        customer = recipient.customer
+        return {
             "customer_name": customer.first_name or "عزيزي العميل",
             "restaurant_name": campaign.restaurant.name if campaign.restaurant else "مطعمنا",
             "first_name": customer.first_name or "عزيزي",
             "last_name": customer.last_name or "",
             "phone": customer.phone_number,
         }
+    
+    async def _personalize_message(
+        self,
+        message_variant: Dict[str, Any],
+        recipient: CampaignRecipient,
+        campaign: Campaign,
+        session: AsyncSession
+    ) -> str:
+        """
+        Personalize message content for a single recipient.
         
-        # Add custom personalization data
-        if recipient.personalization_data:
-            variables.update(recipient.personalization_data)
+        Renders through the same ``render_recipients`` as a page, so a
+        recipient whose page failed gets the same variables and substitution
+        as the rest of the campaign.
+        """
+        # Get customer data (already eager-loaded during campaign execution)
+        if "customer" in inspect(recipient).unloaded:
+            await session.refresh(recipient, ["customer"])
         
-        # Replace variables in content
-        personalized_content = base_content
-        for key, value in variables.items():
-            personalized_content = personalized_content.replace(f"{{{key}}}", str(value))
+        rendered = await self.personalization.render_recipients(
+            [recipient],
+            {recipient.id: message_variant.get("content", "")},
+            campaign,
+            session,
+            base_variables={recipient.id: self._basic_variables(recipient, campaign)}
+        )
+        personalized_content = rendered[recipient.id]
         
         # Use AI for advanced personalization if configured
         if message_variant.get("use_ai_personalization", False):
             personalized_content = await self._ai_personalize_message(
                 content=personalized_content,
-                customer=customer,
+                customer=recipient.customer,
                 campaign=campaign
             )
         
@@ -9,21 +9,52 @@ from typing import Dict, Any, List, Optional, Tuple
 from uuid import UUID
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, text
+from sqlalchemy import func, inspect, select
+from sqlalchemy.orm import selectinload
 
 from ...core.logging import get_logger
-from ...models import Customer, Campaign, CampaignRecipient, WhatsAppMessage, Restaurant
+from ...models import Customer, Campaign, CampaignRecipient, CustomerEngagementStats, WhatsAppMessage, Restaurant
 from ..openrouter.client import OpenRouterClient
 
 logger = get_logger(__name__)
 
+# Any brace-free name, so keys such as {order-id} are substituted too
+PLACEHOLDER_PATTERN = re.compile(r'\{([^{}]+)\}')
+
+
+class CompiledTemplate:
+    """
+    Message template split once into literal text and placeholders.
+    
+    Rendering a page of recipients reuses the split instead of scanning the
+    template once per variable per recipient. Placeholders without a value
+    are left as written.
+    """
+    
+    __slots__ = ("parts",)
+    
+    def __init__(self, content: str):
+        # Literal text at even indices, variable names at odd indices
+        self.parts = PLACEHOLDER_PATTERN.split(content)
+    
+    def render(self, variables: Dict[str, Any]) -> str:
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            parts[i] = str(variables[name]) if name in variables else f"{{{name}}}"
+        return "".join(parts)
+
 
 class PersonalizationEngine:
     """Engine for personalizing campaign messages using AI and customer data."""
     
-    def __init__(self):
+    def __init__(self, batch_size: int = 500, recent_message_limit: int = 5):
         self.openrouter_client = OpenRouterClient()
         
+        # Customers whose context is fetched together, and messages kept per customer
+        self.batch_size = batch_size
+        self.recent_message_limit = recent_message_limit
+        
         # Arabic cultural context templates
         self.arabic_cultural_context = {
             "greetings": {
@@ -61,20 +92,24 @@ class PersonalizationEngine:
         campaign: Campaign,
         session: AsyncSession
     ) -> Dict[UUID, Dict[str, Any]]:
-        """Generate personalization data for each customer."""
+        """
+        Generate personalization data for each customer.
+        
+        Customers are processed in batches of ``batch_size``; each batch costs
+        two queries regardless of its size (see ``get_customer_contexts``).
+        """
         try:
             personalization_data = {}
+            restaurant = await self._load_restaurant(campaign, session)
             
-            for customer in customers:
-                # Get additional customer context
-                customer_context = await self._get_customer_context(customer, session)
-                
-                # Generate personalized variables
-                variables = await self._generate_customer_variables(
-                    customer, campaign, customer_context, session
-                )
+            for start in range(0, len(customers), self.batch_size):
+                batch = customers[start:start + self.batch_size]
+                contexts = await self.get_customer_contexts(batch, session)
                 
-                personalization_data[customer.id] = variables
+                for customer in batch:
+                    personalization_data[customer.id] = await self._generate_customer_variables(
+                        customer, campaign, contexts.get(customer.id, {}), restaurant
+                    )
             
             logger.info(f"Generated personalization data for {len(customers)} customers")
             return personalization_data
@@ -83,72 +118,153 @@ class PersonalizationEngine:
             logger.error(f"Personalization data generation failed: {str(e)}")
             return {}
     
-    async def _get_customer_context(
+    async def render_recipients(
         self,
-        customer: Customer,
+        recipients: List[CampaignRecipient],
+        templates: Dict[UUID, str],
+        campaign: Campaign,
+        session: AsyncSession,
+        base_variables: Optional[Dict[UUID, Dict[str, Any]]] = None
+    ) -> Dict[UUID, str]:
+        """
+        Render a page of recipients at once.
+        
+        ``templates`` maps recipient id to the content of its message variant;
+        recipients must have their customer loaded. Customer context for the
+        page is fetched in two queries and each distinct template is compiled
+        once. A recipient's variables are the generated ones, overridden by
+        its ``base_variables`` and then by its stored ``personalization_data``.
+        """
+        restaurant = await self._load_restaurant(campaign, session)
+        contexts = await self.get_customer_contexts([recipient.customer for recipient in recipients], session)
+        
+        compiled: Dict[str, CompiledTemplate] = {}
+        rendered = {}
+        for recipient in recipients:
+            content = templates[recipient.id]
+            template = compiled.get(content)
+            if template is None:
+                template = compiled[content] = CompiledTemplate(content)
+            
+            customer = recipient.customer
+            variables = await self._generate_customer_variables(
+                customer, campaign, contexts.get(customer.id, {}), restaurant
+            )
+            variables.update((base_variables or {}).get(recipient.id, {}))
+            variables.update(recipient.personalization_data or {})
+            rendered[recipient.id] = template.render(variables)
+        
+        return rendered
+    
+    async def get_customer_contexts(
+        self,
+        customers: List[Customer],
         session: AsyncSession
-    ) -> Dict[str, Any]:
-        """Get additional context about the customer."""
+    ) -> Dict[UUID, Dict[str, Any]]:
+        """
+        Get context for many customers in two queries.
+        
+        Recent messages come from one windowed query (``ROW_NUMBER() OVER
+        (PARTITION BY customer_id ORDER BY created_at DESC)``) over messages
+        that are not deleted, which is what the partial customer/created_at
+        index from migration 006 covers; response history comes from the
+        precomputed engagement stats.
+        """
+        if not customers:
+            return {}
+        
         try:
-            # Get message history
-            stmt = select(WhatsAppMessage).where(
-                WhatsAppMessage.customer_id == customer.id
-            ).order_by(WhatsAppMessage.created_at.desc()).limit(5)
-            
-            result = await session.execute(stmt)
-            recent_messages = result.scalars().all()
-            
-            # Get response history
-            response_stmt = text("""
-                SELECT 
-                    COUNT(*) as total_messages,
-                    SUM(CASE WHEN cr.has_responded = true THEN 1 ELSE 0 END) as responses,
-                    AVG(CASE WHEN cr.has_responded = true THEN 
-                        EXTRACT(EPOCH FROM (cr.responded_at - cr.sent_at))/3600 
-                        ELSE NULL END) as avg_response_time_hours
-                FROM whatsapp_messages wm
-                LEFT JOIN campaign_recipients cr ON wm.id = cr.message_id
-                WHERE wm.customer_id = :customer_id
-            """)
-            
-            response_result = await session.execute(response_stmt, {"customer_id": customer.id})
-            response_stats = response_result.fetchone()
-            
-            # Calculate customer metrics
-            days_since_visit = (datetime.utcnow() - customer.visit_date).days if customer.visit_date else None
+            customer_ids = [customer.id for customer in customers]
+            
+            ranked = select(
+                WhatsAppMessage.customer_id,
+                WhatsAppMessage.content,
+                WhatsAppMessage.direction,
+                WhatsAppMessage.created_at,
+                func.row_number().over(
+                    partition_by=WhatsAppMessage.customer_id,
+                    order_by=WhatsAppMessage.created_at.desc()
+                ).label("position")
+            ).where(
+                WhatsAppMessage.customer_id.in_(customer_ids),
+                WhatsAppMessage.is_deleted == False
+            ).subquery()
+            
+            result = await session.execute(
+                select(ranked)
+                .where(ranked.c.position <= self.recent_message_limit)
+                .order_by(ranked.c.customer_id, ranked.c.position)
+            )
+            recent_messages: Dict[UUID, List[Any]] = {}
+            for row in result:
+                recent_messages.setdefault(row.customer_id, []).append(row)
             
-            context = {
-                "recent_messages": [
-                    {
-                        "content": msg.content[:100],  # Truncate for privacy
-                        "direction": msg.direction,
-                        "created_at": msg.created_at.isoformat()
-                    }
-                    for msg in recent_messages
-                ],
-                "message_history": {
-                    "total_messages": response_stats[0] if response_stats else 0,
-                    "total_responses": response_stats[1] if response_stats else 0,
-                    "avg_response_time_hours": response_stats[2] if response_stats else None,
-                    "response_rate": (response_stats[1] / response_stats[0] * 100) if response_stats and response_stats[0] > 0 else 0
-                },
-                "visit_info": {
-                    "days_since_visit": days_since_visit,
-                    "is_recent_visitor": days_since_visit is not None and days_since_visit <= 7,
-                    "visit_recency": self._categorize_visit_recency(days_since_visit)
-                },
-                "value_info": {
-                    "order_value": customer.order_total or 0,
-                    "value_category": self._categorize_customer_value(customer.order_total or 0)
-                }
-            }
+            stats_result = await session.execute(
+                select(CustomerEngagementStats).where(CustomerEngagementStats.customer_id.in_(customer_ids))
+            )
+            engagement = {stats.customer_id: stats for stats in stats_result.scalars()}
             
-            return context
+            return {
+                customer.id: self._build_customer_context(
+                    customer, recent_messages.get(customer.id, []), engagement.get(customer.id)
+                )
+                for customer in customers
+            }
             
         except Exception as e:
             logger.error(f"Customer context retrieval failed: {str(e)}")
             return {}
     
+    async def _get_customer_context(
+        self,
+        customer: Customer,
+        session: AsyncSession
+    ) -> Dict[str, Any]:
+        """Get additional context about the customer."""
+        contexts = await self.get_customer_contexts([customer], session)
+        return contexts.get(customer.id, {})
+    
+    def _build_customer_context(
+        self,
+        customer: Customer,
+        recent_messages: List[Any],
+        engagement: Optional[CustomerEngagementStats]
+    ) -> Dict[str, Any]:
+        """Assemble a customer's context from their recent messages and engagement stats."""
+        days_since_visit = (datetime.utcnow() - customer.visit_date).days if customer.visit_date else None
+        
+        return {
+            "recent_messages": [
+                {
+                    "content": msg.content[:100],  # Truncate for privacy
+                    "direction": msg.direction,
+                    "created_at": msg.created_at.isoformat()
+                }
+                for msg in recent_messages
+            ],
+            "message_history": engagement.to_history() if engagement else {
+                "total_messages": 0,
+                "total_responses": 0,
+                "avg_response_time_hours": None,
+                "response_rate": 0
+            },
+            "visit_info": {
+                "days_since_visit": days_since_visit,
+                "is_recent_visitor": days_since_visit is not None and days_since_visit <= 7,
+                "visit_recency": self._categorize_visit_recency(days_since_visit)
+            },
+            "value_info": {
+                "order_value": customer.order_total or 0,
+                "value_category": self._categorize_customer_value(customer.order_total or 0)
+            }
+        }
+    
+    async def _load_restaurant(self, campaign: Campaign, session: AsyncSession) -> Optional[Restaurant]:
+        """The campaign's restaurant, loaded at most once."""
+        if "restaurant" in inspect(campaign).unloaded:
+            await session.refresh(campaign, ["restaurant"])
+        return campaign.restaurant
+    
     def _categorize_visit_recency(self, days_since_visit: Optional[int]) -> str:
         """Categorize visit recency."""
         if days_since_visit is None:
@@ -176,14 +292,10 @@ class PersonalizationEngine:
         customer: Customer,
         campaign: Campaign,
         customer_context: Dict[str, Any],
-        session: AsyncSession
+        restaurant: Optional[Restaurant]
     ) -> Dict[str, Any]:
         """Generate personalized variables for a customer."""
         try:
-            # Get restaurant info
-            await session.refresh(campaign, ["restaurant"])
-            restaurant = campaign.restaurant
-            
             # Base variables
             variables = {
                 "customer_name": self._get_appropriate_name(customer),
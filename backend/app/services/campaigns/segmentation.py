@@ -3,21 +3,58 @@ Customer segmentation service for campaign targeting.
 Provides advanced customer segmentation based on behavior, demographics, and preferences.
 """
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, AsyncIterator, List, Optional, Sequence
 from uuid import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, func, text
+from sqlalchemy import Select, select, and_, case, func, literal
 
 from ...core.logging import get_logger
-from ...models import Customer, Campaign, CampaignRecipient, WhatsAppMessage
+from ...models import Customer, CustomerEngagementStats, WhatsAppMessage
 
 logger = get_logger(__name__)
 
+# Criteria that need the customer's message history rather than a customers column
+VISIT_COUNT_CRITERIA = ("visit_count_min", "visit_count_max")
+
+
+def _response_rate_expr():
+    """Response rate in percent from the customer's engagement stats (0 without a row)."""
+    stats = CustomerEngagementStats
+    return case(
+        (stats.total_messages > 0, stats.total_responses * literal(100.0) / stats.total_messages),
+        else_=literal(0.0)
+    )
+
+
+def _with_engagement(stmt: Select, customer_id) -> Select:
+    return stmt.outerjoin(CustomerEngagementStats, CustomerEngagementStats.customer_id == customer_id)
+
+
+def _visit_count_expr():
+    """Distinct days with an inbound message, as a visit count proxy (1 without any)."""
+    visit_days = func.count(func.distinct(func.date(WhatsAppMessage.created_at)))
+    return case((visit_days > 0, visit_days), else_=1)
+
+
+def _visit_count_query(candidates) -> Select:
+    """Per-customer visit count for ``candidates`` (anything with an ``id`` column)."""
+    return (
+        select(candidates.c.id, _visit_count_expr().label("visit_count"))
+        .select_from(candidates)
+        .outerjoin(WhatsAppMessage, and_(
+            WhatsAppMessage.customer_id == candidates.c.id,
+            WhatsAppMessage.direction == "inbound"
+        ))
+        .group_by(candidates.c.id)
+    )
+
 
 class CustomerSegmentationService:
     """Service for advanced customer segmentation and targeting."""
     
-    def __init__(self):
+    def __init__(self, id_chunk_size: int = 5000):
+        # Explicit customer ids are bound in chunks to stay under driver parameter limits
+        self.id_chunk_size = id_chunk_size
         self.segment_definitions = {
             "new_customers": {
                 "description": "First-time customers",
@@ -69,42 +106,189 @@ class CustomerSegmentationService:
     ) -> List[Customer]:
         """Segment customers based on targeting configuration."""
         try:
-            # Start with all provided customers
-            filtered_customers = customers.copy()
-            
-            # Apply demographic filters
-            filtered_customers = await self._apply_demographic_filters(
-                filtered_customers, targeting_config, session
-            )
-            
-            # Apply behavioral filters
-            filtered_customers = await self._apply_behavioral_filters(
-                filtered_customers, targeting_config, session
-            )
-            
-            # Apply geographic filters
-            filtered_customers = await self._apply_geographic_filters(
-                filtered_customers, targeting_config, session
-            )
-            
-            # Apply engagement filters
-            filtered_customers = await self._apply_engagement_filters(
-                filtered_customers, targeting_config, session
-            )
-            
-            # Apply custom segment filters
-            filtered_customers = await self._apply_custom_segments(
-                filtered_customers, targeting_config, session
-            )
-            
+            if not customers:
+                return []
+
+            # One compiled query decides membership; the loaded objects keep their order
+            matched = set()
+            customer_ids = [c.id for c in customers]
+            for start in range(0, len(customer_ids), self.id_chunk_size):
+                stmt = self.build_segment_query(
+                    targeting_config, customer_ids=customer_ids[start:start + self.id_chunk_size]
+                )
+                matched.update((await session.execute(stmt)).scalars())
+
+            filtered_customers = [c for c in customers if c.id in matched]
+
             logger.info(f"Segmented {len(customers)} customers down to {len(filtered_customers)} based on targeting config")
-            
+
             return filtered_customers
-            
+
         except Exception as e:
             logger.error(f"Customer segmentation failed: {str(e)}")
             return customers  # Return original list on error
-    
+
+    def build_segment_query(
+        self,
+        targeting_config: Dict[str, Any],
+        restaurant_id: Optional[UUID] = None,
+        customer_ids: Optional[Sequence[UUID]] = None
+    ) -> Select:
+        """
+        Compile a targeting configuration into one query selecting customer ids.
+
+        Column criteria (language, party size, order value, visit recency,
+        special requests, opt-ins) become WHERE clauses, and so does response
+        rate, read from the precomputed ``customer_engagement_stats`` row.
+        Visit count is an aggregate over the customer's inbound messages: the
+        filtered customers become a CTE that is joined to their messages,
+        grouped and filtered with HAVING, so history is only scanned for
+        customers that already passed the cheap filters. Named segments in
+        ``customer_segments`` add their criteria to the same query.
+        """
+        criteria = [targeting_config or {}]
+        for segment_name in (targeting_config or {}).get("customer_segments", []):
+            if segment_name in self.segment_definitions:
+                criteria.append(self.segment_definitions[segment_name]["criteria"])
+            else:
+                logger.warning(f"Unknown customer segment: {segment_name}")
+
+        conditions = []
+        if restaurant_id is not None:
+            conditions += [Customer.restaurant_id == restaurant_id, Customer.is_deleted.is_(False)]
+        if customer_ids is not None:
+            conditions.append(Customer.id.in_(list(customer_ids)))
+        for config in criteria:
+            conditions += self._column_conditions(config)
+
+        stmt = select(Customer.id).where(*conditions)
+
+        response_rate = _response_rate_expr()
+        response_conditions = []
+        for config in criteria:
+            response_conditions += self._range_conditions(
+                response_rate, config.get("response_rate_min"), config.get("response_rate_max")
+            )
+        if response_conditions:
+            stmt = _with_engagement(stmt, Customer.id).where(*response_conditions)
+
+        if not any(config.get(key) is not None for config in criteria for key in VISIT_COUNT_CRITERIA):
+            return stmt
+
+        candidates = stmt.cte("segment_candidates")
+        visit_count = _visit_count_expr()
+        having = []
+        for config in criteria:
+            having += self._range_conditions(visit_count, config.get("visit_count_min"), config.get("visit_count_max"))
+
+        return _visit_count_query(candidates).with_only_columns(candidates.c.id).having(and_(*having))
+
+    async def count_segment(
+        self,
+        targeting_config: Dict[str, Any],
+        restaurant_id: UUID,
+        session: AsyncSession
+    ) -> int:
+        """Count a restaurant's customers matching the targeting configuration."""
+        segment = self.build_segment_query(targeting_config, restaurant_id=restaurant_id).subquery()
+        result = await session.execute(select(func.count()).select_from(segment))
+        return result.scalar_one()
+
+    async def stream_segment(
+        self,
+        targeting_config: Dict[str, Any],
+        restaurant_id: UUID,
+        session: AsyncSession,
+        batch_size: int = 1000
+    ) -> AsyncIterator[List[UUID]]:
+        """Yield the ids of matching customers in batches, without loading Customer objects."""
+        stmt = self.build_segment_query(targeting_config, restaurant_id=restaurant_id)
+        result = await session.stream(stmt.execution_options(yield_per=batch_size))
+        async for partition in result.scalars().partitions(batch_size):
+            yield list(partition)
+
+    def _column_conditions(self, config: Dict[str, Any]) -> List[Any]:
+        """WHERE clauses for criteria answered by the customers row."""
+        conditions = []
+
+        preferred_languages = config.get("preferred_language")
+        if preferred_languages:
+            conditions.append(Customer.preferred_language.in_(preferred_languages))
+
+        conditions += self._range_conditions(Customer.party_size, config.get("party_size_min"), config.get("party_size_max"))
+        conditions += self._range_conditions(
+            func.coalesce(Customer.order_total, 0), config.get("order_total_min"), config.get("order_total_max")
+        )
+
+        now = datetime.utcnow()
+        visit_days_ago_min = config.get("visit_days_ago_min")
+        if visit_days_ago_min is not None:
+            conditions.append(Customer.visit_date <= now - timedelta(days=visit_days_ago_min))
+        visit_days_ago_max = config.get("visit_days_ago_max")
+        if visit_days_ago_max is not None:
+            conditions.append(Customer.visit_date >= now - timedelta(days=visit_days_ago_max))
+
+        has_special_requests = config.get("has_special_requests")
+        if has_special_requests is not None:
+            has_text = and_(Customer.special_requests.is_not(None), func.trim(Customer.special_requests) != "")
+            conditions.append(has_text if has_special_requests else ~has_text)
+
+        for opt_in in ("whatsapp_opt_in", "email_opt_in"):
+            if config.get(opt_in) is not None:
+                conditions.append(getattr(Customer, opt_in).is_(bool(config[opt_in])))
+
+        return conditions
+
+    @staticmethod
+    def _range_conditions(expr, minimum, maximum) -> List[Any]:
+        conditions = []
+        if minimum is not None:
+            conditions.append(expr >= minimum)
+        if maximum is not None:
+            conditions.append(expr <= maximum)
+        return conditions
+
+    async def segment_customers_in_memory(
+        self,
+        customers: List[Customer],
+        targeting_config: Dict[str, Any],
+        session: AsyncSession
+    ) -> List[Customer]:
+        """
+        Filter already loaded customers stage by stage in Python.
+
+        Same semantics as the compiled query; kept as the reference it is
+        checked against.
+        """
+        filtered_customers = customers.copy()
+
+        # Apply demographic filters
+        filtered_customers = await self._apply_demographic_filters(
+            filtered_customers, targeting_config, session
+        )
+
+        # Apply behavioral filters
+        filtered_customers = await self._apply_behavioral_filters(
+            filtered_customers, targeting_config, session
+        )
+
+        # Apply geographic filters
+        filtered_customers = await self._apply_geographic_filters(
+            filtered_customers, targeting_config, session
+        )
+
+        # Apply engagement filters
+        filtered_customers = await self._apply_engagement_filters(
+            filtered_customers, targeting_config, session
+        )
+
+        # Apply custom segment filters
+        filtered_customers = await self._apply_custom_segments(
+            filtered_customers, targeting_config, session
+        )
+
+        return filtered_customers
+
     async def _apply_demographic_filters(
         self,
         customers: List[Customer],
@@ -260,28 +444,12 @@ class CustomerSegmentationService:
         if not customers:
             return customers
         
-        customer_ids = [c.id for c in customers]
-        
-        # Calculate response rates for each customer
-        stmt = text("""
-            SELECT 
-                c.id,
-                COUNT(wm.id) as total_messages,
-                SUM(CASE WHEN cr.has_responded = true THEN 1 ELSE 0 END) as responses,
-                CASE 
-                    WHEN COUNT(wm.id) > 0 THEN 
-                        (SUM(CASE WHEN cr.has_responded = true THEN 1 ELSE 0 END)::float / COUNT(wm.id) * 100)
-                    ELSE 0 
-                END as response_rate
-            FROM customers c
-            LEFT JOIN whatsapp_messages wm ON c.id = wm.customer_id
-            LEFT JOIN campaign_recipients cr ON wm.id = cr.message_id
-            WHERE c.id = ANY(:customer_ids)
-            GROUP BY c.id
-        """)
-        
-        result = await session.execute(stmt, {"customer_ids": customer_ids})
-        response_rates = {row[0]: row[3] for row in result}
+        # Precomputed per-customer stats; customers without a row have no messages
+        stmt = _with_engagement(
+            select(Customer.id, _response_rate_expr()), Customer.id
+        ).where(Customer.id.in_([c.id for c in customers]))
+        result = await session.execute(stmt)
+        response_rates = {row[0]: row[1] for row in result}
         
         # Filter customers based on response rate
         filtered_customers = []
@@ -405,32 +573,17 @@ class CustomerSegmentationService:
         visit_count_max: Optional[int],
         session: AsyncSession
     ) -> List[Customer]:
-        """Filter customers by visit count (simplified - assumes one visit per customer record)."""
-        # In a real implementation, you'd have a separate visits table
-        # For now, we'll use a simplified approach based on customer records
-        
+        """Filter customers by visit count (days with inbound messages as a proxy)."""
         if not customers:
             return customers
         
-        customer_ids = [c.id for c in customers]
-        
-        # Query visit counts (simplified - using message counts as proxy)
-        stmt = text("""
-            SELECT 
-                customer_id,
-                COUNT(DISTINCT DATE(created_at)) as visit_days
-            FROM whatsapp_messages
-            WHERE customer_id = ANY(:customer_ids)
-            AND direction = 'inbound'
-            GROUP BY customer_id
-        """)
-        
-        result = await session.execute(stmt, {"customer_ids": customer_ids})
+        candidates = select(Customer.id).where(Customer.id.in_([c.id for c in customers])).cte("customer_ids")
+        result = await session.execute(_visit_count_query(candidates))
         visit_counts = {row[0]: row[1] for row in result}
         
         filtered_customers = []
         for customer in customers:
-            visit_count = visit_counts.get(customer.id, 1)  # Default to 1 if no messages
+            visit_count = visit_counts.get(customer.id, 1)
             
             include_customer = True
             
@@ -452,50 +605,46 @@ class CustomerSegmentationService:
     ) -> Dict[str, Any]:
         """Analyze customer segments for a restaurant."""
         try:
-            # Get all customers for the restaurant
-            stmt = select(Customer).where(Customer.restaurant_id == restaurant_id)
-            result = await session.execute(stmt)
-            customers = result.scalars().all()
+            # Overall statistics, aggregated in the database
+            total_customers, overall_avg_order = (await session.execute(
+                select(func.count(Customer.id), func.avg(func.coalesce(Customer.order_total, 0)))
+                .where(Customer.restaurant_id == restaurant_id, Customer.is_deleted.is_(False))
+            )).one()
             
-            if not customers:
+            if not total_customers:
                 return {"message": "No customers found"}
             
             # Analyze each segment
             segment_analysis = {}
             
             for segment_name, segment_info in self.segment_definitions.items():
-                # Apply segment criteria
-                segment_customers = await self._apply_segment_criteria(
-                    customers, segment_info["criteria"], session
-                )
+                segment = self.build_segment_query(
+                    segment_info["criteria"], restaurant_id=restaurant_id
+                ).cte(f"segment_{segment_name}")
                 
-                # Calculate segment metrics
-                segment_size = len(segment_customers)
-                segment_percentage = (segment_size / len(customers)) * 100
-                
-                # Calculate average order value for segment
-                avg_order_value = sum(c.order_total or 0 for c in segment_customers) / segment_size if segment_size > 0 else 0
+                # Size and average order value of the segment
+                segment_size, avg_order_value = (await session.execute(
+                    select(func.count(Customer.id), func.avg(func.coalesce(Customer.order_total, 0)))
+                    .join(segment, segment.c.id == Customer.id)
+                )).one()
+                segment_percentage = (segment_size / total_customers) * 100
                 
                 # Calculate response rate for segment
                 response_rate = await self._calculate_segment_response_rate(
-                    segment_customers, session
-                )
+                    segment, session
+                ) if segment_size else 0.0
                 
                 segment_analysis[segment_name] = {
                     "description": segment_info["description"],
                     "customer_count": segment_size,
                     "percentage_of_total": round(segment_percentage, 2),
-                    "avg_order_value": round(avg_order_value, 2),
+                    "avg_order_value": round(avg_order_value or 0, 2),
                     "avg_response_rate": round(response_rate, 2)
                 }
             
-            # Overall statistics
-            total_customers = len(customers)
-            overall_avg_order = sum(c.order_total or 0 for c in customers) / total_customers
-            
             return {
                 "total_customers": total_customers,
-                "overall_avg_order_value": round(overall_avg_order, 2),
+                "overall_avg_order_value": round(overall_avg_order or 0, 2),
                 "segments": segment_analysis,
                 "top_segments_by_size": sorted(
                     segment_analysis.items(),
@@ -515,35 +664,13 @@ class CustomerSegmentationService:
     
     async def _calculate_segment_response_rate(
         self,
-        customers: List[Customer],
+        segment,
         session: AsyncSession
     ) -> float:
-        """Calculate average response rate for a customer segment."""
-        if not customers:
-            return 0.0
-        
-        customer_ids = [c.id for c in customers]
-        
-        stmt = text("""
-            SELECT 
-                AVG(
-                    CASE 
-                        WHEN COUNT(wm.id) > 0 THEN 
-                            (SUM(CASE WHEN cr.has_responded = true THEN 1 ELSE 0 END)::float / COUNT(wm.id) * 100)
-                        ELSE 0 
-                    END
-                ) as avg_response_rate
-            FROM customers c
-            LEFT JOIN whatsapp_messages wm ON c.id = wm.customer_id
-            LEFT JOIN campaign_recipients cr ON wm.id = cr.message_id
-            WHERE c.id = ANY(:customer_ids)
-            GROUP BY c.id
-        """)
-        
-        result = await session.execute(stmt, {"customer_ids": customer_ids})
-        row = result.fetchone()
-        
-        return row[0] or 0.0 if row else 0.0
+        """Calculate average response rate for a segment (a CTE of customer ids)."""
+        stmt = _with_engagement(select(func.avg(_response_rate_expr())).select_from(segment), segment.c.id)
+        result = await session.execute(stmt)
+        return float(result.scalar() or 0.0)
     
     def get_segment_recommendations(
         self,
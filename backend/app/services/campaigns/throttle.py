@@ -0,0 +1,284 @@
+"""
+Token-bucket send throttle for campaign messages.
+Shared per-campaign, per-restaurant and per-sender limits, in process or across workers through Redis.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+from ...core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Atomically takes ``cost`` sends from every limit, or from none.
+#
+# KEYS: one key per limit; a hash with fields "tokens" and "updated" for a
+#       token bucket, a sorted set of send times for a sliding window
+# ARGV: cost, a unique send id, then (capacity, refill_per_second, window_seconds)
+#       per key; window_seconds is 0 for a token bucket
+#
+# Time comes from the Redis server, so every worker refills against the same
+# clock; a clock that steps back refills nothing. A window admits a send only
+# if fewer than ``capacity`` sends were taken in the last ``window_seconds``.
+# Returns {1, "0"} when the sends were taken, otherwise {0, seconds until every
+# limit can cover the cost}.
+TOKEN_BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local send_id = ARGV[2]
+local levels = {}
+local stamps = {}
+local wait = 0
+
+for i, key in ipairs(KEYS) do
+    local base = 2 + (i - 1) * 3
+    local capacity = tonumber(ARGV[base + 1])
+    local rate = tonumber(ARGV[base + 2])
+    local window = tonumber(ARGV[base + 3])
+    if window > 0 then
+        redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+        local excess = redis.call('ZCARD', key) + cost - capacity
+        if excess > 0 then
+            -- Wait until enough of the oldest sends have left the window
+            local oldest = redis.call('ZRANGE', key, excess - 1, excess - 1, 'WITHSCORES')
+            local until_free = window
+            if #oldest > 0 then
+                until_free = tonumber(oldest[2]) + window - now
+            end
+            wait = math.max(wait, until_free)
+        end
+    else
+        local state = redis.call('HMGET', key, 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or capacity
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+        levels[i] = tokens
+        stamps[i] = math.max(now, updated)
+        if tokens < cost then
+            wait = math.max(wait, (cost - tokens) / rate)
+        end
+    end
+end
+
+if wait > 0 then
+    return {0, tostring(wait)}
+end
+
+for i, key in ipairs(KEYS) do
+    local base = 2 + (i - 1) * 3
+    local capacity = tonumber(ARGV[base + 1])
+    local rate = tonumber(ARGV[base + 2])
+    local window = tonumber(ARGV[base + 3])
+    if window > 0 then
+        for n = 1, cost do
+            redis.call('ZADD', key, now, send_id .. ':' .. n)
+        end
+        redis.call('EXPIRE', key, math.ceil(window) + 60)
+    else
+        redis.call('HSET', key, 'tokens', tostring(levels[i] - cost), 'updated', tostring(stamps[i]))
+        redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+    end
+end
+return {1, '0'}
+"""
+
+
+@dataclass(frozen=True)
+class BucketLimit:
+    """
+    One send limit.
+
+    With ``window`` 0 this is a token bucket: ``rate`` tokens per second up
+    to ``capacity``. With a ``window`` it is a sliding window admitting at
+    most ``capacity`` sends in any ``window`` seconds.
+    """
+    key: str
+    rate: float
+    capacity: float
+    window: float = 0.0
+
+    @classmethod
+    def for_rate(cls, key: str, count: int, period_seconds: float, burst: Optional[float] = None) -> "BucketLimit":
+        """
+        Bucket allowing ``count`` sends per ``period_seconds``.
+
+        Without an explicit ``burst`` the bucket holds at most one minute's
+        worth of sends (and never more than ``count``), so sends are paced
+        instead of going out at once. A bucket is not a quota: over one
+        period it admits up to ``capacity`` more than ``count``; use
+        ``for_window`` for limits that must hold.
+        """
+        rate = count / period_seconds
+        capacity = burst if burst is not None else min(count, max(1.0, rate * 60))
+        return cls(key=key, rate=rate, capacity=capacity)
+
+    @classmethod
+    def for_window(cls, key: str, count: int, period_seconds: float) -> "BucketLimit":
+        """Quota of at most ``count`` sends in any ``period_seconds``, sent as fast as other limits allow."""
+        return cls(key=key, rate=count / period_seconds, capacity=count, window=period_seconds)
+
+
+class TokenBucketThrottle:
+    """
+    Token buckets shared by every campaign executor.
+
+    A send takes one token from each of its buckets at once (campaign,
+    restaurant, sender number), so the tightest limit wins and no bucket is
+    charged for a send another bucket refused. Quotas that must hold over a
+    period (hourly and daily tiers) are sliding windows rather than buckets. With Redis the buckets are
+    shared by all workers; otherwise, or if Redis fails, they live in this
+    process on the monotonic clock.
+    """
+
+    def __init__(self, key_prefix: str = "send_throttle", max_local_buckets: int = 10000):
+        self.key_prefix = key_prefix
+        self.max_local_buckets = max_local_buckets
+        self.redis_client: Optional[Any] = None
+        self._bucket_script = None
+
+        # key -> (tokens, updated, capacity, rate)
+        self.buckets: Dict[str, Tuple[float, float, float, float]] = {}
+        # key -> (times of the sends still inside the window, window seconds)
+        self.windows: Dict[str, Tuple[Deque[float], float]] = {}
+        self.stats = {"acquired": 0, "throttled": 0, "wait_seconds": 0.0, "redis_errors": 0}
+
+    async def initialize(self):
+        """Connect to Redis for cross-worker buckets, falling back to local buckets."""
+        try:
+            if redis and hasattr(settings, 'redis') and settings.redis.REDIS_URL:
+                self.redis_client = redis.from_url(settings.redis.REDIS_URL, decode_responses=True)
+                await self.redis_client.ping()
+                self._bucket_script = self.redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+                logger.info("Redis send throttle backend connected")
+            else:
+                logger.info("Redis not available, using in-process send throttle")
+        except Exception as e:
+            logger.warning(f"Failed to connect to Redis for send throttling: {str(e)}")
+            self.redis_client = None
+
+    async def close(self):
+        """Close the Redis connection."""
+        if self.redis_client:
+            try:
+                await self.redis_client.close()
+            except Exception as e:
+                logger.error(f"Error closing send throttle connection: {str(e)}")
+            self.redis_client = None
+
+    async def try_acquire(self, limits: List[BucketLimit], cost: float = 1.0) -> float:
+        """Take ``cost`` tokens from every bucket; returns 0 on success, else the seconds to wait."""
+        if self.redis_client and self._bucket_script:
+            try:
+                args = [cost, uuid.uuid4().hex]
+                for limit in limits:
+                    args += [limit.capacity, limit.rate, limit.window]
+                taken, wait = await self._bucket_script(
+                    keys=[f"{self.key_prefix}:{limit.key}" for limit in limits],
+                    args=args
+                )
+                return 0.0 if int(taken) else float(wait)
+            except Exception as e:
+                self.stats["redis_errors"] += 1
+                logger.warning(f"Redis send throttle failed, using local buckets: {str(e)}")
+
+        return self._take_local(limits, cost)
+
+    async def acquire(
+        self,
+        limits: List[BucketLimit],
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> bool:
+        """
+        Wait until one send fits every bucket and take it.
+
+        Taking tokens is atomic, so concurrent workers never oversubscribe a
+        bucket and a throttled campaign does not hold up others. Returns
+        False if ``should_stop`` fires while waiting.
+        """
+        started = time.monotonic()
+        while True:
+            if should_stop and should_stop():
+                return False
+            wait = await self.try_acquire(limits)
+            if wait <= 0:
+                break
+            # Wake up periodically so pause/stop is noticed while throttled
+            await asyncio.sleep(min(wait, 1.0))
+
+        waited = time.monotonic() - started
+        self.stats["acquired"] += 1
+        if waited > 0.001:
+            self.stats["throttled"] += 1
+            self.stats["wait_seconds"] += waited
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters and backend."""
+        return {
+            **self.stats,
+            "backend": "redis" if self.redis_client else "local",
+            "local_buckets": len(self.buckets),
+            "local_windows": len(self.windows),
+        }
+
+    def _take_local(self, limits: List[BucketLimit], cost: float) -> float:
+        now = time.monotonic()
+        levels = []
+        wait = 0.0
+        for limit in limits:
+            if limit.window:
+                sends = self._window_sends(limit, now)
+                excess = len(sends) + int(cost) - int(limit.capacity)
+                levels.append(None)
+                if excess > 0:
+                    # Wait until enough of the oldest sends have left the window
+                    wait = max(wait, sends[excess - 1] + limit.window - now if sends else limit.window)
+                continue
+            tokens, updated, _, _ = self.buckets.get(limit.key, (limit.capacity, now, 0, 0))
+            tokens = min(limit.capacity, tokens + (now - updated) * limit.rate)
+            levels.append(tokens)
+            if tokens < cost:
+                wait = max(wait, (cost - tokens) / limit.rate)
+
+        if wait > 0:
+            return wait
+
+        for limit, tokens in zip(limits, levels):
+            if limit.window:
+                sends, _ = self.windows.setdefault(limit.key, (deque(), limit.window))
+                sends.extend([now] * int(cost))
+            else:
+                self.buckets[limit.key] = (tokens - cost, now, limit.capacity, limit.rate)
+        if len(self.buckets) + len(self.windows) > self.max_local_buckets:
+            self._prune(now)
+        return 0.0
+
+    def _window_sends(self, limit: BucketLimit, now: float) -> Deque[float]:
+        """Send times still inside ``limit``'s window, oldest first."""
+        sends, _ = self.windows.get(limit.key, (deque(), limit.window))
+        while sends and sends[0] <= now - limit.window:
+            sends.popleft()
+        return sends
+
+    def _prune(self, now: float):
+        """Forget buckets that have refilled completely and windows with no sends left; both start empty anyway."""
+        for key, (tokens, updated, capacity, rate) in list(self.buckets.items()):
+            if tokens + (now - updated) * rate >= capacity:
+                del self.buckets[key]
+        for key, (sends, window) in list(self.windows.items()):
+            if not sends or sends[-1] <= now - window:
+                del self.windows[key]
+
+
+send_throttle = TokenBucketThrottle()
@@ -0,0 +1,245 @@
+"""
+Conversation history lookup for inbound WhatsApp messages.
+Serves recent turns per customer from a ring buffer and falls back to indexed queries.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, select
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+from ..core.config import settings
+from ..models.customer import Customer
+from ..models.whatsapp import ConversationThread, WhatsAppMessage
+
+logger = logging.getLogger(__name__)
+
+
+def to_turn(direction: str, body: str) -> Dict[str, str]:
+    """Conversation turn in the format RestaurantAIAgent expects."""
+    return {"from": "customer" if direction == "inbound" else "restaurant", "body": body}
+
+
+class RecentTurnBuffer:
+    """
+    In-process ring buffer of recent turns per customer.
+    Bounded by customer count (least recently used is evicted) and by idle TTL.
+    """
+
+    def __init__(self, turns_per_customer: int = 10, max_customers: int = 10000, ttl_seconds: float = 1800):
+        self.turns_per_customer = turns_per_customer
+        self.max_customers = max_customers
+        self.ttl_seconds = ttl_seconds
+        self._buffers: "OrderedDict[str, Tuple[float, Deque[Dict[str, str]]]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[List[Dict[str, str]]]:
+        """Turns for a customer, or None when the buffer is missing or expired."""
+        entry = self._buffers.get(key)
+        if entry is None:
+            return None
+        expires_at, turns = entry
+        if expires_at <= time.monotonic():
+            del self._buffers[key]
+            return None
+        self._buffers.move_to_end(key)
+        return list(turns)
+
+    def replace(self, key: str, turns: List[Dict[str, str]]):
+        """Seed a customer's buffer, e.g. after loading it from the database."""
+        self._store(key, deque(turns, maxlen=self.turns_per_customer))
+
+    def extend(self, key: str, turns: List[Dict[str, str]]):
+        """Append turns to a customer's buffer if it is loaded."""
+        if self.get(key) is None:
+            return
+        buffer = self._buffers[key][1]
+        buffer.extend(turns)
+        self._store(key, buffer)
+
+    def _store(self, key: str, buffer: Deque[Dict[str, str]]):
+        self._buffers[key] = (time.monotonic() + self.ttl_seconds, buffer)
+        self._buffers.move_to_end(key)
+        while len(self._buffers) > self.max_customers:
+            self._buffers.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+
+class ConversationHistoryService:
+    """
+    Recent conversation turns per phone number.
+
+    Reads are served from a ring buffer (Redis when available, so every
+    worker shares it, otherwise in-process). On a miss the phone number is
+    resolved to a customer and their active conversation thread, and the
+    last messages are read through the (customer_id, created_at) index.
+    """
+
+    KEY_PREFIX = "conversation_turns"
+
+    def __init__(self, turns_per_customer: int = 10, max_customers: int = 10000, ttl_seconds: int = 1800):
+        self.turns_per_customer = turns_per_customer
+        self.ttl_seconds = ttl_seconds
+        self.buffer = RecentTurnBuffer(turns_per_customer, max_customers, ttl_seconds)
+        self.redis_client: Optional[Any] = None
+        self.stats = {"hits": 0, "misses": 0, "database_loads": 0}
+
+    async def initialize(self):
+        """Connect the shared Redis buffer if available."""
+        try:
+            if redis and hasattr(settings, 'redis') and settings.redis.REDIS_URL:
+                self.redis_client = redis.from_url(settings.redis.REDIS_URL, decode_responses=True)
+                await self.redis_client.ping()
+                logger.info("Conversation history buffer connected to Redis")
+            else:
+                logger.info("Redis not available, conversation history buffered in memory")
+        except Exception as e:
+            logger.warning(f"Failed to connect to Redis: {str(e)}. Buffering conversation history in memory.")
+            self.redis_client = None
+
+    async def close(self):
+        """Close the Redis connection."""
+        if self.redis_client:
+            try:
+                await self.redis_client.close()
+            except Exception as e:
+                logger.error(f"Error closing conversation history connection: {str(e)}")
+            self.redis_client = None
+
+    async def get_recent_turns(self, phone_number: str, limit: int = 5, session=None) -> List[Dict[str, str]]:
+        """
+        Last turns for a phone number, oldest first.
+
+        Args:
+            phone_number: Customer phone number in E.164 format
+            limit: Maximum number of turns to return
+            session: Optional database session to use on a buffer miss
+        """
+        turns = await self._read_buffer(phone_number)
+        if turns is not None:
+            self.stats["hits"] += 1
+            return turns[-limit:] if limit else []
+
+        self.stats["misses"] += 1
+        turns = await self._load_from_database(phone_number, session)
+        if turns is None:
+            return []  # database unavailable; leave the buffer unloaded
+        await self._write_buffer(phone_number, turns, replace=True)
+        return turns[-limit:] if limit else []
+
+    async def record_exchange(self, phone_number: str, inbound: str, outbound: Optional[str] = None):
+        """Append a customer message and the reply sent to it."""
+        turns = [to_turn("inbound", inbound)]
+        if outbound:
+            turns.append(to_turn("outbound", outbound))
+        await self._write_buffer(phone_number, turns)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Buffer hit ratio and size."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "backend": "redis" if self.redis_client else "memory",
+            "buffered_customers": len(self.buffer),
+        }
+
+    async def _read_buffer(self, phone_number: str) -> Optional[List[Dict[str, str]]]:
+        if self.redis_client:
+            try:
+                key = f"{self.KEY_PREFIX}:{phone_number}"
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.exists(key)
+                pipe.lrange(key, 0, -1)
+                exists, raw_turns = await pipe.execute()
+                if not exists:
+                    return None
+                return [json.loads(raw) for raw in raw_turns if raw]
+            except Exception as e:
+                logger.warning(f"Conversation buffer read failed: {str(e)}")
+        return self.buffer.get(phone_number)
+
+    async def _write_buffer(self, phone_number: str, turns: List[Dict[str, str]], replace: bool = False):
+        """
+        Seed or append to a customer's buffer.
+
+        Appends only touch buffers that already exist, so a buffer that was
+        evicted or expired is reloaded in full instead of holding a partial
+        history. An empty history is stored as a blank entry so that
+        customers without messages do not hit the database on every read.
+        """
+        if self.redis_client:
+            try:
+                key = f"{self.KEY_PREFIX}:{phone_number}"
+                values = [json.dumps(turn, ensure_ascii=False) for turn in turns]
+                pipe = self.redis_client.pipeline(transaction=True)
+                if replace:
+                    pipe.delete(key)
+                    pipe.rpush(key, *(values or [""]))
+                elif values:
+                    pipe.rpushx(key, *values)
+                pipe.ltrim(key, -self.turns_per_customer, -1)
+                pipe.expire(key, self.ttl_seconds)
+                await pipe.execute()
+                return
+            except Exception as e:
+                logger.warning(f"Conversation buffer write failed: {str(e)}")
+
+        if replace:
+            self.buffer.replace(phone_number, turns)
+        else:
+            self.buffer.extend(phone_number, turns)
+
+    async def _load_from_database(self, phone_number: str, session=None) -> Optional[List[Dict[str, str]]]:
+        """Resolve the customer and active thread, then read their latest messages."""
+        self.stats["database_loads"] += 1
+        if session is not None:
+            return await self._query_turns(session, phone_number)
+
+        from ..database import db_manager
+        if not db_manager.is_initialized:
+            return None
+        async with db_manager.get_session() as session:
+            return await self._query_turns(session, phone_number)
+
+    async def _query_turns(self, session, phone_number: str) -> List[Dict[str, str]]:
+        customer_stmt = (
+            select(Customer.id, ConversationThread.started_at)
+            .outerjoin(
+                ConversationThread,
+                and_(
+                    ConversationThread.customer_id == Customer.id,
+                    ConversationThread.status == "active"
+                )
+            )
+            .where(Customer.phone_number == phone_number, Customer.is_deleted == False)
+            .order_by(Customer.created_at.desc(), ConversationThread.started_at.desc())
+            .limit(1)
+        )
+        row = (await session.execute(customer_stmt)).first()
+        if row is None:
+            return []
+        customer_id, thread_started_at = row
+
+        messages_stmt = (
+            select(WhatsAppMessage.direction, WhatsAppMessage.content)
+            .where(WhatsAppMessage.customer_id == customer_id, WhatsAppMessage.is_deleted == False)
+            .order_by(WhatsAppMessage.created_at.desc())
+            .limit(self.turns_per_customer)
+        )
+        if thread_started_at is not None:
+            messages_stmt = messages_stmt.where(WhatsAppMessage.created_at >= thread_started_at)
+
+        rows = (await session.execute(messages_stmt)).all()
+        return [to_turn(direction, content) for direction, content in reversed(rows)]
+
+
+conversation_history = ConversationHistoryService()
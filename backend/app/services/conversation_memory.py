@@ -0,0 +1,136 @@
+"""
+Per-customer conversation memory for the restaurant AI agent.
+Bounded LRU+TTL store in process, or shared across workers through Redis.
+"""
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+from ..core.config import settings
+from .openrouter.memory_store import CacheRecord, LRUTTLStore
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationMemory:
+    """
+    Recent conversation turns per customer.
+
+    In process, customers are kept in an LRU store capped by entry count and
+    approximate bytes, and expire after ``ttl_seconds`` without an update.
+    With Redis each customer is one key with the same TTL, so every worker
+    sees the same memory.
+    """
+
+    KEY_PREFIX = "conversation_memory"
+
+    def __init__(
+        self,
+        max_customers: int = 5000,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl_seconds: int = 3600,
+        max_turns: int = 10
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max_turns
+        self.redis_client: Optional[Any] = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self.store = LRUTTLStore(
+            max_entries=max_customers,
+            max_bytes=max_bytes,
+            on_remove=self._on_remove
+        )
+
+    async def initialize(self):
+        """Connect the shared Redis backend if available."""
+        try:
+            if redis and hasattr(settings, 'redis') and settings.redis.REDIS_URL:
+                self.redis_client = redis.from_url(settings.redis.REDIS_URL, decode_responses=False)
+                await self.redis_client.ping()
+                logger.info("Conversation memory connected to Redis")
+            else:
+                logger.info("Redis not available, conversation memory kept in process")
+        except Exception as e:
+            logger.warning(f"Failed to connect to Redis: {str(e)}. Keeping conversation memory in process.")
+            self.redis_client = None
+
+    async def close(self):
+        """Close the Redis connection."""
+        if self.redis_client:
+            try:
+                await self.redis_client.close()
+            except Exception as e:
+                logger.error(f"Error closing conversation memory connection: {str(e)}")
+            self.redis_client = None
+
+    async def get(self, customer_id: str) -> Optional[List[Dict[str, str]]]:
+        """Remembered turns for a customer, or None."""
+        payload = None
+        if self.redis_client:
+            try:
+                payload = await self.redis_client.get(f"{self.KEY_PREFIX}:{customer_id}")
+            except Exception as e:
+                logger.warning(f"Conversation memory read failed: {str(e)}")
+                payload = self._get_local(customer_id)
+        else:
+            payload = self._get_local(customer_id)
+
+        if payload is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return json.loads(payload)
+
+    async def set(self, customer_id: str, history: List[Dict[str, str]]):
+        """Remember the latest turns for a customer, refreshing their TTL."""
+        payload = json.dumps(history[-self.max_turns:], ensure_ascii=False).encode("utf-8")
+        if self.redis_client:
+            try:
+                await self.redis_client.set(f"{self.KEY_PREFIX}:{customer_id}", payload, ex=self.ttl_seconds)
+                return
+            except Exception as e:
+                logger.warning(f"Conversation memory write failed: {str(e)}")
+
+        self.store.put(CacheRecord(key=customer_id, payload=payload, ttl_seconds=self.ttl_seconds))
+
+    async def forget(self, customer_id: str):
+        """Drop a customer's memory."""
+        if self.redis_client:
+            try:
+                await self.redis_client.delete(f"{self.KEY_PREFIX}:{customer_id}")
+            except Exception as e:
+                logger.warning(f"Conversation memory delete failed: {str(e)}")
+        self.store.remove(customer_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit ratio, evictions and in-process footprint."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "backend": "redis" if self.redis_client else "memory",
+            "customers": len(self.store),
+            "memory_bytes": self.store.total_bytes,
+        }
+
+    def _get_local(self, customer_id: str) -> Optional[bytes]:
+        self.store.expire()
+        record = self.store.get(customer_id)
+        return record.payload if record else None
+
+    def _on_remove(self, key: str, reason: str):
+        if reason == "expired":
+            self.stats["expirations"] += 1
+        else:
+            self.stats["evictions"] += 1
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __contains__(self, customer_id: str) -> bool:
+        return customer_id in self.store
@@ -0,0 +1,113 @@
+"""
+Backfill for the customer_engagement_stats table.
+Recomputes per-customer message and response totals from the message and recipient tables.
+"""
+import uuid
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.logging import get_logger
+from ..models import CampaignRecipient, Customer, CustomerEngagementStats, WhatsAppMessage
+
+logger = get_logger(__name__)
+
+
+def hours_between(later, earlier, dialect: str):
+    """SQL for ``later - earlier`` in hours."""
+    if dialect == "sqlite":
+        return (func.julianday(later) - func.julianday(earlier)) * 24
+    return func.extract("epoch", later - earlier) / 3600
+
+
+async def rebuild_engagement_stats(
+    session: AsyncSession,
+    restaurant_id: Optional[UUID] = None
+) -> int:
+    """
+    Recompute engagement rows from scratch and return how many were written.
+
+    Used to backfill the table and to repair it after writes that bypass the
+    ORM flush hook (raw SQL, Core bulk inserts). Rows are deleted and
+    re-inserted in one transaction, so readers see either the old
+    or the new totals; flushes committed by other sessions while a rebuild
+    runs may be lost, so run it when campaigns are quiet.
+    """
+    dialect = session.get_bind().dialect.name
+    customers = select(Customer.id).where(Customer.is_deleted.is_(False))
+    if restaurant_id is not None:
+        customers = customers.where(Customer.restaurant_id == restaurant_id)
+    customers = customers.cte("engagement_customers")
+
+    messages = (
+        select(
+            WhatsAppMessage.customer_id,
+            func.count(WhatsAppMessage.id).label("total_messages"),
+            func.max(WhatsAppMessage.created_at).label("last_message_at")
+        )
+        .where(WhatsAppMessage.customer_id.in_(select(customers.c.id)))
+        .group_by(WhatsAppMessage.customer_id)
+        .subquery()
+    )
+
+    response_hours = hours_between(CampaignRecipient.responded_at, CampaignRecipient.sent_at, dialect)
+    responses = (
+        select(
+            CampaignRecipient.customer_id,
+            func.count(CampaignRecipient.id).label("total_responses"),
+            func.coalesce(func.sum(response_hours), 0.0).label("response_hours_total"),
+            func.count(response_hours).label("timed_responses")
+        )
+        .where(
+            CampaignRecipient.customer_id.in_(select(customers.c.id)),
+            CampaignRecipient.status == "responded"
+        )
+        .group_by(CampaignRecipient.customer_id)
+        .subquery()
+    )
+
+    rows = (await session.execute(
+        select(
+            customers.c.id,
+            func.coalesce(messages.c.total_messages, 0),
+            func.coalesce(responses.c.total_responses, 0),
+            func.coalesce(responses.c.response_hours_total, 0.0),
+            func.coalesce(responses.c.timed_responses, 0),
+            messages.c.last_message_at
+        )
+        .outerjoin(messages, messages.c.customer_id == customers.c.id)
+        .outerjoin(responses, responses.c.customer_id == customers.c.id)
+        .where((messages.c.customer_id.is_not(None)) | (responses.c.customer_id.is_not(None)))
+    )).all()
+
+    stale = delete(CustomerEngagementStats)
+    if restaurant_id is not None:
+        stale = stale.where(CustomerEngagementStats.customer_id.in_(
+            select(Customer.id).where(Customer.restaurant_id == restaurant_id)
+        ))
+    await session.execute(stale)
+
+    now = datetime.utcnow()
+    if rows:
+        await session.execute(insert(CustomerEngagementStats.__table__), [
+            {
+                "id": uuid.uuid4(),
+                "customer_id": customer_id,
+                "total_messages": total_messages,
+                "total_responses": total_responses,
+                "response_hours_total": float(hours),
+                "timed_responses": timed,
+                "last_message_at": last_message_at,
+                "created_at": now,
+                "updated_at": now,
+                "is_deleted": False,
+            }
+            for customer_id, total_messages, total_responses, hours, timed, last_message_at in rows
+        ])
+
+    await session.commit()
+    logger.info(f"Rebuilt engagement stats for {len(rows)} customers")
+    return len(rows)
@@ -0,0 +1,159 @@
+"""
+Process-wide HTTP connection pool for outbound API calls.
+One keep-alive httpx client shared by every OpenRouter caller, with pool saturation metrics.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401 - enables HTTP/2 in httpx
+except ImportError:
+    h2 = None
+
+from ..core.config import settings
+from ..core.metrics import StageLatencyTracker
+
+logger = logging.getLogger(__name__)
+
+
+class SharedHTTPPool:
+    """
+    A single ``httpx.AsyncClient`` reused by all callers in the process.
+
+    Connections are kept alive between requests, so TLS handshakes and DNS
+    lookups happen once per pooled connection instead of once per client
+    instance. HTTP/2 is negotiated when enabled and ``h2`` is installed.
+
+    Requests beyond ``max_connections`` wait for a free slot; how many are
+    waiting and for how long is exposed through ``get_stats``.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 30,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        http2: bool = True
+    ):
+        self.max_connections = max_connections
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.http2 = http2 and h2 is not None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots = asyncio.Semaphore(max_connections)
+        self.in_use = 0
+        self.waiting = 0
+        self.peak_in_use = 0
+        self.stats = {"requests": 0, "waited": 0, "errors": 0}
+        self.latency = StageLatencyTracker()
+
+    @classmethod
+    def from_settings(cls) -> "SharedHTTPPool":
+        """Pool sized from the OpenRouter settings."""
+        config = settings.openrouter
+        return cls(
+            max_connections=config.OPENROUTER_MAX_CONNECTIONS,
+            max_keepalive_connections=config.OPENROUTER_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.OPENROUTER_KEEPALIVE_EXPIRY,
+            timeout=config.OPENROUTER_TIMEOUT,
+            connect_timeout=config.OPENROUTER_CONNECT_TIMEOUT,
+            http2=config.OPENROUTER_HTTP2
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared client, created on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+            logger.info(f"Shared HTTP pool opened (http2={self.http2}, max_connections={self.max_connections})")
+        return self._client
+
+    @asynccontextmanager
+    async def _slot(self, stage: str) -> AsyncIterator[None]:
+        """Hold one connection slot, recording the wait for it and the time it is held."""
+        started = time.perf_counter()
+        if self._slots.locked():
+            self.stats["waited"] += 1
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        acquired = time.perf_counter()
+        self.latency.record("pool_wait", acquired - started)
+
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self.stats["requests"] += 1
+        try:
+            yield
+        except httpx.HTTPError:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.in_use -= 1
+            self._slots.release()
+            self.latency.record(stage, time.perf_counter() - acquired)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request through the pool, waiting for a free connection slot."""
+        async with self._slot("request"):
+            return await self.client.request(method, url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Open a streaming request through the pool.
+
+        The slot is held until the block exits, so a long-running stream
+        counts against the pool like any other in-flight request. Leaving the
+        block early closes the response and drops the rest of the body.
+        """
+        async with self._slot("stream"):
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        """POST through the pool."""
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        """Close pooled connections."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Shared HTTP pool closed")
+        self._client = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool occupancy and the time requests spend waiting for a connection."""
+        def ms(stage: str, pct: float) -> Optional[float]:
+            value = self.latency.percentile(stage, pct)
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            **self.stats,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "peak_in_use": self.peak_in_use,
+            "saturation": self.in_use / self.max_connections,
+            "wait_p50_ms": ms("pool_wait", 50),
+            "wait_p99_ms": ms("pool_wait", 99),
+            "request_p50_ms": ms("request", 50),
+            "request_p99_ms": ms("request", 99),
+        }
+
+
+http_pool = SharedHTTPPool.from_settings()
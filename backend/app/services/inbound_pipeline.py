@@ -0,0 +1,546 @@
+"""
+Inbound WhatsApp message pipeline.
+Lets the Twilio webhook acknowledge immediately while workers generate and send replies.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+from ..core.config import settings
+from ..core.metrics import StageLatencyTracker
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class InboundMessage:
+    """Inbound message accepted by the webhook."""
+    message_sid: str
+    from_number: str
+    body: str
+    received_at: float = field(default_factory=time.time)
+    entry_id: Optional[str] = None  # Redis stream entry, when journaled
+    attempts: int = 0  # handler runs on this consumer
+
+    def to_fields(self) -> Dict[str, str]:
+        """Serialize for the Redis stream."""
+        data = asdict(self)
+        data.pop("entry_id")
+        data.pop("attempts")
+        return {"payload": json.dumps(data, ensure_ascii=False)}
+
+    @classmethod
+    def from_fields(cls, entry_id: str, fields: Dict[str, str]) -> "InboundMessage":
+        """Rebuild a message from a Redis stream entry."""
+        return cls(entry_id=entry_id, **json.loads(fields["payload"]))
+
+
+InboundHandler = Callable[[InboundMessage, StageLatencyTracker], Awaitable[None]]
+
+
+class InboundQueueFull(Exception):
+    """Raised when a message can neither be journaled nor queued without waiting."""
+
+
+class InboundMessagePipeline:
+    """
+    Worker pool for inbound messages.
+
+    When Redis is reachable, messages are appended to a stream and read back
+    through a consumer group, so a message survives a restart until a worker
+    acknowledges it. A consumer takes a lease on the MessageSid while it
+    answers, and marks the MessageSid replied once the handler succeeds; a
+    message delivered twice (a Twilio retry) is only answered once. A lease
+    whose owner's heartbeat has lapsed can be taken over, so an entry
+    reclaimed from a consumer that died mid-reply is still answered. A
+    failing handler is retried with backoff, and after ``max_attempts`` the
+    message goes to the dead-letter stream instead of being dropped.
+
+    Ordering: within one process each customer always maps to the same shard,
+    so their messages are handled one at a time in stream order. Across
+    processes the consumer group hands entries to whichever consumer reads
+    first, so two messages from one customer sent in quick succession may be
+    answered by different processes, concurrently and in either order.
+    """
+
+    STREAM_KEY = "whatsapp:inbound"
+    GROUP_NAME = "inbound-workers"
+    DEAD_LETTER_KEY = "whatsapp:inbound:dead"
+    HEARTBEAT_PREFIX = "whatsapp:inbound:consumer:"
+    LEASE_PREFIX = "whatsapp:inbound:lease:"
+    REPLIED_PREFIX = "whatsapp:inbound:replied:"
+
+    def __init__(
+        self,
+        handler: InboundHandler,
+        num_workers: int = 8,
+        shard_queue_size: int = 1000,
+        reclaim_idle_ms: int = 60000,
+        reclaim_interval: float = 30.0,
+        stream_max_length: int = 100000,
+        heartbeat_ttl: int = 30,
+        lease_ttl: int = 600,
+        dedupe_ttl: int = 86400,
+        max_local_dedupe_entries: int = 100000,
+        max_attempts: int = 3,
+        retry_delay: float = 1.0
+    ):
+        self.handler = handler
+        self.num_workers = num_workers
+        self.shard_queue_size = shard_queue_size
+        self.reclaim_idle_ms = reclaim_idle_ms
+        self.reclaim_interval = reclaim_interval
+        self.stream_max_length = stream_max_length
+        self.heartbeat_ttl = heartbeat_ttl
+        self.lease_ttl = lease_ttl
+        self.dedupe_ttl = dedupe_ttl
+        self.max_local_dedupe_entries = max_local_dedupe_entries
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.consumer_name = f"{socket.gethostname()}-{os.getpid()}"
+
+        self.redis_client: Optional[Any] = None
+        self.metrics = StageLatencyTracker()
+        self.stats = {
+            "accepted": 0, "processed": 0, "failed": 0, "retried": 0, "recovered": 0,
+            "duplicates": 0, "shed": 0
+        }
+
+        # Replied MessageSid -> monotonic expiry, and MessageSids being answered; used when Redis is unavailable
+        self._replied: "OrderedDict[str, float]" = OrderedDict()
+        self._leased: Set[str] = set()
+        self._retries: Set[asyncio.Task] = set()
+
+        self._shards: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._reader: Optional[asyncio.Task] = None
+        self._in_flight: Set[str] = set()
+        self._start_lock = asyncio.Lock()
+        self.is_running = False
+
+    async def start(self):
+        """Connect the journal and start the workers."""
+        async with self._start_lock:
+            if self.is_running:
+                return
+
+            await self._connect_journal()
+            self._shards = [asyncio.Queue(maxsize=self.shard_queue_size) for _ in range(self.num_workers)]
+            self._workers = [
+                asyncio.create_task(self._worker(shard), name=f"inbound-worker-{index}")
+                for index, shard in enumerate(self._shards)
+            ]
+            if self.redis_client:
+                self._reader = asyncio.create_task(self._read_journal(), name="inbound-journal-reader")
+            self.is_running = True
+            logger.info(f"Inbound pipeline started with {self.num_workers} workers")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Let queued messages finish, then stop the workers."""
+        if not self.is_running:
+            return
+        self.is_running = False
+
+        if self._reader:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(shard.join() for shard in self._shards)),
+                timeout=drain_timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Inbound pipeline stopped with messages still queued")
+
+        # Journaled messages waiting for a retry stay pending and are reclaimed
+        for retry in list(self._retries):
+            retry.cancel()
+        await asyncio.gather(*self._retries, return_exceptions=True)
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        if self.redis_client:
+            try:
+                # Anything still pending can be reclaimed without waiting for the heartbeat to lapse
+                await self.redis_client.delete(f"{self.HEARTBEAT_PREFIX}{self.consumer_name}")
+                await self.redis_client.close()
+            except Exception as e:
+                logger.error(f"Error closing inbound journal connection: {str(e)}")
+            self.redis_client = None
+        logger.info("Inbound pipeline stopped")
+
+    async def submit(self, message: InboundMessage) -> InboundMessage:
+        """
+        Accept a message for processing without waiting on the workers.
+
+        With a journal the message is only appended to the stream and a
+        reader hands it to a worker; otherwise it goes straight to a shard.
+        A full shard is never waited on, since the webhook must answer before
+        Twilio times out: the message is shed and InboundQueueFull raised.
+        """
+        if not self.is_running:
+            await self.start()
+
+        async with self.metrics.time("enqueue"):
+            journaled = False
+            if self.redis_client:
+                try:
+                    message.entry_id = await self.redis_client.xadd(
+                        self.STREAM_KEY,
+                        message.to_fields(),
+                        maxlen=self.stream_max_length,
+                        approximate=True
+                    )
+                    journaled = True
+                except Exception as e:
+                    logger.error(f"Failed to journal inbound message {message.message_sid}: {str(e)}")
+
+            if not journaled:
+                try:
+                    self._shard_for(message.from_number).put_nowait(message)
+                except asyncio.QueueFull:
+                    self.stats["shed"] += 1
+                    raise InboundQueueFull(
+                        f"Inbound queue full, dropped message {message.message_sid} from {message.from_number}"
+                    )
+
+        self.stats["accepted"] += 1
+        return message
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pipeline counters, queue depth and per-stage latency."""
+        return {
+            **self.stats,
+            "running": self.is_running,
+            "durable": self.redis_client is not None,
+            "queued": sum(shard.qsize() for shard in self._shards),
+            "stages": self.metrics.snapshot(),
+        }
+
+    def _shard_for(self, from_number: str) -> asyncio.Queue:
+        """Stable shard for a customer so their messages are handled in order."""
+        return self._shards[zlib.crc32(from_number.encode("utf-8")) % len(self._shards)]
+
+    async def _worker(self, shard: asyncio.Queue):
+        """Process one shard's messages sequentially."""
+        while True:
+            message = await shard.get()
+            retrying = False
+            try:
+                retrying = await self._process(message, shard)
+            except Exception as e:
+                logger.error(f"Inbound message {message.message_sid} could not be processed: {str(e)}", exc_info=True)
+            finally:
+                # A retry keeps the message unfinished, so draining the shard waits for it
+                if not retrying:
+                    shard.task_done()
+
+    async def _process(self, message: InboundMessage, shard: asyncio.Queue) -> bool:
+        """
+        Answer one message, unless it was already answered or is being answered elsewhere.
+
+        Returns True if the message was scheduled for a retry.
+        """
+        refused = await self._acquire_lease(message)
+        if refused:
+            self.stats["duplicates"] += 1
+            logger.info(f"Inbound message {message.message_sid} {refused}, skipping")
+            await self._finish(message)
+            return False
+
+        if not message.attempts:
+            self.metrics.record("queue_wait", max(0.0, time.time() - message.received_at))
+        message.attempts += 1
+        try:
+            async with self.metrics.time("total"):
+                await self.handler(message, self.metrics)
+        except Exception as e:
+            await self._release_lease(message)
+            if message.attempts < self.max_attempts:
+                self.stats["retried"] += 1
+                logger.warning(
+                    f"Inbound message {message.message_sid} failed (attempt {message.attempts}), "
+                    f"retrying: {str(e)}"
+                )
+                self._retry_later(message, shard)
+                return True
+            self.stats["failed"] += 1
+            logger.error(f"Inbound message {message.message_sid} failed: {str(e)}", exc_info=True)
+            await self._dead_letter(message, e)
+            await self._finish(message)
+            return False
+
+        self.stats["processed"] += 1
+        await self._mark_replied(message)
+        await self._finish(message)
+        return False
+
+    def _retry_later(self, message: InboundMessage, shard: asyncio.Queue):
+        """Queue a failed message again after a backoff; a journaled one stays pending meanwhile."""
+        delay = self.retry_delay * 2 ** (message.attempts - 1)
+
+        async def requeue():
+            try:
+                await asyncio.sleep(delay)
+                await shard.put(message)
+            finally:
+                shard.task_done()
+
+        retry = asyncio.create_task(requeue())
+        self._retries.add(retry)
+        retry.add_done_callback(self._retries.discard)
+
+    async def _acquire_lease(self, message: InboundMessage) -> Optional[str]:
+        """
+        Take the lease to answer a MessageSid.
+
+        Returns None when this consumer may answer, otherwise why it may not.
+        A lease held by a consumer whose heartbeat has lapsed is taken over.
+        """
+        if not message.message_sid:
+            return None
+
+        if self.redis_client:
+            try:
+                return await self._acquire_redis_lease(message.message_sid)
+            except Exception as e:
+                logger.warning(f"Failed to lease inbound message {message.message_sid}: {str(e)}")
+
+        now = time.monotonic()
+        while self._replied and (
+            next(iter(self._replied.values())) <= now
+            or len(self._replied) >= self.max_local_dedupe_entries
+        ):
+            self._replied.popitem(last=False)
+        if message.message_sid in self._replied:
+            return "already replied"
+        if message.message_sid in self._leased:
+            return "already being answered"
+        self._leased.add(message.message_sid)
+        return None
+
+    async def _acquire_redis_lease(self, message_sid: str) -> Optional[str]:
+        if await self.redis_client.exists(f"{self.REPLIED_PREFIX}{message_sid}"):
+            return "already replied"
+
+        lease_key = f"{self.LEASE_PREFIX}{message_sid}"
+        if await self.redis_client.set(lease_key, self.consumer_name, nx=True, ex=self.lease_ttl):
+            return None
+
+        owner = await self.redis_client.get(lease_key)
+        if owner is None:
+            # Released between the two calls
+            if await self.redis_client.set(lease_key, self.consumer_name, nx=True, ex=self.lease_ttl):
+                return None
+            return "already being answered"
+        if owner != self.consumer_name and await self.redis_client.exists(f"{self.HEARTBEAT_PREFIX}{owner}"):
+            return f"already being answered by {owner}"
+
+        # Our own lease, or one left by a dead consumer: take it unless someone else does first
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(lease_key)
+                if await pipe.get(lease_key) != owner:
+                    return "already being answered"
+                pipe.multi()
+                pipe.set(lease_key, self.consumer_name, ex=self.lease_ttl)
+                await pipe.execute()
+            except redis.WatchError:
+                return "already being answered"
+        if owner != self.consumer_name:
+            logger.info(f"Took over inbound message {message_sid} from dead consumer {owner}")
+        return None
+
+    async def _release_lease(self, message: InboundMessage):
+        """Give up the lease after a failed attempt, so a retry can take it again."""
+        if not message.message_sid:
+            return
+        self._leased.discard(message.message_sid)
+        if not self.redis_client:
+            return
+        lease_key = f"{self.LEASE_PREFIX}{message.message_sid}"
+        try:
+            if await self.redis_client.get(lease_key) == self.consumer_name:
+                await self.redis_client.delete(lease_key)
+        except Exception as e:
+            logger.warning(f"Failed to release inbound message {message.message_sid}: {str(e)}")
+
+    async def _mark_replied(self, message: InboundMessage):
+        """Record that a MessageSid was answered, so redeliveries are skipped."""
+        if not message.message_sid:
+            return
+        self._leased.discard(message.message_sid)
+        self._replied[message.message_sid] = time.monotonic() + self.dedupe_ttl
+        if not self.redis_client:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.set(f"{self.REPLIED_PREFIX}{message.message_sid}", self.consumer_name, ex=self.dedupe_ttl)
+            pipe.delete(f"{self.LEASE_PREFIX}{message.message_sid}")
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to mark inbound message {message.message_sid} replied: {str(e)}")
+
+    async def _dead_letter(self, message: InboundMessage, error: Exception):
+        """Keep a message that kept failing in the dead-letter stream for inspection."""
+        if not (self.redis_client and message.entry_id):
+            return
+        try:
+            await self.redis_client.xadd(
+                self.DEAD_LETTER_KEY,
+                {**message.to_fields(), "entry_id": message.entry_id, "error": str(error)[:500]},
+                maxlen=self.stream_max_length,
+                approximate=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to dead-letter inbound message {message.message_sid}: {str(e)}")
+
+    async def _finish(self, message: InboundMessage):
+        """Drop a message this consumer is done with from the journal."""
+        await self._acknowledge(message)
+        self._in_flight.discard(message.entry_id)
+
+    async def _acknowledge(self, message: InboundMessage):
+        """Drop a handled message from the journal."""
+        if not (self.redis_client and message.entry_id):
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.xack(self.STREAM_KEY, self.GROUP_NAME, message.entry_id)
+            pipe.xdel(self.STREAM_KEY, message.entry_id)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to acknowledge inbound message {message.message_sid}: {str(e)}")
+
+    async def _connect_journal(self):
+        """Connect to Redis and make sure the consumer group exists."""
+        if not (redis and hasattr(settings, 'redis') and settings.redis.REDIS_URL):
+            logger.info("Redis not available, inbound messages are queued in memory only")
+            return
+
+        try:
+            self.redis_client = redis.from_url(settings.redis.REDIS_URL, decode_responses=True)
+            await self.redis_client.ping()
+            await self._ensure_group()
+            logger.info("Inbound message journal connected")
+        except Exception as e:
+            logger.warning(f"Failed to connect inbound journal: {str(e)}. Queueing in memory only.")
+            self.redis_client = None
+
+    async def _ensure_group(self):
+        """Create the stream and consumer group if missing."""
+        try:
+            await self.redis_client.xgroup_create(self.STREAM_KEY, self.GROUP_NAME, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _heartbeat(self):
+        """Tell other consumers this one is alive, so its pending entries are left alone."""
+        await self.redis_client.set(
+            f"{self.HEARTBEAT_PREFIX}{self.consumer_name}", str(time.time()), ex=self.heartbeat_ttl
+        )
+
+    async def _read_journal(self):
+        """Move journaled messages to their shards, reclaiming abandoned ones."""
+        last_reclaim = None
+        last_heartbeat = None
+        while True:
+            try:
+                if last_heartbeat is None or time.monotonic() - last_heartbeat >= self.heartbeat_ttl / 3:
+                    await self._heartbeat()
+                    last_heartbeat = time.monotonic()
+
+                if last_reclaim is None or time.monotonic() - last_reclaim >= self.reclaim_interval:
+                    await self._reclaim_abandoned()
+                    last_reclaim = time.monotonic()
+
+                entries = await self.redis_client.xreadgroup(
+                    self.GROUP_NAME, self.consumer_name, {self.STREAM_KEY: ">"},
+                    count=100, block=1000
+                )
+                if entries:
+                    await self._requeue(entries[0][1])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Inbound journal read failed: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def _reclaim_abandoned(self):
+        """
+        Take over messages read by a consumer that has died.
+
+        This covers a worker process that crashed or was redeployed between
+        reading a message and replying to it. Idle time alone is not enough:
+        a live consumer may hold entries queued behind a slow reply, so only
+        consumers whose heartbeat has lapsed and that have been idle for
+        ``reclaim_idle_ms`` are taken over, then removed from the group.
+        """
+        recovered = 0
+        consumers = await self.redis_client.xinfo_consumers(self.STREAM_KEY, self.GROUP_NAME)
+        for consumer in consumers:
+            name = consumer["name"]
+            if name == self.consumer_name or consumer["idle"] < self.reclaim_idle_ms:
+                continue
+            if await self.redis_client.exists(f"{self.HEARTBEAT_PREFIX}{name}"):
+                continue
+
+            recovered += await self._claim_pending_of(name)
+            # Its pending list is now empty, so removing it loses nothing
+            await self.redis_client.xgroup_delconsumer(self.STREAM_KEY, self.GROUP_NAME, name)
+
+        if recovered:
+            self.stats["recovered"] += recovered
+            logger.info(f"Recovered {recovered} unprocessed inbound messages")
+
+    async def _claim_pending_of(self, consumer_name: str, batch_size: int = 100) -> int:
+        """Move a dead consumer's pending entries to this consumer and queue them."""
+        requeued = 0
+        while True:
+            pending = await self.redis_client.xpending_range(
+                self.STREAM_KEY, self.GROUP_NAME, min="-", max="+",
+                count=batch_size, consumername=consumer_name
+            )
+            if not pending:
+                break
+
+            claimed = await self.redis_client.xclaim(
+                self.STREAM_KEY, self.GROUP_NAME, self.consumer_name,
+                min_idle_time=0, message_ids=[entry["message_id"] for entry in pending]
+            )
+            requeued += await self._requeue(claimed)
+            if len(pending) < batch_size:
+                break
+        return requeued
+
+    async def _requeue(self, entries) -> int:
+        """Queue stream entries on their shards in stream order."""
+        count = 0
+        for entry_id, fields in entries:
+            if not fields:
+                continue
+            if entry_id in self._in_flight:
+                continue  # already queued on this consumer
+            message = InboundMessage.from_fields(entry_id, fields)
+            self._in_flight.add(entry_id)
+            await self._shard_for(message.from_number).put(message)
+            count += 1
+        return count
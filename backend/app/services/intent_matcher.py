@@ -0,0 +1,171 @@
+"""
+Multi-pattern keyword matcher for customer messages.
+Aho-Corasick automaton over normalized Arabic/English text, built once and reused.
+"""
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Harakat, Quranic marks and tatweel are dropped before matching
+_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+
+# Distinct match results kept decoded; real traffic repeats a few hundred combinations
+DECODE_CACHE_SIZE = 4096
+
+_ARABIC_FOLDING = (
+    ("أ", "ا"), ("إ", "ا"), ("آ", "ا"), ("ٱ", "ا"),  # alef variants
+    ("ى", "ي"),                                  # alef maksura
+    ("ة", "ه"),                                  # ta marbuta
+)
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip diacritics and fold alef, ya and ta marbuta variants."""
+    # str.replace and a search-before-sub are much cheaper than translate()
+    # or an unconditional sub on short non-ASCII strings
+    text = text.lower()
+    if _DIACRITICS.search(text):
+        text = _DIACRITICS.sub("", text)
+    for variant, folded in _ARABIC_FOLDING:
+        text = text.replace(variant, folded)
+    return text
+
+
+@dataclass
+class MatchResult:
+    """Labels found in a message, in declaration order."""
+    intents: List[str] = field(default_factory=list)
+    entities: Dict[str, List[str]] = field(default_factory=dict)
+
+
+class IntentMatcher:
+    """
+    Finds every intent and entity keyword in a message in one pass.
+
+    Keywords are matched as substrings of the normalized message, the same
+    way the previous ``pattern in message`` loops did, so "أهلا" and "اهلا"
+    or "وجبة" and "وجبه" are treated alike. The automaton is built with
+    pyahocorasick when it is installed and in pure Python otherwise.
+    """
+
+    def __init__(self, intent_patterns: Dict[str, List[str]], entity_patterns: Dict[str, List[str]]):
+        self.intent_names = list(intent_patterns)
+        self.entity_types = list(entity_patterns)
+        self.entity_values = {kind: list(values) for kind, values in entity_patterns.items()}
+
+        # Every intent and entity value gets one bit, in declaration order;
+        # a pattern's output is the mask of everything it signals, so a scan
+        # only ORs integers and the mask is decoded once per distinct result.
+        self._bit_labels: List[Tuple] = [(None, name) for name in self.intent_names]
+        for kind, values in entity_patterns.items():
+            self._bit_labels.extend((kind, value) for value in values)
+
+        labels: Dict[str, int] = {}
+        bit = 0
+        for patterns in intent_patterns.values():
+            for pattern in patterns:
+                self._label(labels, pattern, bit)
+            bit += 1
+        for values in entity_patterns.values():
+            for value in values:
+                self._label(labels, value, bit)
+                bit += 1
+
+        self._decoded: Dict[int, Tuple[List[str], Dict[str, List[str]]]] = {}
+
+        if ahocorasick is not None:
+            self.backend = "pyahocorasick"
+            self._automaton = ahocorasick.Automaton()
+            for pattern, mask in labels.items():
+                self._automaton.add_word(pattern, mask)
+            self._automaton.make_automaton()
+        else:
+            self.backend = "python"
+            self._build_python_automaton(labels)
+
+    @staticmethod
+    def _label(labels: Dict[str, int], pattern: str, bit: int):
+        normalized = normalize_text(pattern)
+        if normalized:
+            labels[normalized] = labels.get(normalized, 0) | (1 << bit)
+
+    def _build_python_automaton(self, labels: Dict[str, int]):
+        """
+        Build the trie, then link each node to its longest proper suffix.
+
+        The failure links are folded into ``_delta`` so every node has a
+        complete transition map and a scan does one dict lookup per character.
+        """
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[int] = [0]
+        for pattern, mask in labels.items():
+            node = 0
+            for char in pattern:
+                next_node = goto[node].get(char)
+                if next_node is None:
+                    next_node = len(goto)
+                    goto[node][char] = next_node
+                    goto.append({})
+                    outputs.append(0)
+                node = next_node
+            outputs[node] = mask
+
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                fail[child] = delta[fail[node]].get(char, 0)
+                # Inherit the suffix's outputs so a scan never walks failure chains
+                outputs[child] |= outputs[fail[child]]
+            transitions = dict(delta[fail[node]])
+            transitions.update(goto[node])
+            delta[node] = transitions
+
+        self._delta = delta
+        self._outputs = outputs
+
+    def _scan(self, text: str) -> int:
+        """OR together the masks of every pattern occurring in ``text``."""
+        found = 0
+        if self.backend == "pyahocorasick":
+            for _, mask in self._automaton.iter(text):
+                found |= mask
+            return found
+
+        delta, outputs = self._delta, self._outputs
+        node = 0
+        for char in text:
+            node = delta[node].get(char, 0)
+            found |= outputs[node]
+        return found
+
+    def _decode(self, found: int) -> Tuple[List[str], Dict[str, List[str]]]:
+        decoded = self._decoded.get(found)
+        if decoded is None:
+            intents: List[str] = []
+            entities: Dict[str, List[str]] = {kind: [] for kind in self.entity_types}
+            for bit, (kind, value) in enumerate(self._bit_labels):
+                if found >> bit & 1:
+                    (intents if kind is None else entities[kind]).append(value)
+            decoded = (intents, entities)
+            if len(self._decoded) >= DECODE_CACHE_SIZE:
+                self._decoded.clear()
+            self._decoded[found] = decoded
+        return decoded
+
+    def match(self, message: str) -> MatchResult:
+        """Return all intents and entities found in ``message``."""
+        intents, entities = self._decode(self._scan(normalize_text(message)))
+        return MatchResult(
+            intents=list(intents),
+            entities={kind: list(values) for kind, values in entities.items()}
+        )
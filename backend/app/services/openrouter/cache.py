@@ -7,8 +7,10 @@ import asyncio
 import logging
 import json
 import hashlib
+import heapq
+import time
 from typing import Dict, List, Optional, Any, Tuple, Union
-from datetime import datetime, timedelta
+from datetime import datetime
 from dataclasses import dataclass, asdict
 from enum import Enum
 
@@ -18,6 +20,10 @@ except ImportError:
     redis = None
 
 from .types import OpenRouterResponse, ConversationContext, ChatMessage
+from .embeddings import TextEmbedder, HashingEmbedder, PartitionedVectorIndex, create_vector_index
+from .fuzzy_index import create_token_index, word_set, scoped_word_set, jaccard, min_overlap
+from .memory_store import CacheRecord, LRUTTLStore
+from .codec import CacheCodec, CachedPayload, is_codec_frame
 from ...core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -32,15 +38,40 @@ class CacheStrategy(str, Enum):
 
 @dataclass
 class CacheEntry:
-    """Cache entry with metadata."""
+    """Cache entry with metadata; response and context are rehydrated on first access."""
     key: str
-    response: OpenRouterResponse
-    context: ConversationContext
-    created_at: datetime
+    payload: CachedPayload
+    frame: bytes
     accessed_at: datetime
     access_count: int
-    ttl_seconds: int
-    tags: List[str]
+    
+    @property
+    def response(self) -> OpenRouterResponse:
+        return self.payload.response
+    
+    @property
+    def context(self) -> ConversationContext:
+        return self.payload.context
+    
+    @property
+    def created_at(self) -> datetime:
+        return datetime.utcfromtimestamp(self.payload.created_at)
+    
+    @property
+    def ttl_seconds(self) -> int:
+        return self.payload.ttl_seconds
+    
+    @property
+    def tags(self) -> List[str]:
+        return self.payload.tags
+    
+    @property
+    def query_text(self) -> Optional[str]:
+        return self.payload.query_text
+    
+    @property
+    def scope(self) -> str:
+        return self.payload.scope or ""
 
 
 class ResponseCache:
@@ -48,17 +79,37 @@ class ResponseCache:
     Response caching service with multiple storage backends and strategies.
     
     Features:
-    - Redis backend with fallback to in-memory
+    - In-memory (L1) and Redis (L2) backends sharing a compact binary codec
     - Multiple cache strategies (exact, semantic, fuzzy)
+    - Embedding-backed semantic lookup with a vector index per cache scope
+    - Constant-time LRU eviction and TTL expiry with entry and byte budgets
     - TTL management
     - Cache statistics and analytics
     - Smart cache invalidation
     """
     
-    def __init__(self):
-        """Initialize the response cache."""
+    # Redis fuzzy index: scoped token -> cache keys scored by expiry time,
+    # plus the scoped tokens of each key
+    FUZZY_POSTING_PREFIX = "openrouter_cache_fuzzy_postings:"
+    FUZZY_TOKENS_PREFIX = "openrouter_cache_fuzzy_tokens:"
+    
+    def __init__(
+        self,
+        embedder: Optional[TextEmbedder] = None,
+        vector_index_type: str = "auto",
+        fuzzy_index_type: str = "inverted",
+        codec: Optional[CacheCodec] = None
+    ):
+        """
+        Initialize the response cache.
+        
+        Args:
+            embedder: Text embedder for semantic lookups (local hashing embedder by default)
+            vector_index_type: "brute", "ivf" or "auto" (IVF once the cache is large)
+            fuzzy_index_type: "inverted" (exact candidates) or "minhash" (LSH signatures)
+            codec: Binary codec for stored entries (msgpack + compression by default)
+        """
         self.redis_client: Optional[redis.Redis] = None
-        self.memory_cache: Dict[str, CacheEntry] = {}
         self.cache_stats: Dict[str, int] = {
             "hits": 0,
             "misses": 0,
@@ -66,11 +117,35 @@ class ResponseCache:
             "evictions": 0,
             "errors": 0
         }
+        self.strategy_stats: Dict[str, Dict[str, float]] = {
+            strategy.value: {"hits": 0, "misses": 0, "lookup_time_ms": 0.0}
+            for strategy in CacheStrategy
+        }
         
         # Cache configuration
         self.default_ttl = getattr(settings.redis, 'REDIS_CACHE_TTL', 3600)  # 1 hour
-        self.max_memory_entries = 1000
         self.similarity_threshold = 0.8
+        self.semantic_similarity_threshold = 0.85
+        
+        # Semantic index over query texts of in-memory entries, one per scope;
+        # most scopes hold a handful of entries, so each starts small
+        self.embedder = embedder or HashingEmbedder()
+        self.vector_index = PartitionedVectorIndex(
+            lambda: create_vector_index(self.embedder.dimensions, vector_index_type, initial_capacity=8)
+        )
+        
+        # Token -> key postings for fuzzy lookups over in-memory entries
+        self.token_index = create_token_index(fuzzy_index_type)
+        
+        # Versioned binary encoding shared by the Redis and memory backends
+        self.codec = codec or CacheCodec()
+        
+        # Bounded LRU/TTL store holding encoded entries
+        self.memory_cache = LRUTTLStore(
+            max_entries=1000,
+            max_bytes=64 * 1024 * 1024,
+            on_remove=self._on_memory_remove
+        )
         
         logger.info("Response cache initialized")
     
@@ -81,8 +156,7 @@ class ResponseCache:
             if redis and hasattr(settings, 'redis') and settings.redis.REDIS_URL:
                 self.redis_client = redis.from_url(
                     settings.redis.REDIS_URL,
-                    encoding="utf-8",
-                    decode_responses=True,
+                    decode_responses=False,  # entries are binary codec frames
                     retry_on_timeout=True,
                     socket_keepalive=True,
                     socket_keepalive_options={}
@@ -98,6 +172,24 @@ class ResponseCache:
             logger.warning(f"Failed to connect to Redis: {str(e)}. Using in-memory cache.")
             self.redis_client = None
     
+    @property
+    def max_memory_entries(self) -> int:
+        """Maximum number of entries held in memory."""
+        return self.memory_cache.max_entries
+    
+    @max_memory_entries.setter
+    def max_memory_entries(self, value: int):
+        self.memory_cache.max_entries = value
+    
+    @property
+    def max_memory_bytes(self) -> int:
+        """Approximate byte budget for entries held in memory."""
+        return self.memory_cache.max_bytes
+    
+    @max_memory_bytes.setter
+    def max_memory_bytes(self, value: int):
+        self.memory_cache.max_bytes = value
+    
     async def close(self):
         """Close cache connections."""
         if self.redis_client:
@@ -111,7 +203,9 @@ class ResponseCache:
         self, 
         key: str,
         strategy: CacheStrategy = CacheStrategy.EXACT_MATCH,
-        similarity_threshold: Optional[float] = None
+        similarity_threshold: Optional[float] = None,
+        query_text: Optional[str] = None,
+        scope: Optional[str] = None
     ) -> Optional[Tuple[OpenRouterResponse, ConversationContext]]:
         """
         Get cached response for a given key.
@@ -119,11 +213,17 @@ class ResponseCache:
         Args:
             key: Cache key to lookup
             strategy: Cache lookup strategy
-            similarity_threshold: Similarity threshold for fuzzy matching
+            similarity_threshold: Similarity threshold for fuzzy/semantic matching
+            query_text: Raw query text for semantic matching (defaults to the key)
+            scope: Only entries cached under the same scope are fuzzy/semantic matches
             
         Returns:
             Tuple of (response, context) if found, None otherwise
         """
+        strategy = CacheStrategy(strategy)
+        strategy_stats = self.strategy_stats[strategy.value]
+        started = time.perf_counter()
+        
         try:
             # Try different lookup strategies
             cache_entry = None
@@ -131,11 +231,23 @@ class ResponseCache:
             if strategy == CacheStrategy.EXACT_MATCH:
                 cache_entry = await self._get_exact(key)
             elif strategy == CacheStrategy.FUZZY_MATCH:
-                cache_entry = await self._get_fuzzy(key, similarity_threshold or self.similarity_threshold)
+                cache_entry = await self._get_fuzzy(
+                    query_text or key,
+                    similarity_threshold or self.similarity_threshold,
+                    scope or ""
+                )
             elif strategy == CacheStrategy.SEMANTIC_SIMILAR:
-                cache_entry = await self._get_semantic(key, similarity_threshold or self.similarity_threshold)
+                cache_entry = await self._get_semantic(
+                    query_text or key,
+                    similarity_threshold or self.semantic_similarity_threshold,
+                    scope or ""
+                )
+            
+            strategy_stats["lookup_time_ms"] += (time.perf_counter() - started) * 1000
             
             if cache_entry:
+                strategy_stats["hits"] += 1
+                
                 # Update access statistics
                 cache_entry.accessed_at = datetime.utcnow()
                 cache_entry.access_count += 1
@@ -148,6 +260,7 @@ class ResponseCache:
                 
                 return (cache_entry.response, cache_entry.context)
             
+            strategy_stats["misses"] += 1
             self.cache_stats["misses"] += 1
             logger.debug(f"Cache miss for key: {key[:50]}...")
             return None
@@ -163,7 +276,9 @@ class ResponseCache:
         response: OpenRouterResponse,
         context: ConversationContext,
         ttl: Optional[int] = None,
-        tags: Optional[List[str]] = None
+        tags: Optional[List[str]] = None,
+        query_text: Optional[str] = None,
+        scope: Optional[str] = None
     ) -> bool:
         """
         Cache a response with the given key.
@@ -174,6 +289,8 @@ class ResponseCache:
             context: Conversation context
             ttl: Time to live in seconds
             tags: Optional tags for categorization
+            query_text: Raw query text, indexed for semantic lookups
+            scope: Fingerprint of the user and prompt context the response depends on
             
         Returns:
             True if cached successfully, False otherwise
@@ -182,16 +299,16 @@ class ResponseCache:
             ttl = ttl or self.default_ttl
             tags = tags or []
             
-            # Create cache entry
+            # Create cache entry; the frame is encoded once and shared by both backends
+            payload = CachedPayload.from_models(
+                response, context, time.time(), ttl, tags, query_text, scope
+            )
             cache_entry = CacheEntry(
                 key=key,
-                response=response,
-                context=context,
-                created_at=datetime.utcnow(),
+                payload=payload,
+                frame=self.codec.encode_payload(payload),
                 accessed_at=datetime.utcnow(),
-                access_count=1,
-                ttl_seconds=ttl,
-                tags=tags
+                access_count=1
             )
             
             # Store in backends
@@ -210,81 +327,185 @@ class ResponseCache:
     
     async def _get_exact(self, key: str) -> Optional[CacheEntry]:
         """Get entry with exact key match."""
-        # Try Redis first
+        # Memory first: a local hit costs no Redis round-trip
+        record = self.memory_cache.get(key)
+        if record is not None:
+            return self._record_to_entry(record)
+        
+        # Fall back to the shared Redis backend
         if self.redis_client:
             try:
                 cached_data = await self.redis_client.get(f"openrouter_cache:{key}")
                 if cached_data:
-                    return self._deserialize_entry(cached_data)
+                    return self._deserialize_entry(key, cached_data)
             except Exception as e:
                 logger.warning(f"Redis get error: {str(e)}")
         
-        # Fallback to memory cache
-        if key in self.memory_cache:
-            entry = self.memory_cache[key]
-            if not self._is_expired(entry):
-                return entry
-            else:
-                # Remove expired entry
-                del self.memory_cache[key]
+        return None
+    
+    async def _get_fuzzy(self, text: str, threshold: float, scope: str = "") -> Optional[CacheEntry]:
+        """Get an entry in ``scope`` using fuzzy string matching over the token index."""
+        # Memory cache: only keys sharing scoped tokens with the query are scored
+        for cached_key, _ in self.token_index.candidates(text, threshold, scope):
+            record = self.memory_cache.get(cached_key)
+            if record is None:
+                self.token_index.remove(cached_key)
+                continue
+            return self._record_to_entry(record)
+        
+        # Redis: matching token postings shared by all workers
+        if self.redis_client:
+            try:
+                return await self._get_fuzzy_redis(text, threshold, scope)
+            except Exception as e:
+                logger.warning(f"Redis fuzzy lookup error: {str(e)}")
         
         return None
     
-    async def _get_fuzzy(self, key: str, threshold: float) -> Optional[CacheEntry]:
-        """Get entry using fuzzy string matching."""
-        best_match = None
-        best_score = 0.0
+    async def _get_fuzzy_redis(self, text: str, threshold: float, scope: str = "") -> Optional[CacheEntry]:
+        """Fuzzy lookup against the Redis token postings of ``scope``."""
+        tokens = list(scoped_word_set(text, scope))
+        if not tokens:
+            return None
+        
+        # Members scored below now belong to expired entries and are skipped
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for token in tokens:
+            pipe.zrangebyscore(f"{self.FUZZY_POSTING_PREFIX}{token}", now, "+inf")
+        postings = await pipe.execute()
+        
+        overlap: Dict[str, int] = {}
+        for keys in postings:
+            for cached_key in keys:
+                cached_key = cached_key.decode("utf-8") if isinstance(cached_key, bytes) else cached_key
+                overlap[cached_key] = overlap.get(cached_key, 0) + 1
         
-        # Check memory cache for fuzzy matches
-        for cached_key, entry in self.memory_cache.items():
-            if self._is_expired(entry):
+        # Drop keys that cannot reach the threshold before fetching their tokens
+        required = min_overlap(len(tokens), threshold)
+        candidates = [k for k, shared in overlap.items() if shared >= required]
+        if not candidates:
+            return None
+        
+        stored_tokens = await self.redis_client.mget(
+            [f"{self.FUZZY_TOKENS_PREFIX}{cached_key}" for cached_key in candidates]
+        )
+        scored = []
+        for cached_key, stored in zip(candidates, stored_tokens):
+            if stored is None:
                 continue
-            
-            similarity = self._calculate_string_similarity(key, cached_key)
-            if similarity >= threshold and similarity > best_score:
-                best_match = entry
-                best_score = similarity
+            key_tokens = (stored.decode("utf-8") if isinstance(stored, bytes) else stored).split()
+            shared = overlap[cached_key]
+            score = shared / (len(tokens) + len(key_tokens) - shared)
+            if score >= threshold:
+                scored.append((score, cached_key, key_tokens))
+        
+        for _, cached_key, key_tokens in sorted(scored, reverse=True):
+            entry = await self._get_exact(cached_key)
+            if entry:
+                return entry
+            # Entry left Redis before its expiry (e.g. evicted); drop it from all its postings
+            await self._remove_redis_fuzzy_index(cached_key, key_tokens)
         
-        # TODO: Implement fuzzy search in Redis using patterns or separate index
-        # For now, only check memory cache
+        return None
+    
+    def _queue_redis_fuzzy_index(self, pipe, entry: CacheEntry):
+        """
+        Queue commands adding an entry's tokens to the Redis fuzzy index.
         
-        return best_match
+        Postings are sorted sets scored by each member's expiry time. Every
+        add trims the members that have already expired, so a posting for a
+        common token only ever holds live keys, however often it is written.
+        """
+        tokens = scoped_word_set(entry.query_text or entry.key, entry.scope)
+        if not tokens:
+            return
+        
+        now = time.time()
+        expires_at = entry.payload.created_at + entry.ttl_seconds
+        for token in tokens:
+            posting_key = f"{self.FUZZY_POSTING_PREFIX}{token}"
+            pipe.zadd(posting_key, {entry.key: expires_at})
+            pipe.zremrangebyscore(posting_key, "-inf", now)
+            # A posting no longer written to disappears with its newest entry
+            pipe.expire(posting_key, entry.ttl_seconds)
+        # The entry's own tokens give its size and let it be removed from every posting
+        pipe.setex(f"{self.FUZZY_TOKENS_PREFIX}{entry.key}", entry.ttl_seconds, " ".join(tokens))
+    
+    async def _remove_redis_fuzzy_index(self, key: str, tokens):
+        """Remove a key from the Redis postings of the given tokens."""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for token in tokens:
+            pipe.zrem(f"{self.FUZZY_POSTING_PREFIX}{token}", key)
+        pipe.delete(f"{self.FUZZY_TOKENS_PREFIX}{key}")
+        await pipe.execute()
     
-    async def _get_semantic(self, key: str, threshold: float) -> Optional[CacheEntry]:
-        """Get entry using semantic similarity (placeholder for future implementation)."""
-        # TODO: Implement semantic similarity using embeddings
-        # This would require:
-        # 1. Generate embeddings for cache keys
-        # 2. Store embeddings in vector database or Redis with vector search
-        # 3. Find semantically similar keys
+    async def _get_semantic(self, query_text: str, threshold: float, scope: str = "") -> Optional[CacheEntry]:
+        """Get the entry in ``scope`` whose query embedding is most similar to the given text."""
+        if scope not in self.vector_index.partitions:
+            return None
+        
+        query_vector = self.embedder.embed(query_text)
+        for matched_key, score in self.vector_index.search(query_vector, k=3, partition=scope):
+            if score < threshold:
+                break
+            
+            entry = await self._get_exact(matched_key)
+            if entry:
+                logger.debug(f"Semantic cache match (score={score:.3f}) for: {query_text[:50]}...")
+                return entry
+            
+            # Entry expired or was evicted from every backend
+            self.vector_index.remove(matched_key)
         
-        # For now, fall back to fuzzy matching
-        return await self._get_fuzzy(key, threshold)
+        return None
+    
+    def _index_entry(self, entry: CacheEntry):
+        """Add an entry to the fuzzy token index and the semantic index."""
+        self.token_index.add(entry.key, entry.query_text or entry.key, entry.scope)
+        if not entry.query_text:
+            return
+        try:
+            self.vector_index.add(entry.key, self.embedder.embed(entry.query_text), partition=entry.scope)
+        except Exception as e:
+            logger.warning(f"Failed to index cache entry for semantic lookup: {str(e)}")
+    
+    def _remove_memory_entry(self, key: str):
+        """Remove an entry from the memory cache and its lookup indexes."""
+        self.memory_cache.remove(key)
+        self.token_index.remove(key)
+        self.vector_index.remove(key)
+    
+    def _on_memory_remove(self, key: str, reason: str):
+        """Keep lookup indexes in sync with evictions and expiry in the memory store."""
+        self.token_index.remove(key)
+        self.vector_index.remove(key)
+        self.cache_stats["evictions"] += 1
     
     async def _store_entry(self, entry: CacheEntry) -> bool:
         """Store cache entry in available backends."""
         success = False
         
-        # Try Redis first
+        # Try Redis first; the entry and its fuzzy postings go in one round-trip
         if self.redis_client:
             try:
-                serialized_data = self._serialize_entry(entry)
-                await self.redis_client.setex(
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.setex(
                     f"openrouter_cache:{entry.key}",
                     entry.ttl_seconds,
-                    serialized_data
+                    self._serialize_entry(entry)
                 )
+                self._queue_redis_fuzzy_index(pipe, entry)
+                await pipe.execute()
                 success = True
             except Exception as e:
                 logger.warning(f"Redis store error: {str(e)}")
         
-        # Store in memory cache as backup/fallback
+        # Store in memory cache as backup/fallback; the store evicts LRU entries
         try:
-            # Evict entries if memory cache is full
-            if len(self.memory_cache) >= self.max_memory_entries:
-                await self._evict_memory_entries()
-            
-            self.memory_cache[entry.key] = entry
+            self.memory_cache.put(self._entry_to_record(entry))
+            if entry.key in self.memory_cache:
+                self._index_entry(entry)
             success = True
         except Exception as e:
             logger.error(f"Memory cache store error: {str(e)}")
@@ -292,91 +513,72 @@ class ResponseCache:
         return success
     
     async def _update_entry(self, entry: CacheEntry):
-        """Update an existing cache entry."""
-        # Update in Redis if available
-        if self.redis_client:
-            try:
-                serialized_data = self._serialize_entry(entry)
-                # Update without changing TTL
-                await self.redis_client.set(
-                    f"openrouter_cache:{entry.key}",
-                    serialized_data,
-                    keepttl=True
-                )
-            except Exception as e:
-                logger.warning(f"Redis update error: {str(e)}")
-        
-        # Update in memory cache
-        self.memory_cache[entry.key] = entry
-    
-    def _serialize_entry(self, entry: CacheEntry) -> str:
-        """Serialize cache entry to JSON string."""
-        data = {
-            "key": entry.key,
-            "response": entry.response.dict(),
-            "context": entry.context.dict(),
-            "created_at": entry.created_at.isoformat(),
-            "accessed_at": entry.accessed_at.isoformat(),
-            "access_count": entry.access_count,
-            "ttl_seconds": entry.ttl_seconds,
-            "tags": entry.tags
-        }
-        return json.dumps(data, ensure_ascii=False)
+        """Record a hit on an entry."""
+        # Access statistics are tracked in memory only, so a Redis hit is a
+        # single GET instead of a GET plus a full re-serialize and SET.
+        record = self.memory_cache.peek(entry.key)
+        if record is not None:
+            record.accessed_at = time.time()
+            record.access_count = entry.access_count
+        else:
+            # Promote Redis hits to the memory cache, reusing the encoded frame
+            self.memory_cache.put(self._entry_to_record(entry))
+            if entry.key in self.memory_cache:
+                self._index_entry(entry)
+    
+    def _serialize_entry(self, entry: CacheEntry) -> bytes:
+        """Serialize cache entry to its binary codec frame."""
+        return entry.frame
     
-    def _deserialize_entry(self, data: str) -> CacheEntry:
-        """Deserialize JSON string to cache entry."""
-        parsed = json.loads(data)
+    def _deserialize_entry(self, key: str, data: bytes) -> CacheEntry:
+        """Deserialize a codec frame (or legacy JSON entry) to a cache entry."""
+        payload = self.codec.decode(data)
         
         return CacheEntry(
-            key=parsed["key"],
-            response=OpenRouterResponse(**parsed["response"]),
-            context=ConversationContext(**parsed["context"]),
-            created_at=datetime.fromisoformat(parsed["created_at"]),
-            accessed_at=datetime.fromisoformat(parsed["accessed_at"]),
-            access_count=parsed["access_count"],
-            ttl_seconds=parsed["ttl_seconds"],
-            tags=parsed["tags"]
+            key=key,
+            payload=payload,
+            # Legacy JSON entries are re-encoded so the memory copy uses the codec
+            frame=data if is_codec_frame(data) else self.codec.encode_payload(payload),
+            accessed_at=datetime.utcnow(),
+            access_count=1
+        )
+    
+    def _entry_to_record(self, entry: CacheEntry) -> CacheRecord:
+        """Build a compact memory record from a cache entry."""
+        record = CacheRecord(
+            key=entry.key,
+            payload=entry.frame,
+            ttl_seconds=entry.ttl_seconds,
+            query_text=entry.query_text,
+            tags=entry.tags,
+            created_at=entry.payload.created_at,
+            access_count=entry.access_count
         )
+        
+        # Entries read back from Redis keep their remaining lifetime
+        age_seconds = time.time() - entry.payload.created_at
+        if age_seconds > 0:
+            record.expires_at -= age_seconds
+        return record
     
-    def _is_expired(self, entry: CacheEntry) -> bool:
-        """Check if a cache entry has expired."""
-        expiry_time = entry.created_at + timedelta(seconds=entry.ttl_seconds)
-        return datetime.utcnow() > expiry_time
+    def _record_to_entry(self, record: CacheRecord) -> CacheEntry:
+        """Wrap a memory record; models are only built if the caller reads them."""
+        return CacheEntry(
+            key=record.key,
+            payload=self.codec.decode(record.payload),
+            frame=record.payload,
+            accessed_at=datetime.utcfromtimestamp(record.accessed_at),
+            access_count=record.access_count
+        )
     
     def _calculate_string_similarity(self, str1: str, str2: str) -> float:
-        """Calculate string similarity using simple algorithm."""
-        if not str1 or not str2:
-            return 0.0
-        
-        # Simple Jaccard similarity on word sets
-        words1 = set(str1.lower().split())
-        words2 = set(str2.lower().split())
-        
-        if not words1 or not words2:
-            return 0.0
-        
-        intersection = len(words1.intersection(words2))
-        union = len(words1.union(words2))
-        
-        return intersection / union if union > 0 else 0.0
+        """Calculate string similarity using Jaccard similarity on word sets."""
+        return jaccard(word_set(str1), word_set(str2))
     
     async def _evict_memory_entries(self, count: int = 100):
         """Evict least recently used entries from memory cache."""
-        if len(self.memory_cache) <= count:
-            return
-        
-        # Sort by access time (oldest first)
-        sorted_entries = sorted(
-            self.memory_cache.items(),
-            key=lambda x: x[1].accessed_at
-        )
-        
-        # Remove oldest entries
-        for key, _ in sorted_entries[:count]:
-            del self.memory_cache[key]
-            self.cache_stats["evictions"] += 1
-        
-        logger.debug(f"Evicted {count} entries from memory cache")
+        evicted = self.memory_cache.evict_lru(count)
+        logger.debug(f"Evicted {evicted} entries from memory cache")
     
     async def clear(self, pattern: Optional[str] = None):
         """Clear cache entries, optionally matching a pattern."""
@@ -391,21 +593,25 @@ class ResponseCache:
                 
                 # Memory cache pattern matching
                 keys_to_remove = [
-                    key for key in self.memory_cache.keys()
+                    key for key in list(self.memory_cache.keys())
                     if pattern in key
                 ]
                 for key in keys_to_remove:
-                    del self.memory_cache[key]
+                    self._remove_memory_entry(key)
                 
                 logger.info(f"Cleared cache entries matching pattern: {pattern}")
             else:
                 # Clear all entries
                 if self.redis_client:
                     keys = await self.redis_client.keys("openrouter_cache:*")
+                    keys += await self.redis_client.keys(f"{self.FUZZY_POSTING_PREFIX}*")
+                    keys += await self.redis_client.keys(f"{self.FUZZY_TOKENS_PREFIX}*")
                     if keys:
                         await self.redis_client.delete(*keys)
                 
                 self.memory_cache.clear()
+                self.token_index.clear()
+                self.vector_index.clear()
                 logger.info("Cleared all cache entries")
                 
         except Exception as e:
@@ -418,7 +624,7 @@ class ResponseCache:
         
         # Memory cache stats
         memory_entries = len(self.memory_cache)
-        memory_size = sum(len(str(entry)) for entry in self.memory_cache.values())
+        memory_size = self.memory_cache.total_bytes
         
         # Redis stats (if available)
         redis_info = {}
@@ -438,54 +644,71 @@ class ResponseCache:
                 "memory_cache": {
                     "entries": memory_entries,
                     "size_bytes": memory_size,
-                    "max_entries": self.max_memory_entries
+                    "max_entries": self.max_memory_entries,
+                    "max_bytes": self.max_memory_bytes
                 },
                 "redis_cache": {
                     "connected": self.redis_client is not None,
                     "info": redis_info
                 }
             },
+            "strategies": self._get_strategy_stats(),
+            "semantic_index": {
+                "type": type(self.vector_index).__name__,
+                "embedder": self.embedder.name,
+                "dimensions": self.embedder.dimensions,
+                "entries": len(self.vector_index),
+                "scopes": len(self.vector_index.partitions)
+            },
+            "fuzzy_index": {
+                "type": type(self.token_index).__name__,
+                "entries": len(self.token_index),
+                "tokens": len(self.token_index.postings)
+            },
             "configuration": {
                 "default_ttl_seconds": self.default_ttl,
-                "similarity_threshold": self.similarity_threshold
+                "similarity_threshold": self.similarity_threshold,
+                "semantic_similarity_threshold": self.semantic_similarity_threshold
             }
         }
     
+    def _get_strategy_stats(self) -> Dict[str, Dict[str, float]]:
+        """Hit rate and average lookup latency per lookup strategy."""
+        strategies = {}
+        for name, stats in self.strategy_stats.items():
+            lookups = stats["hits"] + stats["misses"]
+            strategies[name] = {
+                "hits": stats["hits"],
+                "misses": stats["misses"],
+                "hit_rate_percent": (stats["hits"] / max(1, lookups)) * 100,
+                "avg_lookup_ms": stats["lookup_time_ms"] / max(1, lookups)
+            }
+        return strategies
+    
     async def get_popular_entries(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Get most frequently accessed cache entries."""
-        # Sort memory cache entries by access count
-        sorted_entries = sorted(
-            self.memory_cache.values(),
-            key=lambda x: x.access_count,
-            reverse=True
+        live_records = (
+            record for record in self.memory_cache.values()
+            if not record.is_expired()
         )
+        top_records = heapq.nlargest(limit, live_records, key=lambda x: x.access_count)
         
-        popular = []
-        for entry in sorted_entries[:limit]:
-            if not self._is_expired(entry):
-                popular.append({
-                    "key": entry.key[:100],  # Truncate long keys
-                    "access_count": entry.access_count,
-                    "created_at": entry.created_at.isoformat(),
-                    "tags": entry.tags
-                })
-        
-        return popular
+        return [
+            {
+                "key": record.key[:100],  # Truncate long keys
+                "access_count": record.access_count,
+                "created_at": datetime.utcfromtimestamp(record.created_at).isoformat(),
+                "tags": record.tags
+            }
+            for record in top_records
+        ]
     
     async def cleanup_expired(self):
         """Remove expired entries from memory cache."""
-        expired_keys = []
-        
-        for key, entry in self.memory_cache.items():
-            if self._is_expired(entry):
-                expired_keys.append(key)
-        
-        for key in expired_keys:
-            del self.memory_cache[key]
-            self.cache_stats["evictions"] += 1
+        expired_count = self.memory_cache.expire()
         
-        if expired_keys:
-            logger.info(f"Cleaned up {len(expired_keys)} expired cache entries")
+        if expired_count:
+            logger.info(f"Cleaned up {expired_count} expired cache entries")
     
     async def preload_common_responses(self, common_queries: List[str]):
         """Preload cache with responses for common queries (placeholder)."""
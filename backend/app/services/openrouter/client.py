@@ -3,12 +3,11 @@ OpenRouter HTTP client with retry logic and error handling.
 Handles all direct communication with OpenRouter API.
 """
 
-import asyncio
 import json
 import logging
-from typing import Dict, Any, Optional
+from typing import Any, AsyncIterator, Dict, Optional
 from datetime import datetime, timedelta
-import aiohttp
+import httpx
 from tenacity import (
     retry,
     stop_after_attempt,
@@ -24,7 +23,9 @@ from .exceptions import (
     RateLimitExceededError,
     ModelTimeoutError
 )
-from .types import OpenRouterResponse, RequestParameters, Usage
+from .streaming import iter_stream_chunks
+from .types import OpenRouterResponse, RequestParameters, StreamChunk, Usage
+from ..http_pool import SharedHTTPPool, http_pool
 
 logger = logging.getLogger(__name__)
 
@@ -32,11 +33,13 @@ logger = logging.getLogger(__name__)
 class OpenRouterClient:
     """HTTP client for OpenRouter API with comprehensive error handling."""
     
-    def __init__(self):
+    def __init__(self, pool: Optional[SharedHTTPPool] = None):
         self.api_key = settings.openrouter.OPENROUTER_API_KEY
         self.base_url = settings.openrouter.OPENROUTER_BASE_URL
-        self.timeout = aiohttp.ClientTimeout(total=60, connect=10)
-        self.session: Optional[aiohttp.ClientSession] = None
+        # Connections come from the process-wide pool shared by every OpenRouter client
+        self.pool = pool or http_pool
+        self.headers = self._get_default_headers()
+        self.session_active = False
         
         # Request tracking
         self.request_count = 0
@@ -56,18 +59,15 @@ class OpenRouterClient:
     
     async def start_session(self):
         """Initialize HTTP session."""
-        if not self.session or self.session.closed:
-            self.session = aiohttp.ClientSession(
-                timeout=self.timeout,
-                headers=self._get_default_headers(),
-                connector=aiohttp.TCPConnector(limit=100, limit_per_host=30)
-            )
+        if not self.session_active:
+            self.session_active = True
             logger.debug("OpenRouter HTTP session started")
     
     async def close_session(self):
         """Close HTTP session."""
-        if self.session and not self.session.closed:
-            await self.session.close()
+        # Pooled connections stay open for other clients; the pool is closed on shutdown
+        if self.session_active:
+            self.session_active = False
             logger.debug("OpenRouter HTTP session closed")
     
     def _get_default_headers(self) -> Dict[str, str]:
@@ -103,14 +103,14 @@ class OpenRouterClient:
         
         return rate_limit_info
     
-    async def _handle_response_errors(self, response: aiohttp.ClientResponse) -> Dict[str, Any]:
+    async def _handle_response_errors(self, response: httpx.Response) -> Dict[str, Any]:
         """Handle HTTP response errors and extract data."""
         try:
-            response_data = await response.json()
-        except (json.JSONDecodeError, aiohttp.ContentTypeError):
-            response_data = {"error": await response.text()}
+            response_data = response.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            response_data = {"error": response.text}
         
-        if response.status == 200:
+        if response.status_code == 200:
             return response_data
         
         # Extract error information
@@ -124,7 +124,7 @@ class OpenRouterClient:
         request_id = response.headers.get("x-request-id")
         
         # Handle specific error types
-        if response.status == 429:
+        if response.status_code == 429:
             retry_after = response.headers.get("retry-after")
             retry_seconds = int(retry_after) if retry_after else 60
             
@@ -136,20 +136,20 @@ class OpenRouterClient:
                 limit=rate_limit_info.get("requests_limit")
             )
         
-        elif response.status in [500, 502, 503, 504]:
+        elif response.status_code in [500, 502, 503, 504]:
             # Server errors - retryable
             raise APIError(
                 message=f"Server error: {error_message}",
-                status_code=response.status,
+                status_code=response.status_code,
                 response_data=response_data,
                 request_id=request_id
             )
         
-        elif response.status in [400, 401, 403, 404]:
+        elif response.status_code in [400, 401, 403, 404]:
             # Client errors - not retryable
             raise APIError(
                 message=f"Client error: {error_message}",
-                status_code=response.status,
+                status_code=response.status_code,
                 response_data=response_data,
                 request_id=request_id
             )
@@ -158,7 +158,7 @@ class OpenRouterClient:
             # Unknown error
             raise APIError(
                 message=f"Unexpected error: {error_message}",
-                status_code=response.status,
+                status_code=response.status_code,
                 response_data=response_data,
                 request_id=request_id
             )
@@ -166,7 +166,7 @@ class OpenRouterClient:
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=1, max=10),
-        retry=retry_if_exception_type((APIError, aiohttp.ClientError)),
+        retry=retry_if_exception_type((APIError, httpx.TransportError)),
         before_sleep=before_sleep_log(logger, logging.WARNING)
     )
     async def _make_request(
@@ -177,7 +177,7 @@ class OpenRouterClient:
         params: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """Make HTTP request with retry logic."""
-        if not self.session:
+        if not self.session_active:
             await self.start_session()
         
         url = f"{self.base_url.rstrip('/')}/{endpoint.lstrip('/')}"
@@ -189,7 +189,8 @@ class OpenRouterClient:
         request_data = {
             "method": method,
             "url": url,
-            "params": params
+            "params": params,
+            "headers": self.headers
         }
         
         if data is not None:
@@ -198,25 +199,24 @@ class OpenRouterClient:
         logger.debug(f"Making {method} request to {url}")
         
         try:
-            async with self.session.request(**request_data) as response:
-                return await self._handle_response_errors(response)
+            response = await self.pool.request(**request_data)
+            return await self._handle_response_errors(response)
         
-        except asyncio.TimeoutError:
+        except httpx.TimeoutException:
             raise ModelTimeoutError(
                 model_name="unknown",
-                timeout_seconds=int(self.timeout.total)
+                timeout_seconds=int(self.pool.timeout.read)
             )
         
-        except aiohttp.ClientError as e:
+        except httpx.HTTPError as e:
             raise APIError(
                 message=f"HTTP client error: {str(e)}",
                 status_code=None,
                 response_data={"client_error": str(e)}
             )
     
-    async def create_chat_completion(self, params: RequestParameters) -> OpenRouterResponse:
-        """Create a chat completion using OpenRouter API."""
-        # Convert parameters to API format
+    def _build_chat_payload(self, params: RequestParameters) -> Dict[str, Any]:
+        """Convert request parameters to the chat completions API format."""
         request_data = {
             "model": params.model,
             "messages": [
@@ -244,6 +244,12 @@ class OpenRouterClient:
         if params.route:
             request_data["route"] = params.route
         
+        return request_data
+    
+    async def create_chat_completion(self, params: RequestParameters) -> OpenRouterResponse:
+        """Create a chat completion using OpenRouter API."""
+        request_data = self._build_chat_payload(params)
+        
         logger.info(f"Creating chat completion with model: {params.model}")
         
         try:
@@ -256,6 +262,50 @@ class OpenRouterClient:
             logger.error(f"Chat completion failed: {str(e)}")
             raise
     
+    async def stream_chat_completion(self, params: RequestParameters) -> AsyncIterator[StreamChunk]:
+        """
+        Stream a chat completion, yielding chunks as OpenRouter sends them.
+        
+        Usage is requested in the final event. Streams are not retried:
+        a failure after the first chunk cannot be replayed transparently.
+        Closing the iterator early drops the connection, which stops the
+        generation upstream.
+        """
+        request_data = self._build_chat_payload(params)
+        request_data["stream"] = True
+        request_data["usage"] = {"include": True}
+        
+        if not self.session_active:
+            await self.start_session()
+        
+        url = f"{self.base_url.rstrip('/')}/chat/completions"
+        self.request_count += 1
+        self.last_request_time = datetime.utcnow()
+        
+        logger.info(f"Streaming chat completion with model: {params.model}")
+        
+        try:
+            async with self.pool.stream("POST", url, json=request_data, headers=self.headers) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    await self._handle_response_errors(response)
+                
+                async for chunk in iter_stream_chunks(response.aiter_lines()):
+                    yield chunk
+        
+        except httpx.TimeoutException:
+            raise ModelTimeoutError(
+                model_name=params.model,
+                timeout_seconds=int(self.pool.timeout.read)
+            )
+        
+        except httpx.HTTPError as e:
+            raise APIError(
+                message=f"HTTP client error: {str(e)}",
+                status_code=None,
+                response_data={"client_error": str(e)}
+            )
+    
     async def list_models(self) -> Dict[str, Any]:
         """List available models from OpenRouter."""
         logger.debug("Fetching available models")
@@ -290,5 +340,6 @@ class OpenRouterClient:
         return {
             "request_count": self.request_count,
             "last_request_time": self.last_request_time.isoformat() if self.last_request_time else None,
-            "session_active": self.session is not None and not self.session.closed
+            "session_active": self.session_active,
+            "pool": self.pool.get_stats()
         }
\ No newline at end of file
@@ -0,0 +1,248 @@
+"""
+Binary codec for cached OpenRouter responses.
+Versioned msgpack framing with optional compression, plus lazy model rehydration.
+"""
+
+import json
+import logging
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .types import OpenRouterResponse, ConversationContext
+
+logger = logging.getLogger(__name__)
+
+
+# Frame layout: MAGIC (1 byte) | VERSION (1 byte) | FLAGS (1 byte) | body
+CODEC_MAGIC = 0xC7
+CODEC_VERSION = 1
+
+# FLAGS: low nibble = body format, high nibble = compression
+FORMAT_MSGPACK = 0x01
+FORMAT_JSON = 0x02
+COMPRESSION_NONE = 0x00
+COMPRESSION_ZLIB = 0x10
+COMPRESSION_ZSTD = 0x20
+
+
+def is_codec_frame(data: bytes) -> bool:
+    """Check whether data is a codec frame rather than a legacy JSON entry."""
+    return bool(data) and isinstance(data, bytes) and data[0] == CODEC_MAGIC
+
+
+class CodecError(ValueError):
+    """Raised when a cached payload cannot be decoded."""
+
+
+class CachedPayload:
+    """
+    Decoded cache payload whose Pydantic models are built on first access.
+
+    Holding the raw dicts lets lookups that never touch the response (index
+    probes, metadata reads, moving an entry between backends) skip model
+    validation entirely.
+    """
+
+    __slots__ = (
+        "response_data", "context_data", "created_at", "ttl_seconds", "tags",
+        "query_text", "scope", "_response", "_context"
+    )
+
+    def __init__(
+        self,
+        response_data: Dict[str, Any],
+        context_data: Dict[str, Any],
+        created_at: float,
+        ttl_seconds: int,
+        tags: Optional[List[str]] = None,
+        query_text: Optional[str] = None,
+        scope: Optional[str] = None
+    ):
+        self.response_data = response_data
+        self.context_data = context_data
+        self.created_at = created_at
+        self.ttl_seconds = ttl_seconds
+        self.tags = tags or []
+        self.query_text = query_text
+        self.scope = scope
+        self._response: Optional[OpenRouterResponse] = None
+        self._context: Optional[ConversationContext] = None
+
+    @classmethod
+    def from_models(
+        cls,
+        response: OpenRouterResponse,
+        context: ConversationContext,
+        created_at: float,
+        ttl_seconds: int,
+        tags: Optional[List[str]] = None,
+        query_text: Optional[str] = None,
+        scope: Optional[str] = None
+    ) -> "CachedPayload":
+        """Build a payload from live models (they are reused instead of rebuilt)."""
+        payload = cls(
+            response.dict(), context.dict(), created_at, ttl_seconds, tags, query_text, scope
+        )
+        payload._response = response
+        payload._context = context
+        return payload
+
+    @property
+    def response(self) -> OpenRouterResponse:
+        if self._response is None:
+            self._response = OpenRouterResponse(**self.response_data)
+        return self._response
+
+    @property
+    def context(self) -> ConversationContext:
+        if self._context is None:
+            self._context = ConversationContext(**self.context_data)
+        return self._context
+
+
+class CacheCodec:
+    """
+    Encodes cache payloads into compact, versioned binary frames.
+
+    - msgpack body when available (JSON fallback keeps the codec dependency-free)
+    - zstd (if installed) or zlib compression above ``compress_threshold`` bytes,
+      kept only when it actually shrinks the body
+    - frames without the magic byte are decoded as the legacy JSON entries
+      written by earlier versions of the cache
+    """
+
+    def __init__(
+        self,
+        compress_threshold: int = 1024,
+        compression: Optional[str] = "auto",
+        use_msgpack: bool = True,
+        zlib_level: int = 3
+    ):
+        self.compress_threshold = compress_threshold
+        self.use_msgpack = use_msgpack and msgpack is not None
+        self.zlib_level = zlib_level
+
+        if compression == "auto":
+            compression = "zstd" if zstandard is not None else "zlib"
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard not installed, falling back to zlib compression")
+            compression = "zlib"
+        self.compression = compression
+
+        self._zstd_compressor = zstandard.ZstdCompressor(level=3) if compression == "zstd" else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+    def encode(
+        self,
+        response: OpenRouterResponse,
+        context: ConversationContext,
+        created_at: float,
+        ttl_seconds: int,
+        tags: Optional[List[str]] = None,
+        query_text: Optional[str] = None
+    ) -> bytes:
+        """Encode a response/context pair and its metadata into a binary frame."""
+        return self.encode_payload(CachedPayload.from_models(
+            response, context, created_at, ttl_seconds, tags, query_text
+        ))
+
+    def encode_payload(self, payload: CachedPayload) -> bytes:
+        """Encode a payload; its models are not needed if it came from decode()."""
+        # Stored positionally so field names are not repeated in every entry;
+        # fields are only ever appended, so older frames decode with defaults
+        return self.encode_raw((
+            payload.response_data,
+            payload.context_data,
+            payload.created_at,
+            payload.ttl_seconds,
+            payload.tags,
+            payload.query_text,
+            payload.scope
+        ))
+
+    def encode_raw(self, body: Tuple[Any, ...]) -> bytes:
+        """Frame a positional body tuple."""
+        if self.use_msgpack:
+            data = msgpack.packb(body, use_bin_type=True, default=str)
+            body_format = FORMAT_MSGPACK
+        else:
+            data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+            body_format = FORMAT_JSON
+
+        compression = COMPRESSION_NONE
+        if self.compression and len(data) >= self.compress_threshold:
+            if self.compression == "zstd":
+                compressed = self._zstd_compressor.compress(data)
+                flag = COMPRESSION_ZSTD
+            else:
+                compressed = zlib.compress(data, self.zlib_level)
+                flag = COMPRESSION_ZLIB
+            if len(compressed) < len(data):
+                data, compression = compressed, flag
+
+        return bytes((CODEC_MAGIC, CODEC_VERSION, body_format | compression)) + data
+
+    def decode(self, frame: bytes) -> CachedPayload:
+        """Decode a binary frame (or a legacy JSON entry) into a lazy payload."""
+        if isinstance(frame, str):
+            frame = frame.encode("utf-8")
+        if not frame:
+            raise CodecError("Empty cache payload")
+
+        if frame[0] != CODEC_MAGIC:
+            return self._decode_legacy_json(frame)
+
+        if len(frame) < 3:
+            raise CodecError("Truncated cache payload header")
+        version, flags = frame[1], frame[2]
+        if version != CODEC_VERSION:
+            raise CodecError(f"Unsupported cache codec version: {version}")
+
+        data = frame[3:]
+        compression = flags & 0xF0
+        if compression == COMPRESSION_ZLIB:
+            data = zlib.decompress(data)
+        elif compression == COMPRESSION_ZSTD:
+            if self._zstd_decompressor is None:
+                raise CodecError("Payload is zstd-compressed but zstandard is not installed")
+            data = self._zstd_decompressor.decompress(data)
+
+        body_format = flags & 0x0F
+        if body_format == FORMAT_MSGPACK:
+            if msgpack is None:
+                raise CodecError("Payload is msgpack-encoded but msgpack is not installed")
+            body = msgpack.unpackb(data, raw=False)
+        elif body_format == FORMAT_JSON:
+            body = json.loads(data)
+        else:
+            raise CodecError(f"Unknown cache payload format: {body_format}")
+
+        return CachedPayload(*body)
+
+    def _decode_legacy_json(self, frame: bytes) -> CachedPayload:
+        """Decode entries written by the original JSON serializer."""
+        try:
+            parsed = json.loads(frame)
+        except ValueError as e:
+            raise CodecError(f"Invalid cache payload: {str(e)}")
+
+        created_at = datetime.fromisoformat(parsed["created_at"])
+        return CachedPayload(
+            response_data=parsed["response"],
+            context_data=parsed["context"],
+            created_at=created_at.replace(tzinfo=timezone.utc).timestamp(),
+            ttl_seconds=parsed["ttl_seconds"],
+            tags=parsed.get("tags"),
+            query_text=parsed.get("query_text")
+        )
@@ -0,0 +1,436 @@
+"""
+Text embeddings and vector index for semantic response caching.
+Provides an offline local embedder and brute-force / IVF nearest-neighbour indexes.
+"""
+
+import hashlib
+import logging
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+
+# Arabic normalization used before tokenizing: strip tashkeel/tatweel and fold
+# letter variants so spelling differences do not change the embedding.
+_ARABIC_DIACRITICS = re.compile(r'[\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+_ARABIC_FOLDING = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ة': 'ه',
+    'ؤ': 'و',
+})
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase text and fold Arabic letter variants for matching."""
+    if not text:
+        return ""
+    normalized = _ARABIC_DIACRITICS.sub("", text.lower())
+    return normalized.translate(_ARABIC_FOLDING)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split normalized text into word tokens."""
+    return _TOKEN_PATTERN.findall(normalize_text(text))
+
+
+class TextEmbedder:
+    """Base class for text embedders producing L2-normalized float32 vectors."""
+
+    name = "base"
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a single text."""
+        raise NotImplementedError
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed several texts into a (n, dimensions) matrix."""
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.vstack([self.embed(text) for text in texts])
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector = vector / norm
+        return vector
+
+
+class HashingEmbedder(TextEmbedder):
+    """
+    Local, dependency-free embedder based on hashed word and character n-grams.
+
+    Works offline and is deterministic across processes, which makes it the
+    default for tests and for deployments without an embedding model. It
+    captures lexical overlap (spelling variants, word order, extra words), not
+    cross-lingual meaning; plug in a multilingual model through
+    CallableEmbedder to match Arabic questions against English ones.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimensions: int = 256, char_ngram: int = 3):
+        super().__init__(dimensions)
+        self.char_ngram = char_ngram
+
+    def _bucket(self, feature: str) -> Tuple[int, float]:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        sign = 1.0 if value & 1 else -1.0
+        return (value >> 1) % self.dimensions, sign
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in tokenize(text):
+            index, sign = self._bucket(f"w:{token}")
+            vector[index] += sign
+            padded = f"#{token}#"
+            for start in range(max(1, len(padded) - self.char_ngram + 1)):
+                index, sign = self._bucket(f"c:{padded[start:start + self.char_ngram]}")
+                vector[index] += 0.5 * sign
+        return self._normalize(vector)
+
+
+class CallableEmbedder(TextEmbedder):
+    """Adapter for an external embedding function (e.g. a sentence-transformer model)."""
+
+    name = "callable"
+
+    def __init__(self, func: Callable[[str], "np.ndarray | List[float]"], dimensions: int):
+        super().__init__(dimensions)
+        self.func = func
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = self._normalize(self.func(text))
+        if vector.shape[0] != self.dimensions:
+            raise ValueError(
+                f"Embedding has {vector.shape[0]} dimensions, expected {self.dimensions}"
+            )
+        return vector
+
+
+def create_embedder(model_name: Optional[str] = None) -> TextEmbedder:
+    """
+    Create the embedder for semantic caching.
+
+    ``model_name`` names a sentence-transformers model (a multilingual one
+    matches Arabic questions against English ones). Without a model name, or
+    when the model cannot be loaded, the offline hashing embedder is used.
+    """
+    if not model_name:
+        return HashingEmbedder()
+    if SentenceTransformer is None:
+        logger.warning(
+            f"sentence-transformers not installed, cannot load embedding model {model_name}; "
+            "using the hashing embedder"
+        )
+        return HashingEmbedder()
+
+    try:
+        model = SentenceTransformer(model_name)
+    except Exception as e:
+        logger.warning(f"Failed to load embedding model {model_name}: {str(e)}. Using the hashing embedder.")
+        return HashingEmbedder()
+
+    embedder = CallableEmbedder(model.encode, model.get_sentence_embedding_dimension())
+    embedder.name = model_name
+    logger.info(f"Semantic cache uses embedding model {model_name} ({embedder.dimensions} dimensions)")
+    return embedder
+
+
+class VectorIndex:
+    """Base class for cosine-similarity indexes over normalized vectors."""
+
+    def add(self, key: str, vector: np.ndarray):
+        raise NotImplementedError
+
+    def remove(self, key: str):
+        raise NotImplementedError
+
+    def search(self, vector: np.ndarray, k: int = 1) -> List[Tuple[str, float]]:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, key: str) -> bool:
+        raise NotImplementedError
+
+
+class BruteForceVectorIndex(VectorIndex):
+    """
+    Exact nearest-neighbour search over a contiguous float32 matrix.
+
+    Rows are stored densely; removal swaps the last row into the hole so the
+    matrix never fragments. Search is a single matrix-vector product.
+    """
+
+    def __init__(self, dimensions: int, initial_capacity: int = 256):
+        self.dimensions = dimensions
+        self.initial_capacity = initial_capacity
+        self._matrix = np.zeros((initial_capacity, dimensions), dtype=np.float32)
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def add(self, key: str, vector: np.ndarray):
+        if key in self._rows:
+            self._matrix[self._rows[key]] = vector
+            return
+
+        size = len(self._keys)
+        if size >= self._matrix.shape[0]:
+            grown = np.zeros((self._matrix.shape[0] * 2, self.dimensions), dtype=np.float32)
+            grown[:size] = self._matrix[:size]
+            self._matrix = grown
+
+        self._matrix[size] = vector
+        self._rows[key] = size
+        self._keys.append(key)
+
+    def remove(self, key: str):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+
+        last = len(self._keys) - 1
+        if row != last:
+            moved_key = self._keys[last]
+            self._matrix[row] = self._matrix[last]
+            self._keys[row] = moved_key
+            self._rows[moved_key] = row
+        self._keys.pop()
+
+    def search(self, vector: np.ndarray, k: int = 1) -> List[Tuple[str, float]]:
+        size = len(self._keys)
+        if size == 0:
+            return []
+
+        scores = self._matrix[:size] @ vector
+        k = min(k, size)
+        if k == 1:
+            best = int(np.argmax(scores))
+            return [(self._keys[best], float(scores[best]))]
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._keys[i], float(scores[i])) for i in top]
+
+    def vectors(self) -> Tuple[List[str], np.ndarray]:
+        """Return keys and their vectors (a view, do not mutate)."""
+        return list(self._keys), self._matrix[:len(self._keys)]
+
+    def clear(self):
+        self._matrix = np.zeros((self.initial_capacity, self.dimensions), dtype=np.float32)
+        self._keys.clear()
+        self._rows.clear()
+
+
+class IVFVectorIndex(VectorIndex):
+    """
+    Inverted-file (clustered) approximate index for large caches.
+
+    Vectors are assigned to the nearest of ``n_lists`` k-means centroids and a
+    search only scans the ``n_probe`` closest lists. Until ``train_threshold``
+    vectors have been added (or after heavy churn) it behaves like a single
+    brute-force list, so small caches stay exact.
+    """
+
+    def __init__(
+        self,
+        dimensions: int,
+        n_lists: int = 32,
+        n_probe: int = 4,
+        train_threshold: int = 2000,
+        kmeans_iterations: int = 10,
+        initial_capacity: int = 256
+    ):
+        self.dimensions = dimensions
+        self.initial_capacity = initial_capacity
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_threshold = train_threshold
+        self.kmeans_iterations = kmeans_iterations
+
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[BruteForceVectorIndex] = [BruteForceVectorIndex(dimensions, initial_capacity)]
+        self._assignment: Dict[str, int] = {}
+        self._changes_since_train = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def __len__(self) -> int:
+        return len(self._assignment)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._assignment
+
+    def _nearest_lists(self, vector: np.ndarray, count: int) -> List[int]:
+        if self._centroids is None:
+            return [0]
+        scores = self._centroids @ vector
+        count = min(count, len(scores))
+        return list(np.argsort(-scores)[:count])
+
+    def add(self, key: str, vector: np.ndarray):
+        if key in self._assignment:
+            self.remove(key)
+
+        list_id = self._nearest_lists(vector, 1)[0]
+        self._lists[list_id].add(key, vector)
+        self._assignment[key] = list_id
+        self._changes_since_train += 1
+
+        # Train once the cache is large enough, retrain after it has doubled
+        if len(self) >= self.train_threshold and (
+            not self.is_trained or self._changes_since_train >= len(self)
+        ):
+            self.train()
+
+    def remove(self, key: str):
+        list_id = self._assignment.pop(key, None)
+        if list_id is not None:
+            self._lists[list_id].remove(key)
+            self._changes_since_train += 1
+
+    def search(self, vector: np.ndarray, k: int = 1) -> List[Tuple[str, float]]:
+        candidates: List[Tuple[str, float]] = []
+        for list_id in self._nearest_lists(vector, self.n_probe):
+            candidates.extend(self._lists[list_id].search(vector, k))
+        candidates.sort(key=lambda item: item[1], reverse=True)
+        return candidates[:k]
+
+    def train(self):
+        """Run spherical k-means over all stored vectors and rebuild the lists."""
+        keys: List[str] = []
+        blocks: List[np.ndarray] = []
+        for inverted_list in self._lists:
+            list_keys, list_vectors = inverted_list.vectors()
+            keys.extend(list_keys)
+            blocks.append(list_vectors.copy())
+
+        if not keys:
+            return
+        data = np.vstack(blocks)
+        n_lists = min(self.n_lists, len(keys))
+
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(len(keys), n_lists, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            labels = np.argmax(data @ centroids.T, axis=1)
+            for cluster in range(n_lists):
+                members = data[labels == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    centroids[cluster] = centroid / norm if norm > 0 else centroid
+        labels = np.argmax(data @ centroids.T, axis=1)
+
+        self._centroids = centroids.astype(np.float32)
+        self._lists = [BruteForceVectorIndex(self.dimensions) for _ in range(n_lists)]
+        self._assignment = {}
+        for row, key in enumerate(keys):
+            list_id = int(labels[row])
+            self._lists[list_id].add(key, data[row])
+            self._assignment[key] = list_id
+        self._changes_since_train = 0
+
+        logger.debug(f"Trained IVF index with {n_lists} lists over {len(keys)} vectors")
+
+    def clear(self):
+        self._centroids = None
+        self._lists = [BruteForceVectorIndex(self.dimensions, self.initial_capacity)]
+        self._assignment.clear()
+        self._changes_since_train = 0
+
+
+class PartitionedVectorIndex(VectorIndex):
+    """
+    Separate vector indexes per partition (e.g. per cache scope).
+
+    A search only sees vectors added under the same partition, so entries of
+    one user or prompt context can never match a query from another. A
+    partition's index is created on its first add and dropped with its last
+    vector.
+    """
+
+    def __init__(self, factory: Callable[[], VectorIndex]):
+        self.factory = factory
+        self.partitions: Dict[str, VectorIndex] = {}
+        self._partition_of: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._partition_of)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._partition_of
+
+    def add(self, key: str, vector: np.ndarray, partition: str = ""):
+        if self._partition_of.get(key, partition) != partition:
+            self.remove(key)
+
+        index = self.partitions.get(partition)
+        if index is None:
+            index = self.partitions[partition] = self.factory()
+        index.add(key, vector)
+        self._partition_of[key] = partition
+
+    def remove(self, key: str):
+        partition = self._partition_of.pop(key, None)
+        if partition is None:
+            return
+
+        index = self.partitions[partition]
+        index.remove(key)
+        if len(index) == 0:
+            del self.partitions[partition]
+
+    def search(self, vector: np.ndarray, k: int = 1, partition: str = "") -> List[Tuple[str, float]]:
+        index = self.partitions.get(partition)
+        return index.search(vector, k) if index is not None else []
+
+    def clear(self):
+        self.partitions.clear()
+        self._partition_of.clear()
+
+
+def create_vector_index(
+    dimensions: int,
+    index_type: str = "auto",
+    large_cache_threshold: int = 5000,
+    initial_capacity: int = 256
+) -> VectorIndex:
+    """Create a vector index: "brute", "ivf", or "auto" (IVF for large caches)."""
+    if index_type == "brute":
+        return BruteForceVectorIndex(dimensions, initial_capacity)
+    if index_type == "ivf":
+        return IVFVectorIndex(dimensions, initial_capacity=initial_capacity)
+    if index_type == "auto":
+        return IVFVectorIndex(
+            dimensions, train_threshold=large_cache_threshold, initial_capacity=initial_capacity
+        )
+    raise ValueError(f"Unknown vector index type: {index_type}")
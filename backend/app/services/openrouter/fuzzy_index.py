@@ -0,0 +1,209 @@
+"""
+Token indexes for fuzzy response-cache lookups.
+Find cached keys with high word-set Jaccard similarity without scanning every entry.
+"""
+
+import hashlib
+import math
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+
+import numpy as np
+
+
+def word_set(text: str) -> FrozenSet[str]:
+    """Word set used for Jaccard similarity (matches ResponseCache tokenization)."""
+    return frozenset(text.lower().split()) if text else frozenset()
+
+
+def scoped_word_set(text: str, scope: str = "") -> FrozenSet[str]:
+    """Word set with each token namespaced by ``scope``; different scopes share no tokens."""
+    tokens = word_set(text)
+    return frozenset(f"{scope}:{token}" for token in tokens) if scope else tokens
+
+
+def jaccard(tokens1: FrozenSet[str], tokens2: FrozenSet[str]) -> float:
+    """Jaccard similarity of two token sets."""
+    if not tokens1 or not tokens2:
+        return 0.0
+    intersection = len(tokens1 & tokens2)
+    return intersection / (len(tokens1) + len(tokens2) - intersection)
+
+
+class InvertedTokenIndex:
+    """
+    Inverted index mapping tokens to the cache keys that contain them.
+
+    A lookup only touches keys sharing at least one token with the query, and
+    counts the shared tokens while walking the postings, so Jaccard scores come
+    out of the postings walk without re-tokenizing any stored key.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Set[str]] = defaultdict(set)
+        self.key_tokens: Dict[str, FrozenSet[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.key_tokens)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.key_tokens
+
+    def add(self, key: str, text: str, scope: str = ""):
+        """Index a key under the tokens of its text, within ``scope``."""
+        if key in self.key_tokens:
+            self.remove(key)
+
+        tokens = scoped_word_set(text, scope)
+        if not tokens:
+            return
+
+        self.key_tokens[key] = tokens
+        for token in tokens:
+            self.postings[token].add(key)
+
+    def remove(self, key: str):
+        """Drop a key from all its postings lists."""
+        tokens = self.key_tokens.pop(key, None)
+        if not tokens:
+            return
+
+        for token in tokens:
+            keys = self.postings.get(token)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[token]
+
+    def candidates(self, text: str, threshold: float, scope: str = "") -> List[Tuple[str, float]]:
+        """Return (key, jaccard) pairs in ``scope`` with similarity >= threshold, best first."""
+        query = scoped_word_set(text, scope)
+        if not query:
+            return []
+
+        overlap: Dict[str, int] = defaultdict(int)
+        for token in query:
+            for key in self.postings.get(token, ()):
+                overlap[key] += 1
+
+        return self._score(query, overlap.items(), threshold)
+
+    def _score(
+        self, query: FrozenSet[str], overlaps: Iterable[Tuple[str, int]], threshold: float
+    ) -> List[Tuple[str, float]]:
+        query_size = len(query)
+        scored = []
+        for key, shared in overlaps:
+            union = query_size + len(self.key_tokens[key]) - shared
+            score = shared / union if union else 0.0
+            if score >= threshold:
+                scored.append((key, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored
+
+    def clear(self):
+        self.postings.clear()
+        self.key_tokens.clear()
+
+
+class MinHashLSHIndex(InvertedTokenIndex):
+    """
+    MinHash signatures with LSH banding on top of the token index.
+
+    Candidates are keys colliding with the query in at least one band, which
+    keeps lookups sub-linear even when common words ("the", "في") appear in
+    most keys. Candidates are verified with exact Jaccard, so results never
+    contain false positives; keys far below ~0.5 similarity may be missed.
+    """
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        super().__init__()
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, self._PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, self._PRIME, size=num_perm, dtype=np.uint64)
+
+        self.buckets: List[Dict[bytes, Set[str]]] = [defaultdict(set) for _ in range(bands)]
+        self.key_bands: Dict[str, List[bytes]] = {}
+
+    @staticmethod
+    def _token_hash(token: str) -> int:
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") >> 4
+
+    def signature(self, tokens: FrozenSet[str]) -> np.ndarray:
+        """Compute the MinHash signature of a token set."""
+        hashes = np.array([self._token_hash(token) for token in tokens], dtype=np.uint64)
+        # Universal hashing (a*x + b); uint64 overflow wraps, which is fine for mixing
+        permuted = hashes[:, None] * self._a[None, :] + self._b[None, :]
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def add(self, key: str, text: str, scope: str = ""):
+        super().add(key, text, scope)
+        tokens = self.key_tokens.get(key)
+        if not tokens:
+            return
+
+        band_keys = self._band_keys(self.signature(tokens))
+        self.key_bands[key] = band_keys
+        for band, band_key in enumerate(band_keys):
+            self.buckets[band][band_key].add(key)
+
+    def remove(self, key: str):
+        super().remove(key)
+        band_keys = self.key_bands.pop(key, None)
+        if not band_keys:
+            return
+
+        for band, band_key in enumerate(band_keys):
+            keys = self.buckets[band].get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.buckets[band][band_key]
+
+    def candidates(self, text: str, threshold: float, scope: str = "") -> List[Tuple[str, float]]:
+        query = scoped_word_set(text, scope)
+        if not query:
+            return []
+
+        matched: Set[str] = set()
+        for band, band_key in enumerate(self._band_keys(self.signature(query))):
+            matched.update(self.buckets[band].get(band_key, ()))
+
+        overlaps = ((key, len(query & self.key_tokens[key])) for key in matched)
+        return self._score(query, overlaps, threshold)
+
+    def clear(self):
+        super().clear()
+        self.key_bands.clear()
+        for bucket in self.buckets:
+            bucket.clear()
+
+
+def create_token_index(index_type: str = "inverted") -> InvertedTokenIndex:
+    """Create a fuzzy token index: "inverted" (exact) or "minhash" (LSH)."""
+    if index_type == "inverted":
+        return InvertedTokenIndex()
+    if index_type == "minhash":
+        return MinHashLSHIndex()
+    raise ValueError(f"Unknown fuzzy index type: {index_type}")
+
+
+def min_overlap(query_size: int, threshold: float) -> int:
+    """Minimum shared tokens a key needs to reach ``threshold`` Jaccard with the query."""
+    return max(1, math.ceil(threshold * query_size))
@@ -0,0 +1,207 @@
+"""
+Bounded in-memory store for the response cache.
+LRU ordering plus coarse TTL buckets give constant-time eviction and expiry.
+"""
+
+import heapq
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+# Fixed per-record overhead added to the payload size when accounting bytes
+RECORD_OVERHEAD_BYTES = 200
+
+
+class CacheRecord:
+    """Compact cache record; the response and context are kept encoded in ``payload``."""
+
+    __slots__ = (
+        "key", "payload", "query_text", "tags", "created_at", "expires_at",
+        "accessed_at", "access_count", "ttl_seconds", "size_bytes"
+    )
+
+    def __init__(
+        self,
+        key: str,
+        payload: bytes,
+        ttl_seconds: int,
+        query_text: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        created_at: Optional[float] = None,
+        access_count: int = 1
+    ):
+        now = time.time()
+        self.key = key
+        self.payload = payload
+        self.query_text = query_text
+        self.tags = tags or []
+        self.created_at = created_at or now          # wall clock, for reporting
+        self.accessed_at = now                       # wall clock, for reporting
+        self.expires_at = time.monotonic() + ttl_seconds
+        self.access_count = access_count
+        self.ttl_seconds = ttl_seconds
+        self.size_bytes = (
+            len(payload) + len(key) + len(query_text or "") * 2 + RECORD_OVERHEAD_BYTES
+        )
+
+    def is_expired(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.monotonic()) >= self.expires_at
+
+
+class LRUTTLStore:
+    """
+    Least-recently-used store with TTL buckets and entry/byte budgets.
+
+    - Reads and writes move a key to the MRU end of an OrderedDict (O(1)).
+    - Over budget, keys are popped from the LRU end (O(1) each).
+    - Each key sits in a bucket of ``bucket_seconds`` width keyed by expiry;
+      ``expire()`` only visits buckets that are already due, so sweeping costs
+      O(expired entries) instead of a scan of the whole store.
+
+    ``on_remove(key, reason)`` is called for every key dropped by eviction or
+    expiry so callers can keep secondary indexes in sync.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        bucket_seconds: float = 5.0,
+        on_remove: Optional[Callable[[str, str], None]] = None
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bucket_seconds = bucket_seconds
+        self.on_remove = on_remove
+
+        self.total_bytes = 0
+        self._records: "OrderedDict[str, CacheRecord]" = OrderedDict()
+        self._buckets: Dict[int, Set[str]] = {}
+        self._bucket_heap: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._records
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def keys(self):
+        return self._records.keys()
+
+    def values(self):
+        return self._records.values()
+
+    def items(self):
+        return self._records.items()
+
+    def _bucket_id(self, expires_at: float) -> int:
+        return int(expires_at // self.bucket_seconds)
+
+    def put(self, record: CacheRecord):
+        """Insert or replace a record, evicting LRU entries to stay within budget."""
+        if record.key in self._records:
+            self._discard(record.key)
+
+        self._records[record.key] = record
+        self.total_bytes += record.size_bytes
+
+        bucket_id = self._bucket_id(record.expires_at)
+        bucket = self._buckets.get(bucket_id)
+        if bucket is None:
+            bucket = self._buckets[bucket_id] = set()
+            heapq.heappush(self._bucket_heap, bucket_id)
+        bucket.add(record.key)
+
+        self._enforce_budget()
+
+    def get(self, key: str) -> Optional[CacheRecord]:
+        """Return a live record and mark it most recently used."""
+        record = self._records.get(key)
+        if record is None:
+            return None
+
+        if record.is_expired():
+            self._drop(key, "expired")
+            return None
+
+        self._records.move_to_end(key)
+        return record
+
+    def peek(self, key: str) -> Optional[CacheRecord]:
+        """Return a record without touching LRU order or checking expiry."""
+        return self._records.get(key)
+
+    def remove(self, key: str) -> Optional[CacheRecord]:
+        """Remove a record without notifying ``on_remove``."""
+        return self._discard(key)
+
+    def evict_lru(self, count: int) -> int:
+        """Evict up to ``count`` least recently used records."""
+        evicted = 0
+        while self._records and evicted < count:
+            key = next(iter(self._records))
+            self._drop(key, "evicted")
+            evicted += 1
+        return evicted
+
+    def expire(self) -> int:
+        """Drop every expired record; only due TTL buckets are visited."""
+        now = time.monotonic()
+        current_bucket = self._bucket_id(now)
+        expired = 0
+
+        while self._bucket_heap and self._bucket_heap[0] <= current_bucket:
+            bucket_id = self._bucket_heap[0]
+            bucket = self._buckets.get(bucket_id, set())
+
+            for key in list(bucket):
+                record = self._records.get(key)
+                if record is not None and record.is_expired(now):
+                    self._drop(key, "expired")
+                    expired += 1
+
+            # The current bucket may still hold live keys; keep it for next sweep
+            if bucket_id < current_bucket or not self._buckets.get(bucket_id):
+                heapq.heappop(self._bucket_heap)
+                self._buckets.pop(bucket_id, None)
+            else:
+                break
+
+        return expired
+
+    def clear(self):
+        self._records.clear()
+        self._buckets.clear()
+        self._bucket_heap.clear()
+        self.total_bytes = 0
+
+    def _enforce_budget(self):
+        # Expire first so live entries are not evicted while dead ones linger
+        if len(self._records) > self.max_entries or self.total_bytes > self.max_bytes:
+            self.expire()
+
+        while self._records and (
+            len(self._records) > self.max_entries or self.total_bytes > self.max_bytes
+        ):
+            key = next(iter(self._records))
+            self._drop(key, "evicted")
+
+    def _drop(self, key: str, reason: str):
+        if self._discard(key) is not None and self.on_remove:
+            self.on_remove(key, reason)
+
+    def _discard(self, key: str) -> Optional[CacheRecord]:
+        record = self._records.pop(key, None)
+        if record is None:
+            return None
+
+        self.total_bytes -= record.size_bytes
+        bucket_id = self._bucket_id(record.expires_at)
+        bucket = self._buckets.get(bucket_id)
+        if bucket is not None:
+            bucket.discard(key)
+            # Empty buckets stay in the heap and are discarded on the next sweep
+        return record
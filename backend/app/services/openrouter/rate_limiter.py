@@ -5,7 +5,9 @@ Manages API rate limits to prevent exceeding quotas and ensure fair usage.
 
 import asyncio
 import logging
-from typing import Dict, List, Optional, Any
+import time
+import uuid
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
 from dataclasses import dataclass
 from collections import defaultdict, deque
@@ -22,6 +24,95 @@ from ...core.config import settings
 logger = logging.getLogger(__name__)
 
 
+# Atomically trims, checks and records every sliding window of a request.
+#
+# KEYS: one sorted set per configured limit (members "<id>:<cost>", score = time),
+#       then the running-sum key of each limit in the same order
+# ARGV: now, member id, tokens, then (limit, window_seconds, is_token_limit) per limit
+#
+# Token limits keep a running sum that is decremented as members fall out of
+# the window, so checks never re-sum the window. Every key is declared in
+# KEYS and a sum key shares its sorted set's hash tag, so both live in the
+# same cluster slot.
+# Returns {allowed, violated_key_index, retry_after_seconds, usage_1, ..., usage_n}.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local member_id = ARGV[2]
+local tokens = tonumber(ARGV[3])
+local usages = {}
+local costs = {}
+local violated_index = 0
+local retry_after = 0
+local n = #KEYS / 2
+
+for i = 1, n do
+    local key = KEYS[i]
+    local base = 3 + (i - 1) * 3
+    local limit = tonumber(ARGV[base + 1])
+    local window = tonumber(ARGV[base + 2])
+    local is_tokens = ARGV[base + 3] == '1'
+    local cutoff = now - window
+    local usage
+
+    if is_tokens then
+        local sum_key = KEYS[n + i]
+        local expired = redis.call('ZRANGEBYSCORE', key, '-inf', cutoff)
+        if #expired > 0 then
+            local freed = 0
+            for _, member in ipairs(expired) do
+                freed = freed + tonumber(string.match(member, ':(%d+)$'))
+            end
+            redis.call('ZREMRANGEBYSCORE', key, '-inf', cutoff)
+            redis.call('DECRBY', sum_key, freed)
+        end
+        usage = tonumber(redis.call('GET', sum_key) or '0')
+        costs[i] = tokens
+    else
+        redis.call('ZREMRANGEBYSCORE', key, '-inf', cutoff)
+        usage = redis.call('ZCARD', key)
+        costs[i] = 1
+    end
+    usages[i] = usage
+
+    if usage >= limit then
+        local wait = window
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        if #oldest > 0 then
+            wait = tonumber(oldest[2]) + window - now
+        end
+        if violated_index == 0 or wait > retry_after then
+            violated_index = i
+            retry_after = wait
+        end
+    end
+end
+
+if violated_index > 0 then
+    local result = {0, violated_index, tostring(retry_after)}
+    for i = 1, #usages do result[#result + 1] = usages[i] end
+    return result
+end
+
+for i = 1, n do
+    local key = KEYS[i]
+    local base = 3 + (i - 1) * 3
+    local ttl = tonumber(ARGV[base + 2]) + 60
+    redis.call('ZADD', key, now, member_id .. ':' .. costs[i])
+    redis.call('EXPIRE', key, ttl)
+    if ARGV[base + 3] == '1' then
+        local sum_key = KEYS[n + i]
+        redis.call('INCRBY', sum_key, costs[i])
+        redis.call('EXPIRE', sum_key, ttl)
+    end
+    usages[i] = usages[i] + costs[i]
+end
+
+local result = {1, 0, '0'}
+for i = 1, #usages do result[#result + 1] = usages[i] end
+return result
+"""
+
+
 class LimitType(str, Enum):
     """Types of rate limits."""
     REQUESTS_PER_MINUTE = "requests_per_minute"
@@ -58,8 +149,8 @@ class RateLimiter:
     Features:
     - Multiple rate limit types (requests, tokens, per minute/hour/day)
     - Per-user and global rate limiting
-    - Redis-backed for distributed systems
-    - Graceful degradation to in-memory
+    - Redis-backed for distributed systems (one atomic script call per request)
+    - Graceful degradation to in-memory with running window sums
     - Smart wait times and backoff
     """
     
@@ -70,6 +161,10 @@ class RateLimiter:
         # In-memory rate limit tracking (fallback)
         self.request_windows: Dict[str, deque] = defaultdict(deque)
         self.token_windows: Dict[str, deque] = defaultdict(deque)
+        self.token_sums: Dict[str, int] = defaultdict(int)
+        
+        # Registered Lua script for atomic multi-window check-and-record
+        self._window_script = None
         
         # Rate limit configurations
         self.rate_limits: List[RateLimit] = []
@@ -141,6 +236,7 @@ class RateLimiter:
                 
                 # Test connection
                 await self.redis_client.ping()
+                self._window_script = self.redis_client.register_script(SLIDING_WINDOW_SCRIPT)
                 logger.info("Redis rate limiter backend connected")
             else:
                 logger.info("Redis not available, using in-memory rate limiting")
@@ -170,46 +266,26 @@ class RateLimiter:
             RateLimitExceededError: If limits are exceeded and wait time is too long
         """
         try:
-            # Check all configured rate limits
-            violations = []
+            deadline = time.monotonic() + max_wait_seconds
             
-            for rate_limit in self.rate_limits:
-                status = await self._check_limit(user_id, rate_limit, tokens)
+            while True:
+                # Check and record every window in one atomic step
+                allowed, retry_after, violation = await self._try_acquire(user_id, tokens)
+                if allowed:
+                    return True
                 
-                if status.remaining <= 0:
-                    violations.append(status)
-            
-            if not violations:
-                # No violations, record usage and proceed
-                await self._record_usage(user_id, tokens)
-                return True
-            
-            # Find the violation with the shortest reset time
-            next_reset = min(v.reset_time for v in violations)
-            wait_seconds = (next_reset - datetime.utcnow()).total_seconds()
-            
-            if wait_seconds <= 0:
-                # Reset time has passed, try again
-                await self._record_usage(user_id, tokens)
-                return True
-            
-            if wait_seconds > max_wait_seconds:
-                # Wait time too long, reject request
-                violation = violations[0]  # Report first violation
-                raise RateLimitExceededError(
-                    retry_after=int(wait_seconds),
-                    limit_type=violation.limit_type,
-                    current_usage=violation.current_usage,
-                    limit=violation.limit
-                )
-            
-            # Wait for rate limit to reset
-            logger.info(f"Rate limit hit for user {user_id}, waiting {wait_seconds:.1f}s")
-            await asyncio.sleep(wait_seconds)
-            
-            # Record usage after waiting
-            await self._record_usage(user_id, tokens)
-            return True
+                if retry_after > deadline - time.monotonic():
+                    # Wait time too long, reject request
+                    raise RateLimitExceededError(
+                        retry_after=int(retry_after) + 1,
+                        limit_type=violation.limit_type,
+                        current_usage=violation.current_usage,
+                        limit=violation.limit
+                    )
+                
+                # Wait for the oldest usage to leave the window, then retry
+                logger.info(f"Rate limit hit for user {user_id}, waiting {retry_after:.1f}s")
+                await asyncio.sleep(max(retry_after, 0.01))
             
         except RateLimitExceededError:
             raise
@@ -218,6 +294,98 @@ class RateLimiter:
             # On error, allow the request to proceed
             return True
     
+    async def _try_acquire(
+        self,
+        user_id: str,
+        tokens: int
+    ) -> Tuple[bool, float, Optional[RateLimitStatus]]:
+        """
+        Check all limits and record usage if none is exceeded.
+        
+        Returns:
+            (allowed, seconds until retry, status of the binding violation)
+        """
+        if self.redis_client and self._window_script:
+            try:
+                return await self._try_acquire_redis(user_id, tokens)
+            except Exception as e:
+                logger.error(f"Redis rate limit script error: {str(e)}")
+                # Fall back to memory-based limiting
+        
+        return self._try_acquire_memory(user_id, tokens)
+    
+    async def _try_acquire_redis(
+        self,
+        user_id: str,
+        tokens: int
+    ) -> Tuple[bool, float, Optional[RateLimitStatus]]:
+        """Run the sliding-window script: one round-trip for all windows."""
+        keys = [self._get_limit_key(user_id, rate_limit) for rate_limit in self.rate_limits]
+        keys.extend([self._get_sum_key(key) for key in keys])
+        args: List[Any] = [repr(time.time()), uuid.uuid4().hex, tokens]
+        for rate_limit in self.rate_limits:
+            args.extend([
+                rate_limit.limit,
+                rate_limit.window_seconds,
+                1 if self._is_token_limit(rate_limit) else 0
+            ])
+        
+        result = await self._window_script(keys=keys, args=args)
+        allowed, violated_index, retry_after = int(result[0]), int(result[1]), float(result[2])
+        if allowed:
+            return True, 0.0, None
+        
+        rate_limit = self.rate_limits[violated_index - 1]
+        usage = int(result[2 + violated_index])
+        return False, max(0.0, retry_after), self._build_status(rate_limit, usage)
+    
+    def _try_acquire_memory(
+        self,
+        user_id: str,
+        tokens: int
+    ) -> Tuple[bool, float, Optional[RateLimitStatus]]:
+        """Check and record all in-memory windows without yielding to the event loop."""
+        now = datetime.utcnow()
+        violation: Optional[RateLimitStatus] = None
+        retry_after = 0.0
+        
+        for rate_limit in self.rate_limits:
+            key = self._get_limit_key(user_id, rate_limit)
+            usage = self._trim_memory_window(key, rate_limit, now)
+            
+            if usage >= rate_limit.limit:
+                window = self._get_memory_window(key, rate_limit)
+                wait = rate_limit.window_seconds
+                if window:
+                    oldest_expiry = window[0][0] + timedelta(seconds=rate_limit.window_seconds)
+                    wait = (oldest_expiry - now).total_seconds()
+                if violation is None or wait > retry_after:
+                    violation = self._build_status(rate_limit, usage)
+                    retry_after = wait
+        
+        if violation is not None:
+            return False, max(0.0, retry_after), violation
+        
+        for rate_limit in self.rate_limits:
+            key = self._get_limit_key(user_id, rate_limit)
+            self._record_usage_memory(key, rate_limit, tokens, now)
+        return True, 0.0, None
+    
+    def _build_status(self, rate_limit: RateLimit, usage: int) -> RateLimitStatus:
+        """Build a status for a limit at the given usage."""
+        return RateLimitStatus(
+            limit_type=rate_limit.limit_type,
+            current_usage=usage,
+            limit=rate_limit.limit,
+            remaining=max(0, rate_limit.limit - usage),
+            reset_time=datetime.utcnow() + timedelta(seconds=rate_limit.window_seconds),
+            window_seconds=rate_limit.window_seconds
+        )
+    
+    @staticmethod
+    def _is_token_limit(rate_limit: RateLimit) -> bool:
+        return rate_limit.limit_type.value.startswith("tokens")
+    
     async def _check_limit(
         self,
         user_id: str,
@@ -240,31 +408,21 @@ class RateLimiter:
     ) -> RateLimitStatus:
         """Check rate limit using Redis sliding window."""
         try:
-            # Use Redis sliding window counter
+            # Use Redis sliding window counter (scores are epoch seconds)
             now = datetime.utcnow()
-            window_start = now - timedelta(seconds=rate_limit.window_seconds)
-            
-            pipe = self.redis_client.pipeline()
-            
-            # Remove expired entries
-            pipe.zremrangebyscore(key, 0, window_start.timestamp())
-            
-            # Count current entries in window
-            pipe.zcount(key, window_start.timestamp(), now.timestamp())
+            cutoff = time.time() - rate_limit.window_seconds
             
-            # Set expiry for cleanup
-            pipe.expire(key, rate_limit.window_seconds + 60)
-            
-            results = await pipe.execute()
-            current_count = results[1]
-            
-            # Calculate usage based on limit type
-            if rate_limit.limit_type.value.startswith("tokens"):
-                # For token limits, we need to sum the token values
-                # This is a simplified approach - in production, you'd store token counts differently
-                current_usage = current_count * 10  # Rough estimate
+            # Read-only: trimming happens inside the atomic acquire script
+            if self._is_token_limit(rate_limit):
+                # Running sum maintained by the script, minus not-yet-trimmed members
+                pipe = self.redis_client.pipeline()
+                pipe.get(self._get_sum_key(key))
+                pipe.zrangebyscore(key, "-inf", cutoff)
+                total, expired = await pipe.execute()
+                stale = sum(int(member.rsplit(b":", 1)[1]) for member in expired)
+                current_usage = int(total or 0) - stale
             else:
-                current_usage = current_count
+                current_usage = await self.redis_client.zcount(key, f"({cutoff}", "+inf")
             
             remaining = max(0, rate_limit.limit - current_usage)
             reset_time = now + timedelta(seconds=rate_limit.window_seconds)
@@ -291,23 +449,7 @@ class RateLimiter:
     ) -> RateLimitStatus:
         """Check rate limit using in-memory sliding window."""
         now = datetime.utcnow()
-        window_start = now - timedelta(seconds=rate_limit.window_seconds)
-        
-        # Get appropriate window based on limit type
-        if rate_limit.limit_type.value.startswith("tokens"):
-            window = self.token_windows[key]
-        else:
-            window = self.request_windows[key]
-        
-        # Remove expired entries
-        while window and window[0][0] < window_start:
-            window.popleft()
-        
-        # Calculate current usage
-        if rate_limit.limit_type.value.startswith("tokens"):
-            current_usage = sum(entry[1] for entry in window)
-        else:
-            current_usage = len(window)
+        current_usage = self._trim_memory_window(key, rate_limit, now)
         
         remaining = max(0, rate_limit.limit - current_usage)
         reset_time = now + timedelta(seconds=rate_limit.window_seconds)
@@ -321,40 +463,27 @@ class RateLimiter:
             window_seconds=rate_limit.window_seconds
         )
     
-    async def _record_usage(self, user_id: str, tokens: int):
-        """Record API usage for rate limiting."""
-        now = datetime.utcnow()
-        
-        for rate_limit in self.rate_limits:
-            key = self._get_limit_key(user_id, rate_limit)
-            
-            if self.redis_client:
-                await self._record_usage_redis(key, rate_limit, tokens, now)
-            else:
-                await self._record_usage_memory(key, rate_limit, tokens, now)
+    def _get_memory_window(self, key: str, rate_limit: RateLimit) -> deque:
+        """Get the in-memory window for a limit key."""
+        if self._is_token_limit(rate_limit):
+            return self.token_windows[key]
+        return self.request_windows[key]
     
-    async def _record_usage_redis(
-        self,
-        key: str,
-        rate_limit: RateLimit,
-        tokens: int,
-        timestamp: datetime
-    ):
-        """Record usage in Redis."""
-        try:
-            # Add entry to sorted set with timestamp as score
-            value = tokens if rate_limit.limit_type.value.startswith("tokens") else 1
-            await self.redis_client.zadd(key, {str(timestamp.timestamp()): value})
-            
-            # Set expiry
-            await self.redis_client.expire(key, rate_limit.window_seconds + 60)
-            
-        except Exception as e:
-            logger.error(f"Redis usage recording error: {str(e)}")
-            # Fall back to memory recording
-            await self._record_usage_memory(key, rate_limit, tokens, timestamp)
+    def _trim_memory_window(self, key: str, rate_limit: RateLimit, now: datetime) -> int:
+        """Drop entries that left the window and return current usage in O(expired)."""
+        window_start = now - timedelta(seconds=rate_limit.window_seconds)
+        window = self._get_memory_window(key, rate_limit)
+        
+        if self._is_token_limit(rate_limit):
+            while window and window[0][0] < window_start:
+                self.token_sums[key] -= window.popleft()[1]
+            return self.token_sums[key]
+        
+        while window and window[0][0] < window_start:
+            window.popleft()
+        return len(window)
     
-    async def _record_usage_memory(
+    def _record_usage_memory(
         self,
         key: str,
         rate_limit: RateLimit,
@@ -363,26 +492,29 @@ class RateLimiter:
     ):
         """Record usage in memory."""
         # Get appropriate window
-        if rate_limit.limit_type.value.startswith("tokens"):
+        if self._is_token_limit(rate_limit):
             window = self.token_windows[key]
             window.append((timestamp, tokens))
+            self.token_sums[key] += tokens
         else:
             window = self.request_windows[key]
             window.append((timestamp, 1))
         
         # Keep window size reasonable
         if len(window) > 10000:
-            # Remove old entries
-            cutoff = timestamp - timedelta(seconds=rate_limit.window_seconds * 2)
-            while window and window[0][0] < cutoff:
-                window.popleft()
+            self._trim_memory_window(key, rate_limit, timestamp)
     
     def _get_limit_key(self, user_id: str, rate_limit: RateLimit) -> str:
-        """Generate key for rate limit tracking."""
+        """Generate key for rate limit tracking; the user (or "global") is the hash tag."""
         if rate_limit.per_user:
-            return f"rate_limit:{rate_limit.limit_type.value}:{user_id}"
+            return f"rate_limit:{rate_limit.limit_type.value}:{{{user_id}}}"
         else:
-            return f"rate_limit:{rate_limit.limit_type.value}:global"
+            return f"rate_limit:{rate_limit.limit_type.value}:{{global}}"
+    
+    @staticmethod
+    def _get_sum_key(key: str) -> str:
+        """Running token sum of a limit key, in the same cluster slot."""
+        return f"rate_limit_sum:{key.split(':', 1)[1]}"
     
     async def get_status(self, user_id: str = "default") -> Dict[str, Any]:
         """Get current rate limit status for a user."""
@@ -423,13 +555,14 @@ class RateLimiter:
             
             try:
                 if self.redis_client:
-                    await self.redis_client.delete(key)
+                    await self.redis_client.delete(key, self._get_sum_key(key))
                 else:
                     # Clear memory windows
                     if key in self.request_windows:
                         self.request_windows[key].clear()
                     if key in self.token_windows:
                         self.token_windows[key].clear()
+                    self.token_sums.pop(key, None)
                 
                 logger.info(f"Reset {rate_limit.limit_type.value} limit for user {user_id}")
                 
@@ -470,7 +603,8 @@ class RateLimiter:
                 keys = await self.redis_client.keys(pattern)
                 
                 for key in keys[:count]:
-                    user_id = key.split(":")[-1]
+                    key = key.decode() if isinstance(key, bytes) else key
+                    user_id = key.split(":", 2)[-1].strip("{}")
                     if user_id != "global":
                         usage = await self.redis_client.zcard(key)
                         users.append({
@@ -503,10 +637,11 @@ class RateLimiter:
             for key, window in list(self.token_windows.items()):
                 cutoff = now - timedelta(seconds=3600)
                 while window and window[0][0] < cutoff:
-                    window.popleft()
+                    self.token_sums[key] -= window.popleft()[1]
                 
                 if not window:
                     del self.token_windows[key]
+                    self.token_sums.pop(key, None)
     
     async def estimate_wait_time(self, user_id: str, tokens: int = 1) -> float:
         """Estimate wait time before a request can be made."""
@@ -4,28 +4,35 @@ Provides comprehensive multi-model AI capabilities with language-specific optimi
 """
 
 import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Optional, Any, Tuple
+import time
+from typing import AsyncIterator, Dict, List, Optional, Any, Tuple
 from datetime import datetime
 import json
 
+import httpx
+
 from .client import OpenRouterClient
 from .models import ModelManager
 from .language_detector import LanguageDetector
 from .cost_tracker import CostTracker
-from .cache import ResponseCache
+from .cache import ResponseCache, CacheStrategy
+from .embeddings import create_embedder
 from .rate_limiter import RateLimiter
 from .arabic_handler import ArabicHandler
 from .prompt_templates import PromptTemplateEngine
+from .streaming import estimate_tokens
 from .types import (
-    ChatMessage, ConversationContext, RequestParameters, 
-    OpenRouterResponse, Language, MessageRole, ModelSelection
+    ChatMessage, ConversationContext, RequestParameters, ModelChoice,
+    OpenRouterResponse, Language, MessageRole, ModelSelection, Usage
 )
 from .exceptions import (
     OpenRouterError, ModelNotAvailableError, BudgetExceededError,
     RateLimitExceededError, APIError
 )
 from ...core.config import settings
+from ...core.metrics import StageLatencyTracker
 
 logger = logging.getLogger(__name__)
 
@@ -50,11 +57,30 @@ class OpenRouterService:
         self.model_manager = ModelManager()
         self.language_detector = LanguageDetector()
         self.cost_tracker = CostTracker()
-        self.cache = ResponseCache()
+        self.cache = ResponseCache(
+            embedder=create_embedder(getattr(settings.openrouter, "CACHE_EMBEDDING_MODEL", None))
+        )
         self.rate_limiter = RateLimiter()
         self.arabic_handler = ArabicHandler()
         self.template_engine = PromptTemplateEngine()
         
+        # Lookup strategy for cached responses (exact, fuzzy or semantic)
+        self.cache_strategy = CacheStrategy(
+            getattr(settings.openrouter, "CACHE_STRATEGY", CacheStrategy.EXACT_MATCH.value)
+        )
+        
+        # Streaming replies: time to first token and cut-offs
+        self.stream_latency = StageLatencyTracker()
+        self.streaming_stats: Dict[str, int] = {"streams": 0, "cut_off": 0}
+        
+        # In-flight generations by cache key (single-flight request coalescing)
+        self._inflight_requests: Dict[str, asyncio.Future] = {}
+        self.coalescing_stats: Dict[str, int] = {
+            "leader_requests": 0,
+            "coalesced_requests": 0,
+            "leader_cancellations": 0
+        }
+        
         # Service state
         self.is_initialized = False
         self.available_models: Dict[str, Any] = {}
@@ -131,75 +157,29 @@ class OpenRouterService:
         if not self.is_initialized:
             raise OpenRouterError("Service not initialized. Call initialize() first.")
         
-        # Create or update conversation context
-        if context is None:
-            context = ConversationContext(
-                user_id=kwargs.get("user_id", "anonymous"),
-                session_id=kwargs.get("session_id", f"session_{datetime.utcnow().timestamp()}")
-            )
-        
-        # Add new messages to context
-        for msg in messages:
-            context.add_message(msg)
+        context = self._ensure_context(messages, context, **kwargs)
         
         try:
-            # Check rate limits
-            await self.rate_limiter.check_and_wait(context.user_id)
-            
-            # Detect language from latest message
-            latest_message = messages[-1] if messages else None
-            if latest_message and context.language == Language.AUTO_DETECT:
-                detection_result = await self.language_detector.detect_language(
-                    latest_message.content
-                )
-                context.language = detection_result.detected_language
-                logger.debug(f"Detected language: {context.language}")
-            
-            # Apply Arabic cultural context if needed
-            if context.language == Language.ARABIC:
-                messages = await self.arabic_handler.enhance_messages(messages, context)
-            
-            # Apply prompt template if specified
-            if template_name:
-                messages = await self.template_engine.apply_template(
-                    template_name, messages, context, **kwargs
-                )
+            messages = await self._prepare_messages(messages, context, template_name, **kwargs)
             
             # Check cache for similar queries
             cache_key = self._generate_cache_key(messages, context)
-            cached_response = await self.cache.get(cache_key)
+            query_text = self._get_cache_query_text(messages)
+            cached_response = await self.cache.get(
+                cache_key,
+                strategy=self.cache_strategy,
+                query_text=query_text,
+                scope=self._get_cache_scope(messages, context)
+            )
             if cached_response:
                 logger.debug("Returning cached response")
-                return cached_response, context
-            
-            # Select appropriate model
-            model_selection = await self.model_manager.select_model(
-                language=context.language,
-                context=context,
-                **kwargs
-            )
-            
-            # Check budget limits
-            estimated_cost = await self._estimate_request_cost(
-                messages, model_selection.selected_model
-            )
-            await self.cost_tracker.check_budget(estimated_cost)
-            
-            # Generate response with fallback
-            response = await self._generate_with_fallback(
-                messages, model_selection, context
-            )
+                return cached_response[0], context
             
-            # Track usage and costs
-            await self.cost_tracker.track_usage(
-                response.usage,
-                model_selection.selected_model,
-                estimated_cost
+            # Identical concurrent requests share a single completion
+            response = await self._generate_single_flight(
+                cache_key, messages, context, query_text, **kwargs
             )
             
-            # Cache successful response
-            await self.cache.set(cache_key, (response, context))
-            
             # Update conversation context
             if response.choices:
                 assistant_message = response.choices[0].message
@@ -216,6 +196,327 @@ class OpenRouterService:
             logger.error(f"Error generating response: {str(e)}")
             raise OpenRouterError(f"Failed to generate response: {str(e)}")
     
+    def _ensure_context(
+        self,
+        messages: List[ChatMessage],
+        context: Optional[ConversationContext],
+        **kwargs
+    ) -> ConversationContext:
+        """Create the conversation context if needed and add the new messages to it."""
+        if context is None:
+            context = ConversationContext(
+                user_id=kwargs.get("user_id", "anonymous"),
+                session_id=kwargs.get("session_id", f"session_{datetime.utcnow().timestamp()}")
+            )
+        
+        for msg in messages:
+            context.add_message(msg)
+        return context
+    
+    async def _prepare_messages(
+        self,
+        messages: List[ChatMessage],
+        context: ConversationContext,
+        template_name: Optional[str],
+        **kwargs
+    ) -> List[ChatMessage]:
+        """Apply rate limits, language detection, cultural context and templates."""
+        # Check rate limits
+        await self.rate_limiter.check_and_wait(context.user_id)
+        
+        # Detect language from latest message
+        latest_message = messages[-1] if messages else None
+        if latest_message and context.language == Language.AUTO_DETECT:
+            detection_result = await self.language_detector.detect_language(
+                latest_message.content
+            )
+            context.language = detection_result.detected_language
+            logger.debug(f"Detected language: {context.language}")
+        
+        # Apply Arabic cultural context if needed
+        if context.language == Language.ARABIC:
+            messages = await self.arabic_handler.enhance_messages(messages, context)
+        
+        # Apply prompt template if specified
+        if template_name:
+            messages = await self.template_engine.apply_template(
+                template_name, messages, context, **kwargs
+            )
+        
+        return messages
+    
+    async def stream_response(
+        self,
+        messages: List[ChatMessage],
+        context: Optional[ConversationContext] = None,
+        template_name: Optional[str] = None,
+        max_output_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        Stream an AI response, yielding text as soon as the model produces it.
+        
+        Fallback models are only tried while nothing has been yielded yet.
+        Generation stops once ``max_output_tokens`` (estimated) is reached, or
+        when the caller stops iterating; either way the connection is dropped
+        and the tokens received so far are tracked as usage. Only streams
+        that finish on their own are cached.
+        
+        Args:
+            messages: List of conversation messages
+            context: Optional conversation context
+            template_name: Optional prompt template to use
+            max_output_tokens: Business limit on the reply length
+            **kwargs: Additional parameters for model selection
+            
+        Yields:
+            Text deltas of the assistant reply
+        """
+        if not self.is_initialized:
+            raise OpenRouterError("Service not initialized. Call initialize() first.")
+        
+        context = self._ensure_context(messages, context, **kwargs)
+        messages = await self._prepare_messages(messages, context, template_name, **kwargs)
+        
+        cache_key = self._generate_cache_key(messages, context)
+        query_text = self._get_cache_query_text(messages)
+        cached_response = await self.cache.get(
+            cache_key,
+            strategy=self.cache_strategy,
+            query_text=query_text,
+            scope=self._get_cache_scope(messages, context)
+        )
+        if cached_response and cached_response[0].choices:
+            assistant_message = cached_response[0].choices[0].message
+            context.add_message(assistant_message)
+            yield assistant_message.content
+            return
+        
+        model_selection = await self.model_manager.select_model(
+            language=context.language,
+            context=context,
+            **kwargs
+        )
+        estimated_cost = await self._estimate_request_cost(
+            messages, model_selection.selected_model
+        )
+        await self.cost_tracker.check_budget(estimated_cost)
+        
+        max_tokens = settings.openrouter.MAX_TOKENS_PER_REQUEST
+        if max_output_tokens:
+            max_tokens = min(max_tokens, max_output_tokens)
+        
+        models_to_try = [model_selection.selected_model] + model_selection.fallback_models
+        last_error = None
+        
+        for model_name in models_to_try:
+            params = RequestParameters(
+                model=model_name,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=0.7,
+                top_p=0.9,
+                stream=True
+            )
+            if context.language == Language.ARABIC:
+                params = await self.arabic_handler.adjust_parameters(params)
+            
+            parts: List[str] = []
+            output_chars = 0
+            usage: Optional[Usage] = None
+            finish_reason: Optional[str] = None
+            started = time.perf_counter()
+            stream = self.client.stream_chat_completion(params)
+            self.streaming_stats["streams"] += 1
+            
+            try:
+                async for chunk in stream:
+                    usage = chunk.usage or usage
+                    finish_reason = chunk.finish_reason or finish_reason
+                    if not chunk.delta:
+                        continue
+                    
+                    if not parts:
+                        self.stream_latency.record("first_token", time.perf_counter() - started)
+                    parts.append(chunk.delta)
+                    output_chars += len(chunk.delta)
+                    yield chunk.delta
+                    
+                    if max_output_tokens and output_chars // 4 >= max_output_tokens:
+                        finish_reason = "cutoff"
+                        self.streaming_stats["cut_off"] += 1
+                        break
+            
+            except APIError as e:
+                if parts or e.status_code not in [None, 500, 502, 503, 504]:
+                    raise
+                logger.warning(f"Stream from {model_name} failed before output: {str(e)}")
+                last_error = e
+                continue
+            
+            except (OpenRouterError, httpx.HTTPError) as e:
+                if parts:
+                    raise
+                logger.warning(f"Stream from {model_name} failed before output: {str(e)}")
+                last_error = e
+                continue
+            
+            finally:
+                await stream.aclose()
+                if parts:
+                    self.stream_latency.record("stream", time.perf_counter() - started)
+                    await self._finish_stream(
+                        "".join(parts), usage, finish_reason, messages, model_name,
+                        estimated_cost, context, cache_key, query_text
+                    )
+            
+            return
+        
+        raise OpenRouterError(f"All models failed. Last error: {str(last_error)}")
+    
+    async def _finish_stream(
+        self,
+        content: str,
+        usage: Optional[Usage],
+        finish_reason: Optional[str],
+        messages: List[ChatMessage],
+        model_name: str,
+        estimated_cost: float,
+        context: ConversationContext,
+        cache_key: str,
+        query_text: Optional[str]
+    ):
+        """Track usage for a finished or cut-off stream and cache complete replies."""
+        if usage is None:
+            # The provider only reports usage in the last event; estimate it when cut off
+            prompt_tokens = estimate_tokens("".join(msg.content for msg in messages))
+            completion_tokens = estimate_tokens(content)
+            usage = Usage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens
+            )
+        
+        await self.cost_tracker.track_usage(
+            usage,
+            model_name,
+            estimated_cost,
+            user_id=context.user_id,
+            session_id=context.session_id
+        )
+        
+        assistant_message = ChatMessage(role=MessageRole.ASSISTANT, content=content)
+        context.add_message(assistant_message)
+        context.total_tokens_used += usage.total_tokens
+        
+        if finish_reason and finish_reason != "cutoff":
+            response = OpenRouterResponse(
+                id=f"stream-{cache_key}",
+                created=int(datetime.utcnow().timestamp()),
+                model=model_name,
+                choices=[ModelChoice(index=0, message=assistant_message, finish_reason=finish_reason)],
+                usage=usage
+            )
+            await self.cache.set(
+                cache_key, response, context,
+                query_text=query_text,
+                scope=self._get_cache_scope(messages, context)
+            )
+    
+    async def _generate_single_flight(
+        self,
+        cache_key: str,
+        messages: List[ChatMessage],
+        context: ConversationContext,
+        query_text: Optional[str],
+        **kwargs
+    ) -> OpenRouterResponse:
+        """
+        Generate a response, coalescing concurrent requests with the same cache key.
+        
+        The first caller (the leader) makes the API call; callers arriving while
+        it is in flight wait on the same future instead of paying for their own
+        completion. Errors are shared with waiters; if the leader is cancelled,
+        one of the waiters takes over.
+        """
+        while True:
+            inflight = self._inflight_requests.get(cache_key)
+            if inflight is None:
+                break
+            
+            self.coalescing_stats["coalesced_requests"] += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise  # this waiter itself was cancelled
+                # Leader was cancelled; retry as a new leader
+                self.coalescing_stats["leader_cancellations"] += 1
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight_requests[cache_key] = future
+        self.coalescing_stats["leader_requests"] += 1
+        
+        try:
+            response = await self._generate_uncached(
+                cache_key, messages, context, query_text, **kwargs
+            )
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception retrieved so unshared failures are not logged twice
+            future.exception()
+            raise
+        finally:
+            self._inflight_requests.pop(cache_key, None)
+    
+    async def _generate_uncached(
+        self,
+        cache_key: str,
+        messages: List[ChatMessage],
+        context: ConversationContext,
+        query_text: Optional[str],
+        **kwargs
+    ) -> OpenRouterResponse:
+        """Select a model, enforce budget, call the API and cache the result."""
+        # Select appropriate model
+        model_selection = await self.model_manager.select_model(
+            language=context.language,
+            context=context,
+            **kwargs
+        )
+        
+        # Check budget limits
+        estimated_cost = await self._estimate_request_cost(
+            messages, model_selection.selected_model
+        )
+        await self.cost_tracker.check_budget(estimated_cost)
+        
+        # Generate response with fallback
+        response = await self._generate_with_fallback(
+            messages, model_selection, context
+        )
+        
+        # Track usage and costs
+        await self.cost_tracker.track_usage(
+            response.usage,
+            model_selection.selected_model,
+            estimated_cost
+        )
+        
+        # Cache successful response
+        await self.cache.set(
+            cache_key, response, context,
+            query_text=query_text,
+            scope=self._get_cache_scope(messages, context)
+        )
+        
+        return response
+    
     async def _generate_with_fallback(
         self,
         messages: List[ChatMessage],
@@ -314,6 +615,29 @@ class OpenRouterService:
         context_hash = hash(f"{context.language}_{context.user_id}")
         return f"openrouter_{content_hash}_{context_hash}"
     
+    def _get_cache_query_text(self, messages: List[ChatMessage]) -> Optional[str]:
+        """Text used for fuzzy/semantic cache matching: the latest user message."""
+        for msg in reversed(messages):
+            if msg.role == MessageRole.USER:
+                return msg.content
+        return None
+    
+    def _get_cache_scope(self, messages: List[ChatMessage], context: ConversationContext) -> str:
+        """
+        Fingerprint of everything a reply depends on besides the latest question.
+        
+        Fuzzy and semantic matches only compare the latest user message, so
+        they are confined to entries cached for the same user, language and
+        system/template prompt; a reply naming one customer's order is never
+        served to another customer asking something similar.
+        """
+        fingerprint = json.dumps({
+            "user_id": context.user_id,
+            "language": str(context.language),
+            "system": [msg.content for msg in messages if msg.role == MessageRole.SYSTEM]
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32]
+    
     # Public utility methods
     
     async def get_service_status(self) -> Dict[str, Any]:
@@ -325,6 +649,14 @@ class OpenRouterService:
             "cost_tracking": await self.cost_tracker.get_status(),
             "rate_limiting": await self.rate_limiter.get_status(),
             "cache_stats": await self.cache.get_stats(),
+            "request_coalescing": {
+                **self.coalescing_stats,
+                "in_flight": len(self._inflight_requests)
+            },
+            "streaming": {
+                **self.streaming_stats,
+                **self.stream_latency.snapshot()
+            },
             "client_stats": self.client.get_stats()
         }
     
@@ -0,0 +1,58 @@
+"""
+Server-sent event parsing for streaming chat completions.
+Turns OpenRouter's ``data:`` lines into StreamChunk objects as they arrive.
+"""
+
+import json
+from typing import Any, AsyncIterator, Dict
+
+from .exceptions import APIError
+from .types import StreamChunk, Usage
+
+DONE_MARKER = "[DONE]"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count used until the provider reports usage (4 chars per token)."""
+    return len(text) // 4
+
+
+def parse_stream_event(event: Dict[str, Any]) -> StreamChunk:
+    """Build a StreamChunk from one decoded ``chat.completion.chunk`` event."""
+    if "error" in event:
+        error = event["error"] if isinstance(event["error"], dict) else {"message": str(event["error"])}
+        raise APIError(
+            message=f"Stream error: {error.get('message', 'unknown error')}",
+            status_code=error.get("code") if isinstance(error.get("code"), int) else None,
+            response_data=event
+        )
+
+    choices = event.get("choices") or [{}]
+    delta = choices[0].get("delta") or {}
+    usage = event.get("usage")
+    return StreamChunk(
+        id=event.get("id"),
+        model=event.get("model"),
+        delta=delta.get("content") or "",
+        finish_reason=choices[0].get("finish_reason"),
+        usage=Usage(**usage) if usage else None
+    )
+
+
+async def iter_stream_chunks(lines: AsyncIterator[str]) -> AsyncIterator[StreamChunk]:
+    """
+    Yield chunks from the lines of an SSE response body.
+
+    Comment lines (OpenRouter sends ``: OPENROUTER PROCESSING`` while a
+    model warms up) and non-data fields are skipped; ``data: [DONE]`` ends
+    the stream.
+    """
+    async for line in lines:
+        line = line.strip()
+        if not line.startswith("data:"):
+            continue
+
+        data = line[len("data:"):].strip()
+        if data == DONE_MARKER:
+            return
+        yield parse_stream_event(json.loads(data))
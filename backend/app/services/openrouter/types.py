@@ -112,6 +112,15 @@ class OpenRouterResponse(BaseModel):
     request_id: Optional[str] = None
 
 
+class StreamChunk(BaseModel):
+    """One server-sent event from a streaming chat completion."""
+    id: Optional[str] = None
+    model: Optional[str] = None
+    delta: str = ""
+    finish_reason: Optional[str] = None
+    usage: Optional[Usage] = None  # only on the final event
+
+
 class CostTracking(BaseModel):
     """Cost tracking information for usage monitoring."""
     total_requests: int = 0
@@ -6,17 +6,23 @@ with support for multiple models, fallback mechanisms, and cost tracking.
 import asyncio
 import json
 import time
-from typing import Dict, List, Any, Optional, Union
+from typing import AsyncIterator, Dict, List, Any, Optional, Union
 from datetime import datetime
-import httpx
 from dataclasses import dataclass
 from enum import Enum
 
 from ..core.config import settings
 from ..core.logging import get_logger
+from .adaptive_concurrency import AIMDLimiter, ModelThroughput, RateBudget
+from .http_pool import http_pool
+from .openrouter.streaming import estimate_tokens, iter_stream_chunks
 
 logger = get_logger(__name__)
 
+# Completion tokens reserved against the per-minute budget before usage is known;
+# replies are rarely near max_tokens, and the reservation is settled afterwards
+EXPECTED_COMPLETION_TOKENS = 500
+
 
 class ModelType(Enum):
     """Available AI model types through OpenRouter"""
@@ -98,25 +104,28 @@ class OpenRouterService:
             "tokens_consumed": {"input": 0, "output": 0}
         }
         
-        # Rate limiting
-        self.rate_limits = {
-            "requests_per_minute": 60,
-            "requests_per_hour": 1000,
-            "current_minute_requests": 0,
-            "current_hour_requests": 0,
-            "last_minute_reset": time.time(),
-            "last_hour_reset": time.time()
-        }
+        # Rate limiting: requests queue for budget instead of failing
+        self.rate_budget = RateBudget(
+            requests_per_minute=settings.openrouter.MAX_REQUESTS_PER_MINUTE,
+            tokens_per_minute=settings.openrouter.OPENROUTER_TOKENS_PER_MINUTE,
+            requests_per_hour=1000
+        )
         
-        self.client = httpx.AsyncClient(
-            timeout=30.0,
-            headers={
-                "Authorization": f"Bearer {self.api_key}",
-                "HTTP-Referer": self.app_url,
-                "X-Title": self.app_name,
-                "Content-Type": "application/json"
-            }
+        # Batch concurrency grows while the API is healthy and backs off on 429s
+        self.concurrency = AIMDLimiter(
+            max_limit=settings.openrouter.OPENROUTER_MAX_CONCURRENCY,
+            latency_target=settings.openrouter.OPENROUTER_LATENCY_TARGET
         )
+        self.throughput = ModelThroughput()
+        
+        # Requests go through the process-wide connection pool
+        self.client = http_pool
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "HTTP-Referer": self.app_url,
+            "X-Title": self.app_name,
+            "Content-Type": "application/json"
+        }
     
     async def generate_response(
         self,
@@ -129,91 +138,195 @@ class OpenRouterService:
         """
         Generate AI response with automatic model selection and fallback.
         """
+        selected_model = model_type
+        started = time.perf_counter()
         try:
-            # Check rate limits
-            await self._check_rate_limits()
-            
             # Select optimal model based on language and context
-            selected_model = self._select_optimal_model(model_type, language, context)
+            selected_model = await self._select_optimal_model(model_type, language, context)
             
             # Prepare request
             request_data = await self._prepare_request(
                 prompt, selected_model, language, context, **kwargs
             )
             
-            # Make API call with retries
-            response_data = await self._make_api_call_with_retries(request_data, selected_model)
-            
-            # Process and track response
-            processed_response = await self._process_response(
-                response_data, selected_model, prompt
+            # Wait for request and token budget
+            reserved_tokens = self._estimate_request_tokens(request_data)
+            await self._check_rate_limits(reserved_tokens)
+            started = time.perf_counter()
+            used_tokens = None
+            try:
+                # Make API call with retries
+                response_data = await self._make_api_call_with_retries(request_data, selected_model)
+                
+                # Process and track response
+                processed_response = await self._process_response(
+                    response_data, selected_model, prompt
+                )
+                
+                # Update usage statistics
+                await self._update_usage_stats(processed_response, selected_model)
+                used_tokens = processed_response.get("tokens_used", {}).get("total", 0) or reserved_tokens
+            finally:
+                # A call that failed or was cancelled produced no completion; charge its prompt only
+                if used_tokens is None:
+                    used_tokens = self._estimate_prompt_tokens(request_data)
+                self.rate_budget.settle(reserved_tokens, used_tokens)
+            latency = time.perf_counter() - started
+            processed_response["response_time_seconds"] = round(latency, 3)
+            self.throughput.record(
+                selected_model.value,
+                latency,
+                used_tokens,
+                processed_response.get("success", False)
             )
             
-            # Update usage statistics
-            await self._update_usage_stats(processed_response, selected_model)
-            
             logger.info(f"Successfully generated response using {selected_model.value}")
             return processed_response
             
         except Exception as e:
             logger.error(f"Error generating AI response: {str(e)}")
             self.usage_stats["failed_requests"] += 1
+            self.throughput.record(selected_model.value, time.perf_counter() - started, 0, success=False)
+            
+            if context and context.get("fallback_attempt"):
+                raise
             
             # Try fallback model
             return await self._try_fallback_model(prompt, language, context, str(e))
     
+    async def stream_response(
+        self,
+        prompt: str,
+        model_type: ModelType = ModelType.CLAUDE_3_5_HAIKU,
+        language: str = "arabic",
+        context: Optional[Dict[str, Any]] = None,
+        max_output_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        Stream an AI response, yielding text as the model produces it.
+        Stops after max_output_tokens (estimated) or when the caller stops
+        iterating; usage and cost are recorded when the stream ends either way.
+        """
+        selected_model = await self._select_optimal_model(model_type, language, context)
+        request_data = await self._prepare_request(
+            prompt, selected_model, language, context, **kwargs
+        )
+        if max_output_tokens:
+            request_data["max_tokens"] = min(request_data["max_tokens"], max_output_tokens)
+        reserved_tokens = self._estimate_request_tokens(request_data)
+        await self._check_rate_limits(reserved_tokens)
+        request_data["stream"] = True
+        request_data["usage"] = {"include": True}
+        
+        output = []
+        output_chars = 0
+        usage: Dict[str, int] = {}
+        try:
+            async with self.client.stream(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                json=request_data,
+                headers=self.headers,
+                timeout=30.0
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    response.raise_for_status()
+                
+                async for chunk in iter_stream_chunks(response.aiter_lines()):
+                    if chunk.usage:
+                        usage = chunk.usage.dict()
+                    if not chunk.delta:
+                        continue
+                    output.append(chunk.delta)
+                    output_chars += len(chunk.delta)
+                    yield chunk.delta
+                    
+                    if max_output_tokens and output_chars // 4 >= max_output_tokens:
+                        logger.info(f"Stopped streaming after ~{max_output_tokens} tokens")
+                        break
+        finally:
+            content = "".join(output)
+            if not usage:
+                # Usage only arrives with the last event; estimate it for cut-off streams
+                usage = {
+                    "prompt_tokens": estimate_tokens(request_data["messages"][0]["content"] + prompt),
+                    "completion_tokens": estimate_tokens(content)
+                }
+            self.rate_budget.settle(
+                reserved_tokens,
+                usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+            )
+            await self._update_usage_stats({
+                "success": bool(content),
+                "tokens_used": {
+                    "input": usage.get("prompt_tokens", 0),
+                    "output": usage.get("completion_tokens", 0)
+                }
+            }, selected_model)
+    
     async def generate_batch_responses(
         self,
         prompts: List[str],
         model_type: ModelType = ModelType.CLAUDE_3_5_HAIKU,
         language: str = "arabic",
-        max_concurrent: int = 5
+        max_concurrent: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
         Generate multiple AI responses concurrently with rate limiting.
+        
+        Concurrency is set by the service-wide AIMD limiter, so it grows
+        while latency and 429 rates stay healthy and is shared with other
+        batches; max_concurrent only caps this batch. Requests queue for the
+        request and token budgets instead of failing. Results keep the
+        order of prompts.
         """
-        try:
-            semaphore = asyncio.Semaphore(max_concurrent)
-            
-            async def process_single_prompt(prompt: str, index: int) -> Dict[str, Any]:
-                async with semaphore:
-                    try:
-                        response = await self.generate_response(
-                            prompt=prompt,
-                            model_type=model_type,
-                            language=language,
-                            context={"batch_index": index, "batch_total": len(prompts)}
-                        )
-                        return {"index": index, "success": True, **response}
-                    except Exception as e:
-                        logger.error(f"Batch request {index} failed: {str(e)}")
-                        return {
-                            "index": index, 
-                            "success": False, 
-                            "error": str(e),
-                            "fallback_response": "عذراً، حدث خطأ في المعالجة"
-                        }
-            
-            # Execute batch processing
-            tasks = [
-                process_single_prompt(prompt, i) 
-                for i, prompt in enumerate(prompts)
-            ]
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Sort results by index to maintain order
-            sorted_results = sorted(
-                [r for r in results if isinstance(r, dict)], 
-                key=lambda x: x.get("index", 0)
-            )
-            
-            logger.info(f"Batch processing completed: {len(prompts)} prompts")
-            return sorted_results
-            
-        except Exception as e:
-            logger.error(f"Batch processing failed: {str(e)}")
-            return [{"success": False, "error": str(e)} for _ in prompts]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        pending: asyncio.Queue = asyncio.Queue()
+        for index in range(len(prompts)):
+            pending.put_nowait(index)
+        
+        async def process_single_prompt(prompt: str, index: int) -> Dict[str, Any]:
+            async with self.concurrency.slot() as outcome:
+                try:
+                    response = await self.generate_response(
+                        prompt=prompt,
+                        model_type=model_type,
+                        language=language,
+                        context={"batch_index": index, "batch_total": len(prompts)}
+                    )
+                    outcome["success"] = response.get("success", False)
+                    # Time spent queued for rate budget is not API latency
+                    outcome["latency"] = response.get("response_time_seconds")
+                    return {"index": index, **response}
+                except Exception as e:
+                    outcome["success"] = False
+                    logger.error(f"Batch request {index} failed: {str(e)}")
+                    return {
+                        "index": index, 
+                        "success": False, 
+                        "error": str(e),
+                        "fallback_response": "عذراً، حدث خطأ في المعالجة"
+                    }
+        
+        async def worker():
+            while True:
+                try:
+                    index = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results[index] = await process_single_prompt(prompts[index], index)
+        
+        # Enough workers to reach the limiter's ceiling; the limiter decides how many run
+        workers = min(len(prompts), max_concurrent or self.concurrency.max_limit)
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        
+        logger.info(
+            f"Batch processing completed: {len(prompts)} prompts, "
+            f"concurrency limit {self.concurrency.limit}"
+        )
+        return results
     
     async def analyze_text_sentiment(
         self,
@@ -444,13 +557,18 @@ class OpenRouterService:
             try:
                 response = await self.client.post(
                     f"{self.base_url}/chat/completions",
-                    json=request_data
+                    json=request_data,
+                    headers=self.headers,
+                    timeout=30.0
                 )
                 
                 if response.status_code == 200:
                     return response.json()
                 elif response.status_code == 429:  # Rate limited
-                    wait_time = 2 ** attempt  # Exponential backoff
+                    self.concurrency.on_rate_limited()
+                    self.throughput.record_rate_limited(model.value)
+                    retry_after = response.headers.get("retry-after", "")
+                    wait_time = max(2 ** attempt, int(retry_after) if retry_after.isdigit() else 0)
                     logger.warning(f"Rate limited, waiting {wait_time}s before retry {attempt + 1}")
                     await asyncio.sleep(wait_time)
                     continue
@@ -567,34 +685,33 @@ class OpenRouterService:
                 for model, config in self.models.items()
             },
             "available_models": [model.value for model in self.models.keys()],
-            "rate_limits": self.rate_limits
+            "rate_limits": self.rate_budget.get_stats(),
+            "adaptive_concurrency": self.concurrency.get_stats(),
+            "throughput_by_model": self.throughput.get_stats(),
+            "http_pool": self.client.get_stats()
         }
     
-    async def _check_rate_limits(self):
-        """Check and enforce rate limits"""
-        current_time = time.time()
-        
-        # Reset counters if time windows have passed
-        if current_time - self.rate_limits["last_minute_reset"] >= 60:
-            self.rate_limits["current_minute_requests"] = 0
-            self.rate_limits["last_minute_reset"] = current_time
-        
-        if current_time - self.rate_limits["last_hour_reset"] >= 3600:
-            self.rate_limits["current_hour_requests"] = 0
-            self.rate_limits["last_hour_reset"] = current_time
-        
-        # Check limits
-        if self.rate_limits["current_minute_requests"] >= self.rate_limits["requests_per_minute"]:
-            raise Exception("Rate limit exceeded: requests per minute")
-        
-        if self.rate_limits["current_hour_requests"] >= self.rate_limits["requests_per_hour"]:
-            raise Exception("Rate limit exceeded: requests per hour")
-        
-        # Increment counters
-        self.rate_limits["current_minute_requests"] += 1
-        self.rate_limits["current_hour_requests"] += 1
+    async def _check_rate_limits(self, tokens: int = 0) -> float:
+        """Wait until the request and token budgets allow another request"""
+        waited = await self.rate_budget.acquire(tokens)
+        if waited > 1:
+            logger.info(f"Waited {waited:.1f}s for OpenRouter rate budget")
+        return waited
+    
+    def _estimate_prompt_tokens(self, request_data: Dict[str, Any]) -> int:
+        """Estimated tokens in the request's messages"""
+        return sum(estimate_tokens(msg["content"]) for msg in request_data["messages"])
+    
+    def _estimate_request_tokens(self, request_data: Dict[str, Any]) -> int:
+        """Prompt tokens plus the completion budget, reserved until usage is known"""
+        prompt_tokens = self._estimate_prompt_tokens(request_data)
+        return prompt_tokens + min(request_data.get("max_tokens", 0), EXPECTED_COMPLETION_TOKENS)
     
     async def shutdown(self):
         """Cleanup and close connections"""
-        await self.client.aclose()
-        logger.info("OpenRouter service shut down")
\ No newline at end of file
+        # The pool is shared with other clients; it is closed on application shutdown
+        logger.info("OpenRouter service shut down")
+
+
+# Shared instance so agents and services reuse one set of usage stats and rate limits
+openrouter_service = OpenRouterService()
\ No newline at end of file
@@ -6,17 +6,73 @@ Provides natural language understanding and contextual responses in Arabic and E
 import asyncio
 import json
 import logging
-from typing import Dict, List, Any, Optional, Tuple
+import re
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from enum import Enum
 
-from .openrouter_service import OpenRouterService, ModelType
+from .openrouter_service import OpenRouterService, ModelType, openrouter_service
+from .conversation_memory import ConversationMemory
+from .intent_matcher import IntentMatcher, MatchResult
 from ..core.config import settings
 from ..core.logging import get_logger
 
 logger = get_logger(__name__)
 
 
+# Intent keywords (enhanced for Arabic), in priority order for the primary intent
+INTENT_PATTERNS = {
+    "menu_inquiry": [
+        # Arabic patterns
+        "قائمة", "منيو", "أكل", "طعام", "وجبة", "أطباق", "الأكثر مبيعا", "الأشهر", 
+        "أحسن طبق", "أفضل طبق", "تنصحني", "أيش عندكم", "إيش عندكم", "اقترح لي",
+        "كبسة", "مندي", "برياني", "مضغوط", "حمص", "فتوش", "كنافة", "بقلاوة",
+        # English patterns
+        "menu", "food", "dish", "meal", "recommend", "best", "popular", "kabsa", "mandi"
+    ],
+    "price_inquiry": [
+        "كم", "سعر", "ثمن", "تكلفة", "أسعار", "price", "cost", "how much", "كام", "بكام"
+    ],
+    "ordering": [
+        "أريد", "أبغي", "عايز", "طلب", "أطلب", "order", "want", "would like", "احجز", "أحجز"
+    ],
+    "location_hours": [
+        "فين", "وين", "موقع", "عنوان", "ساعات", "أوقات", "مفتوح", "مسكر", 
+        "location", "address", "hours", "open", "closed", "where"
+    ],
+    "feedback_positive": [
+        "شكرا", "ممتاز", "رائع", "جميل", "حلو", "لذيذ", "طيب", "أعجبني", 
+        "thank", "excellent", "great", "good", "delicious", "amazing", "wonderful"
+    ],
+    "feedback_negative": [
+        "سيء", "مش حلو", "ما عجبني", "تعبان", "مشكلة", "شكوى", 
+        "bad", "terrible", "not good", "problem", "complaint", "issue"
+    ],
+    "google_review": [
+        "تقييم", "مراجعة", "جوجل", "نجوم", "review", "rating", "google", "stars"
+    ],
+    "greeting": [
+        "مرحبا", "أهلا", "السلام عليكم", "صباح الخير", "مساء الخير",
+        "hello", "hi", "good morning", "good evening", "hey"
+    ],
+    "goodbye": [
+        "باي", "مع السلامة", "شكرا وبس", "خلاص", "تسلم", 
+        "bye", "goodbye", "thank you", "that's all"
+    ]
+}
+
+# Menu items detected as entities
+MENU_ITEMS = [
+    "كبسة", "مندي", "برياني", "مضغوط", "فتوش", "تبولة", "حمص", "متبل",
+    "كنافة", "بقلاوة", "شاي", "قهوة", "kabsa", "mandi", "biryani"
+]
+
+# Compiled once; matches every intent and menu item in one pass over a message
+INTENT_MATCHER = IntentMatcher(INTENT_PATTERNS, {"menu_items": MENU_ITEMS})
+
+NUMBER_PATTERN = re.compile(r'\d+')
+
+
 class ConversationState(Enum):
     """States in the conversation flow"""
     GREETING = "greeting"
@@ -28,16 +84,38 @@ class ConversationState(Enum):
     CLOSING = "closing"
 
 
+class StreamedReply:
+    """
+    Text deltas of a reply being generated.
+
+    Iterate it for the deltas as they arrive. Once the stream has finished,
+    ``content`` holds the post-processed reply, which is what should be
+    stored or shown as the final message; it stays None if the stream was
+    cancelled or failed part-way.
+    """
+
+    def __init__(self):
+        self.content: Optional[str] = None
+        self.deltas: Optional[AsyncIterator[str]] = None
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.deltas
+
+    async def aclose(self):
+        """Stop generating; works with contextlib.aclosing."""
+        await self.deltas.aclose()
+
+
 class RestaurantAIAgent:
     """
     Intelligent AI agent for restaurant customer service.
     Handles natural language conversations, menu inquiries, and feedback collection.
     """
     
-    def __init__(self):
-        self.openrouter = OpenRouterService()
+    def __init__(self, openrouter: Optional[OpenRouterService] = None):
+        self.openrouter = openrouter or openrouter_service
         self.restaurant_context = self._load_restaurant_context()
-        self.conversation_memory = {}  # Store conversation history per customer
+        self.conversation_memory = ConversationMemory()  # Bounded conversation history per customer
         
     def _load_restaurant_context(self) -> str:
         """Load comprehensive restaurant information and context"""
@@ -122,23 +200,8 @@ class RestaurantAIAgent:
             Intelligent response text
         """
         try:
-            # Update conversation memory
-            if customer_id and conversation_history:
-                self.conversation_memory[customer_id] = conversation_history[-10:]  # Keep last 10 messages
-            
-            # Analyze message intent and extract context
-            intent_analysis = await self._analyze_message_intent(message, language)
-            conversation_state = await self._determine_conversation_state(
-                message, conversation_history, intent_analysis
-            )
-            
-            # Build comprehensive prompt
-            prompt = await self._build_intelligent_prompt(
-                message=message,
-                conversation_history=conversation_history or [],
-                intent_analysis=intent_analysis,
-                conversation_state=conversation_state,
-                language=language
+            prompt, intent_analysis, conversation_state = await self._prepare_reply(
+                message, conversation_history, customer_id, language
             )
             
             # Generate response using AI
@@ -173,65 +236,125 @@ class RestaurantAIAgent:
             logger.error(f"Error generating intelligent response: {str(e)}")
             return await self._generate_fallback_response(message, language)
     
-    async def _analyze_message_intent(self, message: str, language: str) -> Dict[str, Any]:
-        """Analyze the customer message to understand intent and extract entities"""
+    def stream_intelligent_response(
+        self,
+        message: str,
+        conversation_history: List[Dict[str, str]] = None,
+        customer_id: str = None,
+        language: str = "ar",
+        max_output_tokens: int = 250
+    ) -> StreamedReply:
+        """
+        Stream an intelligent response as it is generated.
         
-        # Define intent patterns (enhanced for Arabic)
-        intent_patterns = {
-            "menu_inquiry": [
-                # Arabic patterns
-                "قائمة", "منيو", "أكل", "طعام", "وجبة", "أطباق", "الأكثر مبيعا", "الأشهر", 
-                "أحسن طبق", "أفضل طبق", "تنصحني", "أيش عندكم", "إيش عندكم", "اقترح لي",
-                "كبسة", "مندي", "برياني", "مضغوط", "حمص", "فتوش", "كنافة", "بقلاوة",
-                # English patterns
-                "menu", "food", "dish", "meal", "recommend", "best", "popular", "kabsa", "mandi"
-            ],
-            "price_inquiry": [
-                "كم", "سعر", "ثمن", "تكلفة", "أسعار", "price", "cost", "how much", "كام", "بكام"
-            ],
-            "ordering": [
-                "أريد", "أبغي", "عايز", "طلب", "أطلب", "order", "want", "would like", "احجز", "أحجز"
-            ],
-            "location_hours": [
-                "فين", "وين", "موقع", "عنوان", "ساعات", "أوقات", "مفتوح", "مسكر", 
-                "location", "address", "hours", "open", "closed", "where"
-            ],
-            "feedback_positive": [
-                "شكرا", "ممتاز", "رائع", "جميل", "حلو", "لذيذ", "طيب", "أعجبني", 
-                "thank", "excellent", "great", "good", "delicious", "amazing", "wonderful"
-            ],
-            "feedback_negative": [
-                "سيء", "مش حلو", "ما عجبني", "تعبان", "مشكلة", "شكوى", 
-                "bad", "terrible", "not good", "problem", "complaint", "issue"
-            ],
-            "google_review": [
-                "تقييم", "مراجعة", "جوجل", "نجوم", "review", "rating", "google", "stars"
-            ],
-            "greeting": [
-                "مرحبا", "أهلا", "السلام عليكم", "صباح الخير", "مساء الخير",
-                "hello", "hi", "good morning", "good evening", "hey"
-            ],
-            "goodbye": [
-                "باي", "مع السلامة", "شكرا وبس", "خلاص", "تسلم", 
-                "bye", "goodbye", "thank you", "that's all"
-            ]
-        }
+        The default token limit keeps replies within the ~1000 characters
+        that post-processing allows for WhatsApp. If the model fails before
+        producing any text, a fallback response is yielded instead. The
+        deltas are the raw model output; when the stream ends the reply's
+        ``content`` is set to the text post-processed as in
+        generate_intelligent_response.
         
-        message_lower = message.lower()
-        detected_intents = []
+        Args:
+            message: Current customer message
+            conversation_history: Previous conversation messages
+            customer_id: Unique customer identifier
+            language: Preferred language ('ar' or 'en')
+            max_output_tokens: Stop generating after roughly this many tokens
+            
+        Returns:
+            StreamedReply yielding response text deltas
+        """
+        reply = StreamedReply()
+        reply.deltas = self._stream_reply_deltas(
+            reply, message, conversation_history, customer_id, language, max_output_tokens
+        )
+        return reply
+    
+    async def _stream_reply_deltas(
+        self,
+        reply: StreamedReply,
+        message: str,
+        conversation_history: Optional[List[Dict[str, str]]],
+        customer_id: Optional[str],
+        language: str,
+        max_output_tokens: int
+    ) -> AsyncIterator[str]:
+        """Yield the model's deltas, then set the post-processed reply on ``reply``"""
+        chunks = []
+        try:
+            prompt, intent_analysis, conversation_state = await self._prepare_reply(
+                message, conversation_history, customer_id, language
+            )
+            
+            async for delta in self.openrouter.stream_response(
+                prompt=prompt,
+                model_type=ModelType.CLAUDE_3_5_HAIKU,
+                language=language,
+                context={
+                    "task": "restaurant_conversation",
+                    "intent": intent_analysis.get("primary_intent"),
+                    "state": conversation_state.value,
+                    "customer_id": customer_id
+                },
+                max_output_tokens=max_output_tokens
+            ):
+                chunks.append(delta)
+                yield delta
+                
+        except Exception as e:
+            if chunks:
+                raise
+            logger.error(f"Error streaming intelligent response: {str(e)}")
+            fallback = await self._generate_fallback_response(message, language)
+            reply.content = fallback
+            yield fallback
+            return
+        
+        reply.content = await self._post_process_response(
+            "".join(chunks), intent_analysis, conversation_state, language
+        )
+    
+    async def _prepare_reply(
+        self,
+        message: str,
+        conversation_history: Optional[List[Dict[str, str]]],
+        customer_id: Optional[str],
+        language: str
+    ) -> Tuple[str, Dict[str, Any], ConversationState]:
+        """Recall memory, analyze the message and build the prompt for a reply"""
+        # Update conversation memory, or recall it when no history was passed
+        if customer_id and conversation_history:
+            await self.conversation_memory.set(customer_id, conversation_history)
+        elif customer_id:
+            conversation_history = await self.conversation_memory.get(customer_id)
+        
+        # Analyze message intent and extract context
+        intent_analysis = await self._analyze_message_intent(message, language)
+        conversation_state = await self._determine_conversation_state(
+            message, conversation_history, intent_analysis
+        )
+        
+        # Build comprehensive prompt
+        prompt = await self._build_intelligent_prompt(
+            message=message,
+            conversation_history=conversation_history or [],
+            intent_analysis=intent_analysis,
+            conversation_state=conversation_state,
+            language=language
+        )
+        return prompt, intent_analysis, conversation_state
+    
+    async def _analyze_message_intent(self, message: str, language: str) -> Dict[str, Any]:
+        """Analyze the customer message to understand intent and extract entities"""
         
-        # Check for intent patterns
-        for intent, patterns in intent_patterns.items():
-            for pattern in patterns:
-                if pattern in message_lower:
-                    detected_intents.append(intent)
-                    break
+        matches = INTENT_MATCHER.match(message)
+        detected_intents = matches.intents
         
         # Determine primary intent
         primary_intent = detected_intents[0] if detected_intents else "general_inquiry"
         
-        # Extract entities (menu items, prices, etc.)
-        entities = await self._extract_entities(message, language)
+        # Extract entities (menu items, prices, etc.) from the same pass
+        entities = await self._extract_entities(message, language, matches)
         
         return {
             "primary_intent": primary_intent,
@@ -241,33 +364,22 @@ class RestaurantAIAgent:
             "message_language": self._detect_language(message)
         }
     
-    async def _extract_entities(self, message: str, language: str) -> Dict[str, List[str]]:
+    async def _extract_entities(
+        self,
+        message: str,
+        language: str,
+        matches: Optional[MatchResult] = None
+    ) -> Dict[str, List[str]]:
         """Extract entities like menu items, numbers, etc. from the message"""
         
-        entities = {
-            "menu_items": [],
-            "numbers": [],
+        matches = matches or INTENT_MATCHER.match(message)
+        
+        return {
+            "menu_items": matches.entities["menu_items"],
+            "numbers": NUMBER_PATTERN.findall(message),  # quantities, prices, etc.
             "locations": [],
             "times": []
         }
-        
-        # Menu items detection
-        menu_items = [
-            "كبسة", "مندي", "برياني", "مضغوط", "فتوش", "تبولة", "حمص", "متبل",
-            "كنافة", "بقلاوة", "شاي", "قهوة", "kabsa", "mandi", "biryani"
-        ]
-        
-        message_lower = message.lower()
-        for item in menu_items:
-            if item in message_lower:
-                entities["menu_items"].append(item)
-        
-        # Extract numbers (for quantities, prices, etc.)
-        import re
-        numbers = re.findall(r'\d+', message)
-        entities["numbers"] = numbers
-        
-        return entities
     
     def _detect_language(self, message: str) -> str:
         """Simple language detection based on Arabic characters"""
@@ -0,0 +1,314 @@
+"""
+Batched ingestion of WhatsApp delivery receipts.
+Buffers status callbacks for a few milliseconds and applies each batch as one bulk update.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import bindparam, select, update
+
+from ..models.base import MessageStatusChoice
+from ..models.campaign import Campaign
+from ..models.whatsapp import WhatsAppMessage
+from ..core.metrics import StageLatencyTracker
+
+logger = logging.getLogger(__name__)
+
+# Twilio reports "undelivered" when the carrier gave up on a message
+STATUS_ALIASES = {"undelivered": MessageStatusChoice.FAILED}
+
+# A receipt only moves a message forward. Failed is final unless the message is
+# later read, which proves it was delivered after all
+STATUS_RANK = {
+    MessageStatusChoice.QUEUED: 0,
+    MessageStatusChoice.SENT: 1,
+    MessageStatusChoice.DELIVERED: 2,
+    MessageStatusChoice.FAILED: 2,
+    MessageStatusChoice.READ: 3,
+}
+
+DELIVERED_STATUSES = (MessageStatusChoice.DELIVERED, MessageStatusChoice.READ)
+
+
+def advances(current: Optional[str], new: str) -> bool:
+    """True if a receipt with status ``new`` moves a message on from ``current``."""
+    return STATUS_RANK.get(new, -1) > STATUS_RANK.get(current, -1)
+
+
+@dataclass
+class StatusEvent:
+    """Delivery receipt for one outbound message."""
+    message_sid: str
+    status: str
+    received_at: datetime = field(default_factory=datetime.utcnow)
+    error_code: Optional[str] = None
+    error_message: Optional[str] = None
+    attempts: int = 0  # failed flushes this receipt was part of
+
+
+class StatusIngestion:
+    """
+    Micro-batching stage for status callbacks.
+
+    Receipts arrive in bursts, often several per message. They are held for
+    ``flush_interval`` seconds (or until ``max_batch_size`` messages are
+    pending), keeping only the furthest status per message. A flush reads the
+    affected messages in one query, drops receipts that would move a message
+    backwards (read -> delivered), writes the rest as one bulk UPDATE and adds
+    the new deliveries, reads and failures to their campaigns in the same
+    transaction.
+
+    Twilio has already been answered when a receipt is buffered, so a batch
+    that fails is merged back into ``pending`` and retried with exponential
+    backoff. Receipts still failing after ``max_retries`` batch attempts are
+    applied one at a time, so a single bad receipt cannot sink the others.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 0.05,
+        max_batch_size: int = 500,
+        max_retries: int = 8,
+        max_retry_delay: float = 30.0
+    ):
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.max_retry_delay = max_retry_delay
+        self.pending: Dict[str, StatusEvent] = {}
+        self.metrics = StageLatencyTracker()
+        self.stats = {
+            "received": 0, "coalesced": 0, "ignored": 0, "batches": 0,
+            "applied": 0, "regressions": 0, "unknown_messages": 0, "retried": 0, "failed": 0
+        }
+
+        self._consecutive_failures = 0
+        self._backoff_until = 0.0
+        self._timer: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+        self._flush_lock = asyncio.Lock()
+
+    async def submit(self, event: StatusEvent):
+        """Buffer a receipt; it is written with the next batch."""
+        event.status = STATUS_ALIASES.get(event.status, event.status)
+        if event.status not in STATUS_RANK:
+            self.stats["ignored"] += 1
+            return
+        self.stats["received"] += 1
+
+        queued = self.pending.get(event.message_sid)
+        if queued is not None:
+            self.stats["coalesced"] += 1
+            if not advances(queued.status, event.status):
+                return
+        self.pending[event.message_sid] = event
+
+        # While backing off after a failed batch the retry timer is already set
+        if len(self.pending) >= self.max_batch_size and time.monotonic() >= self._backoff_until:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self, session=None) -> int:
+        """Write everything pending; returns how many messages changed status."""
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return 0
+
+        # Batches are applied in the order they were cut
+        async with self._flush_lock:
+            try:
+                async with self.metrics.time("flush"):
+                    applied = await self._apply(list(batch.values()), session)
+            except Exception as e:
+                logger.error(f"Failed to apply {len(batch)} status updates: {str(e)}")
+                return await self._retry_later(batch, session)
+
+        self._consecutive_failures = 0
+        self._backoff_until = 0.0
+        self.stats["batches"] += 1
+        self.stats["applied"] += applied
+        self.metrics.record("batch_size", len(batch))
+        return applied
+
+    async def close(self):
+        """Flush what is pending and wait for in-flight batches."""
+        if self._timer:
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+        async with self._flush_lock:
+            pass  # a timer flush that was already running has finished
+
+        # A failed final flush schedules a retry that will never run
+        if self._timer:
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+        if self.pending:
+            self.stats["failed"] += len(self.pending)
+            logger.error(f"Dropped {len(self.pending)} status updates on shutdown")
+            self.pending = {}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters, pending receipts and flush latency."""
+        return {
+            **self.stats,
+            "pending": len(self.pending),
+            "flush": self.metrics.snapshot().get("flush", {}),
+        }
+
+    async def _flush_later(self, delay: Optional[float] = None):
+        await asyncio.sleep(self.flush_interval if delay is None else delay)
+        self._timer = None
+        await self.flush()
+
+    async def _retry_later(self, batch: Dict[str, StatusEvent], session=None) -> int:
+        """
+        Merge a failed batch back into ``pending`` and schedule a retry.
+
+        A receipt that arrived meanwhile wins if it is further along.
+        Receipts out of retries are applied one at a time instead; returns
+        how many of those changed status.
+        """
+        exhausted = []
+        for sid, event in batch.items():
+            event.attempts += 1
+            if event.attempts > self.max_retries:
+                exhausted.append(event)
+                continue
+            queued = self.pending.get(sid)
+            if queued is None or advances(queued.status, event.status):
+                self.pending[sid] = event
+            self.stats["retried"] += 1
+
+        self._consecutive_failures += 1
+        delay = min(self.max_retry_delay, self.flush_interval * 2 ** self._consecutive_failures)
+        self._backoff_until = time.monotonic() + delay
+        if self.pending:
+            if self._timer:
+                self._timer.cancel()
+            self._timer = asyncio.create_task(self._flush_later(delay))
+
+        applied = 0
+        for event in exhausted:
+            try:
+                applied += await self._apply([event], session)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Dropped status update {event.status} for {event.message_sid}: {str(e)}")
+        self.stats["applied"] += applied
+        return applied
+
+    def _flush_now(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _apply(self, events: List[StatusEvent], session=None) -> int:
+        if session is not None:
+            try:
+                return await self._apply_batch(session, events)
+            except Exception:
+                await session.rollback()
+                raise
+
+        from ..database import db_manager
+        async with db_manager.get_session() as session:
+            return await self._apply_batch(session, events)
+
+    async def _apply_batch(self, session, events: List[StatusEvent]) -> int:
+        by_sid = {event.message_sid: event for event in events}
+        rows = (await session.execute(
+            select(
+                WhatsAppMessage.id,
+                WhatsAppMessage.whatsapp_message_id,
+                WhatsAppMessage.status,
+                WhatsAppMessage.campaign_id,
+                WhatsAppMessage.delivered_at,
+                WhatsAppMessage.read_at,
+                WhatsAppMessage.failed_at,
+                WhatsAppMessage.error_code,
+                WhatsAppMessage.error_message
+            )
+            .where(WhatsAppMessage.whatsapp_message_id.in_(list(by_sid)))
+            # Lock rows in one order so overlapping batches cannot deadlock
+            .order_by(WhatsAppMessage.id)
+            .with_for_update()
+        )).all()
+        self.stats["unknown_messages"] += len(by_sid) - len(rows)
+
+        updates = []
+        campaign_counts: Dict[Any, Counter] = {}
+        for row in rows:
+            event = by_sid[row.whatsapp_message_id]
+            if not advances(row.status, event.status):
+                self.stats["regressions"] += 1
+                continue
+
+            failed = event.status == MessageStatusChoice.FAILED
+            updates.append({
+                "id": row.id,
+                "status": event.status,
+                "delivered_at": row.delivered_at or (
+                    event.received_at if event.status in DELIVERED_STATUSES else None
+                ),
+                "read_at": event.received_at if event.status == MessageStatusChoice.READ else row.read_at,
+                "failed_at": event.received_at if failed else row.failed_at,
+                "error_code": event.error_code if failed else row.error_code,
+                "error_message": event.error_message if failed else row.error_message,
+            })
+
+            if row.campaign_id is None:
+                continue
+            counts = campaign_counts.setdefault(row.campaign_id, Counter())
+            if event.status in DELIVERED_STATUSES and row.status not in DELIVERED_STATUSES:
+                counts["delivered"] += 1
+                # A read after a failure: the failure was premature, count it as delivered instead
+                if row.status == MessageStatusChoice.FAILED:
+                    counts["failed"] -= 1
+            if event.status == MessageStatusChoice.READ:
+                counts["read"] += 1
+            if failed:
+                counts["failed"] += 1
+
+        if updates:
+            # ORM bulk UPDATE by primary key: one executemany for the whole batch
+            await session.execute(update(WhatsAppMessage), updates)
+
+        if campaign_counts:
+            campaigns = Campaign.__table__
+            await session.execute(
+                update(campaigns)
+                .where(campaigns.c.id == bindparam("campaign"))
+                .values(
+                    messages_delivered=campaigns.c.messages_delivered + bindparam("delivered"),
+                    messages_read=campaigns.c.messages_read + bindparam("read"),
+                    messages_failed=campaigns.c.messages_failed + bindparam("failed")
+                ),
+                [
+                    {
+                        "campaign": campaign_id,
+                        "delivered": counts["delivered"],
+                        "read": counts["read"],
+                        "failed": counts["failed"]
+                    }
+                    for campaign_id, counts in campaign_counts.items()
+                ]
+            )
+
+        await session.commit()
+        return len(updates)
+
+
+status_ingestion = StatusIngestion()
@@ -6,9 +6,10 @@ Interactive testing environment for agent conversations with real-time analysis.
 Supports WebSocket connections for live testing feedback.
 """
 
-import asyncio
 import json
+import time
 import uuid
+from contextlib import aclosing
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, BackgroundTasks
@@ -223,22 +224,41 @@ class ConversationPlaygroundAPI:
         customer_message: TestMessage,
         conversation_state: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """Generate agent response using AI"""
-        
-        # This would integrate with your CrewAI agents
-        # For now, returning mock response
-        
-        start_time = datetime.utcnow()
-        
-        # Mock agent response generation
-        await asyncio.sleep(1)  # Simulate processing time
-        
-        response_time = (datetime.utcnow() - start_time).total_seconds()
+        """Generate agent response using AI, streaming tokens to the session as they arrive"""
+        
+        from ..services.restaurant_ai_agent import restaurant_ai_agent
+        
+        start_time = time.perf_counter()
+        first_token_time = None
+        reply_id = str(uuid.uuid4())
+        chunks = []
+        
+        reply = restaurant_ai_agent.stream_intelligent_response(
+            message=customer_message.content,
+            conversation_history=[
+                {"from": "customer" if msg.get("sender") == "customer" else "restaurant", "body": msg.get("content", "")}
+                for msg in conversation_state["messages"][-10:-1]
+            ],
+            language="en" if customer_message.language in ("english", "en") else "ar",
+            max_output_tokens=conversation_state.get("max_reply_tokens", 250)
+        )
+        async with aclosing(reply):
+            async for delta in reply:
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start_time
+                chunks.append(delta)
+                await manager.send_to_session(session_id, {
+                    "type": "agent_response_chunk",
+                    "data": {"reply_id": reply_id, "index": len(chunks) - 1, "delta": delta}
+                })
+        
+        response_time = time.perf_counter() - start_time
         
         agent_response = {
-            "content": f"شكراً لك على رسالتك. كيف يمكنني مساعدتك اليوم؟",
-            "language": "arabic",
+            "content": reply.content if reply.content is not None else "".join(chunks),
+            "language": customer_message.language or "arabic",
             "response_time_seconds": response_time,
+            "time_to_first_token_seconds": first_token_time,
             "confidence_score": 0.95,
             "persona_consistency": 0.92,
             "cultural_sensitivity": 0.98
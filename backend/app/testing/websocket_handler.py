@@ -6,8 +6,9 @@ Manages WebSocket connections for real-time testing feedback, progress updates,
 and live performance monitoring during agent testing sessions.
 """
 
-import json
 import asyncio
+import time
+from contextlib import aclosing
 from datetime import datetime
 from typing import Dict, List, Set, Optional, Any
 from fastapi import WebSocket, WebSocketDisconnect
@@ -27,6 +28,8 @@ class MessageType(str, Enum):
     UNSUBSCRIBE_TEST = "unsubscribe_test" 
     GET_STATUS = "get_status"
     START_TEST = "start_test"
+    STREAM_REPLY = "stream_reply"
+    CANCEL_REPLY = "cancel_reply"
     
     # Server -> Client messages
     PONG = "pong"
@@ -37,6 +40,8 @@ class MessageType(str, Enum):
     ERROR = "error"
     TEST_COMPLETED = "test_completed"
     CONNECTION_CONFIRMED = "connection_confirmed"
+    REPLY_CHUNK = "reply_chunk"
+    REPLY_COMPLETED = "reply_completed"
 
 @dataclass
 class Connection:
@@ -64,6 +69,7 @@ class WebSocketManager:
         self.connections: Dict[str, Connection] = {}  # connection_id -> Connection
         self.user_connections: Dict[str, List[str]] = {}  # user_id -> [connection_ids]
         self.test_subscribers: Dict[str, Set[str]] = {}  # test_session_id -> {connection_ids}
+        self.reply_streams: Dict[str, asyncio.Task] = {}  # connection_id -> streaming agent reply
         self.connection_stats: Dict[str, Any] = {
             "total_connections": 0,
             "active_connections": 0,
@@ -131,6 +137,11 @@ class WebSocketManager:
             connection = self.connections[connection_id]
             user_id = connection.user_id
             
+            # Stop any reply still streaming to this connection
+            reply_stream = self.reply_streams.pop(connection_id, None)
+            if reply_stream:
+                reply_stream.cancel()
+            
             # Remove from user connections
             if user_id in self.user_connections:
                 if connection_id in self.user_connections[user_id]:
@@ -191,6 +202,17 @@ class WebSocketManager:
             elif message_type == MessageType.GET_STATUS:
                 await self._handle_get_status(connection_id)
             
+            elif message_type == MessageType.STREAM_REPLY:
+                if data.get("message"):
+                    self._start_reply_stream(connection_id, data)
+                else:
+                    await self._send_error(connection_id, "stream_reply requires a message")
+            
+            elif message_type == MessageType.CANCEL_REPLY:
+                reply_stream = self.reply_streams.get(connection_id)
+                if reply_stream:
+                    reply_stream.cancel()
+            
             else:
                 await self._send_error(connection_id, f"Unknown message type: {message_type}")
                 
@@ -308,6 +330,77 @@ class WebSocketManager:
         except Exception as e:
             logger.error(f"Error sending status to connection {connection_id}: {str(e)}")
     
+    def _start_reply_stream(self, connection_id: str, data: Dict[str, Any]):
+        """Stream an agent reply in the background so cancel_reply can still be received"""
+        
+        previous = self.reply_streams.pop(connection_id, None)
+        if previous:
+            previous.cancel()
+        
+        task = asyncio.create_task(self._stream_reply(connection_id, data))
+        self.reply_streams[connection_id] = task
+        task.add_done_callback(
+            lambda done: self.reply_streams.pop(connection_id, None) if self.reply_streams.get(connection_id) is done else None
+        )
+    
+    async def _stream_reply(self, connection_id: str, data: Dict[str, Any]):
+        """Send agent reply tokens to the connection as they are generated"""
+        
+        from ..services.restaurant_ai_agent import restaurant_ai_agent
+        
+        reply_id = data.get("reply_id") or str(uuid.uuid4())
+        started = time.perf_counter()
+        first_token_ms = None
+        chunks = []
+        
+        reply = restaurant_ai_agent.stream_intelligent_response(
+            message=data["message"],
+            conversation_history=data.get("conversation_history"),
+            customer_id=data.get("customer_id"),
+            language=data.get("language", "ar"),
+            max_output_tokens=data.get("max_tokens", 250)
+        )
+        
+        def completed(cancelled: bool) -> WebSocketMessage:
+            # A finished reply carries the post-processed text that replaces the streamed deltas
+            content = reply.content if not cancelled and reply.content is not None else "".join(chunks)
+            return WebSocketMessage(
+                type=MessageType.REPLY_COMPLETED,
+                data={
+                    "reply_id": reply_id,
+                    "content": content,
+                    "chunks": len(chunks),
+                    "cancelled": cancelled,
+                    "time_to_first_token_ms": first_token_ms,
+                    "total_time_ms": round((time.perf_counter() - started) * 1000, 2)
+                }
+            )
+        
+        try:
+            # aclosing stops generation (and records usage) as soon as the reply is cancelled
+            async with aclosing(reply):
+                async for delta in reply:
+                    if first_token_ms is None:
+                        first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+                    chunks.append(delta)
+                    await self._send_to_connection(
+                        connection_id,
+                        WebSocketMessage(
+                            type=MessageType.REPLY_CHUNK,
+                            data={"reply_id": reply_id, "index": len(chunks) - 1, "delta": delta}
+                        )
+                    )
+        except asyncio.CancelledError:
+            # Tell the client what it got, then let the cancellation finish the task
+            await self._send_to_connection(connection_id, completed(cancelled=True))
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming reply to connection {connection_id}: {str(e)}")
+            await self._send_error(connection_id, f"Reply streaming error: {str(e)}")
+            return
+        
+        await self._send_to_connection(connection_id, completed(cancelled=False))
+    
     async def broadcast_test_progress(
         self, 
         test_session_id: str, 
@@ -455,7 +548,7 @@ class WebSocketManager:
                 return
             
             connection = self.connections[connection_id]
-            message_json = json.dumps(asdict(message))
+            message_json = message.json()
             
             await connection.websocket.send_text(message_json)
             
@@ -513,6 +606,7 @@ class WebSocketManager:
             "active_users": len(self.user_connections),
             "active_test_subscriptions": len(self.test_subscribers),
             "total_subscriptions": sum(len(subs) for subs in self.test_subscribers.values()),
+            "streaming_replies": len(self.reply_streams),
             "timestamp": datetime.utcnow().isoformat()
         })
         
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark the OpenRouter response cache codec against the legacy JSON path.
+Compares payload size, encode time and decode/rehydrate time per cache hit.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Any
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services.openrouter.codec import CacheCodec
+from app.services.openrouter.types import (
+    OpenRouterResponse, ConversationContext, ModelChoice, ChatMessage, Usage, Language
+)
+
+
+ARABIC_REPLY = (
+    "أهلاً وسهلاً بك في مطعمنا! نفتح يومياً من الساعة الثانية عشرة ظهراً حتى منتصف الليل، "
+    "ويسعدنا استقبالك في أي وقت. هل تود حجز طاولة لعائلتك؟ "
+)
+
+
+def build_sample(reply_repeats: int, history: int):
+    """Build a realistic Arabic response and conversation context."""
+    response = OpenRouterResponse(
+        id="gen-benchmark",
+        created=int(time.time()),
+        model="anthropic/claude-3.5-haiku",
+        choices=[ModelChoice(
+            index=0,
+            message=ChatMessage(role="assistant", content=ARABIC_REPLY * reply_repeats),
+            finish_reason="stop"
+        )],
+        usage=Usage(prompt_tokens=420, completion_tokens=180, total_tokens=600)
+    )
+    context = ConversationContext(
+        user_id="+966500000000",
+        session_id="session-benchmark",
+        language=Language.ARABIC,
+        cultural_context={"dialect": "gulf", "formality": "formal"},
+        message_history=[
+            ChatMessage(role="user" if i % 2 == 0 else "assistant", content=ARABIC_REPLY)
+            for i in range(history)
+        ]
+    )
+    return response, context
+
+
+def legacy_serialize(response, context) -> str:
+    """Serializer used by ResponseCache before the binary codec."""
+    now = datetime.utcnow()
+    return json.dumps({
+        "key": "benchmark",
+        "response": response.dict(),
+        "context": context.dict(),
+        "created_at": now.isoformat(),
+        "accessed_at": now.isoformat(),
+        "access_count": 1,
+        "ttl_seconds": 3600,
+        "tags": []
+    }, ensure_ascii=False)
+
+
+def legacy_deserialize(data: str):
+    """Deserializer used by ResponseCache before the binary codec."""
+    parsed = json.loads(data)
+    return (
+        OpenRouterResponse(**parsed["response"]),
+        ConversationContext(**parsed["context"]),
+        datetime.fromisoformat(parsed["created_at"])
+    )
+
+
+def time_per_call(func: Callable[[], Any], iterations: int) -> float:
+    """Average microseconds per call."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def run_benchmark(iterations: int, reply_repeats: int, history: int) -> Dict[str, Dict[str, float]]:
+    response, context = build_sample(reply_repeats, history)
+    codec = CacheCodec()
+    now = time.time()
+
+    legacy_data = legacy_serialize(response, context)
+    frame = codec.encode(response, context, now, 3600)
+
+    def legacy_hit():
+        # _get_exact deserialized, then _update_entry re-serialized for the SET
+        legacy_deserialize(legacy_data)
+        return legacy_serialize(response, context)
+
+    def codec_hit():
+        payload = codec.decode(frame)
+        return payload.response, payload.context
+
+    return {
+        "legacy_json": {
+            "size_bytes": len(legacy_data.encode("utf-8")),
+            "encode_us": time_per_call(lambda: legacy_serialize(response, context), iterations),
+            "hit_us": time_per_call(legacy_hit, iterations),
+            # GET plus a full re-serialize and SET(keepttl) on every hit
+            "redis_round_trips_per_hit": 2,
+        },
+        "binary_codec": {
+            "size_bytes": len(frame),
+            "encode_us": time_per_call(lambda: codec.encode(response, context, now, 3600), iterations),
+            "hit_us": time_per_call(codec_hit, iterations),
+            "decode_only_us": time_per_call(lambda: codec.decode(frame), iterations),
+            # Memory (L1) hits skip Redis; Redis (L2) hits are a single GET
+            "redis_round_trips_per_hit": 1,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the response cache codec")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--reply-repeats", type=int, default=4, help="Size of the cached reply")
+    parser.add_argument("--history", type=int, default=6, help="Messages in the cached context")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.iterations, args.reply_repeats, args.history)
+
+    print(f"{'metric':<28}{'legacy_json':>16}{'binary_codec':>16}")
+    for metric in ("size_bytes", "encode_us", "hit_us", "redis_round_trips_per_hit"):
+        legacy = results["legacy_json"][metric]
+        binary = results["binary_codec"][metric]
+        print(f"{metric:<28}{legacy:>16.1f}{binary:>16.1f}")
+    print(f"{'decode_only_us (lazy)':<28}{'-':>16}{results['binary_codec']['decode_only_us']:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
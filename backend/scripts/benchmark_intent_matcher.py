@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark the compiled intent matcher against the legacy substring loops.
+Runs intent and menu-item detection over generated Arabic/English customer messages.
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.services import intent_matcher as intent_matcher_module
+from app.services.intent_matcher import IntentMatcher
+from app.services.restaurant_ai_agent import INTENT_PATTERNS, MENU_ITEMS
+
+
+OPENERS = ["السلام عليكم", "مرحبا", "اهلاً", "هلا والله", "Hi", "Hello", "صباح الخير", ""]
+BODIES = [
+    "كم سعر الكبسة اليوم؟",
+    "ابغى اطلب مندي دجاج وشاي",
+    "وين موقعكم بالضبط وهل انتم مفتوحين الحين؟",
+    "الأكل كان لذيذ جداً والخدمة ممتازة 👌",
+    "للأسف الطلب وصل بارد وفيه مشكلة في الحساب",
+    "ايش تنصحني من الحلويات؟ الكنافة ولا البقلاوة",
+    "أبي احجز طاولة لـ 6 أشخاص الساعة 9",
+    "What are your opening hours on Friday?",
+    "Can I order 2 kabsa and 1 mandi for delivery?",
+    "The food was amazing, thank you!",
+    "I have a complaint about my last order",
+    "عندكم عرض الغداء؟ وكم الوجبة العائلية",
+    "تم التقييم على جوجل خمس نجوم",
+    "وجبةٌ رائعةٌ، شكراً لكم",
+]
+CLOSERS = ["", "شكرا", "مع السلامة", "thanks", "🙏", "يعطيكم العافية"]
+
+
+def build_messages(count: int, seed: int) -> List[str]:
+    """Build customer-like messages from common openers, requests and sign-offs."""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        parts = [rng.choice(OPENERS), rng.choice(BODIES)]
+        if rng.random() < 0.3:
+            parts.append(rng.choice(BODIES))
+        parts.append(rng.choice(CLOSERS))
+        messages.append(" ".join(part for part in parts if part))
+    return messages
+
+
+def legacy_analyze(message: str) -> Tuple[List[str], Dict[str, List[str]]]:
+    """Detection used by RestaurantAIAgent before the compiled matcher."""
+    intent_patterns = {intent: list(patterns) for intent, patterns in INTENT_PATTERNS.items()}
+
+    message_lower = message.lower()
+    detected_intents = []
+    for intent, patterns in intent_patterns.items():
+        for pattern in patterns:
+            if pattern in message_lower:
+                detected_intents.append(intent)
+                break
+
+    menu_items = list(MENU_ITEMS)
+    entities = {"menu_items": []}
+    for item in menu_items:
+        if item in message_lower:
+            entities["menu_items"].append(item)
+    entities["numbers"] = re.findall(r'\d+', message)
+    return detected_intents, entities
+
+
+def compiled_analyze(matcher: IntentMatcher, number_pattern, message: str):
+    matches = matcher.match(message)
+    return matches.intents, {"menu_items": matches.entities["menu_items"], "numbers": number_pattern.findall(message)}
+
+
+def time_per_message(func, messages: List[str], repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for message in messages:
+            func(message)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages) * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark intent matching")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--pure-python", action="store_true", help="Ignore pyahocorasick even if installed")
+    args = parser.parse_args()
+
+    messages = build_messages(args.messages, args.seed)
+    if args.pure_python:
+        intent_matcher_module.ahocorasick = None
+
+    start = time.perf_counter()
+    matcher = IntentMatcher(INTENT_PATTERNS, {"menu_items": MENU_ITEMS})
+    build_ms = (time.perf_counter() - start) * 1000
+    number_pattern = re.compile(r'\d+')
+
+    legacy_us = time_per_message(legacy_analyze, messages, args.repeats)
+    compiled_us = time_per_message(lambda m: compiled_analyze(matcher, number_pattern, m), messages, args.repeats)
+
+    extra = sum(
+        1 for message in messages
+        if compiled_analyze(matcher, number_pattern, message)[0] != legacy_analyze(message)[0]
+    )
+
+    print(f"{len(messages)} messages, {matcher.backend} automaton built in {build_ms:.2f} ms")
+    print(f"{'path':<12}{'us/message':>12}")
+    print(f"{'legacy':<12}{legacy_us:>12.2f}")
+    print(f"{'compiled':<12}{compiled_us:>12.2f}")
+    print(f"speedup: {legacy_us / compiled_us:.1f}x")
+    print(f"messages whose intents differ (alef/ya/ta-marbuta folding): {extra}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark page-at-a-time personalization against the per-customer path.
+Renders campaign variants for generated recipients on an in-memory SQLite database.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from uuid import uuid4
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.compiler import compiles
+
+from app.models import Campaign, CampaignRecipient, Customer, CustomerEngagementStats, WhatsAppMessage
+from app.services.campaigns.personalization import PersonalizationEngine
+
+
+VARIANTS = [
+    "{greeting} {customer_name}! شكراً لزيارتك {restaurant_name} في {visit_date}. {personal_touch}",
+    "{greeting} {first_name}, we hope you enjoyed your table for {party_size}. Reply with a rating 1-5.",
+    "{customer_name}، لديك خصم {discount} على طلبك القادم من {restaurant_name} 🎉",
+]
+
+
+@compiles(postgresql.UUID, "sqlite")
+def compile_uuid_for_sqlite(type_, compiler, **kw):
+    return "CHAR(32)"
+
+
+async def seed(session: AsyncSession, count: int, seed: int):
+    """Customers with a few messages each, and one recipient per customer."""
+    rng = random.Random(seed)
+    restaurant_id = uuid4()
+    now = datetime.utcnow()
+    campaign = Campaign(id=uuid4(), name="Benchmark", campaign_type="promotion", restaurant_id=restaurant_id)
+    campaign.restaurant = None
+
+    recipients = []
+    for i in range(count):
+        customer = Customer(
+            id=uuid4(), customer_number=str(i), phone_number=f"+9665{i:08d}", restaurant_id=restaurant_id,
+            first_name=rng.choice(["محمد", "Sara", "نورة", None]), preferred_language=rng.choice(["ar", "en"]),
+            party_size=rng.randint(1, 8), order_total=rng.choice([None, 45.0, 180.0, 420.0]),
+            visit_date=now - timedelta(days=rng.randint(0, 90))
+        )
+        session.add(customer)
+        for n in range(rng.randint(0, 12)):
+            session.add(WhatsAppMessage(
+                id=uuid4(), content="شكراً", direction=rng.choice(["inbound", "outbound"]),
+                restaurant_id=restaurant_id, customer_id=customer.id, created_at=now - timedelta(hours=n)
+            ))
+        recipients.append(CampaignRecipient(
+            id=uuid4(), campaign_id=campaign.id, customer_id=customer.id, customer=customer,
+            variant_id=str(i % len(VARIANTS)), personalization_data={"discount": "15%"}
+        ))
+    await session.commit()
+    return campaign, recipients
+
+
+async def per_customer(engine: PersonalizationEngine, campaign, recipients, session):
+    """One context lookup and one str.replace pass per variable for every recipient."""
+    restaurant = await engine._load_restaurant(campaign, session)
+    rendered = {}
+    for recipient in recipients:
+        customer = recipient.customer
+        context = await engine._get_customer_context(customer, session)
+        variables = await engine._generate_customer_variables(customer, campaign, context, restaurant)
+        variables.update(recipient.personalization_data or {})
+        content = VARIANTS[int(recipient.variant_id)]
+        for key, value in variables.items():
+            content = content.replace(f"{{{key}}}", str(value))
+        rendered[recipient.id] = content
+    return rendered
+
+
+async def batched(engine: PersonalizationEngine, campaign, recipients, session, page_size: int):
+    """Pages of recipients through ``render_recipients``."""
+    templates = {recipient.id: VARIANTS[int(recipient.variant_id)] for recipient in recipients}
+    rendered = {}
+    for start in range(0, len(recipients), page_size):
+        page = recipients[start:start + page_size]
+        rendered.update(await engine.render_recipients(page, templates, campaign, session))
+    return rendered
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark campaign personalization")
+    parser.add_argument("--recipients", type=int, default=2000)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    db = create_async_engine("sqlite+aiosqlite://")
+    tables = [
+        Customer.__table__, WhatsAppMessage.__table__,
+        CampaignRecipient.__table__, CustomerEngagementStats.__table__
+    ]
+    async with db.begin() as conn:
+        await conn.run_sync(lambda sync_conn: Customer.metadata.create_all(sync_conn, tables=tables))
+
+    queries = [0]
+    event.listen(db.sync_engine, "before_cursor_execute", lambda *a: queries.__setitem__(0, queries[0] + 1))
+
+    engine = PersonalizationEngine()
+    async with AsyncSession(db, expire_on_commit=False) as session:
+        campaign, recipients = await seed(session, args.recipients, args.seed)
+
+        results = {}
+        for name, run in [
+            ("per-customer", lambda: per_customer(engine, campaign, recipients, session)),
+            ("batched", lambda: batched(engine, campaign, recipients, session, args.page_size)),
+        ]:
+            best = float("inf")
+            for _ in range(args.repeats):
+                queries[0] = 0
+                start = time.perf_counter()
+                rendered = await run()
+                best = min(best, time.perf_counter() - start)
+            results[name] = (best / len(recipients) * 1000 * 1000, queries[0], rendered)
+
+    await db.dispose()
+
+    print(f"{len(recipients)} recipients, {len(VARIANTS)} variants, pages of {args.page_size}")
+    print(f"{'path':<14}{'ms/1k recipients':>18}{'queries':>10}")
+    for name, (ms_per_1k, query_count, _) in results.items():
+        print(f"{name:<14}{ms_per_1k:>18.1f}{query_count:>10}")
+    print(f"speedup: {results['per-customer'][0] / results['batched'][0]:.1f}x")
+    # Greetings depend on the hour, so compare everything but the first word
+    differing = sum(
+        1 for recipient in recipients
+        if results["per-customer"][2][recipient.id].split(" ", 1)[1:] != results["batched"][2][recipient.id].split(" ", 1)[1:]
+    )
+    print(f"recipients rendered differently: {differing}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
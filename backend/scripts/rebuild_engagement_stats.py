@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Rebuild the customer_engagement_stats table.
+Recomputes per-customer message and response totals after a bulk import or raw SQL writes.
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+from uuid import UUID
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.core.logging import get_logger
+from app.database import close_database, db_manager, init_database
+from app.services.engagement_stats import rebuild_engagement_stats
+
+logger = get_logger(__name__)
+
+
+async def main():
+    """Rebuild engagement stats for every customer or a single restaurant."""
+    parser = argparse.ArgumentParser(description="Rebuild per-customer engagement stats")
+    parser.add_argument("--restaurant-id", type=UUID,
+                        help="Only rebuild customers of this restaurant")
+
+    args = parser.parse_args()
+
+    await init_database()
+    try:
+        async with db_manager.get_session() as session:
+            rebuilt = await rebuild_engagement_stats(session, restaurant_id=args.restaurant_id)
+        print(f"Rebuilt engagement stats for {rebuilt} customers")
+    finally:
+        await close_database()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -85,7 +85,7 @@ def mock_external_services():
 
         # Mock OpenRouter
         mock_openrouter = MagicMock()
-        m.setattr("app.services.openrouter_service.httpx.AsyncClient", mock_openrouter)
+        m.setattr("app.services.http_pool.httpx.AsyncClient", mock_openrouter)
 
         yield
 
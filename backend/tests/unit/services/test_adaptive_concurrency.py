@@ -0,0 +1,188 @@
+"""
+Unit tests for adaptive batch concurrency.
+Tests the AIMD limiter, queued rate budgets, per-model throughput and batched generation.
+"""
+import asyncio
+import time
+
+import pytest
+
+from app.services.adaptive_concurrency import AIMDLimiter, ModelThroughput, RateBudget
+from app.services.openrouter_service import OpenRouterService
+
+
+class TestAIMDLimiter:
+    """Test cases for AIMDLimiter."""
+
+    @pytest.mark.asyncio
+    async def test_grows_after_a_healthy_window(self):
+        """Test the limit increases by one after a full window of fast successes."""
+        limiter = AIMDLimiter(initial_limit=2, max_limit=3, latency_target=1.0)
+        for _ in range(2):
+            async with limiter.slot():
+                pass
+
+        assert limiter.limit == 3
+
+        for _ in range(10):
+            async with limiter.slot():
+                pass
+
+        assert limiter.limit == 3  # capped at max_limit
+
+    @pytest.mark.asyncio
+    async def test_backs_off_on_rate_limits_and_slow_requests(self):
+        """Test 429s and slow requests halve the limit, once per cooldown."""
+        limiter = AIMDLimiter(initial_limit=8, latency_target=0.01, cooldown=60)
+        limiter.on_rate_limited()
+        limiter.on_rate_limited()
+
+        assert limiter.limit == 4
+        assert limiter.get_stats()["rate_limited"] == 2
+
+        limiter.cooldown = 0
+        async with limiter.slot() as outcome:
+            outcome["latency"] = 0.5
+
+        assert limiter.limit == 2
+        assert limiter.get_stats()["slow"] == 1
+
+    @pytest.mark.asyncio
+    async def test_never_exceeds_the_current_limit(self):
+        """Test concurrent callers wait for a free slot."""
+        limiter = AIMDLimiter(initial_limit=3, max_limit=3)
+        running = 0
+        peak = 0
+
+        async def request():
+            nonlocal running, peak
+            async with limiter.slot():
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(request() for _ in range(12)))
+
+        assert peak == 3
+        assert limiter.in_flight == 0
+
+
+class TestRateBudget:
+    """Test cases for RateBudget."""
+
+    @pytest.mark.asyncio
+    async def test_queues_instead_of_failing(self):
+        """Test a request over the token budget waits for the bucket to refill."""
+        budget = RateBudget(requests_per_minute=600, tokens_per_minute=600)
+        await budget.acquire(600)
+
+        started = time.monotonic()
+        await budget.acquire(3)  # refills at 10 tokens per second
+
+        assert time.monotonic() - started >= 0.25
+        assert budget.get_stats()["queued"] == 1
+
+    @pytest.mark.asyncio
+    async def test_settle_returns_unused_tokens(self):
+        """Test over-reserved tokens go back into the budget."""
+        budget = RateBudget(tokens_per_minute=1000)
+        await budget.acquire(800)
+        budget.settle(reserved_tokens=800, used_tokens=100)
+
+        assert budget.get_stats()["available"]["tokens_per_minute"] >= 900
+
+
+class TestModelThroughput:
+    """Test cases for ModelThroughput."""
+
+    def test_reports_rates_per_model(self):
+        """Test requests, tokens, failures and 429s are reported per model."""
+        throughput = ModelThroughput()
+        throughput.record("anthropic/claude-3.5-haiku", 0.4, 300)
+        throughput.record("anthropic/claude-3.5-haiku", 0.6, 200)
+        throughput.record("openai/gpt-4o-mini", 0.2, 0, success=False)
+        throughput.record_rate_limited("openai/gpt-4o-mini")
+
+        stats = throughput.get_stats()
+        assert stats["anthropic/claude-3.5-haiku"]["requests_per_minute"] == 2
+        assert stats["anthropic/claude-3.5-haiku"]["tokens_per_minute"] == 500
+        assert stats["openai/gpt-4o-mini"]["failed"] == 1
+        assert stats["openai/gpt-4o-mini"]["rate_limited"] == 1
+
+    def test_record_prunes_the_window(self, monkeypatch):
+        """Test old samples are dropped on record even if stats are never read."""
+        throughput = ModelThroughput(window_seconds=60)
+        clock = [1000.0]
+        monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+        for _ in range(100):
+            throughput.record("anthropic/claude-3.5-haiku", 0.1, 10)
+            clock[0] += 1.0
+
+        assert len(throughput.recent["anthropic/claude-3.5-haiku"]) <= 61
+
+
+class TestRateBudgetSettlement:
+    """Test cases for token reservations made by OpenRouterService."""
+
+    @pytest.mark.asyncio
+    async def test_failed_request_settles_its_reservation(self):
+        """Test a request that fails gives back the completion tokens it reserved."""
+        service = OpenRouterService()
+        settled = []
+        settle = service.rate_budget.settle
+        service.rate_budget.settle = lambda reserved, used: (settled.append((reserved, used)), settle(reserved, used))
+
+        async def failing_call(request_data, model):
+            raise RuntimeError("502 Bad Gateway")
+
+        service._make_api_call_with_retries = failing_call
+        with pytest.raises(RuntimeError):
+            await service.generate_response("مرحبا", context={"fallback_attempt": True})
+
+        assert len(settled) == 1
+        reserved, used = settled[0]
+        assert 0 < used < reserved
+
+
+class TestBatchResponses:
+    """Test cases for OpenRouterService.generate_batch_responses."""
+
+    @pytest.fixture
+    def service(self):
+        """Service with a fast adaptive limiter."""
+        service = OpenRouterService()
+        service.concurrency = AIMDLimiter(initial_limit=2, max_limit=8, latency_target=1.0, cooldown=0)
+        return service
+
+    @pytest.mark.asyncio
+    async def test_results_keep_prompt_order_and_concurrency_grows(self, service):
+        """Test a healthy batch raises the limit and results stay in order."""
+        async def generate_response(prompt, **kwargs):
+            await asyncio.sleep(0.001 * (int(prompt) % 3))
+            return {"content": f"reply {prompt}", "success": True, "response_time_seconds": 0.1}
+
+        service.generate_response = generate_response
+        results = await service.generate_batch_responses([str(i) for i in range(40)])
+
+        assert [r["content"] for r in results] == [f"reply {i}" for i in range(40)]
+        assert all(r["index"] == i for i, r in enumerate(results))
+        assert service.concurrency.limit > 2
+
+    @pytest.mark.asyncio
+    async def test_rate_limited_batch_backs_off(self, service):
+        """Test 429s seen during a batch shrink the concurrency limit."""
+        service.concurrency.limit = 8
+
+        async def generate_response(prompt, **kwargs):
+            if prompt == "3":
+                service.concurrency.on_rate_limited()
+                raise RuntimeError("429 Too Many Requests")
+            return {"content": "ok", "success": True, "response_time_seconds": 0.1}
+
+        service.generate_response = generate_response
+        results = await service.generate_batch_responses([str(i) for i in range(6)], max_concurrent=2)
+
+        assert results[3]["success"] is False
+        assert service.concurrency.get_stats()["decreases"] >= 1
+        assert service.concurrency.limit < 8
@@ -0,0 +1,195 @@
+"""
+Unit tests for CampaignExecutionService.
+Tests the concurrent worker pool, page personalization, batched commits, pause handling and keyset paging.
+"""
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+
+from app.models import Campaign, CampaignRecipient, Customer
+from app.services.campaigns.execution import CampaignExecutionService, ExecutionProgress
+from app.services.campaigns.throttle import BucketLimit, TokenBucketThrottle
+
+
+async def pages_of(recipients, size=10):
+    """Yield recipients in pages like the recipient loaders do."""
+    for start in range(0, len(recipients), size):
+        yield recipients[start:start + size]
+
+
+def make_campaign(recipient_count: int) -> Campaign:
+    """Build a running campaign with pending recipients, outside any session."""
+    campaign = Campaign(
+        id=uuid4(),
+        name="Weekend offer",
+        campaign_type="promotion",
+        status="running",
+        send_rate_per_hour=100000,
+        default_language="ar",
+        restaurant_id=uuid4(),
+        message_variants=[{"id": "variant_1", "content": "مرحباً {first_name}"}],
+        messages_sent=0,
+        messages_failed=0
+    )
+    campaign.restaurant = None
+    campaign.campaign_recipients = [
+        CampaignRecipient(
+            id=uuid4(),
+            status="pending",
+            campaign_id=campaign.id,
+            customer_id=uuid4(),
+            customer=Customer(first_name=f"Customer {i}", phone_number=f"+96650000{i:04d}")
+        )
+        for i in range(recipient_count)
+    ]
+    return campaign
+
+
+class TestCampaignExecutionService:
+    """Test cases for CampaignExecutionService."""
+
+    @pytest.fixture
+    def mock_session(self):
+        """Mock async database session."""
+        session = AsyncMock()
+        session.add = MagicMock()
+        return session
+
+    @pytest.fixture
+    def service(self):
+        """Service with a fast simulated provider and no status polling."""
+        service = CampaignExecutionService(
+            max_concurrency=8, commit_batch_size=10, throttle=TokenBucketThrottle()
+        )
+        service.in_flight = 0
+        service.peak_in_flight = 0
+
+        async def dispatch(message):
+            service.in_flight += 1
+            service.peak_in_flight = max(service.peak_in_flight, service.in_flight)
+            await asyncio.sleep(0.01)
+            service.in_flight -= 1
+            message.status = "sent"
+
+        service._dispatch_message = dispatch
+        service._watch_campaign_status = AsyncMock()
+        service.personalization.get_customer_contexts = AsyncMock(return_value={})
+        return service
+
+    @pytest.mark.asyncio
+    async def test_sends_concurrently_and_commits_in_batches(self, service, mock_session):
+        """Test recipients are sent in parallel with one commit per batch."""
+        campaign = make_campaign(35)
+        progress = ExecutionProgress(total=35)
+
+        stopped = await service._run_worker_pool(
+            campaign=campaign,
+            recipient_pages=pages_of(campaign.campaign_recipients),
+            send_limits=[BucketLimit.for_rate(f"campaign:{campaign.id}", campaign.send_rate_per_hour, 3600)],
+            progress=progress,
+            session=mock_session
+        )
+
+        assert not stopped
+        assert progress.sent == 35
+        assert campaign.messages_sent == 35
+        assert all(r.status == "sent" and r.message_id for r in campaign.campaign_recipients)
+        assert 1 < service.peak_in_flight <= 8
+        # Three full batches of 10 plus the final partial batch
+        assert mock_session.commit.await_count == 4
+        assert mock_session.add.call_count == 35
+        # Personalized a page (of 10) at a time
+        assert service.personalization.get_customer_contexts.await_count == 4
+        contents = {call.args[0].content for call in mock_session.add.call_args_list}
+        assert contents == {f"مرحباً Customer {i}" for i in range(35)}
+
+    @pytest.mark.asyncio
+    async def test_stops_when_campaign_is_paused(self, service, mock_session):
+        """Test workers stop taking recipients once the status watcher fires."""
+        campaign = make_campaign(40)
+        progress = ExecutionProgress(total=40)
+
+        async def pause_soon(campaign_id, stop_event):
+            await asyncio.sleep(0.015)
+            stop_event.set()
+
+        service._watch_campaign_status = pause_soon
+
+        stopped = await service._run_worker_pool(
+            campaign=campaign,
+            recipient_pages=pages_of(campaign.campaign_recipients),
+            send_limits=[BucketLimit.for_rate(f"campaign:{campaign.id}", campaign.send_rate_per_hour, 3600)],
+            progress=progress,
+            session=mock_session
+        )
+
+        assert stopped
+        assert 0 < progress.sent < 40
+        pending = [r for r in campaign.campaign_recipients if r.status == "pending"]
+        assert len(pending) == 40 - progress.sent
+
+    @pytest.mark.asyncio
+    async def test_single_recipient_fallback_renders_like_a_page(self, service, mock_session):
+        """Test a recipient personalized on its own gets the same text as its page would."""
+        campaign = make_campaign(1)
+        campaign.message_variants = [
+            {"id": "variant_1", "content": "{first_name}, {server_name} saved {order-id} for {visit_date}"}
+        ]
+        recipient = campaign.campaign_recipients[0]
+        recipient.customer.server_name = "Ali"
+        recipient.customer.party_size = 2
+        recipient.personalization_data = {"order-id": "A7"}
+
+        page = await service._personalize_page(campaign, [recipient], mock_session, asyncio.Lock())
+        single = await service._personalize_message(
+            campaign.message_variants[0], recipient, campaign, mock_session
+        )
+
+        assert single == page[recipient.id] == "Customer 0, Ali saved A7 for "
+
+    @pytest.mark.asyncio
+    async def test_progress_broadcasts_are_throttled(self, service):
+        """Test progress updates are sent at most once per interval."""
+        websocket_manager = MagicMock()
+        websocket_manager.broadcast_to_campaign = AsyncMock()
+        progress = ExecutionProgress(total=10)
+
+        for _ in range(5):
+            await service._broadcast_progress(uuid4(), progress, websocket_manager)
+        await service._broadcast_progress(uuid4(), progress, websocket_manager, force=True)
+
+        assert websocket_manager.broadcast_to_campaign.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_keyset_pages_resume_after_last_id(self, service, mock_session):
+        """Test recipient pages are fetched by keyset on (campaign_id, status, id)."""
+        service.recipient_page_size = 2
+        campaign = make_campaign(3)
+        recipients = sorted(campaign.campaign_recipients, key=lambda r: r.id)
+
+        def result_for(page):
+            result = MagicMock()
+            result.scalars.return_value.all.return_value = page
+            return result
+
+        mock_session.execute = AsyncMock(side_effect=[
+            result_for(recipients[:2]),
+            result_for(recipients[2:])
+        ])
+
+        pages = [
+            page async for page in service._iter_pending_recipient_pages(
+                mock_session, campaign.id, asyncio.Lock()
+            )
+        ]
+
+        assert [len(page) for page in pages] == [2, 1]
+        assert mock_session.execute.await_count == 2
+
+        first_query, second_query = [call.args[0] for call in mock_session.execute.await_args_list]
+        assert "campaign_recipients.id >" not in str(first_query)
+        assert "campaign_recipients.id >" in str(second_query)
+        assert second_query.compile().params["id_1"] == recipients[1].id
+        assert "LIMIT" in str(second_query)
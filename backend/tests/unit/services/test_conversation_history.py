@@ -0,0 +1,117 @@
+"""
+Unit tests for ConversationHistoryService.
+Tests the recent-turn ring buffer, the Redis buffer and the indexed database lookup.
+"""
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+
+from app.services.conversation_history import (
+    ConversationHistoryService, RecentTurnBuffer, to_turn
+)
+
+
+def result_of(first=None, rows=None):
+    """Mock SQLAlchemy result for a first() or all() call."""
+    result = MagicMock()
+    result.first.return_value = first
+    result.all.return_value = rows or []
+    return result
+
+
+class TestConversationHistoryService:
+    """Test cases for ConversationHistoryService."""
+
+    @pytest.fixture
+    def mock_session(self):
+        """Session returning a customer without an active thread and two messages (newest first)."""
+        session = AsyncMock()
+        session.execute = AsyncMock(side_effect=[
+            result_of(first=(uuid4(), None)),
+            result_of(rows=[("outbound", "أهلاً بك"), ("inbound", "مرحبا")])
+        ])
+        return session
+
+    @pytest.fixture
+    def service(self):
+        """Service buffering three turns per customer in memory."""
+        return ConversationHistoryService(turns_per_customer=3)
+
+    @pytest.fixture
+    def redis_service(self, service):
+        """Service buffering in fakeredis."""
+        fakeredis = pytest.importorskip("fakeredis")
+        service.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        return service
+
+    @pytest.mark.asyncio
+    async def test_miss_loads_by_customer_then_serves_from_buffer(self, service, mock_session):
+        """Test a miss queries by customer id and later reads skip the database."""
+        turns = await service.get_recent_turns("+966500000001", session=mock_session)
+        assert turns == [to_turn("inbound", "مرحبا"), to_turn("outbound", "أهلاً بك")]
+
+        customer_query, messages_query = [call.args[0] for call in mock_session.execute.await_args_list]
+        assert "customers.phone_number =" in str(customer_query)
+        assert "conversation_threads" in str(customer_query)
+        assert "whatsapp_messages.customer_id =" in str(messages_query)
+        assert "LIKE" not in str(messages_query).upper()
+
+        await service.record_exchange("+966500000001", "كم سعر الكبسة؟", "45 ريال")
+        turns = await service.get_recent_turns("+966500000001", limit=5, session=mock_session)
+
+        assert mock_session.execute.await_count == 2
+        assert [turn["body"] for turn in turns] == ["أهلاً بك", "كم سعر الكبسة؟", "45 ريال"]
+        assert service.stats["hits"] == 1
+        assert service.stats["misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_record_does_not_create_partial_buffer(self, service, mock_session):
+        """Test recording for an unloaded customer leaves the next read to the database."""
+        await service.record_exchange("+966500000001", "مرحبا", "أهلاً")
+        assert service.buffer.get("+966500000001") is None
+
+        await service.get_recent_turns("+966500000001", session=mock_session)
+        assert mock_session.execute.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_redis_buffer_keeps_newest_turns(self, redis_service, mock_session):
+        """Test the Redis list is seeded on a miss and trimmed to the ring size."""
+        await redis_service.get_recent_turns("+966500000001", session=mock_session)
+        await redis_service.record_exchange("+966500000001", "كم سعر الكبسة؟", "45 ريال")
+
+        turns = await redis_service.get_recent_turns("+966500000001", session=mock_session)
+        assert [turn["body"] for turn in turns] == ["أهلاً بك", "كم سعر الكبسة؟", "45 ريال"]
+        assert await redis_service.redis_client.llen("conversation_turns:+966500000001") == 3
+        assert mock_session.execute.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_redis_buffer_remembers_empty_history(self, redis_service):
+        """Test a customer without messages is cached so reads stay off the database."""
+        session = AsyncMock()
+        session.execute = AsyncMock(return_value=result_of(first=None))
+
+        assert await redis_service.get_recent_turns("+966500000009", session=session) == []
+        assert await redis_service.get_recent_turns("+966500000009", session=session) == []
+        assert session.execute.await_count == 1
+
+
+class TestRecentTurnBuffer:
+    """Test cases for RecentTurnBuffer."""
+
+    def test_evicts_least_recently_used_customer(self):
+        """Test the buffer holds at most max_customers ring buffers."""
+        buffer = RecentTurnBuffer(turns_per_customer=2, max_customers=2)
+        buffer.replace("a", [to_turn("inbound", "1")])
+        buffer.replace("b", [to_turn("inbound", "2")])
+        buffer.get("a")
+        buffer.replace("c", [to_turn("inbound", "3")])
+
+        assert buffer.get("b") is None
+        assert buffer.get("a") is not None
+        assert len(buffer) == 2
+
+    def test_expired_buffer_is_a_miss(self):
+        """Test idle buffers expire after the TTL."""
+        buffer = RecentTurnBuffer(ttl_seconds=0)
+        buffer.replace("a", [to_turn("inbound", "1")])
+        assert buffer.get("a") is None
@@ -0,0 +1,73 @@
+"""
+Unit tests for ConversationMemory.
+Tests LRU and TTL eviction, the memory cap and the shared Redis backend.
+"""
+import pytest
+
+from app.services.conversation_memory import ConversationMemory
+
+
+def history(*bodies):
+    """Conversation turns from the customer."""
+    return [{"from": "customer", "body": body} for body in bodies]
+
+
+class TestConversationMemory:
+    """Test cases for ConversationMemory."""
+
+    @pytest.fixture
+    def memory(self):
+        """In-process memory holding at most two customers."""
+        return ConversationMemory(max_customers=2, max_turns=3)
+
+    @pytest.fixture
+    def redis_memory(self, memory):
+        """Memory shared through fakeredis."""
+        fakeredis = pytest.importorskip("fakeredis")
+        memory.redis_client = fakeredis.FakeAsyncRedis()
+        return memory
+
+    @pytest.mark.asyncio
+    async def test_keeps_latest_turns_and_counts_hits(self, memory):
+        """Test only the newest turns are kept and lookups are counted."""
+        await memory.set("966500000001", history("1", "2", "3", "4"))
+
+        assert await memory.get("966500000001") == history("2", "3", "4")
+        assert await memory.get("966500000002") is None
+        assert memory.get_stats()["hits"] == 1
+        assert memory.get_stats()["misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_evicts_least_recently_used_customer(self, memory):
+        """Test the customer cap evicts the least recently used customer."""
+        await memory.set("a", history("1"))
+        await memory.set("b", history("2"))
+        await memory.get("a")
+        await memory.set("c", history("3"))
+
+        assert "b" not in memory
+        assert "a" in memory
+        assert memory.get_stats()["evictions"] == 1
+
+    @pytest.mark.asyncio
+    async def test_byte_cap_and_ttl(self):
+        """Test the byte budget bounds memory and idle customers expire."""
+        memory = ConversationMemory(max_customers=100, max_bytes=2000, ttl_seconds=0)
+        for index in range(20):
+            await memory.set(str(index), history("مرحبا " * 20))
+
+        assert memory.get_stats()["memory_bytes"] <= 2000
+        assert await memory.get("19") is None
+        assert memory.get_stats()["expirations"] >= 1
+
+    @pytest.mark.asyncio
+    async def test_redis_backend_is_shared(self, redis_memory):
+        """Test a second instance on the same Redis sees the stored memory."""
+        await redis_memory.set("966500000001", history("كم سعر الكبسة؟"))
+
+        other_worker = ConversationMemory()
+        other_worker.redis_client = redis_memory.redis_client
+
+        assert await other_worker.get("966500000001") == history("كم سعر الكبسة؟")
+        assert await redis_memory.redis_client.ttl("conversation_memory:966500000001") > 0
+        assert len(redis_memory) == 0
@@ -0,0 +1,133 @@
+"""
+Unit tests for customer engagement stats.
+Tests incremental maintenance on flush against a full rebuild on a SQLite database.
+"""
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.compiler import compiles
+
+from app.models import CampaignRecipient, Customer, CustomerEngagementStats, WhatsAppMessage
+from app.services.engagement_stats import rebuild_engagement_stats
+
+pytest.importorskip("aiosqlite")
+
+
+@compiles(postgresql.UUID, "sqlite")
+def compile_uuid_for_sqlite(type_, compiler, **kw):
+    """SQLite has no UUID column type."""
+    return "CHAR(32)"
+
+
+async def load_stats(session):
+    """customer_id -> (messages, responses, timed responses, rounded hours total)."""
+    rows = (await session.execute(select(CustomerEngagementStats))).scalars().all()
+    return {
+        row.customer_id: (row.total_messages, row.total_responses, row.timed_responses, round(row.response_hours_total, 3))
+        for row in rows
+    }
+
+
+class TestCustomerEngagementStats:
+    """Test cases for the customer_engagement_stats table."""
+
+    @pytest_asyncio.fixture
+    async def session(self):
+        """SQLite session with the message, recipient and stats tables."""
+        engine = create_async_engine("sqlite+aiosqlite://")
+        tables = [
+            Customer.__table__, WhatsAppMessage.__table__,
+            CampaignRecipient.__table__, CustomerEngagementStats.__table__
+        ]
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync_conn: Customer.metadata.create_all(sync_conn, tables=tables))
+
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+        await engine.dispose()
+
+    @pytest_asyncio.fixture
+    async def customer(self, session):
+        """A stored customer."""
+        customer = Customer(id=uuid4(), customer_number="1", phone_number="+966500000001", restaurant_id=uuid4())
+        session.add(customer)
+        await session.commit()
+        return customer
+
+    def message(self, customer, direction="outbound"):
+        """An unsaved message for ``customer``."""
+        return WhatsAppMessage(
+            id=uuid4(), content="Hello", direction=direction,
+            restaurant_id=customer.restaurant_id, customer_id=customer.id
+        )
+
+    @pytest.mark.asyncio
+    async def test_flushes_update_stats_incrementally(self, session, customer):
+        """Test messages and responses are added to the customer's row as they are flushed."""
+        sent_at = datetime.utcnow() - timedelta(hours=3)
+        recipients = []
+        for _ in range(2):
+            message = self.message(customer)
+            recipient = CampaignRecipient(
+                campaign_id=uuid4(), customer_id=customer.id, message_id=message.id,
+                status="sent", sent_at=sent_at
+            )
+            session.add_all([message, recipient])
+            recipients.append(recipient)
+        session.add(self.message(customer, direction="inbound"))
+        await session.commit()
+
+        stats = (await load_stats(session))[customer.id]
+        assert stats == (3, 0, 0, 0.0)
+
+        recipients[0].mark_responded("Thanks!")
+        recipients[0].responded_at = sent_at + timedelta(hours=2)
+        await session.commit()
+        recipients[0].response_sentiment = "positive"  # later edits do not count it again
+        await session.commit()
+
+        row = (await session.execute(select(CustomerEngagementStats))).scalar_one()
+        assert (row.total_messages, row.total_responses) == (3, 1)
+        assert row.response_rate == pytest.approx(100 / 3)
+        assert row.avg_response_hours == pytest.approx(2)
+        assert row.last_message_at is not None
+
+    @pytest.mark.asyncio
+    async def test_rolled_back_flush_leaves_stats_unchanged(self, session, customer):
+        """Test aggregates share the transaction of the rows they count."""
+        customer_id = customer.id
+        session.add(self.message(customer))
+        await session.commit()
+
+        session.add(self.message(customer))
+        await session.flush()
+        await session.rollback()
+
+        assert (await load_stats(session))[customer_id][0] == 1
+
+    @pytest.mark.asyncio
+    async def test_rebuild_matches_incremental_totals(self, session, customer):
+        """Test a rebuild from the source tables reproduces the maintained rows."""
+        other = Customer(id=uuid4(), customer_number="2", phone_number="+966500000002", restaurant_id=uuid4())
+        session.add(other)
+        sent_at = datetime.utcnow() - timedelta(hours=5)
+        for owner, statuses in [(customer, ["responded", "delivered", "responded"]), (other, ["read"])]:
+            for status in statuses:
+                message = self.message(owner)
+                session.add_all([message, CampaignRecipient(
+                    campaign_id=uuid4(), customer_id=owner.id, message_id=message.id, status=status,
+                    sent_at=sent_at, responded_at=sent_at + timedelta(hours=1.5) if status == "responded" else None
+                )])
+        await session.commit()
+        incremental = await load_stats(session)
+
+        rebuilt = await rebuild_engagement_stats(session)
+
+        assert rebuilt == 2
+        assert await load_stats(session) == incremental
+        assert incremental[customer.id] == (3, 2, 2, 3.0)
@@ -0,0 +1,85 @@
+"""
+Unit tests for SharedHTTPPool.
+Tests connection slot accounting, wait-time metrics and reuse across OpenRouter clients.
+"""
+import asyncio
+
+import httpx
+import pytest
+# Bound before the conftest replaces httpx.AsyncClient with a mock
+from httpx import AsyncClient, MockTransport
+
+from app.services.http_pool import SharedHTTPPool, http_pool
+from app.services.openrouter.client import OpenRouterClient
+from app.services.openrouter_service import openrouter_service
+from app.services.restaurant_ai_agent import RestaurantAIAgent
+
+
+class TestSharedHTTPPool:
+    """Test cases for SharedHTTPPool."""
+
+    @pytest.fixture
+    def pool(self):
+        """Pool with a single connection slot."""
+        return SharedHTTPPool(max_connections=1, http2=False)
+
+    @pytest.mark.asyncio
+    async def test_requests_wait_for_a_free_slot(self, pool):
+        """Test requests beyond the pool size queue and their wait is measured."""
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return httpx.Response(200, json={"ok": True})
+
+        pool._client = AsyncClient(transport=MockTransport(handler))
+        first = asyncio.create_task(pool.post("https://openrouter.test/a"))
+        second = asyncio.create_task(pool.post("https://openrouter.test/b"))
+        await asyncio.sleep(0.05)
+
+        stats = pool.get_stats()
+        assert stats["in_use"] == 1
+        assert stats["waiting"] == 1
+        assert stats["saturation"] == 1.0
+
+        release.set()
+        responses = await asyncio.gather(first, second)
+
+        stats = pool.get_stats()
+        assert [response.status_code for response in responses] == [200, 200]
+        assert stats["requests"] == 2
+        assert stats["waited"] == 1
+        assert stats["in_use"] == 0
+        assert stats["wait_p99_ms"] >= 40
+        await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_transport_errors_release_the_slot(self, pool):
+        """Test a failed request is counted and frees its connection slot."""
+        def handler(request):
+            raise httpx.ConnectError("connection refused", request=request)
+
+        pool._client = AsyncClient(transport=MockTransport(handler))
+        with pytest.raises(httpx.ConnectError):
+            await pool.request("GET", "https://openrouter.test/models")
+
+        assert pool.get_stats()["errors"] == 1
+        assert pool.get_stats()["in_use"] == 0
+        assert not pool._slots.locked()
+        await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_client_is_reopened_after_close(self, pool):
+        """Test the shared client is recreated lazily after shutdown."""
+        client = pool._client = AsyncClient(transport=MockTransport(lambda request: httpx.Response(200)))
+        await pool.close()
+
+        assert client.is_closed
+        assert pool._client is None
+        assert pool.client is not client
+
+    def test_openrouter_clients_share_the_pool(self):
+        """Test every OpenRouter caller goes through the process-wide pool."""
+        assert OpenRouterClient().pool is http_pool
+        assert openrouter_service.client is http_pool
+        assert RestaurantAIAgent().openrouter is openrouter_service
@@ -0,0 +1,286 @@
+"""
+Unit tests for the inbound WhatsApp message pipeline.
+Tests per-customer ordering, stage latency metrics and the Redis stream journal.
+"""
+import asyncio
+
+import pytest
+
+from app.core.metrics import StageLatencyTracker
+from app.services.inbound_pipeline import InboundMessage, InboundMessagePipeline, InboundQueueFull
+
+
+class TestInboundMessagePipeline:
+    """Test cases for InboundMessagePipeline."""
+
+    @pytest.fixture
+    def handled(self):
+        """Messages in the order the handler finished them."""
+        return []
+
+    @pytest.fixture
+    def pipeline(self, handled):
+        """In-memory pipeline whose handler sleeps longer for the first message of a customer."""
+        async def handler(message, metrics):
+            async with metrics.time("ai_generation"):
+                await asyncio.sleep(0.03 if message.body == "1" else 0.01)
+            handled.append((message.from_number, message.body))
+
+        pipeline = InboundMessagePipeline(handler=handler, num_workers=4)
+
+        async def no_journal():
+            pipeline.redis_client = None
+
+        pipeline._connect_journal = no_journal
+        return pipeline
+
+    @pytest.fixture
+    def redis_pipeline(self, pipeline):
+        """Pipeline journaling to fakeredis."""
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+        async def fake_journal():
+            pipeline.redis_client = client
+            await pipeline._ensure_group()
+
+        pipeline._connect_journal = fake_journal
+        return pipeline
+
+    @pytest.mark.asyncio
+    async def test_keeps_customer_order_and_acks_fast(self, pipeline, handled):
+        """Test submit returns before processing and each customer's messages stay in order."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for body in ("1", "2", "3"):
+            for customer in ("+966500000001", "+966500000002"):
+                await pipeline.submit(InboundMessage(f"SM{customer}{body}", customer, body))
+        assert loop.time() - start < 0.02
+        assert handled == []
+
+        await pipeline.stop()
+
+        for customer in ("+966500000001", "+966500000002"):
+            assert [body for number, body in handled if number == customer] == ["1", "2", "3"]
+        stats = pipeline.get_stats()
+        assert stats["accepted"] == 6
+        assert stats["processed"] == 6
+        assert stats["stages"]["ai_generation"]["count"] == 6
+        assert {"enqueue", "queue_wait", "total"} <= set(stats["stages"])
+
+    @pytest.mark.asyncio
+    async def test_handler_failure_does_not_stop_worker(self, pipeline, handled):
+        """Test a failing message is retried, then counted, and later messages are still processed."""
+        original = pipeline.handler
+        pipeline.retry_delay = 0
+
+        async def flaky(message, metrics):
+            if message.body == "boom":
+                raise RuntimeError("provider down")
+            await original(message, metrics)
+
+        pipeline.handler = flaky
+        await pipeline.submit(InboundMessage("SM1", "+966500000001", "boom"))
+        await pipeline.submit(InboundMessage("SM2", "+966500000001", "2"))
+        await pipeline.stop()
+
+        assert handled == [("+966500000001", "2")]
+        assert pipeline.stats["retried"] == pipeline.max_attempts - 1
+        assert pipeline.stats["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_transient_failure_is_retried(self, pipeline, handled):
+        """Test a message whose handler fails once is answered on the retry."""
+        original = pipeline.handler
+        pipeline.retry_delay = 0
+        attempts = []
+
+        async def flaky_once(message, metrics):
+            attempts.append(message.message_sid)
+            if len(attempts) == 1:
+                raise RuntimeError("provider down")
+            await original(message, metrics)
+
+        pipeline.handler = flaky_once
+        await pipeline.submit(InboundMessage("SM1", "+966500000001", "2"))
+        await pipeline.stop()
+
+        assert handled == [("+966500000001", "2")]
+        assert pipeline.stats["processed"] == 1
+        assert pipeline.stats["failed"] == 0
+
+    @pytest.mark.asyncio
+    async def test_duplicate_message_sid_is_answered_once(self, pipeline, handled):
+        """Test a redelivered MessageSid does not produce a second reply."""
+        await pipeline.submit(InboundMessage("SM1", "+966500000001", "2"))
+        await pipeline.submit(InboundMessage("SM1", "+966500000001", "2"))
+        await pipeline.stop()
+
+        assert handled == [("+966500000001", "2")]
+        assert pipeline.stats["duplicates"] == 1
+
+    @pytest.mark.asyncio
+    async def test_full_shard_sheds_instead_of_blocking(self, pipeline):
+        """Test submit never waits on a full shard."""
+        release = asyncio.Event()
+
+        async def stuck(message, metrics):
+            await release.wait()
+
+        pipeline.handler = stuck
+        pipeline.num_workers = 1
+        pipeline.shard_queue_size = 1
+        await pipeline.submit(InboundMessage("SM1", "+966500000001", "1"))
+        await asyncio.sleep(0)  # the worker takes SM1 and waits on the handler
+        await pipeline.submit(InboundMessage("SM2", "+966500000001", "2"))
+
+        with pytest.raises(InboundQueueFull):
+            await asyncio.wait_for(
+                pipeline.submit(InboundMessage("SM3", "+966500000001", "3")), timeout=0.5
+            )
+
+        assert pipeline.stats["shed"] == 1
+        release.set()
+        await pipeline.stop()
+
+    @pytest.mark.asyncio
+    async def test_journal_entries_are_acked_after_processing(self, redis_pipeline, handled):
+        """Test journaled messages are read through the consumer group and removed once handled."""
+        await redis_pipeline.start()
+        client = redis_pipeline.redis_client
+        await redis_pipeline.submit(InboundMessage("SM1", "+966500000001", "2"))
+
+        for _ in range(300):
+            if handled:
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+
+        assert handled == [("+966500000001", "2")]
+        assert await client.xlen(InboundMessagePipeline.STREAM_KEY) == 0
+        pending = await client.xpending(InboundMessagePipeline.STREAM_KEY, InboundMessagePipeline.GROUP_NAME)
+        assert pending["pending"] == 0
+        await redis_pipeline.stop()
+
+    @pytest.mark.asyncio
+    async def test_reclaims_messages_abandoned_by_another_consumer(self, redis_pipeline, handled):
+        """Test entries read by a crashed consumer are taken over and processed."""
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await client.xgroup_create(InboundMessagePipeline.STREAM_KEY, InboundMessagePipeline.GROUP_NAME, id="0", mkstream=True)
+        await client.xadd(InboundMessagePipeline.STREAM_KEY, InboundMessage("SM1", "+966500000001", "2").to_fields())
+        await client.xreadgroup(InboundMessagePipeline.GROUP_NAME, "crashed-worker", {InboundMessagePipeline.STREAM_KEY: ">"})
+
+        async def fake_journal():
+            redis_pipeline.redis_client = client
+
+        redis_pipeline._connect_journal = fake_journal
+        redis_pipeline.reclaim_idle_ms = 0
+        await redis_pipeline.start()
+
+        for _ in range(300):
+            if handled:
+                break
+            await asyncio.sleep(0.01)
+
+        assert handled == [("+966500000001", "2")]
+        assert redis_pipeline.stats["recovered"] == 1
+        await redis_pipeline.stop()
+
+
+    @pytest.mark.asyncio
+    async def test_live_consumer_entries_are_not_reclaimed(self, redis_pipeline, handled):
+        """Test entries held by a consumer with a fresh heartbeat are left to it."""
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await client.xgroup_create(InboundMessagePipeline.STREAM_KEY, InboundMessagePipeline.GROUP_NAME, id="0", mkstream=True)
+        await client.xadd(InboundMessagePipeline.STREAM_KEY, InboundMessage("SM1", "+966500000001", "2").to_fields())
+        await client.xreadgroup(InboundMessagePipeline.GROUP_NAME, "busy-worker", {InboundMessagePipeline.STREAM_KEY: ">"})
+        await client.set(f"{InboundMessagePipeline.HEARTBEAT_PREFIX}busy-worker", "1", ex=30)
+
+        async def fake_journal():
+            redis_pipeline.redis_client = client
+
+        redis_pipeline._connect_journal = fake_journal
+        redis_pipeline.reclaim_idle_ms = 0
+        await redis_pipeline.start()
+        await asyncio.sleep(0.1)
+
+        assert handled == []
+        assert redis_pipeline.stats["recovered"] == 0
+        pending = await client.xpending(InboundMessagePipeline.STREAM_KEY, InboundMessagePipeline.GROUP_NAME)
+        assert pending["pending"] == 1
+        await redis_pipeline.stop()
+
+    @pytest.mark.asyncio
+    async def test_consumer_dying_mid_reply_does_not_lose_the_message(self, redis_pipeline, handled):
+        """Test an entry leased by a consumer that died before replying is answered by the reclaimer."""
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await client.xgroup_create(InboundMessagePipeline.STREAM_KEY, InboundMessagePipeline.GROUP_NAME, id="0", mkstream=True)
+        await client.xadd(InboundMessagePipeline.STREAM_KEY, InboundMessage("SM1", "+966500000001", "2").to_fields())
+        await client.xreadgroup(InboundMessagePipeline.GROUP_NAME, "crashed-worker", {InboundMessagePipeline.STREAM_KEY: ">"})
+        # It took the lease, then died before the reply went out; its heartbeat has lapsed
+        await client.set(f"{InboundMessagePipeline.LEASE_PREFIX}SM1", "crashed-worker", ex=600)
+
+        async def fake_journal():
+            redis_pipeline.redis_client = client
+
+        redis_pipeline._connect_journal = fake_journal
+        redis_pipeline.reclaim_idle_ms = 0
+        await redis_pipeline.start()
+
+        for _ in range(300):
+            if handled:
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+
+        assert handled == [("+966500000001", "2")]
+        assert redis_pipeline.stats["duplicates"] == 0
+        assert await client.exists(f"{InboundMessagePipeline.REPLIED_PREFIX}SM1")
+        assert not await client.exists(f"{InboundMessagePipeline.LEASE_PREFIX}SM1")
+        assert await client.xlen(InboundMessagePipeline.STREAM_KEY) == 0
+        await redis_pipeline.stop()
+
+    @pytest.mark.asyncio
+    async def test_message_out_of_retries_is_dead_lettered(self, redis_pipeline):
+        """Test a message that keeps failing is moved to the dead-letter stream, not dropped."""
+        redis_pipeline.retry_delay = 0
+
+        async def failing(message, metrics):
+            raise RuntimeError("provider down")
+
+        redis_pipeline.handler = failing
+        await redis_pipeline.start()
+        client = redis_pipeline.redis_client
+        await redis_pipeline.submit(InboundMessage("SM1", "+966500000001", "2"))
+
+        for _ in range(300):
+            if redis_pipeline.stats["failed"]:
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+
+        dead = await client.xrange(InboundMessagePipeline.DEAD_LETTER_KEY)
+        assert len(dead) == 1
+        assert dead[0][1]["error"] == "provider down"
+        assert not await client.exists(f"{InboundMessagePipeline.REPLIED_PREFIX}SM1")
+        await redis_pipeline.stop()
+
+
+class TestStageLatencyTracker:
+    """Test cases for StageLatencyTracker."""
+
+    def test_percentiles_over_bounded_window(self):
+        """Test p50/p99 are computed over the most recent samples only."""
+        tracker = StageLatencyTracker(window_size=100)
+        for _ in range(50):
+            tracker.record("send", 10.0)
+        for ms in range(1, 101):
+            tracker.record("send", ms / 1000)
+
+        snapshot = tracker.snapshot()["send"]
+        assert snapshot["count"] == 150
+        assert snapshot["p50_ms"] == 50.0
+        assert snapshot["p99_ms"] == 99.0
@@ -0,0 +1,76 @@
+"""
+Unit tests for the compiled intent matcher.
+Tests Arabic normalization and single-pass intent/entity detection on both automaton backends.
+"""
+import pytest
+
+from app.services import intent_matcher as intent_matcher_module
+from app.services.intent_matcher import IntentMatcher, normalize_text
+from app.services.restaurant_ai_agent import INTENT_MATCHER, INTENT_PATTERNS, MENU_ITEMS
+
+
+class TestNormalizeText:
+    """Test cases for normalize_text."""
+
+    def test_folds_alef_ya_and_ta_marbuta(self):
+        """Test alef variants, alef maksura and ta marbuta are folded."""
+        assert normalize_text("أهلاً إلى آخر وجبة") == "اهلا الي اخر وجبه"
+
+    def test_strips_diacritics_and_tatweel(self):
+        """Test harakat and tatweel do not affect matching."""
+        assert normalize_text("مـرحـبـاً بِكُم") == "مرحبا بكم"
+        assert normalize_text("Hello") == "hello"
+
+
+class TestIntentMatcher:
+    """Test cases for IntentMatcher."""
+
+    @pytest.fixture(params=["pyahocorasick", "python"])
+    def matcher(self, request, monkeypatch):
+        """Agent patterns compiled on each available backend."""
+        if request.param == "pyahocorasick":
+            pytest.importorskip("ahocorasick")
+        else:
+            monkeypatch.setattr(intent_matcher_module, "ahocorasick", None)
+        matcher = IntentMatcher(INTENT_PATTERNS, {"menu_items": MENU_ITEMS})
+        assert matcher.backend == request.param
+        return matcher
+
+    def test_finds_all_intents_in_declaration_order(self, matcher):
+        """Test every intent is reported once, ordered as declared."""
+        result = matcher.match("السلام عليكم، كم سعر الكبسة؟ شكرا")
+
+        assert result.intents == ["menu_inquiry", "price_inquiry", "feedback_positive", "greeting"]
+        assert result.entities["menu_items"] == ["كبسة"]
+
+    def test_matches_spelling_variants(self, matcher):
+        """Test folded spellings match keywords written with hamza or ta marbuta."""
+        result = matcher.match("اهلا، ابغى وجبه كبسه")
+
+        assert "greeting" in result.intents
+        assert "menu_inquiry" in result.intents
+        assert result.entities["menu_items"] == ["كبسة"]
+
+    def test_overlapping_patterns(self, matcher):
+        """Test patterns nested inside longer ones are all found."""
+        result = matcher.match("good morning, thank you")
+
+        assert {"feedback_positive", "greeting", "goodbye"} <= set(result.intents)
+
+    def test_no_match(self, matcher):
+        """Test messages without keywords produce empty results."""
+        result = matcher.match("؟؟ 123")
+
+        assert result.intents == []
+        assert result.entities == {"menu_items": []}
+
+    def test_results_are_independent_copies(self, matcher):
+        """Test callers cannot corrupt cached results by mutating them."""
+        first = matcher.match("كبسة")
+        first.entities["menu_items"].append("mutated")
+
+        assert matcher.match("كبسة").entities["menu_items"] == ["كبسة"]
+
+    def test_agent_matcher_is_built_once(self):
+        """Test the agent module exposes a prebuilt matcher."""
+        assert INTENT_MATCHER.match("menu please").intents == ["menu_inquiry"]
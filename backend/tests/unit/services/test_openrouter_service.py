@@ -0,0 +1,213 @@
+"""
+Unit tests for OpenRouterService.
+Tests request coalescing around the OpenRouter API call and streamed replies.
+"""
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock
+
+from app.core.config import settings
+from app.services.openrouter import embeddings
+from app.services.openrouter.cache import CacheStrategy
+from app.services.openrouter.embeddings import CallableEmbedder, HashingEmbedder
+from app.services.openrouter.service import OpenRouterService
+from app.services.openrouter.exceptions import APIError, OpenRouterError
+from app.services.openrouter.types import (
+    OpenRouterResponse, ModelChoice, ChatMessage, Usage, ModelSelection, Language,
+    LanguageDetectionResult, StreamChunk
+)
+
+
+def make_response(content: str) -> OpenRouterResponse:
+    """Build a minimal OpenRouter response."""
+    return OpenRouterResponse(
+        id="gen-test",
+        created=0,
+        model="openai/gpt-4o-mini",
+        choices=[ModelChoice(index=0, message=ChatMessage(role="assistant", content=content))],
+        usage=Usage(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+    )
+
+
+class TestOpenRouterService:
+    """Test cases for OpenRouterService."""
+
+    @pytest.fixture
+    def service(self):
+        """Service with its API-facing components mocked."""
+        service = OpenRouterService()
+        service.is_initialized = True
+        service.rate_limiter.check_and_wait = AsyncMock()
+        service.language_detector.detect_language = AsyncMock(return_value=LanguageDetectionResult(
+            detected_language=Language.ENGLISH,
+            confidence=0.9
+        ))
+        service.cost_tracker.check_budget = AsyncMock()
+        service.cost_tracker.track_usage = AsyncMock()
+        service.model_manager.select_model = AsyncMock(return_value=ModelSelection(
+            selected_model="openai/gpt-4o-mini",
+            reason="test",
+            language=Language.ENGLISH
+        ))
+        service._estimate_request_cost = AsyncMock(return_value=0.001)
+        return service
+
+    @staticmethod
+    def messages():
+        return [ChatMessage(role="user", content="What time do you open?")]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_identical_requests_share_one_completion(self, service):
+        """Test identical in-flight requests are coalesced into one API call."""
+        async def slow_completion(params):
+            await asyncio.sleep(0.05)
+            return make_response("We open at noon")
+
+        service.client.create_chat_completion = AsyncMock(side_effect=slow_completion)
+
+        results = await asyncio.gather(*[
+            service.generate_response(self.messages(), user_id="customer-1", session_id=f"s{i}")
+            for i in range(5)
+        ])
+
+        assert service.client.create_chat_completion.await_count == 1
+        assert service.cost_tracker.track_usage.await_count == 1
+        assert all(r[0].choices[0].message.content == "We open at noon" for r in results)
+
+        status = service.coalescing_stats
+        assert status["leader_requests"] == 1
+        assert status["coalesced_requests"] == 4
+        assert not service._inflight_requests
+
+    @pytest.mark.asyncio
+    async def test_waiters_receive_leader_failure(self, service):
+        """Test a failed in-flight request fails its waiters without a retry storm."""
+        async def failing_completion(params):
+            await asyncio.sleep(0.05)
+            raise RuntimeError("upstream down")
+
+        service.client.create_chat_completion = AsyncMock(side_effect=failing_completion)
+
+        results = await asyncio.gather(*[
+            service.generate_response(self.messages(), user_id="customer-1")
+            for _ in range(3)
+        ], return_exceptions=True)
+
+        assert all(isinstance(r, OpenRouterError) for r in results)
+        assert not service._inflight_requests
+
+    @pytest.mark.asyncio
+    async def test_semantic_cache_is_not_shared_between_users(self, service):
+        """Test a similar question from another customer is not served a cached reply."""
+        service.cache_strategy = CacheStrategy.SEMANTIC_SIMILAR
+        service.client.create_chat_completion = AsyncMock(return_value=make_response("Hi Sara"))
+
+        await service.generate_response(self.messages(), user_id="customer-1")
+        await service.generate_response(self.messages(), user_id="customer-2")
+        await service.generate_response(self.messages(), user_id="customer-1")
+
+        assert service.client.create_chat_completion.await_count == 2
+
+    def test_cache_uses_configured_embedding_model(self, monkeypatch):
+        """Test the configured embedding model is wired into the response cache."""
+        class FakeModel:
+            def __init__(self, name):
+                self.name = name
+
+            def get_sentence_embedding_dimension(self):
+                return 4
+
+            def encode(self, text):
+                return [1.0, float(len(text)), 0.0, 0.0]
+
+        monkeypatch.setattr(embeddings, "SentenceTransformer", FakeModel)
+        monkeypatch.setattr(settings.openrouter, "CACHE_EMBEDDING_MODEL", "multilingual-test", raising=False)
+
+        embedder = OpenRouterService().cache.embedder
+
+        assert isinstance(embedder, CallableEmbedder)
+        assert embedder.name == "multilingual-test"
+        assert embedder.embed("hello").shape == (4,)
+
+    def test_cache_falls_back_to_hashing_embedder(self, monkeypatch):
+        """Test the hashing embedder is used when no model is set or it cannot be loaded."""
+        monkeypatch.setattr(settings.openrouter, "CACHE_EMBEDDING_MODEL", None, raising=False)
+        assert isinstance(OpenRouterService().cache.embedder, HashingEmbedder)
+
+        monkeypatch.setattr(embeddings, "SentenceTransformer", None)
+        monkeypatch.setattr(settings.openrouter, "CACHE_EMBEDDING_MODEL", "multilingual-test", raising=False)
+        assert isinstance(OpenRouterService().cache.embedder, HashingEmbedder)
+
+    @staticmethod
+    def stream_of(*deltas, usage=None, fail_with=None):
+        """Fake stream_chat_completion yielding the given deltas."""
+        async def stream(params):
+            if fail_with:
+                raise fail_with
+            for delta in deltas:
+                yield StreamChunk(delta=delta)
+            yield StreamChunk(finish_reason="stop", usage=usage)
+        return stream
+
+    @pytest.mark.asyncio
+    async def test_stream_yields_deltas_and_tracks_reported_usage(self, service):
+        """Test a completed stream is tracked with provider usage and cached."""
+        usage = Usage(prompt_tokens=12, completion_tokens=4, total_tokens=16)
+        service.client.stream_chat_completion = self.stream_of("We ", "open ", "at noon", usage=usage)
+        service.cache.set = AsyncMock()
+
+        deltas = [delta async for delta in service.stream_response(self.messages(), user_id="customer-1")]
+
+        assert deltas == ["We ", "open ", "at noon"]
+        assert service.cost_tracker.track_usage.await_args.args[0] == usage
+        cached = service.cache.set.await_args.args[1]
+        assert cached.choices[0].message.content == "We open at noon"
+
+    @pytest.mark.asyncio
+    async def test_stream_cut_off_at_max_output_tokens(self, service):
+        """Test generation stops at the business limit and estimated usage is still tracked."""
+        service.client.stream_chat_completion = self.stream_of(*["word " for _ in range(50)])
+        service.cache.set = AsyncMock()
+
+        deltas = [
+            delta async for delta in service.stream_response(self.messages(), max_output_tokens=5)
+        ]
+
+        assert len(deltas) == 4  # 20 characters ~ 5 tokens
+        tracked = service.cost_tracker.track_usage.await_args.args[0]
+        assert tracked.completion_tokens == 5
+        assert service.streaming_stats["cut_off"] == 1
+        service.cache.set.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_caller_closing_stream_still_tracks_usage(self, service):
+        """Test usage is recorded when the caller stops iterating early."""
+        service.client.stream_chat_completion = self.stream_of("first ", "second ", "third")
+
+        stream = service.stream_response(self.messages())
+        assert await stream.__anext__() == "first "
+        await stream.aclose()
+
+        assert service.cost_tracker.track_usage.await_count == 1
+        assert service.cost_tracker.track_usage.await_args.args[0].completion_tokens == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_falls_back_before_first_token(self, service):
+        """Test a model failing before any output falls back to the next model."""
+        service.model_manager.select_model = AsyncMock(return_value=ModelSelection(
+            selected_model="anthropic/claude-3.5-haiku",
+            reason="test",
+            fallback_models=["openai/gpt-4o-mini"],
+            language=Language.ENGLISH
+        ))
+        primary = self.stream_of(fail_with=APIError("overloaded", status_code=503))
+        fallback = self.stream_of("Hello")
+        service.client.stream_chat_completion = lambda params: (
+            primary(params) if params.model == "anthropic/claude-3.5-haiku" else fallback(params)
+        )
+
+        deltas = [delta async for delta in service.stream_response(self.messages())]
+
+        assert deltas == ["Hello"]
+        assert service.cost_tracker.track_usage.await_args.args[1] == "openai/gpt-4o-mini"
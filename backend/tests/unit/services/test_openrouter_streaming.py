@@ -0,0 +1,146 @@
+"""
+Unit tests for OpenRouter streaming completions.
+Tests SSE parsing, OpenRouterClient.stream_chat_completion over the shared pool and streamed agent replies.
+"""
+import json
+
+import httpx
+import pytest
+# Bound before the conftest replaces httpx.AsyncClient with a mock
+from httpx import AsyncClient, MockTransport
+
+from app.services.http_pool import SharedHTTPPool
+from app.services.openrouter.client import OpenRouterClient
+from app.services.openrouter.exceptions import APIError
+from app.services.openrouter.streaming import iter_stream_chunks
+from app.services.openrouter.types import ChatMessage, RequestParameters
+from app.services.restaurant_ai_agent import RestaurantAIAgent
+
+
+def sse_body(*events):
+    """SSE body with a keep-alive comment, the given events and the DONE marker."""
+    lines = [": OPENROUTER PROCESSING", ""]
+    for event in events:
+        lines += [f"data: {json.dumps(event, ensure_ascii=False)}", ""]
+    lines += ["data: [DONE]", ""]
+    return "\n".join(lines).encode("utf-8")
+
+
+def delta_event(content, finish_reason=None, usage=None):
+    """One chat.completion.chunk event."""
+    event = {
+        "id": "gen-1",
+        "model": "anthropic/claude-3.5-haiku",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}]
+    }
+    if usage:
+        event["usage"] = usage
+    return event
+
+
+async def lines_of(body):
+    for line in body.decode("utf-8").split("\n"):
+        yield line
+
+
+class TestStreamParsing:
+    """Test cases for iter_stream_chunks."""
+
+    @pytest.mark.asyncio
+    async def test_parses_deltas_and_final_usage(self):
+        """Test comments are skipped and usage is read from the last event."""
+        body = sse_body(
+            delta_event("أهلاً "),
+            delta_event("وسهلاً"),
+            delta_event("", "stop", {"prompt_tokens": 9, "completion_tokens": 3, "total_tokens": 12})
+        )
+
+        chunks = [chunk async for chunk in iter_stream_chunks(lines_of(body))]
+
+        assert [chunk.delta for chunk in chunks] == ["أهلاً ", "وسهلاً", ""]
+        assert chunks[-1].finish_reason == "stop"
+        assert chunks[-1].usage.total_tokens == 12
+
+    @pytest.mark.asyncio
+    async def test_error_event_raises(self):
+        """Test a mid-stream provider error surfaces as APIError."""
+        body = sse_body(delta_event("Hi"), {"error": {"code": 502, "message": "provider disconnected"}})
+
+        with pytest.raises(APIError) as exc_info:
+            async for _ in iter_stream_chunks(lines_of(body)):
+                pass
+
+        assert exc_info.value.status_code == 502
+
+
+class TestClientStreaming:
+    """Test cases for OpenRouterClient.stream_chat_completion."""
+
+    @pytest.fixture
+    def params(self):
+        """Streaming request parameters."""
+        return RequestParameters(
+            model="anthropic/claude-3.5-haiku",
+            messages=[ChatMessage(role="user", content="Menu?")]
+        )
+
+    @staticmethod
+    def client_for(handler):
+        """OpenRouter client on a pool backed by a mock transport."""
+        pool = SharedHTTPPool(http2=False)
+        pool._client = AsyncClient(transport=MockTransport(handler))
+        return OpenRouterClient(pool=pool)
+
+    @pytest.mark.asyncio
+    async def test_streams_through_the_pool(self, params):
+        """Test the request asks for a stream with usage and chunks are yielded in order."""
+        requests = []
+
+        def handler(request):
+            requests.append(json.loads(request.content))
+            return httpx.Response(200, content=sse_body(delta_event("Kabsa"), delta_event(", mandi", "stop")))
+
+        client = self.client_for(handler)
+        chunks = [chunk async for chunk in client.stream_chat_completion(params)]
+
+        assert "".join(chunk.delta for chunk in chunks) == "Kabsa, mandi"
+        assert requests[0]["stream"] is True
+        assert requests[0]["usage"] == {"include": True}
+        assert client.pool.get_stats()["in_use"] == 0
+        await client.pool.close()
+
+    @pytest.mark.asyncio
+    async def test_http_error_status_raises_before_streaming(self, params):
+        """Test non-200 responses are reported like blocking requests."""
+        def handler(request):
+            return httpx.Response(503, json={"error": {"message": "overloaded"}})
+
+        client = self.client_for(handler)
+
+        with pytest.raises(APIError) as exc_info:
+            async for _ in client.stream_chat_completion(params):
+                pass
+
+        assert exc_info.value.status_code == 503
+        await client.pool.close()
+
+
+class TestAgentStreaming:
+    """Test cases for RestaurantAIAgent.stream_intelligent_response."""
+
+    @pytest.mark.asyncio
+    async def test_finished_reply_is_post_processed(self, monkeypatch):
+        """Test the completed reply gets the same clean-up as a blocking reply."""
+        agent = RestaurantAIAgent()
+
+        async def stream_response(**kwargs):
+            for delta in ["Assistant: ", "Kabsa is our ", "most popular dish"]:
+                yield delta
+
+        monkeypatch.setattr(agent.openrouter, "stream_response", stream_response)
+        reply = agent.stream_intelligent_response("What do you recommend?", language="en")
+
+        deltas = [delta async for delta in reply]
+
+        assert "".join(deltas) == "Assistant: Kabsa is our most popular dish"
+        assert reply.content.startswith("Kabsa is our most popular dish")
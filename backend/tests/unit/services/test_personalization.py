@@ -0,0 +1,137 @@
+"""
+Unit tests for PersonalizationEngine.
+Tests batched customer context retrieval on a SQLite database and page rendering.
+"""
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.compiler import compiles
+
+from app.models import Campaign, CampaignRecipient, Customer, CustomerEngagementStats, WhatsAppMessage
+from app.services.campaigns.personalization import CompiledTemplate, PersonalizationEngine
+
+pytest.importorskip("aiosqlite")
+
+
+@compiles(postgresql.UUID, "sqlite")
+def compile_uuid_for_sqlite(type_, compiler, **kw):
+    """SQLite has no UUID column type."""
+    return "CHAR(32)"
+
+
+class TestCompiledTemplate:
+    """Test cases for CompiledTemplate."""
+
+    def test_renders_known_placeholders_once(self):
+        """Test values are substituted in one pass and unknown placeholders are kept."""
+        template = CompiledTemplate("{greeting} {customer_name}, {unknown} {{first_name}}")
+
+        rendered = template.render({"greeting": "Hi", "customer_name": "{first_name}", "first_name": "Sara"})
+
+        assert rendered == "Hi {first_name}, {unknown} {Sara}"
+
+    def test_renders_names_that_are_not_identifiers(self):
+        """Test keys like {order-id} are substituted, as the per-variable replace loop did."""
+        template = CompiledTemplate("Order {order-id} for {customer name}")
+
+        assert template.render({"order-id": "A7", "customer name": "Sara"}) == "Order A7 for Sara"
+
+
+class TestBatchPersonalization:
+    """Test cases for page-at-a-time personalization."""
+
+    @pytest_asyncio.fixture
+    async def session(self):
+        """SQLite session with customers, messages and engagement stats."""
+        engine = create_async_engine("sqlite+aiosqlite://")
+        tables = [
+            Customer.__table__, WhatsAppMessage.__table__,
+            CampaignRecipient.__table__, CustomerEngagementStats.__table__
+        ]
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync_conn: Customer.metadata.create_all(sync_conn, tables=tables))
+
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+        await engine.dispose()
+
+    @pytest_asyncio.fixture
+    async def customers(self, session):
+        """Three customers with 0, 3 and 8 messages."""
+        restaurant_id = uuid4()
+        now = datetime.utcnow()
+        customers = []
+        for i, message_count in enumerate([0, 3, 8]):
+            customer = Customer(
+                id=uuid4(), customer_number=str(i), phone_number=f"+96650000000{i}",
+                restaurant_id=restaurant_id, first_name=f"Customer {i}", preferred_language="en",
+                visit_date=now - timedelta(days=2)
+            )
+            session.add(customer)
+            customers.append(customer)
+            for n in range(message_count):
+                session.add(WhatsAppMessage(
+                    id=uuid4(), content=f"message {n}", direction="inbound", restaurant_id=restaurant_id,
+                    customer_id=customer.id, created_at=now - timedelta(hours=n)
+                ))
+        await session.commit()
+        return customers
+
+    @pytest.mark.asyncio
+    async def test_contexts_match_per_customer_lookup(self, session, customers):
+        """Test the windowed query keeps each customer's latest messages, newest first."""
+        engine = PersonalizationEngine(recent_message_limit=5)
+
+        contexts = await engine.get_customer_contexts(customers, session)
+
+        assert [len(contexts[c.id]["recent_messages"]) for c in customers] == [0, 3, 5]
+        assert [m["content"] for m in contexts[customers[2].id]["recent_messages"]] == [
+            f"message {n}" for n in range(5)
+        ]
+        assert contexts[customers[2].id]["message_history"]["total_messages"] == 8
+        assert contexts[customers[0].id]["message_history"]["total_messages"] == 0
+        for customer in customers:
+            assert await engine._get_customer_context(customer, session) == contexts[customer.id]
+
+    @pytest.mark.asyncio
+    async def test_contexts_skip_deleted_messages(self, session, customers):
+        """Test deleted messages are neither returned nor take a recent-message slot."""
+        customer = customers[1]
+        session.add(WhatsAppMessage(
+            id=uuid4(), content="deleted", direction="inbound", restaurant_id=customer.restaurant_id,
+            customer_id=customer.id, created_at=datetime.utcnow() + timedelta(minutes=1), is_deleted=True
+        ))
+        await session.commit()
+
+        contexts = await PersonalizationEngine(recent_message_limit=3).get_customer_contexts([customer], session)
+
+        assert [m["content"] for m in contexts[customer.id]["recent_messages"]] == [
+            f"message {n}" for n in range(3)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_render_recipients_applies_variable_precedence(self, session, customers):
+        """Test generated variables are overridden by base variables, then stored data."""
+        engine = PersonalizationEngine()
+        campaign = Campaign(id=uuid4(), campaign_type="promotion", restaurant_id=customers[0].restaurant_id)
+        campaign.restaurant = None
+        recipients = [
+            CampaignRecipient(id=uuid4(), customer_id=c.id, customer=c, personalization_data=data)
+            for c, data in zip(customers, [None, {"offer": "20%"}, {"first_name": "VIP"}])
+        ]
+        templates = {r.id: "{first_name} at {restaurant_name}: {offer}" for r in recipients}
+
+        rendered = await engine.render_recipients(
+            recipients, templates, campaign, session,
+            base_variables={recipients[0].id: {"restaurant_name": "Kabsa House"}}
+        )
+
+        assert [rendered[r.id] for r in recipients] == [
+            "Customer 0 at Kabsa House: {offer}",
+            "Customer 1 at مطعمنا: 20%",
+            "VIP at مطعمنا: {offer}",
+        ]
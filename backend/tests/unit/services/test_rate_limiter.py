@@ -0,0 +1,86 @@
+"""
+Unit tests for the OpenRouter RateLimiter.
+Tests the atomic sliding-window acquire on both the memory and Redis backends.
+"""
+import pytest
+
+from app.services.openrouter.rate_limiter import (
+    RateLimiter, RateLimit, LimitType, SLIDING_WINDOW_SCRIPT
+)
+from app.services.openrouter.exceptions import RateLimitExceededError
+
+
+class TestRateLimiter:
+    """Test cases for RateLimiter."""
+
+    @pytest.fixture
+    def limiter(self):
+        """Limiter with a small request limit and a token limit."""
+        limiter = RateLimiter()
+        limiter.rate_limits = [
+            RateLimit(LimitType.REQUESTS_PER_MINUTE, limit=3, window_seconds=60),
+            RateLimit(LimitType.TOKENS_PER_MINUTE, limit=100, window_seconds=60),
+        ]
+        return limiter
+
+    @pytest.fixture
+    def redis_limiter(self, limiter):
+        """Limiter backed by fakeredis with the Lua script registered."""
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        limiter.redis_client = fakeredis.FakeAsyncRedis()
+        limiter._window_script = limiter.redis_client.register_script(SLIDING_WINDOW_SCRIPT)
+        return limiter
+
+    @pytest.mark.asyncio
+    async def test_memory_running_token_sum(self, limiter):
+        """Test token usage is tracked as a running sum without re-summing the window."""
+        await limiter.check_and_wait("user-1", tokens=40)
+        await limiter.check_and_wait("user-1", tokens=35)
+
+        status = await limiter.get_status("user-1")
+        assert status["limits"]["tokens_per_minute"]["current_usage"] == 75
+        assert status["limits"]["requests_per_minute"]["current_usage"] == 2
+        assert limiter.token_sums["rate_limit:tokens_per_minute:{user-1}"] == 75
+
+    @pytest.mark.asyncio
+    async def test_memory_rejects_without_recording(self, limiter):
+        """Test a rejected request does not consume any window."""
+        for _ in range(3):
+            await limiter.check_and_wait("user-1", tokens=10)
+
+        with pytest.raises(RateLimitExceededError):
+            await limiter.check_and_wait("user-1", tokens=10, max_wait_seconds=0)
+
+        assert len(limiter.request_windows["rate_limit:requests_per_minute:{user-1}"]) == 3
+        assert limiter.token_sums["rate_limit:tokens_per_minute:{user-1}"] == 30
+
+    @pytest.mark.asyncio
+    async def test_redis_script_checks_and_records_atomically(self, redis_limiter):
+        """Test the Lua script records all windows and rejects once a limit is hit."""
+        for _ in range(3):
+            assert await redis_limiter.check_and_wait("user-1", tokens=20)
+
+        with pytest.raises(RateLimitExceededError) as exc_info:
+            await redis_limiter.check_and_wait("user-1", tokens=20, max_wait_seconds=0)
+        assert exc_info.value.limit_type == LimitType.REQUESTS_PER_MINUTE
+
+        status = await redis_limiter.get_status("user-1")
+        assert status["limits"]["requests_per_minute"]["current_usage"] == 3
+        assert status["limits"]["tokens_per_minute"]["current_usage"] == 60
+
+    @pytest.mark.asyncio
+    async def test_redis_sum_keys_share_the_window_slot(self, redis_limiter):
+        """Test the script only touches declared keys, each sum key tagged like its window."""
+        await redis_limiter.check_and_wait("user-1", tokens=20)
+
+        keys = sorted(key.decode() for key in await redis_limiter.redis_client.keys("*"))
+        assert keys == [
+            "rate_limit:requests_per_minute:{user-1}",
+            "rate_limit:tokens_per_minute:{user-1}",
+            "rate_limit_sum:tokens_per_minute:{user-1}",
+        ]
+        assert int(await redis_limiter.redis_client.get("rate_limit_sum:tokens_per_minute:{user-1}")) == 20
+
+        await redis_limiter.reset_limits("user-1")
+        assert await redis_limiter.redis_client.keys("*") == []
@@ -0,0 +1,327 @@
+"""
+Unit tests for the OpenRouter ResponseCache.
+Tests lookup strategies, indexing and eviction of the in-memory backend.
+"""
+import json
+import time
+
+import pytest
+
+from app.services.openrouter import cache as cache_module, memory_store
+from app.services.openrouter.cache import ResponseCache, CacheStrategy
+from app.services.openrouter.codec import CacheCodec, COMPRESSION_ZLIB
+from app.services.openrouter.embeddings import (
+    HashingEmbedder, BruteForceVectorIndex, IVFVectorIndex
+)
+from app.services.openrouter.fuzzy_index import InvertedTokenIndex, MinHashLSHIndex
+from app.services.openrouter.types import (
+    OpenRouterResponse, ConversationContext, ModelChoice, ChatMessage, Usage
+)
+
+
+def make_response(content: str) -> OpenRouterResponse:
+    """Build a minimal OpenRouter response."""
+    return OpenRouterResponse(
+        id="gen-test",
+        created=0,
+        model="openai/gpt-4o-mini",
+        choices=[ModelChoice(index=0, message=ChatMessage(role="assistant", content=content))],
+        usage=Usage(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+    )
+
+
+def make_context() -> ConversationContext:
+    """Build a minimal conversation context."""
+    return ConversationContext(user_id="customer-1", session_id="session-1")
+
+
+class TestResponseCache:
+    """Test cases for ResponseCache."""
+
+    @pytest.fixture
+    def cache(self):
+        """In-memory cache with an exact brute-force vector index."""
+        return ResponseCache(embedder=HashingEmbedder(), vector_index_type="brute")
+
+    @pytest.mark.asyncio
+    async def test_semantic_lookup_matches_spelling_variants(self, cache):
+        """Test semantic lookup tolerates Arabic spelling variants and extra words."""
+        await cache.set(
+            "key-hours-ar", make_response("نفتح الساعة ١٢ ظهراً"), make_context(),
+            query_text="متى تفتحون؟"
+        )
+
+        result = await cache.get(
+            "key-other", strategy=CacheStrategy.SEMANTIC_SIMILAR,
+            query_text="متي تفتحون", similarity_threshold=0.7
+        )
+
+        assert result is not None
+        assert result[0].choices[0].message.content == "نفتح الساعة ١٢ ظهراً"
+
+    @pytest.mark.asyncio
+    async def test_semantic_lookup_misses_unrelated_query(self, cache):
+        """Test semantic lookup does not return unrelated entries."""
+        await cache.set(
+            "key-hours", make_response("We open at noon"), make_context(),
+            query_text="what time do you open"
+        )
+
+        result = await cache.get(
+            "key-other", strategy=CacheStrategy.SEMANTIC_SIMILAR,
+            query_text="do you have vegetarian dishes"
+        )
+
+        assert result is None
+
+    @pytest.mark.asyncio
+    async def test_semantic_lookup_stays_within_scope(self, cache):
+        """Test two users asking the same question do not share an entry."""
+        await cache.set(
+            "key-customer-1", make_response("Your order #17 is ready, Sara"), make_context(),
+            query_text="is my order ready", scope="customer-1"
+        )
+
+        other_user = await cache.get(
+            "key-customer-2", strategy=CacheStrategy.SEMANTIC_SIMILAR,
+            query_text="is my order ready", scope="customer-2"
+        )
+        same_user = await cache.get(
+            "key-customer-1b", strategy=CacheStrategy.SEMANTIC_SIMILAR,
+            query_text="is my order ready", scope="customer-1"
+        )
+
+        assert other_user is None
+        assert same_user is not None
+
+    @pytest.mark.asyncio
+    async def test_cleared_entries_leave_semantic_index(self, cache):
+        """Test clearing the cache also clears the vector index."""
+        await cache.set(
+            "key-hours", make_response("We open at noon"), make_context(),
+            query_text="what time do you open"
+        )
+        assert len(cache.vector_index) == 1
+
+        await cache.clear()
+
+        assert len(cache.vector_index) == 0
+
+    @pytest.mark.asyncio
+    async def test_fuzzy_lookup_uses_token_index(self, cache):
+        """Test fuzzy lookup finds the closest entry through the token index."""
+        await cache.set("k1", make_response("noon"), make_context(), query_text="what time do you open today")
+        await cache.set("k2", make_response("yes"), make_context(), query_text="do you deliver to my area")
+
+        result = await cache.get(
+            "other", strategy=CacheStrategy.FUZZY_MATCH,
+            query_text="what time do you open", similarity_threshold=0.6
+        )
+
+        assert result is not None
+        assert result[0].choices[0].message.content == "noon"
+
+    @pytest.mark.asyncio
+    async def test_fuzzy_lookup_stays_within_scope(self, cache):
+        """Test fuzzy postings are partitioned so other users' entries never match."""
+        await cache.set(
+            "k1", make_response("Your table for 4 is at 8pm, Omar"), make_context(),
+            query_text="what time is my booking", scope="customer-1"
+        )
+
+        other_user = await cache.get(
+            "other", strategy=CacheStrategy.FUZZY_MATCH,
+            query_text="what time is my booking", scope="customer-2"
+        )
+        same_user = await cache.get(
+            "other", strategy=CacheStrategy.FUZZY_MATCH,
+            query_text="what time is my booking", scope="customer-1"
+        )
+
+        assert other_user is None
+        assert same_user is not None
+
+    @pytest.mark.asyncio
+    async def test_redis_postings_drop_expired_members(self, cache, monkeypatch):
+        """Test writing to a posting trims members whose entries have expired."""
+        fakeredis = pytest.importorskip("fakeredis")
+        cache.redis_client = fakeredis.FakeAsyncRedis(decode_responses=False)
+        await cache.set("k1", make_response("noon"), make_context(), query_text="opening hours", ttl=60)
+
+        later = time.time() + 120
+        monkeypatch.setattr(cache_module.time, "time", lambda: later)
+        await cache.set("k2", make_response("noon"), make_context(), query_text="opening hours", ttl=60)
+
+        members = await cache.redis_client.zrange(f"{ResponseCache.FUZZY_POSTING_PREFIX}hours", 0, -1)
+        assert members == [b"k2"]
+        tokens = await cache.redis_client.get(f"{ResponseCache.FUZZY_TOKENS_PREFIX}k2")
+        assert set(tokens.decode("utf-8").split()) == {"opening", "hours"}
+
+    @pytest.mark.asyncio
+    async def test_evicted_entries_leave_token_index(self, cache):
+        """Test evicted entries are removed from the fuzzy postings."""
+        cache.max_memory_entries = 3
+        for i in range(4):
+            await cache.set(f"k{i}", make_response("ok"), make_context(), query_text=f"question {i}")
+
+        await cache._evict_memory_entries(count=2)
+
+        assert set(cache.token_index.key_tokens) == set(cache.memory_cache)
+        assert all(
+            key in cache.memory_cache
+            for keys in cache.token_index.postings.values() for key in keys
+        )
+
+    @pytest.mark.asyncio
+    async def test_memory_cache_evicts_least_recently_used(self, cache):
+        """Test the entry budget evicts the least recently used key."""
+        cache.max_memory_entries = 2
+        await cache.set("k1", make_response("one"), make_context())
+        await cache.set("k2", make_response("two"), make_context())
+        await cache.get("k1")
+
+        await cache.set("k3", make_response("three"), make_context())
+
+        assert set(cache.memory_cache.keys()) == {"k1", "k3"}
+        assert cache.cache_stats["evictions"] == 1
+
+    @pytest.mark.asyncio
+    async def test_memory_cache_respects_byte_budget(self, cache):
+        """Test the byte budget bounds memory regardless of entry count."""
+        await cache.set("k0", make_response("x" * 1000), make_context())
+        cache.max_memory_bytes = cache.memory_cache.total_bytes * 3 + 100
+
+        for i in range(1, 10):
+            await cache.set(f"k{i}", make_response("x" * 1000), make_context())
+
+        assert len(cache.memory_cache) == 3
+        assert cache.memory_cache.total_bytes <= cache.max_memory_bytes
+
+    @pytest.mark.asyncio
+    async def test_expired_entries_are_swept_from_indexes(self, cache, monkeypatch):
+        """Test expiry drops records and their index postings."""
+        await cache.set("k1", make_response("ok"), make_context(), query_text="opening hours", ttl=60)
+
+        later = time.monotonic() + 120
+        monkeypatch.setattr(memory_store.time, "monotonic", lambda: later)
+        await cache.cleanup_expired()
+
+        assert len(cache.memory_cache) == 0
+        assert len(cache.token_index) == 0
+        assert len(cache.vector_index) == 0
+        assert await cache.get("k1") is None
+
+    @pytest.mark.asyncio
+    async def test_stats_report_per_strategy_hit_rate(self, cache):
+        """Test get_stats reports hits, misses and latency per strategy."""
+        await cache.set("key-1", make_response("ok"), make_context(), query_text="menu please")
+        await cache.get("key-1")
+        await cache.get("missing")
+        await cache.get("key-x", strategy=CacheStrategy.SEMANTIC_SIMILAR, query_text="menu please")
+
+        stats = await cache.get_stats()
+
+        assert stats["strategies"]["exact"]["hits"] == 1
+        assert stats["strategies"]["exact"]["misses"] == 1
+        assert stats["strategies"]["exact"]["hit_rate_percent"] == 50.0
+        assert stats["strategies"]["semantic"]["hits"] == 1
+        assert stats["strategies"]["semantic"]["avg_lookup_ms"] >= 0.0
+
+
+class TestCacheCodec:
+    """Test cases for the binary cache codec."""
+
+    def test_round_trip_preserves_models(self):
+        """Test encoded entries decode to equal Pydantic models."""
+        codec = CacheCodec()
+        response, context = make_response("أهلاً وسهلاً"), make_context()
+
+        payload = codec.decode(codec.encode(response, context, 1700000000.0, 60, ["faq"], "hello"))
+
+        assert payload.response == response
+        assert payload.context == context
+        assert payload.tags == ["faq"]
+        assert payload.query_text == "hello"
+
+    def test_large_payloads_are_compressed(self):
+        """Test bodies above the threshold are compressed when it helps."""
+        codec = CacheCodec(compress_threshold=256, compression="zlib")
+
+        frame = codec.encode(make_response("مرحبا بكم " * 200), make_context(), 0.0, 60)
+
+        assert frame[2] & 0xF0 == COMPRESSION_ZLIB
+        assert len(frame) < len("مرحبا بكم ".encode("utf-8") * 200)
+        assert codec.decode(frame).response.choices[0].message.content.startswith("مرحبا")
+
+    def test_decodes_legacy_json_entries(self):
+        """Test entries written by the previous JSON serializer still load."""
+        legacy = json.dumps({
+            "key": "k1",
+            "response": make_response("ok").dict(),
+            "context": make_context().dict(),
+            "created_at": "2024-01-01T12:00:00",
+            "accessed_at": "2024-01-01T12:00:00",
+            "access_count": 3,
+            "ttl_seconds": 60,
+            "tags": []
+        }, ensure_ascii=False)
+
+        payload = CacheCodec().decode(legacy.encode("utf-8"))
+
+        assert payload.response.choices[0].message.content == "ok"
+        assert payload.ttl_seconds == 60
+
+
+class TestTokenIndexes:
+    """Test cases for the fuzzy cache token indexes."""
+
+    @pytest.mark.parametrize("index_class", [InvertedTokenIndex, MinHashLSHIndex])
+    def test_candidates_match_exact_jaccard(self, index_class):
+        """Test indexed candidates agree with the exact Jaccard scan."""
+        index = index_class()
+        index.add("a", "what time do you open")
+        index.add("b", "what time do you close")
+        index.add("c", "table for four tonight")
+
+        candidates = index.candidates("what time do you open", threshold=0.9)
+
+        assert candidates == [("a", 1.0)]
+
+    def test_remove_drops_empty_postings(self):
+        """Test removing the last key for a token drops the postings list."""
+        index = InvertedTokenIndex()
+        index.add("a", "hello world")
+        index.remove("a")
+
+        assert len(index) == 0
+        assert not index.postings
+
+
+class TestVectorIndexes:
+    """Test cases for the semantic cache vector indexes."""
+
+    def test_brute_force_remove_keeps_rows_consistent(self):
+        """Test removal swaps rows without losing other vectors."""
+        embedder = HashingEmbedder()
+        index = BruteForceVectorIndex(embedder.dimensions, initial_capacity=2)
+        texts = ["opening hours", "table booking", "delivery area"]
+        for text in texts:
+            index.add(text, embedder.embed(text))
+
+        index.remove("opening hours")
+
+        assert len(index) == 2
+        assert index.search(embedder.embed("delivery area"))[0][0] == "delivery area"
+        assert index.search(embedder.embed("table booking"))[0][0] == "table booking"
+
+    def test_ivf_index_finds_exact_vectors_after_training(self):
+        """Test the IVF index still finds stored vectors once clustered."""
+        embedder = HashingEmbedder()
+        index = IVFVectorIndex(embedder.dimensions, n_lists=4, n_probe=2, train_threshold=50)
+        for i in range(60):
+            index.add(f"key-{i}", embedder.embed(f"question number {i} about dish {i * 7}"))
+
+        assert index.is_trained
+        key, score = index.search(embedder.embed("question number 42 about dish 294"))[0]
+        assert key == "key-42"
+        assert score == pytest.approx(1.0, abs=1e-5)
@@ -0,0 +1,151 @@
+"""
+Unit tests for CustomerSegmentationService.
+Tests the compiled segment query against the in-memory filters on a SQLite database.
+"""
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.compiler import compiles
+
+from app.models import CampaignRecipient, Customer, CustomerEngagementStats, WhatsAppMessage
+from app.services.campaigns.segmentation import CustomerSegmentationService
+
+pytest.importorskip("aiosqlite")
+
+
+@compiles(postgresql.UUID, "sqlite")
+def compile_uuid_for_sqlite(type_, compiler, **kw):
+    """SQLite has no UUID column type."""
+    return "CHAR(32)"
+
+
+TARGETING_CONFIGS = [
+    {},
+    {"preferred_language": ["en"]},
+    {"party_size_min": 3, "party_size_max": 6},
+    {"order_total_min": 100, "order_total_max": 250},
+    {"visit_days_ago_max": 7},
+    {"visit_days_ago_min": 30, "whatsapp_opt_in": True},
+    {"has_special_requests": True},
+    {"has_special_requests": False, "email_opt_in": False},
+    {"response_rate_min": 50},
+    {"response_rate_max": 10, "preferred_language": ["ar"]},
+    {"customer_segments": ["loyal_customers"]},
+    {"customer_segments": ["new_customers", "low_value"]},
+    {"customer_segments": ["responsive_customers", "recent_visitors"], "party_size_min": 2},
+    {"customer_segments": ["unknown_segment"], "order_total_min": 50},
+]
+
+
+class TestSegmentQuery:
+    """Test cases for the SQL segment query."""
+
+    @pytest_asyncio.fixture
+    async def session(self):
+        """SQLite session with customers, messages and campaign responses."""
+        engine = create_async_engine("sqlite+aiosqlite://")
+        tables = [
+            Customer.__table__, WhatsAppMessage.__table__,
+            CampaignRecipient.__table__, CustomerEngagementStats.__table__
+        ]
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync_conn: Customer.metadata.create_all(sync_conn, tables=tables))
+
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+        await engine.dispose()
+
+    @pytest_asyncio.fixture
+    async def restaurant_id(self, session):
+        """A restaurant with 24 customers of varied profiles and histories."""
+        restaurant_id = uuid4()
+        now = datetime.utcnow()
+        for i in range(24):
+            customer = Customer(
+                id=uuid4(),
+                customer_number=str(i),
+                phone_number=f"+9665000000{i:02d}",
+                restaurant_id=restaurant_id,
+                preferred_language=["ar", "en"][i % 2],
+                party_size=1 + i % 7,
+                order_total=None if i % 5 == 0 else 40.0 * (i % 8),
+                visit_date=now - timedelta(days=3 * i),
+                special_requests=["", "No onions", None, "   "][i % 4],
+                whatsapp_opt_in=i % 3 != 0,
+                email_opt_in=i % 4 != 0,
+            )
+            session.add(customer)
+
+            # Outbound campaign messages, some answered, and inbound messages on i % 4 days
+            for n in range(i % 3):
+                message = WhatsAppMessage(
+                    id=uuid4(), content="Offer", direction="outbound",
+                    restaurant_id=restaurant_id, customer_id=customer.id
+                )
+                session.add(message)
+                session.add(CampaignRecipient(
+                    campaign_id=uuid4(), customer_id=customer.id, message_id=message.id,
+                    status="responded" if (i + n) % 2 else "delivered"
+                ))
+            for day in range(i % 4):
+                session.add(WhatsAppMessage(
+                    id=uuid4(), content="Hi", direction="inbound", restaurant_id=restaurant_id,
+                    customer_id=customer.id, created_at=now - timedelta(days=day)
+                ))
+        await session.commit()
+        return restaurant_id
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("targeting_config", TARGETING_CONFIGS)
+    async def test_matches_in_memory_filters(self, session, restaurant_id, targeting_config):
+        """Test the compiled query selects exactly what the stage-by-stage filters keep."""
+        service = CustomerSegmentationService(id_chunk_size=7)
+        customers = (await session.execute(Customer.__table__.select())).all()
+        customers = [await session.get(Customer, row.id) for row in customers]
+
+        expected = await service.segment_customers_in_memory(customers, targeting_config, session)
+        segmented = await service.segment_customers(customers, targeting_config, session)
+        count = await service.count_segment(targeting_config, restaurant_id, session)
+        streamed = [
+            customer_id
+            async for batch in service.stream_segment(targeting_config, restaurant_id, session, batch_size=5)
+            for customer_id in batch
+        ]
+
+        assert [c.id for c in segmented] == [c.id for c in expected]
+        assert count == len(expected)
+        assert sorted(streamed) == sorted(c.id for c in expected)
+
+    def test_aggregates_use_one_grouped_query(self):
+        """Test response rate reads engagement stats and visit count becomes HAVING on a CTE."""
+        service = CustomerSegmentationService()
+
+        def compile(targeting_config):
+            stmt = service.build_segment_query(targeting_config)
+            return str(stmt.compile(dialect=postgresql.dialect()))
+
+        responsive = compile({"party_size_min": 2, "customer_segments": ["responsive_customers"]})
+        loyal = compile({"party_size_min": 2, "customer_segments": ["loyal_customers"]})
+
+        assert "customer_engagement_stats" in responsive
+        assert "GROUP BY" not in responsive
+        assert loyal.startswith("WITH segment_candidates AS")
+        assert "HAVING" in loyal
+        assert "customers.party_size >=" in loyal
+
+    @pytest.mark.asyncio
+    async def test_segment_analysis_is_aggregated_in_sql(self, session, restaurant_id):
+        """Test segment sizes in the analysis agree with the segment counts."""
+        service = CustomerSegmentationService()
+
+        analysis = await service.analyze_customer_segments(restaurant_id, session)
+
+        assert analysis["total_customers"] == 24
+        for name, info in service.segment_definitions.items():
+            assert analysis["segments"][name]["customer_count"] == await service.count_segment(
+                info["criteria"], restaurant_id, session
+            )
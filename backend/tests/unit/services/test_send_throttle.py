@@ -0,0 +1,175 @@
+"""
+Unit tests for TokenBucketThrottle.
+Tests all-or-nothing bucket charging, stop handling, Redis sharing across workers and campaign limits.
+"""
+import pytest
+from uuid import uuid4
+
+from app.core.config import settings
+from app.models import Campaign, Restaurant
+from app.services.campaigns import throttle as throttle_module
+from app.services.campaigns.execution import CampaignExecutionService
+from app.services.campaigns.throttle import BucketLimit, TokenBucketThrottle, TOKEN_BUCKET_SCRIPT
+
+
+class TestTokenBucketThrottle:
+    """Test cases for TokenBucketThrottle."""
+
+    @pytest.fixture
+    def limits(self):
+        """A roomy campaign bucket behind a tight sender bucket."""
+        return [
+            BucketLimit(key="campaign:1", rate=100.0, capacity=10),
+            BucketLimit(key="sender:+966500000000:second", rate=1.0, capacity=2),
+        ]
+
+    def test_capacity_defaults_to_a_minute_of_sends(self):
+        """Test buckets pace sends unless a burst is given."""
+        assert BucketLimit.for_rate("c", 600, 3600).capacity == 10
+        assert BucketLimit.for_rate("c", 80, 1).capacity == 80
+        assert BucketLimit.for_rate("c", 600, 3600, burst=50).capacity == 50
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("count,period", [(1000, 3600), (10000, 86400)])
+    async def test_window_never_admits_more_than_its_count(self, monkeypatch, count, period):
+        """Test an hourly or daily quota holds over every rolling period, not just the first."""
+        limits = [BucketLimit.for_window("sender:+1:tier", count, period)]
+        throttle = TokenBucketThrottle()
+        clock = [1000.0]
+        monkeypatch.setattr(throttle_module.time, "monotonic", lambda: clock[0])
+
+        # Send whenever allowed for three periods, a little faster than the quota refills
+        admitted = []
+        step = period / count / 2
+        while clock[0] < 1000.0 + 3 * period:
+            if await throttle.try_acquire(limits) == 0:
+                admitted.append(clock[0])
+            clock[0] += step
+
+        assert len(admitted) >= 2 * count
+        start = 0
+        for end, sent_at in enumerate(admitted):
+            while admitted[start] <= sent_at - period:
+                start += 1
+            assert end - start + 1 <= count
+
+    @pytest.mark.asyncio
+    async def test_window_admits_a_full_quota_at_once(self, monkeypatch):
+        """Test a window lets a period's whole quota go out as fast as other limits allow."""
+        whatsapp = settings.whatsapp
+        limits = [BucketLimit.for_window("sender:+1:day", whatsapp.WHATSAPP_MAX_MESSAGES_PER_DAY, 86400)]
+        throttle = TokenBucketThrottle()
+        clock = [1000.0]
+        monkeypatch.setattr(throttle_module.time, "monotonic", lambda: clock[0])
+
+        for _ in range(whatsapp.WHATSAPP_MAX_MESSAGES_PER_DAY):
+            assert await throttle.try_acquire(limits) == 0
+
+        wait = await throttle.try_acquire(limits)
+        assert wait == pytest.approx(86400)
+
+    @pytest.mark.asyncio
+    async def test_tightest_bucket_wins_without_charging_others(self, limits):
+        """Test a refused send leaves every bucket untouched."""
+        throttle = TokenBucketThrottle()
+        assert await throttle.try_acquire(limits) == 0
+        assert await throttle.try_acquire(limits) == 0
+
+        wait = await throttle.try_acquire(limits)
+
+        assert 0.9 < wait <= 1.0
+        assert throttle.buckets["campaign:1"][0] == pytest.approx(8, abs=0.1)
+
+    @pytest.mark.asyncio
+    async def test_acquire_gives_up_when_stopped(self, limits):
+        """Test a throttled acquire returns False once the campaign stops."""
+        throttle = TokenBucketThrottle()
+        for _ in range(2):
+            assert await throttle.acquire(limits)
+
+        assert not await throttle.acquire(limits, should_stop=lambda: True)
+
+    @pytest.mark.asyncio
+    async def test_redis_buckets_are_shared_by_workers(self, limits):
+        """Test two executors on the same Redis share one sender budget."""
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        workers = []
+        for _ in range(2):
+            throttle = TokenBucketThrottle()
+            throttle.redis_client = client
+            throttle._bucket_script = client.register_script(TOKEN_BUCKET_SCRIPT)
+            workers.append(throttle)
+
+        assert await workers[0].try_acquire(limits) == 0
+        assert await workers[1].try_acquire(limits) == 0
+        assert await workers[0].try_acquire(limits) > 0
+        assert await workers[1].try_acquire(limits) > 0
+        assert workers[0].buckets == {}
+
+    @pytest.mark.asyncio
+    async def test_redis_window_is_shared_by_workers(self):
+        """Test two executors on the same Redis share one windowed quota."""
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        limits = [BucketLimit.for_window("sender:+966500000000:hour", 2, 3600)]
+        workers = []
+        for _ in range(2):
+            throttle = TokenBucketThrottle()
+            throttle.redis_client = client
+            throttle._bucket_script = client.register_script(TOKEN_BUCKET_SCRIPT)
+            workers.append(throttle)
+
+        assert await workers[0].try_acquire(limits) == 0
+        assert await workers[1].try_acquire(limits) == 0
+
+        wait = await workers[0].try_acquire(limits)
+        assert 3590 < wait <= 3600
+        assert workers[0].windows == {}
+
+
+class TestCampaignSendLimits:
+    """Test cases for CampaignExecutionService._send_limits."""
+
+    def test_campaign_restaurant_and_sender_buckets(self, monkeypatch):
+        """Test sends are charged to the campaign, its restaurant and the restaurant's number."""
+        monkeypatch.setattr(settings.whatsapp, "WHATSAPP_RESTAURANT_MAX_MESSAGES_PER_HOUR", 500)
+        campaign = Campaign(id=uuid4(), restaurant_id=uuid4(), send_rate_per_hour=120)
+        campaign.restaurant = Restaurant(whatsapp_business_phone="+966112223333")
+
+        limits = CampaignExecutionService(throttle=TokenBucketThrottle())._send_limits(campaign)
+        keys = [limit.key for limit in limits]
+
+        assert keys == [
+            f"campaign:{campaign.id}",
+            f"campaign:{campaign.id}:hour",
+            f"restaurant:{campaign.restaurant_id}",
+            "sender:+966112223333:second",
+            "sender:+966112223333:hour",
+            "sender:+966112223333:day",
+        ]
+        assert limits[0].rate == pytest.approx(120 / 3600)
+        assert [limit.window for limit in limits] == [0, 3600, 3600, 0, 3600, 86400]
+
+    def test_restaurant_bucket_is_off_by_default(self, monkeypatch):
+        """Test no restaurant bucket is charged unless a restaurant limit is configured."""
+        monkeypatch.setattr(settings.whatsapp, "WHATSAPP_RESTAURANT_MAX_MESSAGES_PER_HOUR", 0)
+        campaign = Campaign(id=uuid4(), restaurant_id=uuid4(), send_rate_per_hour=1000)
+        campaign.restaurant = None
+
+        limits = CampaignExecutionService(throttle=TokenBucketThrottle())._send_limits(campaign)
+
+        assert not any(limit.key.startswith("restaurant:") for limit in limits)
+
+    def test_restaurants_without_a_number_share_the_twilio_sender(self, monkeypatch):
+        """Test the shared Twilio sender is throttled as one number."""
+        monkeypatch.setattr(settings.whatsapp, "WHATSAPP_RESTAURANT_MAX_MESSAGES_PER_HOUR", 0)
+        campaign = Campaign(id=uuid4(), restaurant_id=uuid4(), send_rate_per_hour=120)
+        campaign.restaurant = None
+
+        limits = CampaignExecutionService(throttle=TokenBucketThrottle())._send_limits(campaign)
+
+        assert limits[2].key.startswith("sender:+")
+        assert "whatsapp:" not in limits[2].key
@@ -0,0 +1,178 @@
+"""
+Unit tests for StatusIngestion.
+Tests receipt coalescing, timed and size-triggered flushes and the bulk update with campaign roll-up.
+"""
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+
+from sqlalchemy.dialects import postgresql
+
+from app.services.status_ingestion import StatusEvent, StatusIngestion, advances
+
+
+def message_row(sid, status, campaign_id=None, delivered_at=None):
+    """Row as returned by the batch SELECT."""
+    return SimpleNamespace(
+        id=uuid4(), whatsapp_message_id=sid, status=status, campaign_id=campaign_id,
+        delivered_at=delivered_at, read_at=None, failed_at=None, error_code=None, error_message=None
+    )
+
+
+class TestStatusIngestion:
+    """Test cases for StatusIngestion."""
+
+    @pytest.fixture
+    def ingestion(self):
+        """Stage with a long flush interval so tests control flushing."""
+        return StatusIngestion(flush_interval=60, max_batch_size=100)
+
+    def test_status_order(self):
+        """Test receipts only move a message forward."""
+        assert advances("sent", "delivered")
+        assert advances("delivered", "read")
+        assert not advances("read", "delivered")
+        assert not advances("delivered", "failed")
+
+    @pytest.mark.asyncio
+    async def test_burst_is_coalesced_per_message(self, ingestion):
+        """Test repeated receipts keep the furthest status and unknown statuses are ignored."""
+        for status in ["delivered", "read", "delivered"]:
+            await ingestion.submit(StatusEvent("SM1", status))
+        await ingestion.submit(StatusEvent("SM2", "undelivered"))
+        await ingestion.submit(StatusEvent("SM3", "accepted"))
+
+        assert ingestion.pending["SM1"].status == "read"
+        assert ingestion.pending["SM2"].status == "failed"
+        assert "SM3" not in ingestion.pending
+        assert ingestion.stats["coalesced"] == 2
+        assert ingestion.stats["ignored"] == 1
+
+        await ingestion.close()
+
+    @pytest.mark.asyncio
+    async def test_timer_and_batch_size_trigger_flushes(self):
+        """Test pending receipts are flushed after the interval or once the batch is full."""
+        ingestion = StatusIngestion(flush_interval=0.01, max_batch_size=3)
+        ingestion._apply = AsyncMock(side_effect=lambda events, session=None: len(events))
+
+        await ingestion.submit(StatusEvent("SM1", "delivered"))
+        await ingestion.submit(StatusEvent("SM2", "delivered"))
+        await asyncio.sleep(0.05)
+
+        assert ingestion._apply.await_count == 1
+        assert len(ingestion._apply.await_args.args[0]) == 2
+
+        for sid in ["SM3", "SM4", "SM5"]:
+            await ingestion.submit(StatusEvent(sid, "read"))
+        await asyncio.sleep(0)
+        await ingestion.close()
+
+        assert ingestion._apply.await_count == 2
+        assert ingestion.stats["applied"] == 5
+        assert ingestion.pending == {}
+
+    @pytest.mark.asyncio
+    async def test_flush_writes_one_bulk_update_and_campaign_counts(self, ingestion):
+        """Test one SELECT, one bulk UPDATE, one campaign UPDATE and a single commit per batch."""
+        campaign_id = uuid4()
+        rows = [
+            message_row("SM1", "sent", campaign_id),
+            message_row("SM2", "read", campaign_id),
+            message_row("SM3", "delivered", campaign_id),
+            message_row("SM4", "sent", campaign_id),
+        ]
+        select_result = MagicMock()
+        select_result.all.return_value = rows
+        session = AsyncMock()
+        session.execute = AsyncMock(side_effect=[select_result, None, None])
+
+        await ingestion.submit(StatusEvent("SM1", "read"))
+        await ingestion.submit(StatusEvent("SM2", "delivered"))
+        await ingestion.submit(StatusEvent("SM3", "read"))
+        await ingestion.submit(StatusEvent("SM4", "failed", error_code="63016"))
+        await ingestion.submit(StatusEvent("SM9", "delivered"))
+
+        applied = await ingestion.flush(session=session)
+
+        assert applied == 3
+        assert ingestion.stats["regressions"] == 1
+        assert ingestion.stats["unknown_messages"] == 1
+        assert session.execute.await_count == 3
+        session.commit.assert_awaited_once()
+
+        select_stmt = session.execute.await_args_list[0].args[0]
+        compiled = str(select_stmt.compile(dialect=postgresql.dialect()))
+        assert "FOR UPDATE" in compiled
+        assert "ORDER BY whatsapp_messages.id" in compiled
+
+        message_updates = session.execute.await_args_list[1].args[1]
+        assert [update["status"] for update in message_updates] == ["read", "read", "failed"]
+        assert message_updates[0]["delivered_at"] is not None
+        assert message_updates[2]["error_code"] == "63016"
+
+        campaign_update = session.execute.await_args_list[2].args[1]
+        assert campaign_update == [{"campaign": campaign_id, "delivered": 1, "read": 2, "failed": 1}]
+
+        await ingestion.close()
+
+    @pytest.mark.asyncio
+    async def test_read_after_failure_moves_campaign_count_to_delivered(self, ingestion):
+        """Test a failed message that is later read counts as delivered, not failed."""
+        campaign_id = uuid4()
+        select_result = MagicMock()
+        select_result.all.return_value = [message_row("SM1", "failed", campaign_id)]
+        session = AsyncMock()
+        session.execute = AsyncMock(side_effect=[select_result, None, None])
+
+        await ingestion.submit(StatusEvent("SM1", "read"))
+        assert await ingestion.flush(session=session) == 1
+
+        message_update = session.execute.await_args_list[1].args[1][0]
+        assert message_update["status"] == "read"
+        assert message_update["delivered_at"] is not None
+
+        campaign_update = session.execute.await_args_list[2].args[1]
+        assert campaign_update == [{"campaign": campaign_id, "delivered": 1, "read": 1, "failed": -1}]
+
+        await ingestion.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_retried_not_dropped(self):
+        """Test a failed flush re-queues its receipts, keeping newer ones that arrived meanwhile."""
+        ingestion = StatusIngestion(flush_interval=60, max_batch_size=100)
+        ingestion._apply = AsyncMock(side_effect=[RuntimeError("database down"), 2])
+
+        await ingestion.submit(StatusEvent("SM1", "delivered"))
+        await ingestion.submit(StatusEvent("SM2", "delivered"))
+        assert await ingestion.flush() == 0
+        await ingestion.submit(StatusEvent("SM1", "read"))
+
+        assert ingestion.pending["SM1"].status == "read"
+        assert ingestion.pending["SM2"].attempts == 1
+        assert ingestion.stats["failed"] == 0
+
+        assert await ingestion.flush() == 2
+        assert ingestion.stats["applied"] == 2
+        await ingestion.close()
+
+    @pytest.mark.asyncio
+    async def test_receipts_out_of_retries_are_applied_one_by_one(self):
+        """Test a batch that keeps failing falls back to per-receipt updates."""
+        ingestion = StatusIngestion(flush_interval=60, max_batch_size=100, max_retries=0)
+
+        async def apply(events, session=None):
+            if len(events) > 1 or events[0].message_sid == "SM2":
+                raise RuntimeError("bad row")
+            return 1
+
+        ingestion._apply = AsyncMock(side_effect=apply)
+        for sid in ["SM1", "SM2", "SM3"]:
+            await ingestion.submit(StatusEvent(sid, "delivered"))
+
+        assert await ingestion.flush() == 2
+        assert ingestion.stats["failed"] == 1
+        assert ingestion.pending == {}
+        await ingestion.close()
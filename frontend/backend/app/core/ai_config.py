@@ -63,6 +63,14 @@ class PerformanceThresholds(BaseModel):
     rate_limit_requests_per_minute: int = 60
 
 
+class ConnectionPoolSettings(BaseModel):
+    """Shared HTTP connection pool for OpenRouter requests"""
+    max_connections: int = 100
+    max_connections_per_host: int = 30
+    keepalive_timeout_seconds: float = 60.0
+    dns_cache_ttl_seconds: int = 300
+
+
 class CulturalContext(BaseModel):
     """Cultural context settings for Arabic users"""
     respect_religious_values: bool = True
@@ -156,6 +164,7 @@ class AIConfig:
         # Cost and performance settings
         self.cost_limits = CostLimits()
         self.performance_thresholds = PerformanceThresholds()
+        self.connection_pool = ConnectionPoolSettings()
         self.cultural_context = CulturalContext()
     
     def get_model_for_task(
@@ -21,6 +21,17 @@ class Settings(BaseSettings):
     # Redis Configuration (for caching and job queues)
     REDIS_URL: str = "redis://localhost:6379/0"
     
+    # Message Queue Configuration
+    MESSAGE_QUEUE_BACKEND: str = "memory"  # memory, sql, redis
+    MESSAGE_QUEUE_VISIBILITY_TIMEOUT: int = 300  # seconds before an unacked task is redelivered
+    MESSAGE_QUEUE_MAX_DELIVERIES: int = 5  # deliveries before a task is dead-lettered
+    
+    # Webhook De-duplication
+    WEBHOOK_DEDUP_BACKEND: str = "memory"  # memory, sql, redis
+    WEBHOOK_DEDUP_TTL: int = 86400  # seconds an event key is remembered
+    WEBHOOK_DEDUP_MAX_ENTRIES: int = 100000  # memory backend size cap
+    WEBHOOK_DEDUP_BLOOM_CAPACITY: int = 100000  # sql backend Bloom filter front, 0 disables
+    
     # Application Settings
     APP_NAME: str = "Restaurant AI Customer Feedback Agent"
     APP_VERSION: str = "1.0.0"
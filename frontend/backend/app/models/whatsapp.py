@@ -4,7 +4,7 @@ WhatsApp integration models for message tracking and template management.
 
 from enum import Enum
 from typing import Optional, Dict, Any
-from sqlalchemy import Column, String, Text, Boolean, JSON, Index, ForeignKey, Integer
+from sqlalchemy import Column, String, Text, Boolean, JSON, Index, ForeignKey, Integer, DateTime
 from sqlalchemy.orm import relationship
 
 from .base import BaseModel
@@ -271,4 +271,61 @@ class DeliveryReport(BaseModel):
     )
     
     def __repr__(self) -> str:
-        return f"<DeliveryReport(id={self.id}, status={self.status}, message_id={self.message_id})>"
\ No newline at end of file
+        return f"<DeliveryReport(id={self.id}, status={self.status}, message_id={self.message_id})>"
+
+
+class QueuedTaskStatus(str, Enum):
+    """Durable message queue task status enum."""
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DEAD = "dead"
+
+
+class MessageQueueTask(BaseModel):
+    """Durable queue entry for asynchronous outbound messages."""
+    
+    __tablename__ = "message_queue_tasks"
+    
+    # Task identification
+    task_id = Column(String(150), unique=True, nullable=False)
+    queue_name = Column(String(50), nullable=False)
+    
+    # Scheduling
+    status = Column(String(20), nullable=False, default=QueuedTaskStatus.PENDING)
+    priority_rank = Column(Integer, nullable=False, default=0)  # Higher is served first
+    scheduled_at = Column(DateTime, nullable=False)
+    
+    # Lease (visibility timeout) for at-least-once delivery
+    leased_by = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    delivery_count = Column(Integer, default=0, nullable=False)
+    
+    # Serialized MessageTask and failure details
+    payload = Column(JSON, nullable=False)
+    last_error = Column(Text, nullable=True)
+    
+    # Indexes for dequeue ordering and lease recovery
+    __table_args__ = (
+        Index('idx_queue_task_ready', 'queue_name', 'status', 'priority_rank', 'scheduled_at'),
+        Index('idx_queue_task_lease', 'queue_name', 'status', 'lease_expires_at'),
+    )
+    
+    def __repr__(self) -> str:
+        return f"<MessageQueueTask(task_id={self.task_id}, queue={self.queue_name}, status={self.status})>"
+
+
+class ProcessedWebhookEvent(BaseModel):
+    """Idempotency key of a webhook event that has already been handled."""
+    
+    __tablename__ = "processed_webhook_events"
+    
+    event_key = Column(String(200), unique=True, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    
+    # Index for purging expired keys
+    __table_args__ = (
+        Index('idx_processed_webhook_event_expiry', 'expires_at'),
+    )
+    
+    def __repr__(self) -> str:
+        return f"<ProcessedWebhookEvent(event_key={self.event_key}, expires_at={self.expires_at})>"
@@ -0,0 +1,127 @@
+"""
+Process-wide HTTP connection pool for outbound API calls.
+One keep-alive aiohttp session with DNS caching, shared by every OpenRouter client.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+import aiohttp
+import structlog
+
+from app.core.ai_config import ConnectionPoolSettings, ai_config
+
+
+logger = structlog.get_logger(__name__)
+
+
+class SharedHTTPPool:
+    """
+    A single aiohttp session reused by all callers in the process.
+
+    Connections are kept alive between requests and resolved hostnames are
+    cached, so TLS handshakes and DNS lookups are not repeated per client.
+    Requests beyond ``max_connections`` wait for a free slot; the wait time
+    and pool occupancy are reported by ``get_stats``.
+    """
+
+    def __init__(self, settings: Optional[ConnectionPoolSettings] = None, window_size: int = 2048):
+        self.settings = settings or ai_config.connection_pool
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._slots = asyncio.Semaphore(self.settings.max_connections)
+        self.wait_times: Deque[float] = deque(maxlen=window_size)
+        self.in_use = 0
+        self.waiting = 0
+        self.peak_in_use = 0
+        self.stats = {"requests": 0, "waited": 0, "errors": 0}
+
+    def _ensure_session(self) -> aiohttp.ClientSession:
+        """Create the shared session on first use"""
+        if not self.session or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.settings.max_connections,
+                limit_per_host=self.settings.max_connections_per_host,
+                keepalive_timeout=self.settings.keepalive_timeout_seconds,
+                ttl_dns_cache=self.settings.dns_cache_ttl_seconds,
+                use_dns_cache=True
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+            logger.info(
+                "Shared HTTP pool opened",
+                max_connections=self.settings.max_connections
+            )
+        return self.session
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Send a request through the pool, waiting for a free connection slot.
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            **kwargs: Passed to ``aiohttp.ClientSession.request``
+
+        Yields:
+            The response; its connection returns to the pool on exit
+        """
+        started = time.perf_counter()
+        if self._slots.locked():
+            self.stats["waited"] += 1
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.wait_times.append(time.perf_counter() - started)
+
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self.stats["requests"] += 1
+        try:
+            async with self._ensure_session().request(method, url, **kwargs) as response:
+                yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.in_use -= 1
+            self._slots.release()
+
+    def post(self, url: str, **kwargs):
+        """POST through the pool"""
+        return self.request("POST", url, **kwargs)
+
+    async def close(self):
+        """Close pooled connections"""
+        if self.session and not self.session.closed:
+            await self.session.close()
+            logger.info("Shared HTTP pool closed")
+        self.session = None
+
+    def _wait_ms(self, pct: float) -> Optional[float]:
+        if not self.wait_times:
+            return None
+        ordered = sorted(self.wait_times)
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+        return round(ordered[index] * 1000, 2)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool occupancy and the time requests spend waiting for a connection"""
+        return {
+            **self.stats,
+            "max_connections": self.settings.max_connections,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "peak_in_use": self.peak_in_use,
+            "saturation": self.in_use / self.settings.max_connections,
+            "wait_p50_ms": self._wait_ms(50),
+            "wait_p99_ms": self._wait_ms(99),
+        }
+
+
+# Global pool instance
+http_pool = SharedHTTPPool()
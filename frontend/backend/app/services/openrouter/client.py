@@ -15,6 +15,7 @@ from pydantic import BaseModel
 
 from app.core.ai_config import AIConfig, ModelType, ai_config
 from app.models.ai import AIInteraction, ModelUsage
+from app.services.http_pool import SharedHTTPPool, http_pool
 
 
 logger = structlog.get_logger(__name__)
@@ -126,39 +127,31 @@ class OpenRouterClient:
     - Performance monitoring
     """
     
-    def __init__(self, config: Optional[AIConfig] = None):
+    def __init__(self, config: Optional[AIConfig] = None, pool: Optional[SharedHTTPPool] = None):
         self.config = config or ai_config
         self.rate_limiter = RateLimiter(
             self.config.performance_thresholds.rate_limit_requests_per_minute
         )
         self.cost_tracker = CostTracker(self.config)
-        self.session: Optional[aiohttp.ClientSession] = None
+        # Connections come from the process-wide pool shared by every OpenRouter client
+        self.pool = pool or http_pool
+        self.timeout = aiohttp.ClientTimeout(
+            total=self.config.performance_thresholds.max_response_time_seconds
+        )
+        self.headers = {
+            "Authorization": f"Bearer {self.config.openrouter_api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": self.config.site_url,
+            "X-Title": self.config.app_name,
+        }
     
     async def __aenter__(self):
         """Async context manager entry"""
-        await self._ensure_session()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Async context manager exit"""
-        if self.session:
-            await self.session.close()
-    
-    async def _ensure_session(self):
-        """Ensure aiohttp session exists"""
-        if not self.session or self.session.closed:
-            timeout = aiohttp.ClientTimeout(
-                total=self.config.performance_thresholds.max_response_time_seconds
-            )
-            self.session = aiohttp.ClientSession(
-                timeout=timeout,
-                headers={
-                    "Authorization": f"Bearer {self.config.openrouter_api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": self.config.site_url,
-                    "X-Title": self.config.app_name,
-                }
-            )
+        # Pooled connections stay open for other clients
     
     def _estimate_tokens(self, text: str) -> int:
         """Rough token estimation (4 chars per token average)"""
@@ -188,7 +181,6 @@ class OpenRouterClient:
         start_time = time.time()
         
         try:
-            await self._ensure_session()
             model_config = self.config.get_model_config(model)
             
             # Estimate input tokens
@@ -234,9 +226,11 @@ class OpenRouterClient:
                 attempt=attempt
             )
             
-            async with self.session.post(
+            async with self.pool.post(
                 f"{self.config.openrouter_base_url}/chat/completions",
-                json=payload
+                json=payload,
+                headers=self.headers,
+                timeout=self.timeout
             ) as response:
                 response_data = await response.json()
                 
@@ -416,7 +410,8 @@ class OpenRouterClient:
             "daily_remaining": max(0, self.config.cost_limits.daily_budget_usd - 
                                  self.cost_tracker.daily_usage.get(today, 0.0)),
             "monthly_remaining": max(0, self.config.cost_limits.monthly_budget_usd - 
-                                   self.cost_tracker.monthly_usage.get(current_month, 0.0))
+                                   self.cost_tracker.monthly_usage.get(current_month, 0.0)),
+            "http_pool": self.pool.get_stats()
         }
 
 
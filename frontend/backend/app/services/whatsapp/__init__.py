@@ -20,6 +20,13 @@ from .media import WhatsAppMediaHandler
 from .webhook import WebhookHandler
 from .template_manager import TemplateManager
 from .async_messaging import AsyncMessagingService
+from .queue_backends import QueueBackend, SQLQueueBackend, RedisStreamQueueBackend
+from .idempotency import (
+    IdempotencyStore,
+    MemoryIdempotencyStore,
+    SQLIdempotencyStore,
+    RedisIdempotencyStore
+)
 from .bulk_messaging import BulkMessagingService
 from .rate_limiter import RateLimiter
 from .exceptions import (
@@ -57,6 +64,13 @@ __all__ = [
     
     # Advanced services
     'AsyncMessagingService',
+    'QueueBackend',
+    'SQLQueueBackend',
+    'RedisStreamQueueBackend',
+    'IdempotencyStore',
+    'MemoryIdempotencyStore',
+    'SQLIdempotencyStore',
+    'RedisIdempotencyStore',
     'BulkMessagingService',
     'RateLimiter',
     
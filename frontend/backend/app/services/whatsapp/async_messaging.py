@@ -9,12 +9,15 @@ WhatsApp Business API integration.
 import asyncio
 import json
 import logging
+import os
+import socket
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Callable, Union
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Any, Callable, Union, Tuple
+from dataclasses import dataclass, asdict, fields
 from enum import Enum
-from collections import defaultdict
+from collections import defaultdict, deque
 import heapq
+import itertools
 
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_
@@ -29,6 +32,67 @@ from .exceptions import (
     MessageDeliveryError, QueueError, RateLimitExceededError
 )
 from .rate_limiter import RateLimiter, RateLimitType
+from .queue_backends import QueueBackend, LeasedTask, create_queue_backend
+
+
+# Numeric ordering of priorities (higher is served first)
+PRIORITY_RANKS = {
+    Priority.LOW: 0,
+    Priority.NORMAL: 1,
+    Priority.HIGH: 2,
+    Priority.URGENT: 3
+}
+
+# Task fields that only exist in the process that queued the task
+_CALLBACK_FIELDS = ('success_callback', 'failure_callback')
+
+# Durable backends are shared across processes, so waiting workers re-poll
+DURABLE_POLL_INTERVAL = 1.0
+
+# Longest a worker blocks before re-checking that the service is still running
+WORKER_IDLE_TIMEOUT = 1.0
+
+
+async def wait_for_task(
+    take: Callable[[], Any],
+    condition: asyncio.Condition,
+    timeout: float,
+    next_due: Callable[[], float],
+    durable: bool = False
+) -> Optional["MessageTask"]:
+    """
+    Call ``take`` until it returns a task or ``timeout`` expires.
+    
+    In-memory queues are checked while holding ``condition`` so an add between
+    the check and the wait cannot be missed; waits end early on notify or when
+    ``next_due`` says a delayed task is due. Durable queues can be fed by other
+    processes, so they are re-polled instead, without holding the condition
+    across backend I/O.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    
+    while True:
+        if durable:
+            task = await take()
+        else:
+            async with condition:
+                task = await take()
+                remaining = deadline - loop.time()
+                if task is None and remaining > 0:
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout=min(remaining, next_due()))
+                    except asyncio.TimeoutError:
+                        pass
+        
+        if task is not None:
+            return task
+        
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return None
+        if durable:
+            await asyncio.sleep(min(remaining, next_due()))
 
 
 class MessageQueueStatus(str, Enum):
@@ -83,8 +147,8 @@ class MessageTask:
     def __lt__(self, other):
         """Support priority queue ordering."""
         if self.priority != other.priority:
-            # Higher priority values come first
-            return self.priority.value > other.priority.value
+            # Higher priorities come first
+            return PRIORITY_RANKS[self.priority] > PRIORITY_RANKS[other.priority]
         return self.scheduled_at < other.scheduled_at
     
     def should_retry(self) -> bool:
@@ -101,32 +165,93 @@ class MessageTask:
             return 60  # 1 minute
         else:  # IMMEDIATE
             return 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the task for durable storage (callbacks are not persisted)."""
+        data = {
+            f.name: getattr(self, f.name)
+            for f in fields(self)
+            if f.name not in _CALLBACK_FIELDS
+        }
+        data['message_type'] = self.message_type.value
+        data['priority'] = self.priority.value
+        data['retry_strategy'] = self.retry_strategy.value
+        data['scheduled_at'] = self.scheduled_at.isoformat()
+        return data
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MessageTask":
+        """Rebuild a task serialized with ``to_dict``."""
+        data = dict(data)
+        data['message_type'] = MessageType(data['message_type'])
+        data['priority'] = Priority(data['priority'])
+        data['retry_strategy'] = RetryStrategy(data['retry_strategy'])
+        data['scheduled_at'] = datetime.fromisoformat(data['scheduled_at'])
+        return cls(**data)
 
 
 class MessageQueue:
-    """Priority queue for message tasks with persistent storage."""
+    """
+    Priority queue for message tasks.
+    
+    Without a backend, tasks live in process memory (single-node mode) in two
+    tiers: a delay heap keyed by ``scheduled_at`` and one ready heap per
+    priority. Due tasks are promoted from the delay heap on dequeue, so add and
+    dequeue are O(log n) and workers can block on ``task_available`` instead of
+    polling. Removed tasks are dropped lazily when they reach the top of a heap.
     
-    def __init__(self, db: Session, name: str = "default"):
+    With a durable ``QueueBackend`` the queue is shared by every worker process
+    using the same backend: dequeued tasks are leased, and must be acked
+    (``ack_task``), rescheduled or dead-lettered before the visibility timeout
+    or they are delivered again.
+    """
+    
+    def __init__(
+        self,
+        db: Session,
+        name: str = "default",
+        backend: Optional[QueueBackend] = None,
+        consumer_name: Optional[str] = None,
+        task_available: Optional[asyncio.Condition] = None
+    ):
         """Initialize message queue."""
         self.db = db
         self.name = name
+        self.backend = backend
+        self.consumer_name = consumer_name or f"{socket.gethostname()}:{os.getpid()}"
         self.logger = logging.getLogger(__name__)
         
-        # In-memory priority queue for active tasks
-        self._queue: List[MessageTask] = []
+        # In-memory tiers: (scheduled_at, seq, task) entries
+        self._delayed: List[Tuple[datetime, int, MessageTask]] = []
+        self._ready: Dict[int, List[Tuple[datetime, int, MessageTask]]] = {
+            rank: [] for rank in sorted(PRIORITY_RANKS.values(), reverse=True)
+        }
         self._task_lookup: Dict[str, MessageTask] = {}
+        self._task_seq: Dict[str, int] = {}  # Sequence of each task's live entry
+        self._seq = itertools.count()
+        
+        # Durable mode: leases held by this process and callbacks of tasks it queued
+        self._leases: Dict[str, LeasedTask] = {}
+        self._callbacks: Dict[str, Tuple[Optional[Callable], Optional[Callable]]] = {}
+        
+        # Permanently failed tasks in single-node mode
+        self.dead_letters: deque = deque(maxlen=1000)
         
         # Queue statistics
         self.stats = {
             'total_added': 0,
             'total_processed': 0,
             'total_failed': 0,
+            'total_dead_lettered': 0,
             'current_size': 0,
             'processing_count': 0
         }
         
         # Queue lock for thread safety
         self._lock = asyncio.Lock()
+        
+        # Notified when a task is added; may be shared by several queues
+        self.task_available = task_available or asyncio.Condition()
     
     async def add_task(self, task: MessageTask) -> bool:
         """
@@ -138,67 +263,87 @@ class MessageQueue:
         Returns:
             True if task added successfully
         """
+        if self.backend:
+            try:
+                if task.success_callback or task.failure_callback:
+                    self._callbacks[task.id] = (task.success_callback, task.failure_callback)
+                await self.backend.enqueue(
+                    self.name,
+                    task.id,
+                    task.to_dict(),
+                    PRIORITY_RANKS.get(task.priority, 0),
+                    task.scheduled_at
+                )
+                self.stats['total_added'] += 1
+                self.logger.debug(f"Task {task.id} added to durable queue {self.name}")
+                return True
+            except Exception as e:
+                self.logger.error(f"Failed to add task to durable queue: {str(e)}")
+                return False
+        
         async with self._lock:
             try:
-                # Add to priority queue
-                heapq.heappush(self._queue, task)
-                self._task_lookup[task.id] = task
+                self._push(task)
                 
                 # Update statistics
                 self.stats['total_added'] += 1
-                self.stats['current_size'] = len(self._queue)
+                self.stats['current_size'] = len(self._task_lookup)
                 
                 self.logger.debug(f"Task {task.id} added to queue {self.name}")
-                return True
                 
             except Exception as e:
                 self.logger.error(f"Failed to add task to queue: {str(e)}")
                 return False
+        
+        async with self.task_available:
+            self.task_available.notify()
+        return True
     
-    async def get_next_task(self) -> Optional[MessageTask]:
+    async def get_next_task(self, timeout: Optional[float] = None) -> Optional[MessageTask]:
         """
         Get the next task from the queue.
         
+        Args:
+            timeout: Seconds to wait for a task to become due; None returns immediately
+            
         Returns:
             Next task or None if queue is empty
         """
+        if timeout is None:
+            return await self._take_next_task()
+        
+        return await wait_for_task(
+            self._take_next_task,
+            self.task_available,
+            timeout,
+            self.seconds_until_due,
+            durable=self.backend is not None
+        )
+    
+    async def _take_next_task(self) -> Optional[MessageTask]:
+        """Dequeue the highest-priority due task without waiting."""
+        if self.backend:
+            return await self._lease_next_task()
+        
         async with self._lock:
             try:
-                # Find next ready task
-                now = datetime.utcnow()
-                ready_tasks = []
-                delayed_tasks = []
-                
-                # Separate ready and delayed tasks
-                while self._queue:
-                    task = heapq.heappop(self._queue)
-                    if task.scheduled_at <= now:
-                        ready_tasks.append(task)
-                    else:
-                        delayed_tasks.append(task)
+                self._promote_due(datetime.utcnow())
                 
-                # Restore delayed tasks to queue
-                for task in delayed_tasks:
-                    heapq.heappush(self._queue, task)
-                
-                # Return highest priority ready task
-                if ready_tasks:
-                    # Sort by priority and time
-                    ready_tasks.sort(key=lambda t: (t.priority.value, t.scheduled_at), reverse=True)
-                    next_task = ready_tasks[0]
-                    
-                    # Restore other ready tasks to queue
-                    for task in ready_tasks[1:]:
-                        heapq.heappush(self._queue, task)
-                    
-                    # Remove from lookup
-                    del self._task_lookup[next_task.id]
-                    
-                    # Update statistics
-                    self.stats['current_size'] = len(self._queue)
-                    self.stats['processing_count'] += 1
-                    
-                    return next_task
+                # Highest priority first, earliest scheduled within a priority
+                for ready in self._ready.values():
+                    while ready:
+                        _, seq, task = heapq.heappop(ready)
+                        if self._task_seq.get(task.id) != seq:
+                            continue  # Removed or superseded entry
+                        
+                        del self._task_lookup[task.id]
+                        del self._task_seq[task.id]
+                        
+                        # Update statistics
+                        self.stats['current_size'] = len(self._task_lookup)
+                        self.stats['processing_count'] += 1
+                        
+                        return task
                 
                 return None
                 
@@ -206,6 +351,36 @@ class MessageQueue:
                 self.logger.error(f"Failed to get next task: {str(e)}")
                 return None
     
+    def _push(self, task: MessageTask):
+        """Insert a task into the delay heap or its ready heap."""
+        seq = next(self._seq)
+        self._task_lookup[task.id] = task
+        self._task_seq[task.id] = seq
+        
+        entry = (task.scheduled_at, seq, task)
+        if task.scheduled_at <= datetime.utcnow():
+            heapq.heappush(self._ready[PRIORITY_RANKS[task.priority]], entry)
+        else:
+            heapq.heappush(self._delayed, entry)
+    
+    def _promote_due(self, now: datetime):
+        """Move tasks whose scheduled time has passed into the ready heaps."""
+        while self._delayed and self._delayed[0][0] <= now:
+            entry = heapq.heappop(self._delayed)
+            task = entry[2]
+            if self._task_seq.get(task.id) == entry[1]:
+                heapq.heappush(self._ready[PRIORITY_RANKS[task.priority]], entry)
+    
+    def seconds_until_due(self) -> float:
+        """Seconds until the earliest delayed task is due (poll interval for durable backends)."""
+        if self.backend:
+            return DURABLE_POLL_INTERVAL
+        if any(self._ready.values()):
+            return 0.0
+        if not self._delayed:
+            return float("inf")
+        return max(0.0, (self._delayed[0][0] - datetime.utcnow()).total_seconds())
+    
     async def reschedule_task(
         self,
         task: MessageTask,
@@ -224,8 +399,69 @@ class MessageQueue:
         task.retry_count += 1
         task.scheduled_at = datetime.utcnow() + timedelta(seconds=delay_seconds)
         
+        leased = self._leases.pop(task.id, None)
+        if self.backend and leased:
+            try:
+                await self.backend.release(self.name, leased, task.to_dict(), task.scheduled_at)
+                return True
+            except Exception as e:
+                self.logger.error(f"Failed to reschedule task {task.id}: {str(e)}")
+                return False
+        
         return await self.add_task(task)
     
+    async def ack_task(self, task: MessageTask):
+        """Mark a task as completed so it is not delivered again."""
+        self.stats['total_processed'] += 1
+        self._callbacks.pop(task.id, None)
+        
+        leased = self._leases.pop(task.id, None)
+        if self.backend and leased:
+            try:
+                await self.backend.ack(self.name, leased)
+            except Exception as e:
+                # The lease will expire and the task will be redelivered
+                self.logger.error(f"Failed to ack task {task.id}: {str(e)}")
+    
+    async def dead_letter_task(self, task: MessageTask, error: Optional[str] = None):
+        """Move a permanently failed task to the dead-letter queue."""
+        self.stats['total_failed'] += 1
+        self.stats['total_dead_lettered'] += 1
+        self._callbacks.pop(task.id, None)
+        
+        leased = self._leases.pop(task.id, None)
+        if self.backend and leased:
+            try:
+                await self.backend.dead_letter(self.name, leased, task.to_dict(), error)
+            except Exception as e:
+                self.logger.error(f"Failed to dead-letter task {task.id}: {str(e)}")
+            return
+        
+        self.dead_letters.append({
+            'task': task.to_dict(),
+            'error': error,
+            'failed_at': datetime.utcnow().isoformat()
+        })
+    
+    async def _lease_next_task(self) -> Optional[MessageTask]:
+        """Lease the next due task from the durable backend."""
+        try:
+            leased = await self.backend.dequeue(self.name, self.consumer_name)
+            if leased is None:
+                return None
+            
+            task = MessageTask.from_dict(leased.payload)
+            # Callbacks are only available in the process that queued the task
+            task.success_callback, task.failure_callback = self._callbacks.get(task.id, (None, None))
+            
+            self._leases[task.id] = leased
+            self.stats['processing_count'] += 1
+            return task
+            
+        except Exception as e:
+            self.logger.error(f"Failed to lease next task: {str(e)}")
+            return None
+    
     async def remove_task(self, task_id: str) -> bool:
         """
         Remove a task from the queue.
@@ -236,39 +472,62 @@ class MessageQueue:
         Returns:
             True if removed successfully
         """
+        if self.backend:
+            self._callbacks.pop(task_id, None)
+            return await self.backend.remove(self.name, task_id)
+        
         async with self._lock:
             if task_id in self._task_lookup:
-                task = self._task_lookup[task_id]
-                try:
-                    self._queue.remove(task)
-                    heapq.heapify(self._queue)  # Restore heap property
-                    del self._task_lookup[task_id]
-                    
-                    self.stats['current_size'] = len(self._queue)
-                    return True
-                except ValueError:
-                    # Task might have been already processed
-                    del self._task_lookup[task_id]
-                    return True
+                # The heap entry is skipped when it surfaces
+                del self._task_lookup[task_id]
+                del self._task_seq[task_id]
+                self.stats['current_size'] = len(self._task_lookup)
+                return True
             
             return False
     
     def get_size(self) -> int:
-        """Get current queue size."""
-        return len(self._queue)
+        """Get current queue size (last refreshed value for durable backends)."""
+        if self.backend:
+            return self.stats['current_size']
+        return len(self._task_lookup)
+    
+    async def refresh_size(self) -> int:
+        """Read the current size from the durable backend."""
+        if self.backend:
+            try:
+                self.stats['current_size'] = await self.backend.size(self.name)
+            except Exception as e:
+                self.logger.error(f"Failed to read queue size: {str(e)}")
+        return self.get_size()
+    
+    async def clear(self):
+        """Remove every task from the queue."""
+        if self.backend:
+            await self.backend.clear(self.name)
+            self._callbacks.clear()
+        
+        async with self._lock:
+            self._delayed.clear()
+            for ready in self._ready.values():
+                ready.clear()
+            self._task_lookup.clear()
+            self._task_seq.clear()
+        self.stats['current_size'] = 0
     
     def get_stats(self) -> Dict[str, Any]:
         """Get queue statistics."""
         return {
             **self.stats,
-            'current_size': len(self._queue),
+            'current_size': self.get_size(),
+            'backend': type(self.backend).__name__ if self.backend else 'memory',
             'tasks_by_priority': self._get_priority_distribution()
         }
     
     def _get_priority_distribution(self) -> Dict[str, int]:
         """Get distribution of tasks by priority."""
         distribution = defaultdict(int)
-        for task in self._queue:
+        for task in self._task_lookup.values():
             distribution[task.priority.value] += 1
         return dict(distribution)
 
@@ -374,6 +633,7 @@ class AsyncMessagingService:
     - Message delivery tracking
     - Batch processing capabilities
     - Dead letter queue for permanently failed messages
+    - Optional durable SQL/Redis queue backend shared by multiple nodes
     """
     
     def __init__(
@@ -381,7 +641,8 @@ class AsyncMessagingService:
         db: Session,
         whatsapp_client: Optional[WhatsAppClient] = None,
         rate_limiter: Optional[RateLimiter] = None,
-        worker_count: int = 3
+        worker_count: int = 3,
+        queue_backend: Optional[QueueBackend] = None
     ):
         """
         Initialize async messaging service.
@@ -391,6 +652,8 @@ class AsyncMessagingService:
             whatsapp_client: WhatsApp client instance
             rate_limiter: Rate limiter instance
             worker_count: Number of background workers
+            queue_backend: Durable queue backend shared across processes;
+                defaults to MESSAGE_QUEUE_BACKEND (in-memory when "memory")
         """
         self.db = db
         self.whatsapp_client = whatsapp_client or WhatsAppClient(db)
@@ -399,10 +662,17 @@ class AsyncMessagingService:
         self.logger = logging.getLogger(__name__)
         
         # Message queues
+        self.queue_backend = queue_backend or create_queue_backend()
+        self.task_available = asyncio.Condition()
         self.queues = {
-            'high': MessageQueue(db, "high_priority"),
-            'normal': MessageQueue(db, "normal_priority"),
-            'low': MessageQueue(db, "low_priority")
+            name: MessageQueue(
+                db, queue_name, self.queue_backend, task_available=self.task_available
+            )
+            for name, queue_name in (
+                ('high', "high_priority"),
+                ('normal', "normal_priority"),
+                ('low', "low_priority")
+            )
         }
         
         # Retry manager
@@ -571,6 +841,10 @@ class AsyncMessagingService:
         self.running = False
         self.shutdown_event.set()
         
+        # Wake workers blocked waiting for tasks
+        async with self.task_available:
+            self.task_available.notify_all()
+        
         # Wait for workers to complete
         if self.workers:
             await asyncio.gather(*self.workers, return_exceptions=True)
@@ -586,12 +860,10 @@ class AsyncMessagingService:
         try:
             while self.running:
                 try:
-                    # Get next task from queues (priority order)
-                    task = await self._get_next_task()
+                    # Get next task from queues (priority order), waiting until one is due
+                    task = await self._get_next_task(timeout=WORKER_IDLE_TIMEOUT)
                     
                     if task is None:
-                        # No tasks available, sleep briefly
-                        await asyncio.sleep(1)
                         continue
                     
                     # Process the task
@@ -638,9 +910,29 @@ class AsyncMessagingService:
         finally:
             self.logger.info("Retry scheduler stopped")
     
-    async def _get_next_task(self) -> Optional[MessageTask]:
-        """Get next task from queues in priority order."""
-        # Check queues in priority order
+    async def _get_next_task(self, timeout: Optional[float] = None) -> Optional[MessageTask]:
+        """
+        Get next task from queues in priority order.
+        
+        With a timeout, blocks on the shared condition until a task is added,
+        the earliest delayed task is due, or the timeout expires.
+        """
+        if timeout is None:
+            return await self._take_next_task()
+        
+        return await wait_for_task(
+            self._take_next_task,
+            self.task_available,
+            timeout,
+            lambda: min(queue.seconds_until_due() for queue in self.queues.values()),
+            durable=self.queue_backend is not None
+        )
+    
+    async def _take_next_task(self) -> Optional[MessageTask]:
+        """Take the first due task, checking queues in priority order."""
+        if not self.running:
+            return None
+        
         for queue_name in ['high', 'normal', 'low']:
             task = await self.queues[queue_name].get_next_task()
             if task:
@@ -701,6 +993,7 @@ class AsyncMessagingService:
             if message_record and message_record.status != MessageStatus.FAILED:
                 # Task completed successfully
                 self.stats['messages_sent'] += 1
+                await self.queues[self._get_queue_name(task.priority)].ack_task(task)
                 
                 # Call success callback if provided
                 if task.success_callback:
@@ -727,6 +1020,7 @@ class AsyncMessagingService:
     ):
         """Handle task processing failure."""
         self.stats['messages_failed'] += 1
+        queue = self.queues[self._get_queue_name(task.priority)]
         
         # Check if task should be retried
         if task.should_retry():
@@ -734,16 +1028,17 @@ class AsyncMessagingService:
             delay = task.get_next_retry_delay()
             
             # Reschedule task
-            queue_name = self._get_queue_name(task.priority)
-            queue = self.queues[queue_name]
-            
             if await queue.reschedule_task(task, delay):
                 self.logger.info(f"Task {task.id} rescheduled for retry in {delay}s")
             else:
                 self.logger.error(f"Failed to reschedule task {task.id}")
         
         else:
-            # Max retries exceeded - call failure callback
+            # Max retries exceeded - dead-letter and call failure callback
+            if error_message is None and message_record is not None:
+                error_message = message_record.error_message
+            await queue.dead_letter_task(task, error_message)
+            
             if task.failure_callback:
                 try:
                     await self._call_callback(
@@ -810,7 +1105,9 @@ class AsyncMessagingService:
             health_status['issues'].append('No active workers')
         
         # Check queue sizes
-        total_queued = sum(queue.get_size() for queue in self.queues.values())
+        total_queued = 0
+        for queue in self.queues.values():
+            total_queued += await queue.refresh_size()
         if total_queued > 10000:  # Arbitrary threshold
             health_status['status'] = 'warning'
             health_status['issues'].append(f'High queue size: {total_queued}')
@@ -826,9 +1123,7 @@ class AsyncMessagingService:
     async def clear_queues(self):
         """Clear all message queues (use with caution)."""
         for queue in self.queues.values():
-            queue._queue.clear()
-            queue._task_lookup.clear()
-            queue.stats['current_size'] = 0
+            await queue.clear()
         
         self.logger.warning("All message queues cleared")
     
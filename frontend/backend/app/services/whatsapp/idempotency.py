@@ -0,0 +1,364 @@
+"""
+Idempotency stores for WhatsApp webhook de-duplication.
+
+Meta delivers webhooks at least once and retries them for hours, so the same
+message or status can arrive several times, on any worker and after restarts.
+Each event is identified by a key (``msg_<id>`` or ``status_<id>_<status>``)
+that is remembered for a TTL. Stores offer an O(1) check-and-mark, expire keys
+after the TTL and keep a bounded footprint:
+
+- MemoryIdempotencyStore: per-process, insertion-ordered with a size cap
+- SQLIdempotencyStore: ``processed_webhook_events`` table shared by workers
+- RedisIdempotencyStore: ``SET NX EX`` keys shared by workers
+
+A time-bucketed Bloom filter can sit in front of a store. Keys it has
+definitely not seen skip the lookup and go straight to the insert, which still
+detects keys marked by other workers.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+from app.core.config import settings
+from app.models.whatsapp import ProcessedWebhookEvent
+from .exceptions import ConfigurationError
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys (double hashing on BLAKE2b)."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RotatingBloomFilter:
+    """
+    Two Bloom filter generations that rotate every ``rotate_seconds``.
+
+    A key is kept for at least one full period and at most two, so nothing
+    marked within the TTL is ever reported as unseen. Generations rotate on
+    time only: going over capacity raises the false positive rate (an extra
+    lookup) instead of dropping keys early.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, rotate_seconds: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rotate_seconds = rotate_seconds
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous: Optional[BloomFilter] = None
+        self._started = time.monotonic()
+
+    def _rotate_if_due(self):
+        elapsed = time.monotonic() - self._started
+        if elapsed < self.rotate_seconds:
+            return
+        self.previous = self.current if elapsed < 2 * self.rotate_seconds else None
+        self.current = BloomFilter(self.capacity, self.error_rate)
+        self._started = time.monotonic()
+
+    def add(self, key: str):
+        self._rotate_if_due()
+        self.current.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        self._rotate_if_due()
+        return key in self.current or (self.previous is not None and key in self.previous)
+
+
+class IdempotencyStore(ABC):
+    """Interface for remembering processed webhook event keys."""
+
+    def __init__(
+        self,
+        ttl: int = 86400,
+        bloom_capacity: Optional[int] = None,
+        bloom_error_rate: float = 0.01
+    ):
+        self.ttl = ttl
+        self.bloom = (
+            RotatingBloomFilter(bloom_capacity, bloom_error_rate, ttl) if bloom_capacity else None
+        )
+        self.stats = {"checked": 0, "duplicates": 0, "bloom_skips": 0}
+        self.logger = logging.getLogger(__name__)
+
+    async def check_and_mark(self, keys: List[str]) -> bool:
+        """
+        Return True if any key was already processed; otherwise mark all keys.
+
+        A webhook with one duplicate key is treated as a duplicate and none of
+        its keys are marked, so its new events can still be delivered again.
+        """
+        keys = list(dict.fromkeys(key for key in keys if key))
+        if not keys:
+            return False
+
+        self.stats["checked"] += 1
+        known_new = self.bloom is not None and not any(key in self.bloom for key in keys)
+        if known_new:
+            self.stats["bloom_skips"] += 1
+
+        duplicate = await self._check_and_add(keys, known_new)
+        if duplicate:
+            self.stats["duplicates"] += 1
+        elif self.bloom is not None:
+            for key in keys:
+                self.bloom.add(key)
+        return duplicate
+
+    async def forget(self, keys: List[str]):
+        """Unmark keys whose processing failed so a redelivery is handled."""
+        if keys:
+            await self._remove(keys)
+
+    @abstractmethod
+    async def _check_and_add(self, keys: List[str], known_new: bool) -> bool:
+        """
+        Atomically check and mark ``keys``; True means at least one was present.
+
+        ``known_new`` is set when the Bloom filter has never seen any of the
+        keys; stores may skip their lookup but must still detect a conflict.
+        """
+
+    @abstractmethod
+    async def _remove(self, keys: List[str]):
+        """Delete keys."""
+
+    @abstractmethod
+    async def purge_expired(self) -> int:
+        """Drop expired keys and return how many were removed."""
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Check, duplicate and Bloom filter counters."""
+        return {**self.stats, "backend": type(self).__name__, "ttl": self.ttl}
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """
+    Per-process store: an insertion-ordered dict of key -> expiry.
+
+    The TTL is the same for every key, so insertion order is expiry order and
+    expired keys are popped from the front. Past ``max_entries`` the oldest
+    keys are evicted early.
+    """
+
+    def __init__(self, ttl: int = 86400, max_entries: int = 100000, **kwargs):
+        super().__init__(ttl, **kwargs)
+        self.max_entries = max_entries
+        self.expiry: "OrderedDict[str, float]" = OrderedDict()
+        self.stats["evicted"] = 0
+
+    def _purge(self, now: float) -> int:
+        purged = 0
+        while self.expiry:
+            key, expires_at = next(iter(self.expiry.items()))
+            if expires_at > now:
+                break
+            self.expiry.popitem(last=False)
+            purged += 1
+        return purged
+
+    async def _check_and_add(self, keys, known_new):
+        now = time.monotonic()
+        self._purge(now)
+        if any(key in self.expiry for key in keys):
+            return True
+
+        for key in keys:
+            self.expiry[key] = now + self.ttl
+        while len(self.expiry) > self.max_entries:
+            self.expiry.popitem(last=False)
+            self.stats["evicted"] += 1
+        return False
+
+    async def _remove(self, keys):
+        for key in keys:
+            self.expiry.pop(key, None)
+
+    async def purge_expired(self):
+        return self._purge(time.monotonic())
+
+    def get_stats(self):
+        return {**super().get_stats(), "size": len(self.expiry), "max_entries": self.max_entries}
+
+
+class SQLIdempotencyStore(IdempotencyStore):
+    """
+    Store backed by the ``processed_webhook_events`` table.
+
+    The unique ``event_key`` makes concurrent marks from several workers
+    conflict instead of both succeeding. Expired rows are reused when a key
+    comes back and deleted by ``purge_expired``. Blocking database work runs
+    in a thread with its own session.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        ttl: int = 86400,
+        **kwargs
+    ):
+        super().__init__(ttl, **kwargs)
+        if session_factory is None:
+            from app.models.base import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+
+    async def _check_and_add(self, keys, known_new):
+        if known_new and await asyncio.to_thread(self._insert, keys):
+            return False
+        return await asyncio.to_thread(self._check_and_add_sync, keys)
+
+    def _insert(self, keys: List[str]) -> bool:
+        """Insert without looking first; False if any key already has a row."""
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+        with self.session_factory() as db:
+            db.add_all(ProcessedWebhookEvent(event_key=key, expires_at=expires_at) for key in keys)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                return False
+        return True
+
+    def _check_and_add_sync(self, keys: List[str]) -> bool:
+        now = datetime.utcnow()
+        with self.session_factory() as db:
+            existing = {
+                row.event_key: row
+                for row in db.query(ProcessedWebhookEvent).filter(
+                    ProcessedWebhookEvent.event_key.in_(keys)
+                )
+            }
+            if any(row.expires_at > now for row in existing.values()):
+                return True
+
+            expires_at = now + timedelta(seconds=self.ttl)
+            for key in keys:
+                if key in existing:
+                    existing[key].expires_at = expires_at
+                else:
+                    db.add(ProcessedWebhookEvent(event_key=key, expires_at=expires_at))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker marked one of the keys since the lookup
+                db.rollback()
+                return True
+        return False
+
+    async def _remove(self, keys):
+        await asyncio.to_thread(self._remove_sync, keys)
+
+    def _remove_sync(self, keys: List[str]):
+        with self.session_factory() as db:
+            db.query(ProcessedWebhookEvent).filter(
+                ProcessedWebhookEvent.event_key.in_(keys)
+            ).delete(synchronize_session=False)
+            db.commit()
+
+    async def purge_expired(self):
+        return await asyncio.to_thread(self._purge_sync)
+
+    def _purge_sync(self) -> int:
+        with self.session_factory() as db:
+            purged = db.query(ProcessedWebhookEvent).filter(
+                ProcessedWebhookEvent.expires_at <= datetime.utcnow()
+            ).delete(synchronize_session=False)
+            db.commit()
+        return purged
+
+
+class RedisIdempotencyStore(IdempotencyStore):
+    """
+    Store keeping one ``<prefix>:<event key>`` Redis key per event.
+
+    Keys are written with ``SET NX EX`` in one pipeline, so checking and
+    marking is a single round trip and Redis expires them itself.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        key_prefix: str = "whatsapp_webhook_event",
+        ttl: int = 86400,
+        **kwargs
+    ):
+        super().__init__(ttl, **kwargs)
+        if redis is None:
+            raise ConfigurationError("redis package is required for the Redis idempotency store")
+
+        self.client = redis.from_url(redis_url or settings.REDIS_URL, decode_responses=True)
+        self.key_prefix = key_prefix
+
+    def _key(self, event_key: str) -> str:
+        return f"{self.key_prefix}:{event_key}"
+
+    async def _check_and_add(self, keys, known_new):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.set(self._key(key), 1, nx=True, ex=self.ttl)
+            results = await pipe.execute()
+
+        if all(results):
+            return False
+
+        # Undo the keys this call set so the webhook's new events stay unmarked
+        fresh = [self._key(key) for key, created in zip(keys, results) if created]
+        if fresh:
+            await self.client.delete(*fresh)
+        return True
+
+    async def _remove(self, keys):
+        await self.client.delete(*(self._key(key) for key in keys))
+
+    async def purge_expired(self):
+        return 0  # Redis expires keys itself
+
+
+def create_idempotency_store(backend_type: Optional[str] = None) -> IdempotencyStore:
+    """Create the configured webhook idempotency store."""
+    backend_type = (backend_type or settings.WEBHOOK_DEDUP_BACKEND).lower()
+    ttl = settings.WEBHOOK_DEDUP_TTL
+
+    if backend_type == "memory":
+        return MemoryIdempotencyStore(ttl=ttl, max_entries=settings.WEBHOOK_DEDUP_MAX_ENTRIES)
+    if backend_type == "sql":
+        return SQLIdempotencyStore(ttl=ttl, bloom_capacity=settings.WEBHOOK_DEDUP_BLOOM_CAPACITY or None)
+    if backend_type == "redis":
+        # SET NX already checks and marks in one round trip; a Bloom filter would not save a lookup
+        return RedisIdempotencyStore(settings.REDIS_URL, ttl=ttl)
+
+    raise ConfigurationError(f"Unknown webhook dedup backend: {backend_type}")
@@ -0,0 +1,476 @@
+"""
+Durable storage backends for the async messaging queue.
+
+This module provides pluggable backends that let several worker processes on
+several nodes share one message queue with at-least-once delivery. Tasks are
+leased to a consumer for a visibility timeout; tasks that are not acknowledged
+in time are redelivered, and tasks delivered too many times are dead-lettered.
+
+Backends store opaque JSON payloads, so they do not depend on ``MessageTask``.
+"""
+
+import asyncio
+import json
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Set
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+from app.core.config import settings
+from app.models.whatsapp import MessageQueueTask, QueuedTaskStatus
+from .exceptions import ConfigurationError
+
+
+@dataclass
+class LeasedTask:
+    """A task handed to a consumer until it is acked, released or dead-lettered."""
+    task_id: str
+    payload: Dict[str, Any]
+    delivery_count: int
+    receipt: Any = None  # Backend-specific lease handle
+
+
+class QueueBackend(ABC):
+    """Interface for durable message queue storage."""
+
+    def __init__(self, visibility_timeout: int = 300, max_deliveries: int = 5):
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self.logger = logging.getLogger(__name__)
+
+    @abstractmethod
+    async def enqueue(
+        self,
+        queue_name: str,
+        task_id: str,
+        payload: Dict[str, Any],
+        priority_rank: int,
+        scheduled_at: datetime
+    ):
+        """Store a task; it becomes visible at ``scheduled_at``."""
+
+    @abstractmethod
+    async def dequeue(self, queue_name: str, consumer: str) -> Optional[LeasedTask]:
+        """Lease the next due task, or return None if nothing is ready."""
+
+    @abstractmethod
+    async def ack(self, queue_name: str, leased: LeasedTask):
+        """Delete a completed task."""
+
+    @abstractmethod
+    async def release(
+        self,
+        queue_name: str,
+        leased: LeasedTask,
+        payload: Dict[str, Any],
+        scheduled_at: datetime
+    ):
+        """Return a leased task to the queue with an updated payload and due time."""
+
+    @abstractmethod
+    async def dead_letter(
+        self,
+        queue_name: str,
+        leased: LeasedTask,
+        payload: Dict[str, Any],
+        error: Optional[str] = None
+    ):
+        """Move a leased task to the dead-letter store."""
+
+    @abstractmethod
+    async def remove(self, queue_name: str, task_id: str) -> bool:
+        """Remove a queued task."""
+
+    @abstractmethod
+    async def size(self, queue_name: str) -> int:
+        """Number of queued (including leased) tasks."""
+
+    @abstractmethod
+    async def clear(self, queue_name: str):
+        """Delete every task in a queue."""
+
+
+class SQLQueueBackend(QueueBackend):
+    """
+    Queue stored in the ``message_queue_tasks`` table.
+
+    Dequeue uses ``SELECT ... FOR UPDATE SKIP LOCKED`` so concurrent consumers
+    never lease the same row; a lease is a ``processing`` row whose
+    ``lease_expires_at`` is in the future. Expired leases are picked up again by
+    the same query. Blocking database work runs in a thread with its own session.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        visibility_timeout: int = 300,
+        max_deliveries: int = 5
+    ):
+        super().__init__(visibility_timeout, max_deliveries)
+        if session_factory is None:
+            from app.models.base import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+
+    async def enqueue(self, queue_name, task_id, payload, priority_rank, scheduled_at):
+        await asyncio.to_thread(
+            self._enqueue, queue_name, task_id, payload, priority_rank, scheduled_at
+        )
+
+    def _enqueue(self, queue_name, task_id, payload, priority_rank, scheduled_at):
+        with self.session_factory() as db:
+            db.add(MessageQueueTask(
+                task_id=task_id,
+                queue_name=queue_name,
+                status=QueuedTaskStatus.PENDING,
+                priority_rank=priority_rank,
+                scheduled_at=scheduled_at,
+                payload=payload
+            ))
+            db.commit()
+
+    async def dequeue(self, queue_name, consumer):
+        return await asyncio.to_thread(self._dequeue, queue_name, consumer)
+
+    def _dequeue(self, queue_name: str, consumer: str) -> Optional[LeasedTask]:
+        with self.session_factory() as db:
+            while True:
+                now = datetime.utcnow()
+                row = db.query(MessageQueueTask).filter(
+                    MessageQueueTask.queue_name == queue_name,
+                    or_(
+                        and_(
+                            MessageQueueTask.status == QueuedTaskStatus.PENDING,
+                            MessageQueueTask.scheduled_at <= now
+                        ),
+                        and_(
+                            MessageQueueTask.status == QueuedTaskStatus.PROCESSING,
+                            MessageQueueTask.lease_expires_at <= now
+                        )
+                    )
+                ).order_by(
+                    MessageQueueTask.priority_rank.desc(),
+                    MessageQueueTask.scheduled_at
+                ).with_for_update(skip_locked=True).first()
+
+                if row is None:
+                    db.rollback()
+                    return None
+
+                if row.delivery_count >= self.max_deliveries:
+                    # Consumers keep dying on this task - stop redelivering it
+                    self.logger.error(f"Task {row.task_id} dead-lettered after {row.delivery_count} deliveries")
+                    row.status = QueuedTaskStatus.DEAD
+                    row.leased_by = None
+                    row.last_error = f"Exceeded {self.max_deliveries} deliveries without ack"
+                    db.commit()
+                    continue
+
+                row.status = QueuedTaskStatus.PROCESSING
+                row.leased_by = consumer
+                row.lease_expires_at = now + timedelta(seconds=self.visibility_timeout)
+                row.delivery_count += 1
+
+                # Built before commit so the row is not reloaded after expiry
+                leased = LeasedTask(
+                    task_id=row.task_id,
+                    payload=row.payload,
+                    delivery_count=row.delivery_count,
+                    receipt=(consumer, row.delivery_count)
+                )
+                db.commit()
+                return leased
+
+    def _owned_lease(self, db: Session, leased: LeasedTask):
+        """Query for the row only if this lease is still the current one."""
+        consumer, delivery_count = leased.receipt
+        return db.query(MessageQueueTask).filter(
+            MessageQueueTask.task_id == leased.task_id,
+            MessageQueueTask.status == QueuedTaskStatus.PROCESSING,
+            MessageQueueTask.leased_by == consumer,
+            MessageQueueTask.delivery_count == delivery_count
+        )
+
+    async def ack(self, queue_name, leased):
+        await asyncio.to_thread(self._ack, leased)
+
+    def _ack(self, leased: LeasedTask):
+        with self.session_factory() as db:
+            if not self._owned_lease(db, leased).delete(synchronize_session=False):
+                self.logger.warning(f"Lease on task {leased.task_id} expired before ack")
+            db.commit()
+
+    async def release(self, queue_name, leased, payload, scheduled_at):
+        await asyncio.to_thread(self._update_lease, leased, {
+            MessageQueueTask.status: QueuedTaskStatus.PENDING,
+            MessageQueueTask.scheduled_at: scheduled_at,
+            MessageQueueTask.payload: payload,
+            MessageQueueTask.leased_by: None,
+            MessageQueueTask.lease_expires_at: None,
+            # Explicit retries are counted in the payload, not as lost deliveries
+            MessageQueueTask.delivery_count: 0
+        })
+
+    async def dead_letter(self, queue_name, leased, payload, error=None):
+        await asyncio.to_thread(self._update_lease, leased, {
+            MessageQueueTask.status: QueuedTaskStatus.DEAD,
+            MessageQueueTask.payload: payload,
+            MessageQueueTask.leased_by: None,
+            MessageQueueTask.lease_expires_at: None,
+            MessageQueueTask.last_error: error
+        })
+
+    def _update_lease(self, leased: LeasedTask, values: Dict[Any, Any]):
+        with self.session_factory() as db:
+            if not self._owned_lease(db, leased).update(values, synchronize_session=False):
+                self.logger.warning(f"Lease on task {leased.task_id} expired before update")
+            db.commit()
+
+    async def remove(self, queue_name, task_id):
+        return await asyncio.to_thread(self._remove, queue_name, task_id)
+
+    def _remove(self, queue_name: str, task_id: str) -> bool:
+        with self.session_factory() as db:
+            deleted = db.query(MessageQueueTask).filter(
+                MessageQueueTask.queue_name == queue_name,
+                MessageQueueTask.task_id == task_id,
+                MessageQueueTask.status == QueuedTaskStatus.PENDING
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted > 0
+
+    async def size(self, queue_name):
+        return await asyncio.to_thread(self._size, queue_name)
+
+    def _size(self, queue_name: str) -> int:
+        with self.session_factory() as db:
+            return db.query(MessageQueueTask).filter(
+                MessageQueueTask.queue_name == queue_name,
+                MessageQueueTask.status != QueuedTaskStatus.DEAD
+            ).count()
+
+    async def clear(self, queue_name):
+        await asyncio.to_thread(self._clear, queue_name)
+
+    def _clear(self, queue_name: str):
+        with self.session_factory() as db:
+            db.query(MessageQueueTask).filter(
+                MessageQueueTask.queue_name == queue_name
+            ).delete(synchronize_session=False)
+            db.commit()
+
+
+# Moves due task ids from the delayed sorted set onto the ready stream atomically
+PROMOTE_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, task_id in ipairs(due) do
+    redis.call('ZREM', KEYS[1], task_id)
+    redis.call('XADD', KEYS[2], '*', 'task_id', task_id)
+end
+return #due
+"""
+
+
+class RedisStreamQueueBackend(QueueBackend):
+    """
+    Queue stored in Redis streams with a consumer group.
+
+    Per queue:
+    - ``<prefix>:<queue>:tasks``   hash of task id -> JSON payload
+    - ``<prefix>:<queue>:delayed`` sorted set of task ids scored by due time
+    - ``<prefix>:<queue>:stream``  ready stream read with XREADGROUP
+    - ``<prefix>:<queue>:dead``    dead-letter stream
+
+    Unacked entries idle longer than the visibility timeout are reclaimed with
+    XAUTOCLAIM. Streams are FIFO, so ordering within a queue is by due time only.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        key_prefix: str = "whatsapp_queue",
+        group_name: str = "messaging_workers",
+        visibility_timeout: int = 300,
+        max_deliveries: int = 5,
+        promote_batch_size: int = 100
+    ):
+        super().__init__(visibility_timeout, max_deliveries)
+        if redis is None:
+            raise ConfigurationError("redis package is required for the Redis queue backend")
+
+        self.client = redis.from_url(redis_url or settings.REDIS_URL, decode_responses=True)
+        self.key_prefix = key_prefix
+        self.group_name = group_name
+        self.promote_batch_size = promote_batch_size
+        self._promote_script = self.client.register_script(PROMOTE_DUE_SCRIPT)
+        self._groups_ready: Set[str] = set()
+
+    def _key(self, queue_name: str, kind: str) -> str:
+        return f"{self.key_prefix}:{queue_name}:{kind}"
+
+    async def _ensure_group(self, queue_name: str):
+        if queue_name in self._groups_ready:
+            return
+        try:
+            await self.client.xgroup_create(
+                self._key(queue_name, "stream"), self.group_name, id="0", mkstream=True
+            )
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._groups_ready.add(queue_name)
+
+    async def enqueue(self, queue_name, task_id, payload, priority_rank, scheduled_at):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(self._key(queue_name, "tasks"), task_id, json.dumps(payload))
+        if scheduled_at > datetime.utcnow():
+            pipe.zadd(self._key(queue_name, "delayed"), {task_id: scheduled_at.timestamp()})
+        else:
+            pipe.xadd(self._key(queue_name, "stream"), {"task_id": task_id})
+        await pipe.execute()
+
+    async def dequeue(self, queue_name, consumer):
+        await self._ensure_group(queue_name)
+        stream = self._key(queue_name, "stream")
+
+        await self._promote_script(
+            keys=[self._key(queue_name, "delayed"), stream],
+            args=[datetime.utcnow().timestamp(), self.promote_batch_size]
+        )
+
+        while True:
+            entry = await self._read_entry(stream, consumer)
+            if entry is None:
+                return None
+            entry_id, fields = entry
+            task_id = (fields or {}).get("task_id")
+            if task_id is None:
+                # Reclaimed entry that was already deleted from the stream
+                await self._drop_entry(queue_name, entry_id)
+                continue
+
+            pending = await self.client.xpending_range(
+                stream, self.group_name, min=entry_id, max=entry_id, count=1
+            )
+            delivery_count = pending[0]["times_delivered"] if pending else 1
+
+            raw_payload = await self.client.hget(self._key(queue_name, "tasks"), task_id)
+            if raw_payload is None:
+                # Task was removed while queued
+                await self._drop_entry(queue_name, entry_id)
+                continue
+
+            payload = json.loads(raw_payload)
+            leased = LeasedTask(task_id, payload, delivery_count, receipt=entry_id)
+
+            if delivery_count > self.max_deliveries:
+                self.logger.error(f"Task {task_id} dead-lettered after {delivery_count} deliveries")
+                await self.dead_letter(
+                    queue_name, leased, payload,
+                    f"Exceeded {self.max_deliveries} deliveries without ack"
+                )
+                continue
+
+            return leased
+
+    async def _read_entry(self, stream: str, consumer: str):
+        """Read a new entry, or reclaim one whose lease has expired."""
+        response = await self.client.xreadgroup(
+            self.group_name, consumer, {stream: ">"}, count=1
+        )
+        if response and response[0][1]:
+            return response[0][1][0]
+
+        reclaimed = await self.client.xautoclaim(
+            stream, self.group_name, consumer,
+            min_idle_time=self.visibility_timeout * 1000,
+            start_id="0-0",
+            count=1
+        )
+        # XAUTOCLAIM returns [next_start_id, entries, (deleted ids on Redis 7+)]
+        if reclaimed and reclaimed[1]:
+            return reclaimed[1][0]
+        return None
+
+    async def _drop_entry(self, queue_name: str, entry_id: str, pipe=None):
+        stream = self._key(queue_name, "stream")
+        target = pipe or self.client.pipeline(transaction=True)
+        target.xack(stream, self.group_name, entry_id)
+        target.xdel(stream, entry_id)
+        if pipe is None:
+            await target.execute()
+
+    async def ack(self, queue_name, leased):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hdel(self._key(queue_name, "tasks"), leased.task_id)
+        await self._drop_entry(queue_name, leased.receipt, pipe)
+        await pipe.execute()
+
+    async def release(self, queue_name, leased, payload, scheduled_at):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(self._key(queue_name, "tasks"), leased.task_id, json.dumps(payload))
+        pipe.zadd(self._key(queue_name, "delayed"), {leased.task_id: scheduled_at.timestamp()})
+        await self._drop_entry(queue_name, leased.receipt, pipe)
+        await pipe.execute()
+
+    async def dead_letter(self, queue_name, leased, payload, error=None):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.xadd(self._key(queue_name, "dead"), {
+            "task_id": leased.task_id,
+            "payload": json.dumps(payload),
+            "error": error or "",
+            "failed_at": datetime.utcnow().isoformat()
+        })
+        pipe.hdel(self._key(queue_name, "tasks"), leased.task_id)
+        await self._drop_entry(queue_name, leased.receipt, pipe)
+        await pipe.execute()
+
+    async def remove(self, queue_name, task_id):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hdel(self._key(queue_name, "tasks"), task_id)
+        pipe.zrem(self._key(queue_name, "delayed"), task_id)
+        removed, _ = await pipe.execute()
+        # A ready stream entry without a payload is skipped on dequeue
+        return removed > 0
+
+    async def size(self, queue_name):
+        return await self.client.hlen(self._key(queue_name, "tasks"))
+
+    async def clear(self, queue_name):
+        await self.client.delete(
+            self._key(queue_name, "tasks"),
+            self._key(queue_name, "delayed"),
+            self._key(queue_name, "stream")
+        )
+        self._groups_ready.discard(queue_name)
+
+
+def create_queue_backend(backend_type: Optional[str] = None) -> Optional[QueueBackend]:
+    """
+    Create the configured queue backend.
+
+    Returns None for ``memory``, which keeps the single-node in-process queue.
+    """
+    backend_type = (backend_type or settings.MESSAGE_QUEUE_BACKEND).lower()
+    options = {
+        "visibility_timeout": settings.MESSAGE_QUEUE_VISIBILITY_TIMEOUT,
+        "max_deliveries": settings.MESSAGE_QUEUE_MAX_DELIVERIES
+    }
+
+    if backend_type == "memory":
+        return None
+    if backend_type == "sql":
+        return SQLQueueBackend(**options)
+    if backend_type == "redis":
+        return RedisStreamQueueBackend(settings.REDIS_URL, **options)
+
+    raise ConfigurationError(f"Unknown message queue backend: {backend_type}")
@@ -548,6 +548,7 @@ class WhatsAppService:
             'components': {
                 'async_messaging': self.async_messaging.get_service_stats(),
                 'rate_limiter': self.rate_limiter.get_current_status(),
+                'webhook_dedup': self.webhook_handler.idempotency_store.get_stats(),
                 'database': 'connected' if self.db else 'disconnected'
             },
             'timestamp': datetime.utcnow().isoformat()
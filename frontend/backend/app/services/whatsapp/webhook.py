@@ -28,6 +28,7 @@ from app.models.customer import Customer
 from .exceptions import WebhookValidationError, WhatsAppAPIError
 from .utils import format_phone_number, parse_webhook_timestamp, parse_interactive_response
 from .rate_limiter import RateLimiter, RateLimitType
+from .idempotency import IdempotencyStore, create_idempotency_store
 
 
 class WebhookEventType(str, Enum):
@@ -147,6 +148,30 @@ class WebhookValidator:
         except (KeyError, IndexError):
             return None
     
+    @staticmethod
+    def extract_event_ids(data: Dict[str, Any]) -> List[str]:
+        """
+        Build idempotency keys for the messages and statuses in a webhook.
+        
+        Args:
+            data: Webhook payload
+            
+        Returns:
+            One key per message and per status transition, across all entries
+        """
+        event_ids = []
+        for entry in data.get('entry', []):
+            for change in entry.get('changes', []):
+                value = change.get('value', {})
+                
+                for msg in value.get('messages', []):
+                    event_ids.append(f"msg_{msg.get('id')}")
+                
+                for status in value.get('statuses', []):
+                    event_ids.append(f"status_{status.get('id')}_{status.get('status')}")
+        
+        return event_ids
+    
     @staticmethod
     def is_duplicate_event(
         data: Dict[str, Any],
@@ -163,21 +188,7 @@ class WebhookValidator:
             True if event is duplicate
         """
         try:
-            # Generate event ID from key components
-            entry = data['entry'][0]
-            changes = entry['changes'][0]
-            value = changes['value']
-            
-            # Create unique ID from messages or statuses
-            event_ids = []
-            
-            if 'messages' in value:
-                for msg in value['messages']:
-                    event_ids.append(f"msg_{msg.get('id')}")
-            
-            if 'statuses' in value:
-                for status in value['statuses']:
-                    event_ids.append(f"status_{status.get('id')}_{status.get('status')}")
+            event_ids = WebhookValidator.extract_event_ids(data)
             
             # Check if any event ID has been processed
             for event_id in event_ids:
@@ -387,6 +398,16 @@ class MessageProcessor:
         return settings.DEFAULT_LANGUAGE
 
 
+# A status update only moves a message forward
+STATUS_RANK = {
+    MessageStatus.PENDING: 0,
+    MessageStatus.SENT: 1,
+    MessageStatus.DELIVERED: 2,
+    MessageStatus.FAILED: 2,
+    MessageStatus.READ: 3,
+}
+
+
 class StatusProcessor:
     """Process message status updates."""
     
@@ -407,81 +428,136 @@ class StatusProcessor:
         Returns:
             True if processed successfully
         """
-        try:
-            message_id = status_data.get('id')
-            recipient_id = status_data.get('recipient_id')
-            status_value = status_data.get('status')
-            timestamp = status_data.get('timestamp')
-            
-            # Find the message record
-            message = self.db.query(WhatsAppMessage).filter(
-                WhatsAppMessage.whatsapp_message_id == message_id
-            ).first()
-            
-            if not message:
-                self.logger.warning(f"Message not found for status update: {message_id}")
-                return False
-            
-            # Update message status
-            old_status = message.status
-            new_status = self._map_status(status_value)
-            message.status = new_status
+        return bool(await self.process_status_batch([status_data]))
+    
+    async def process_status_batch(
+        self,
+        statuses: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Apply a burst of status updates in one transaction.
+        
+        Messages are loaded with a single query; each gets the furthest
+        status reported for it, and updates that would move a message
+        backwards (read -> delivered) are dropped. Every update for a known
+        message is still recorded as a delivery report.
+        
+        Args:
+            statuses: Status data from webhook
             
-            # Update status timestamps
-            status_timestamp = parse_webhook_timestamp(timestamp)
+        Returns:
+            The status updates that changed a message
+        """
+        latest: Dict[str, Dict[str, Any]] = {}
+        for status_data in statuses:
+            message_id = status_data.get('id')
+            current = latest.get(message_id)
+            if current is None or self._status_rank(status_data.get('status')) > self._status_rank(current.get('status')):
+                latest[message_id] = status_data
+        
+        try:
+            messages = {
+                message.whatsapp_message_id: message
+                for message in self.db.query(WhatsAppMessage).filter(
+                    WhatsAppMessage.whatsapp_message_id.in_(list(latest))
+                )
+            }
             
-            if status_value == 'sent':
-                message.sent_at = status_timestamp.isoformat()
-            elif status_value == 'delivered':
-                message.delivered_at = status_timestamp.isoformat()
-            elif status_value == 'read':
-                message.read_at = status_timestamp.isoformat()
-            elif status_value == 'failed':
-                message.failed_at = status_timestamp.isoformat()
+            applied = []
+            for message_id, status_data in latest.items():
+                message = messages.get(message_id)
+                if not message:
+                    self.logger.warning(f"Message not found for status update: {message_id}")
+                    continue
                 
-                # Handle failure details
-                if 'errors' in status_data:
-                    error = status_data['errors'][0]
-                    message.error_code = str(error.get('code', ''))
-                    message.error_message = error.get('title', 'Message failed')
-                    
-                    # Check if this is a retryable error
-                    if message.can_retry():
-                        message.retry_count += 1
-                        retry_delay = message.get_retry_delay_seconds()
-                        retry_time = datetime.utcnow().timestamp() + retry_delay
-                        message.next_retry_at = datetime.fromtimestamp(retry_time).isoformat()
-            
-            # Create delivery report
-            delivery_report = DeliveryReport(
-                message_id=message.id,
-                status=status_value,
-                timestamp=status_timestamp.isoformat(),
-                whatsapp_status_id=message_id,
-                webhook_payload=status_data
-            )
-            
-            # Add error details to delivery report if failed
-            if status_value == 'failed' and 'errors' in status_data:
-                error = status_data['errors'][0]
-                delivery_report.error_code = str(error.get('code', ''))
-                delivery_report.error_title = error.get('title', '')
-                delivery_report.error_message = error.get('message', '')
-                delivery_report.error_details = error
+                old_status = message.status
+                new_status = self._map_status(status_data.get('status'))
+                if self._status_rank(new_status) <= self._status_rank(old_status):
+                    self.logger.debug(
+                        f"Ignored out-of-order status for {message_id}: {old_status} -> {new_status}"
+                    )
+                    continue
+                
+                self._apply_status(message, status_data)
+                applied.append(status_data)
+                self.logger.info(
+                    f"Updated message {message_id} status from {old_status} to {new_status}"
+                )
             
-            self.db.add(delivery_report)
+            self.db.add_all([
+                self._build_delivery_report(messages[status_data.get('id')], status_data)
+                for status_data in statuses
+                if status_data.get('id') in messages
+            ])
             self.db.commit()
             
-            self.logger.info(
-                f"Updated message {message_id} status from {old_status} to {new_status}"
-            )
-            
-            return True
+            return applied
             
         except Exception as e:
             self.logger.error(f"Error processing status update: {str(e)}")
             self.db.rollback()
-            return False
+            return []
+    
+    def _apply_status(self, message: WhatsAppMessage, status_data: Dict[str, Any]):
+        """Set a message's status, timestamps and failure details."""
+        status_value = status_data.get('status')
+        message.status = self._map_status(status_value)
+        
+        # Update status timestamps
+        status_timestamp = parse_webhook_timestamp(status_data.get('timestamp'))
+        
+        if status_value == 'sent':
+            message.sent_at = status_timestamp.isoformat()
+        elif status_value == 'delivered':
+            message.delivered_at = status_timestamp.isoformat()
+        elif status_value == 'read':
+            message.read_at = status_timestamp.isoformat()
+            if not message.delivered_at:
+                message.delivered_at = status_timestamp.isoformat()
+        elif status_value == 'failed':
+            message.failed_at = status_timestamp.isoformat()
+            
+            # Handle failure details
+            if 'errors' in status_data:
+                error = status_data['errors'][0]
+                message.error_code = str(error.get('code', ''))
+                message.error_message = error.get('title', 'Message failed')
+                
+                # Check if this is a retryable error
+                if message.can_retry():
+                    message.retry_count += 1
+                    retry_delay = message.get_retry_delay_seconds()
+                    retry_time = datetime.utcnow().timestamp() + retry_delay
+                    message.next_retry_at = datetime.fromtimestamp(retry_time).isoformat()
+    
+    def _build_delivery_report(
+        self,
+        message: WhatsAppMessage,
+        status_data: Dict[str, Any]
+    ) -> DeliveryReport:
+        """Delivery report for one status update."""
+        status_value = status_data.get('status')
+        delivery_report = DeliveryReport(
+            message_id=message.id,
+            status=status_value,
+            timestamp=parse_webhook_timestamp(status_data.get('timestamp')).isoformat(),
+            whatsapp_status_id=status_data.get('id'),
+            webhook_payload=status_data
+        )
+        
+        # Add error details to delivery report if failed
+        if status_value == 'failed' and 'errors' in status_data:
+            error = status_data['errors'][0]
+            delivery_report.error_code = str(error.get('code', ''))
+            delivery_report.error_title = error.get('title', '')
+            delivery_report.error_message = error.get('message', '')
+            delivery_report.error_details = error
+        
+        return delivery_report
+    
+    def _status_rank(self, status: Optional[str]) -> int:
+        """Position of a status in the delivery lifecycle; failed is final unless later read."""
+        return STATUS_RANK.get(status, -1)
     
     def _map_status(self, whatsapp_status: str) -> MessageStatus:
         """Map WhatsApp status to internal enum."""
@@ -509,7 +585,8 @@ class WebhookHandler:
         self,
         db: Session,
         webhook_secret: Optional[str] = None,
-        rate_limiter: Optional[RateLimiter] = None
+        rate_limiter: Optional[RateLimiter] = None,
+        idempotency_store: Optional[IdempotencyStore] = None
     ):
         """
         Initialize webhook handler.
@@ -518,6 +595,7 @@ class WebhookHandler:
             db: Database session
             webhook_secret: Secret for webhook validation
             rate_limiter: Rate limiter for webhook processing
+            idempotency_store: Store of processed event keys (configured backend by default)
         """
         self.db = db
         self.webhook_secret = webhook_secret or getattr(settings, 'WHATSAPP_WEBHOOK_SECRET', None)
@@ -529,7 +607,7 @@ class WebhookHandler:
         self.status_processor = StatusProcessor(db)
         
         # Event tracking for deduplication
-        self.processed_events: Set[str] = set()
+        self.idempotency_store = idempotency_store or create_idempotency_store()
         
         # Event handlers registry
         self.event_handlers: Dict[WebhookEventType, List[Callable]] = {
@@ -559,6 +637,7 @@ class WebhookHandler:
             WebhookValidationError: If validation fails
             HTTPException: For HTTP-level errors
         """
+        event_ids: List[str] = []
         try:
             # Acquire rate limit permission
             await self.rate_limiter.acquire(RateLimitType.WEBHOOK_PROCESSING)
@@ -585,7 +664,8 @@ class WebhookHandler:
                 raise WebhookValidationError("Invalid webhook structure")
             
             # Check for duplicate events
-            if WebhookValidator.is_duplicate_event(data, self.processed_events):
+            event_ids = WebhookValidator.extract_event_ids(data)
+            if await self.idempotency_store.check_and_mark(event_ids):
                 self.logger.info("Duplicate webhook event ignored")
                 return {'status': 'ignored', 'reason': 'duplicate'}
             
@@ -608,6 +688,8 @@ class WebhookHandler:
             raise
         except Exception as e:
             self.logger.error(f"Webhook processing error: {str(e)}")
+            # Let Meta's retry of this webhook through
+            await self.idempotency_store.forget(event_ids)
             raise HTTPException(status_code=500, detail="Internal processing error")
     
     async def _process_webhook_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
@@ -699,21 +781,20 @@ class WebhookHandler:
                 self.logger.error(f"Error processing message: {str(e)}")
     
     async def _process_statuses(self, statuses: List[Dict[str, Any]]):
-        """Process message status updates."""
-        for status_data in statuses:
+        """Process message status updates as one batch."""
+        applied = await self.status_processor.process_status_batch(statuses)
+        
+        for status_data in applied:
             try:
-                success = await self.status_processor.process_status_update(status_data)
-                
-                if success:
-                    # Trigger status event handlers
-                    await self._trigger_event_handlers(
-                        WebhookEventType.STATUS,
-                        {
-                            'status_data': status_data,
-                            'message_id': status_data.get('id'),
-                            'status': status_data.get('status')
-                        }
-                    )
+                # Trigger status event handlers
+                await self._trigger_event_handlers(
+                    WebhookEventType.STATUS,
+                    {
+                        'status_data': status_data,
+                        'message_id': status_data.get('id'),
+                        'status': status_data.get('status')
+                    }
+                )
                 
             except Exception as e:
                 self.logger.error(f"Error processing status: {str(e)}")
@@ -866,13 +947,9 @@ class WebhookHandler:
             self.logger.error("Webhook verification failed")
             raise HTTPException(status_code=403, detail="Verification failed")
     
-    def cleanup_processed_events(self, max_age_hours: int = 24):
-        """Clean up old processed event IDs to prevent memory growth."""
-        # This is a simple implementation - in production you might want
-        # to use a more sophisticated approach with timestamps
-        if len(self.processed_events) > 10000:  # Arbitrary limit
-            # Keep only the most recent half
-            events_list = list(self.processed_events)
-            self.processed_events = set(events_list[-5000:])
-            
-            self.logger.info("Cleaned up old processed event IDs")
\ No newline at end of file
+    async def cleanup_processed_events(self) -> int:
+        """Drop expired event keys from the idempotency store."""
+        purged = await self.idempotency_store.purge_expired()
+        if purged:
+            self.logger.info(f"Purged {purged} expired webhook event keys")
+        return purged
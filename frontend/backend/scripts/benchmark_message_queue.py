@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the async messaging MessageQueue.
+Compares the original single-heap rescan dequeue with the two-tier delay/ready heaps.
+"""
+import argparse
+import asyncio
+import heapq
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.models.whatsapp import MessageType, Priority
+from app.services.whatsapp.async_messaging import MessageQueue, MessageTask
+
+
+PRIORITIES = [Priority.LOW, Priority.NORMAL, Priority.NORMAL, Priority.HIGH, Priority.URGENT]
+
+
+class LegacyMessageQueue:
+    """Dequeue used by MessageQueue before the two-tier rewrite."""
+
+    def __init__(self):
+        self._queue: List[MessageTask] = []
+        self._lock = asyncio.Lock()
+
+    async def add_task(self, task: MessageTask) -> bool:
+        async with self._lock:
+            heapq.heappush(self._queue, task)
+            return True
+
+    async def get_next_task(self) -> Optional[MessageTask]:
+        async with self._lock:
+            now = datetime.utcnow()
+            ready_tasks = []
+            delayed_tasks = []
+
+            while self._queue:
+                task = heapq.heappop(self._queue)
+                if task.scheduled_at <= now:
+                    ready_tasks.append(task)
+                else:
+                    delayed_tasks.append(task)
+
+            for task in delayed_tasks:
+                heapq.heappush(self._queue, task)
+
+            if ready_tasks:
+                ready_tasks.sort(key=lambda t: (t.priority.value, t.scheduled_at), reverse=True)
+                for task in ready_tasks[1:]:
+                    heapq.heappush(self._queue, task)
+                return ready_tasks[0]
+
+            return None
+
+
+def build_tasks(count: int, delayed_ratio: float, seed: int) -> List[MessageTask]:
+    """Build a mix of due and future tasks across priorities."""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    tasks = []
+    for i in range(count):
+        if rng.random() < delayed_ratio:
+            scheduled_at = now + timedelta(hours=1, seconds=rng.randint(0, 3600))
+        else:
+            scheduled_at = now - timedelta(seconds=rng.randint(0, 600))
+        tasks.append(MessageTask(
+            id=f"task_{i}",
+            customer_id=i,
+            phone_number=f"+9665{i:08d}",
+            message_type=MessageType.TEXT,
+            priority=rng.choice(PRIORITIES),
+            scheduled_at=scheduled_at,
+            content="مرحباً"
+        ))
+    return tasks
+
+
+async def measure(queue, tasks: List[MessageTask], dequeues: int) -> dict:
+    """Fill the queue, then time a number of dequeues."""
+    start = time.perf_counter()
+    for task in tasks:
+        await queue.add_task(task)
+    fill_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    taken = 0
+    for _ in range(dequeues):
+        if await queue.get_next_task() is None:
+            break
+        taken += 1
+    dequeue_seconds = time.perf_counter() - start
+
+    return {
+        "fill_us_per_task": fill_seconds / len(tasks) * 1_000_000,
+        "dequeues": taken,
+        "dequeue_us": dequeue_seconds / max(taken, 1) * 1_000_000,
+    }
+
+
+async def run_benchmark(count: int, delayed_ratio: float, legacy_dequeues: int, seed: int):
+    tasks = build_tasks(count, delayed_ratio, seed)
+    ready_count = sum(1 for t in tasks if t.scheduled_at <= datetime.utcnow())
+
+    legacy = await measure(LegacyMessageQueue(), tasks, legacy_dequeues)
+    two_tier = await measure(MessageQueue(db=None, name="benchmark"), tasks, ready_count)
+    return ready_count, legacy, two_tier
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MessageQueue dequeue")
+    parser.add_argument("--tasks", type=int, default=100_000)
+    parser.add_argument("--delayed-ratio", type=float, default=0.3, help="Share of tasks scheduled in the future")
+    parser.add_argument("--legacy-dequeues", type=int, default=20, help="Legacy dequeues are O(n log n); sample a few")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    ready_count, legacy, two_tier = asyncio.run(
+        run_benchmark(args.tasks, args.delayed_ratio, args.legacy_dequeues, args.seed)
+    )
+
+    print(f"{args.tasks} queued tasks, {ready_count} due")
+    print(f"{'metric':<22}{'legacy_rescan':>16}{'two_tier':>16}")
+    for metric in ("fill_us_per_task", "dequeue_us"):
+        print(f"{metric:<22}{legacy[metric]:>16.1f}{two_tier[metric]:>16.1f}")
+    print(f"{'dequeues measured':<22}{legacy['dequeues']:>16}{two_tier['dequeues']:>16}")
+    print(f"speedup per dequeue: {legacy['dequeue_us'] / two_tier['dequeue_us']:.0f}x")
+
+
+if __name__ == "__main__":
+    main()